@@ -0,0 +1,208 @@
+"""
+Caché de distancias entre puntos
+
+Cada punto, con las coordenadas redondeadas a ``DECIMALES`` (~1 m), ocupa
+una fila y la columna del mismo número en una matriz float32 simétrica.
+Las distancias se llenan a medida que se piden (las casillas vacías son
+NaN), de modo que una consulta muchos a muchos es una sola lectura con
+``np.ix_`` y solo los pares que faltan pasan por Haversine.
+
+Caben ``CAPACIDAD`` puntos; al llenarse se reutiliza la fila del punto
+usado hace más tiempo. Una consulta con más puntos distintos que la
+capacidad se calcula directamente, sin pasar por el caché.
+
+La clave son las coordenadas, así que un cliente o bodega que se mueve
+nunca recibe una distancia vieja. ``invalidar_punto`` (llamado al cambiar
+sus coordenadas) libera la fila de la posición anterior sin esperar a que
+salga por antigüedad.
+"""
+
+import threading
+
+import numpy as np
+
+from .geoespacial import distancias_entre, distancias_pares
+
+DECIMALES = 5
+# 2.048 puntos: 16 MB con la matriz llena; crece por duplicación desde TAMANO_INICIAL
+CAPACIDAD = 2048
+TAMANO_INICIAL = 64
+
+_ESCALA = 10 ** DECIMALES
+
+
+def _vector(valores):
+    return np.asarray(valores, dtype=float).reshape(-1)
+
+
+def _clave(lat, lng):
+    # round() y np.rint redondean igual (mitades al par)
+    return round(lat * _ESCALA), round(lng * _ESCALA)
+
+
+class CacheDistancias:
+    """Distancias Haversine en km entre puntos redondeados, con descarte LRU por punto"""
+
+    def __init__(self, capacidad=CAPACIDAD):
+        self.capacidad = capacidad
+        self._lock = threading.Lock()
+        self.limpiar()
+
+    def limpiar(self):
+        with self._lock:
+            self._filas = {}
+            self._claves = []
+            self._lats = np.empty(0)
+            self._lngs = np.empty(0)
+            self._uso = np.empty(0, dtype=np.int64)
+            self._matriz = np.empty((0, 0), dtype=np.float32)
+            self._reloj = 0
+            self.aciertos = 0
+            self.fallos = 0
+
+    def __len__(self):
+        return len(self._filas)
+
+    def _crecer(self):
+        tamano = min(max(TAMANO_INICIAL, 2 * len(self._uso)), self.capacidad)
+        anterior = len(self._uso)
+        matriz = np.full((tamano, tamano), np.nan, dtype=np.float32)
+        matriz[:anterior, :anterior] = self._matriz
+        self._matriz = matriz
+        self._lats = np.concatenate((self._lats, np.zeros(tamano - anterior)))
+        self._lngs = np.concatenate((self._lngs, np.zeros(tamano - anterior)))
+        self._uso = np.concatenate((self._uso, np.full(tamano - anterior, -1, dtype=np.int64)))
+
+    def _reservar(self, clave):
+        """Fila para un punto nuevo: una libre o la del punto usado hace más tiempo"""
+        if len(self._claves) < self.capacidad:
+            fila = len(self._claves)
+            if fila == len(self._uso):
+                self._crecer()
+            self._claves.append(clave)
+        else:
+            fila = int(np.argmin(self._uso))
+            if self._claves[fila] is not None:
+                del self._filas[self._claves[fila]]
+            self._claves[fila] = clave
+            self._matriz[fila, :] = np.nan
+            self._matriz[:, fila] = np.nan
+        self._filas[clave] = fila
+        self._lats[fila], self._lngs[fila] = clave[0] / _ESCALA, clave[1] / _ESCALA
+        self._matriz[fila, fila] = 0
+        return fila
+
+    def _ubicar(self, lats, lngs):
+        """Filas de los puntos (reservando las que falten), o None si no caben"""
+        claves = list(zip(
+            np.rint(lats * _ESCALA).astype(np.int64).tolist(),
+            np.rint(lngs * _ESCALA).astype(np.int64).tolist(),
+        ))
+        if len(set(claves)) > self.capacidad:
+            return None
+        self._reloj += 1
+        filas = np.empty(len(claves), dtype=np.intp)
+        for posicion, clave in enumerate(claves):
+            fila = self._filas.get(clave)
+            if fila is None:
+                fila = self._reservar(clave)
+            # Marcada enseguida para que ``_reservar`` no la reutilice en esta misma consulta
+            self._uso[fila] = self._reloj
+            filas[posicion] = fila
+        return filas
+
+    def _completar(self, valores, filas_a, filas_b):
+        """Calcula las casillas NaN de ``valores`` (leídas en filas_a × filas_b) y las guarda"""
+        faltan = np.isnan(valores)
+        cantidad = int(faltan.sum())
+        self.aciertos += valores.size - cantidad
+        self.fallos += cantidad
+        if cantidad:
+            a, b = filas_a[faltan], filas_b[faltan]
+            nuevas = distancias_pares(self._lats[a], self._lngs[a], self._lats[b], self._lngs[b])
+            self._matriz[a, b] = nuevas
+            self._matriz[b, a] = nuevas
+            valores[faltan] = nuevas
+        return valores.astype(float)
+
+    def distancias(self, lats_a, lngs_a, lats_b, lngs_b):
+        """Distancia entre cada punto de ``a`` y el de la misma posición en ``b`` (arreglo 1D)"""
+        lats_a, lngs_a, lats_b, lngs_b = map(_vector, (lats_a, lngs_a, lats_b, lngs_b))
+        with self._lock:
+            filas = self._ubicar(np.concatenate((lats_a, lats_b)), np.concatenate((lngs_a, lngs_b)))
+            if filas is None:
+                return distancias_pares(lats_a, lngs_a, lats_b, lngs_b)
+            filas_a, filas_b = filas[:len(lats_a)], filas[len(lats_a):]
+            return self._completar(self._matriz[filas_a, filas_b], filas_a, filas_b)
+
+    def distancia(self, lat1, lng1, lat2, lng2):
+        """Distancia en km entre dos puntos (sin NumPy si el par ya está en el caché)"""
+        with self._lock:
+            fila_a, fila_b = self._filas.get(_clave(lat1, lng1)), self._filas.get(_clave(lat2, lng2))
+            if fila_a is not None and fila_b is not None:
+                valor = float(self._matriz[fila_a, fila_b])
+                if valor == valor:
+                    self._reloj += 1
+                    self._uso[fila_a] = self._uso[fila_b] = self._reloj
+                    self.aciertos += 1
+                    return valor
+        return float(self.distancias([lat1], [lng1], [lat2], [lng2])[0])
+
+    def desde(self, lat, lng, lats, lngs):
+        """Distancias desde (lat, lng) a cada destino (arreglo 1D)"""
+        return self.matriz([lat], [lng], lats, lngs)[0]
+
+    def matriz(self, lats_a, lngs_a, lats_b=None, lngs_b=None):
+        """Matriz len(a)×len(b) de distancias; sin ``b``, la de ``a`` contra sí mismo"""
+        lats_a, lngs_a = _vector(lats_a), _vector(lngs_a)
+        simetrica = lats_b is None
+        if simetrica:
+            lats_b, lngs_b = lats_a, lngs_a
+        else:
+            lats_b, lngs_b = _vector(lats_b), _vector(lngs_b)
+
+        with self._lock:
+            if simetrica:
+                filas_a = filas_b = self._ubicar(lats_a, lngs_a)
+            else:
+                filas = self._ubicar(np.concatenate((lats_a, lats_b)), np.concatenate((lngs_a, lngs_b)))
+                filas_a, filas_b = (None, None) if filas is None else (filas[:len(lats_a)], filas[len(lats_a):])
+            if filas_a is None:
+                return distancias_entre(lats_a, lngs_a, lats_b, lngs_b)
+            filas_a, filas_b = np.ix_(filas_a, filas_b)
+            filas_a, filas_b = np.broadcast_arrays(filas_a, filas_b)
+            return self._completar(self._matriz[filas_a, filas_b], filas_a, filas_b)
+
+    def invalidar_punto(self, lat, lng):
+        """Libera la fila de (lat, lng); queda primera para reutilizarse"""
+        with self._lock:
+            fila = self._filas.pop(_clave(lat, lng), None)
+            if fila is not None:
+                self._claves[fila] = None
+                self._matriz[fila, :] = np.nan
+                self._matriz[:, fila] = np.nan
+                self._uso[fila] = -1
+
+
+cache_distancias = CacheDistancias()
+
+
+def distancia_km(lat1, lng1, lat2, lng2):
+    """Distancia en km entre dos puntos, desde el caché compartido"""
+    return cache_distancias.distancia(float(lat1), float(lng1), float(lat2), float(lng2))
+
+
+def distancias_desde(lat, lng, lats, lngs):
+    """Distancias en km desde un origen a muchos destinos (arreglo 1D)"""
+    return cache_distancias.desde(float(lat), float(lng), lats, lngs)
+
+
+def matriz_distancias(lats_a, lngs_a, lats_b=None, lngs_b=None):
+    """Matriz de distancias en km, muchos a muchos (ver ``CacheDistancias.matriz``)"""
+    return cache_distancias.matriz(lats_a, lngs_a, lats_b, lngs_b)
+
+
+def invalidar_punto(lat, lng):
+    """Libera del caché la posición anterior de un cliente o bodega"""
+    if lat is not None and lng is not None:
+        cache_distancias.invalidar_punto(float(lat), float(lng))
@@ -0,0 +1,204 @@
+"""
+Búsquedas espaciales de repartidores y clientes
+
+Antes de calcular distancias se descartan los puntos lejanos:
+
+* Clientes: la caja envolvente del radio se empuja a SQL sobre
+  ``latitud``/``longitud`` (índice compuesto en ``Cliente``).
+* Repartidores: índice en memoria por celdas de ``TAMANO_CELDA_GRADOS``.
+  Se reconstruye (una consulta) cuando cambia la huella de la tabla de
+  usuarios (cantidad y última ``fecha_modificacion``), que se consulta a lo
+  sumo cada ``VIGENCIA_VERSION`` segundos. La huella sale de la base de
+  datos, no de la caché, así que los cambios hechos en otro worker se ven
+  aunque cada proceso tenga su propia caché. ``User.save`` renueva
+  ``fecha_modificacion`` al cambiar la ubicación, el radio o la
+  disponibilidad de un repartidor, e invalida el índice del propio proceso.
+
+Los candidatos que quedan pasan por un Haversine vectorizado con NumPy.
+"""
+
+import math
+import time
+from collections import defaultdict
+
+import numpy as np
+from django.db.models import Count, Max, Q
+
+from .models import User
+
+RADIO_TIERRA_KM = 6371.0
+KM_POR_GRADO = math.pi * RADIO_TIERRA_KM / 180
+# ~5,5 km de lado en latitud; con radios de 10 km se revisan unas 25 celdas
+TAMANO_CELDA_GRADOS = 0.05
+# Segundos durante los que un proceso usa su índice sin volver a consultar la huella
+VIGENCIA_VERSION = 5
+
+_indice_actual = {'version': None, 'indice': None, 'verificado': 0.0}
+
+
+def haversine_km(lat, lng, lats, lngs):
+    """Distancias en km desde (lat, lng) a cada punto de los arreglos ``lats``/``lngs``"""
+    lat1, lng1 = math.radians(lat), math.radians(lng)
+    lats = np.radians(np.asarray(lats, dtype=float))
+    lngs = np.radians(np.asarray(lngs, dtype=float))
+    a = np.sin((lats - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lats) * np.sin((lngs - lng1) / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def distancias_entre(lats_a, lngs_a, lats_b, lngs_b):
+    """Matriz len(a)×len(b) de distancias Haversine en km (una operación NumPy)"""
+    lats_a, lngs_a = np.radians(np.asarray(lats_a, dtype=float)), np.radians(np.asarray(lngs_a, dtype=float))
+    lats_b, lngs_b = np.radians(np.asarray(lats_b, dtype=float)), np.radians(np.asarray(lngs_b, dtype=float))
+    a = (
+        np.sin((lats_a[:, None] - lats_b[None, :]) / 2) ** 2
+        + np.cos(lats_a)[:, None] * np.cos(lats_b)[None, :] * np.sin((lngs_a[:, None] - lngs_b[None, :]) / 2) ** 2
+    )
+    return 2 * RADIO_TIERRA_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def distancias_pares(lats_a, lngs_a, lats_b, lngs_b):
+    """Distancia Haversine en km entre cada punto de ``a`` y el de la misma posición en ``b``"""
+    lats_a, lngs_a = np.radians(np.asarray(lats_a, dtype=float)), np.radians(np.asarray(lngs_a, dtype=float))
+    lats_b, lngs_b = np.radians(np.asarray(lats_b, dtype=float)), np.radians(np.asarray(lngs_b, dtype=float))
+    a = np.sin((lats_b - lats_a) / 2) ** 2 + np.cos(lats_a) * np.cos(lats_b) * np.sin((lngs_b - lngs_a) / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def matriz_distancias(lats, lngs):
+    """Matriz n×n de distancias Haversine en km entre todos los puntos"""
+    return distancias_entre(lats, lngs, lats, lngs)
+
+
+def caja_envolvente(lat, lng, radio_km):
+    """(lat_min, lat_max, lng_min, lng_max) que contiene el círculo de ``radio_km`` alrededor del punto"""
+    delta_lat = radio_km / KM_POR_GRADO
+    lat_min, lat_max = max(lat - delta_lat, -90.0), min(lat + delta_lat, 90.0)
+    # El grado de longitud es más corto hacia los polos: se usa la latitud extrema de la caja
+    coseno = math.cos(math.radians(max(abs(lat_min), abs(lat_max))))
+    delta_lng = 180.0 if coseno < 1e-9 else min(radio_km / (KM_POR_GRADO * coseno), 180.0)
+    return lat_min, lat_max, lng - delta_lng, lng + delta_lng
+
+
+def filtro_caja(lat, lng, radio_km, prefijo=''):
+    """Q sobre ``latitud``/``longitud`` con la caja envolvente del radio (para ``.filter``)"""
+    lat_min, lat_max, lng_min, lng_max = caja_envolvente(lat, lng, radio_km)
+    filtro = Q(**{f'{prefijo}latitud__range': (lat_min, lat_max)})
+    if lng_max - lng_min >= 360:
+        return filtro & Q(**{f'{prefijo}longitud__isnull': False})
+    # La caja cruza el antimeridiano: dos rangos de longitud
+    if lng_min < -180:
+        return filtro & (Q(**{f'{prefijo}longitud__gte': lng_min + 360}) | Q(**{f'{prefijo}longitud__lte': lng_max}))
+    if lng_max > 180:
+        return filtro & (Q(**{f'{prefijo}longitud__gte': lng_min}) | Q(**{f'{prefijo}longitud__lte': lng_max - 360}))
+    return filtro & Q(**{f'{prefijo}longitud__range': (lng_min, lng_max)})
+
+
+def _celda(lat, lng):
+    return math.floor(lat / TAMANO_CELDA_GRADOS), math.floor(lng / TAMANO_CELDA_GRADOS)
+
+
+class IndiceRepartidores:
+    """Repartidores disponibles con GPS, en arreglos NumPy agrupados por celda de la grilla"""
+
+    def __init__(self, filas):
+        """``filas``: tuplas (id, latitud, longitud, radio_cobertura_km)"""
+        filas = list(filas)
+        self.ids = np.array([fila[0] for fila in filas], dtype=np.int64)
+        self.lats = np.array([float(fila[1]) for fila in filas], dtype=float)
+        self.lngs = np.array([float(fila[2]) for fila in filas], dtype=float)
+        self.radios = np.array([float(fila[3]) for fila in filas], dtype=float)
+        self.radio_maximo = float(self.radios.max()) if filas else 0.0
+
+        celdas = defaultdict(list)
+        for posicion, (lat, lng) in enumerate(zip(self.lats, self.lngs)):
+            celdas[_celda(lat, lng)].append(posicion)
+        self.celdas = {celda: np.array(posiciones, dtype=np.intp) for celda, posiciones in celdas.items()}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def candidatos(self, lat, lng, radio_km):
+        """Posiciones de los repartidores en las celdas que tocan la caja del radio"""
+        lat_min, lat_max, lng_min, lng_max = caja_envolvente(lat, lng, radio_km)
+        fila_min, columna_min = _celda(lat_min, lng_min)
+        fila_max, columna_max = _celda(lat_max, lng_max)
+        celdas_caja = (fila_max - fila_min + 1) * (columna_max - columna_min + 1)
+        # Radio enorme o caja que cruza el antimeridiano: sale más barato revisar todos
+        if celdas_caja >= len(self.celdas) or lng_min < -180 or lng_max > 180:
+            return np.arange(len(self.ids))
+
+        partes = [
+            self.celdas[(fila, columna)]
+            for fila in range(fila_min, fila_max + 1)
+            for columna in range(columna_min, columna_max + 1)
+            if (fila, columna) in self.celdas
+        ]
+        return np.concatenate(partes) if partes else np.empty(0, dtype=np.intp)
+
+    def mas_cercano(self, lat, lng):
+        """(id, distancia_km) del repartidor más cercano cuyo radio cubre el punto, o None"""
+        posiciones = self.candidatos(lat, lng, self.radio_maximo)
+        if not len(posiciones):
+            return None
+        distancias = haversine_km(lat, lng, self.lats[posiciones], self.lngs[posiciones])
+        distancias = np.where(distancias <= self.radios[posiciones], distancias, np.inf)
+        mejor = int(np.argmin(distancias))
+        if math.isinf(distancias[mejor]):
+            return None
+        return int(self.ids[posiciones[mejor]]), float(distancias[mejor])
+
+
+def invalidar_indice_repartidores():
+    """Descarta el índice de este proceso; los demás ven el cambio en la huella (ver ``VIGENCIA_VERSION``)"""
+    _indice_actual['indice'] = None
+
+
+def version_repartidores():
+    """Huella de la tabla de usuarios: cambia con altas, bajas y cada save que toca el índice"""
+    datos = User.objects.aggregate(total=Count('id'), modificado=Max('fecha_modificacion'))
+    return datos['total'], datos['modificado']
+
+
+def indice_repartidores():
+    """Índice vigente; se reconstruye si la huella en la base de datos cambió desde la última vez"""
+    ahora = time.monotonic()
+    if _indice_actual['indice'] is not None and ahora - _indice_actual['verificado'] < VIGENCIA_VERSION:
+        return _indice_actual['indice']
+
+    # La huella se lee antes que las filas: un cambio que llegue en medio se detecta en la próxima verificación
+    version = version_repartidores()
+    if _indice_actual['indice'] is None or _indice_actual['version'] != version:
+        filas = User.objects.filter(
+            role='repartidor',
+            activo=True,
+            disponible_entregas=True,
+            latitud__isnull=False,
+            longitud__isnull=False,
+        ).values_list('id', 'latitud', 'longitud', 'radio_cobertura_km')
+        _indice_actual['indice'] = IndiceRepartidores(filas)
+        _indice_actual['version'] = version
+    _indice_actual['verificado'] = ahora
+    return _indice_actual['indice']
+
+
+def clientes_en_radio(lat, lng, radio_km):
+    """
+    Clientes a ``radio_km`` o menos del punto, del más cercano al más lejano,
+    como lista de dicts ``{'cliente', 'distancia'}`` (distancia en km).
+    """
+    from ventas.models import Cliente
+
+    clientes = list(Cliente.objects.filter(filtro_caja(lat, lng, radio_km)))
+    if not clientes:
+        return []
+    distancias = haversine_km(
+        lat, lng,
+        [float(cliente.latitud) for cliente in clientes],
+        [float(cliente.longitud) for cliente in clientes],
+    )
+    dentro = np.flatnonzero(distancias <= radio_km)
+    dentro = dentro[np.argsort(distancias[dentro], kind='stable')]
+    return [
+        {'cliente': clientes[posicion], 'distancia': round(float(distancias[posicion]), 2)}
+        for posicion in dentro
+    ]
@@ -1,7 +1,6 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
 from decimal import Decimal
-import math
 
 class User(AbstractUser):
     """
@@ -102,6 +101,9 @@ class User(AbstractUser):
         verbose_name='Zona de cobertura'
     )
     
+    # Campos que cambian el índice espacial de repartidores (accounts.geoespacial)
+    CAMPOS_INDICE_GEO = ('role', 'activo', 'disponible_entregas', 'latitud', 'longitud', 'radio_cobertura_km')
+    
     class Meta:
         verbose_name = 'Usuario'
         verbose_name_plural = 'Usuarios'
@@ -110,6 +112,28 @@ class User(AbstractUser):
     def __str__(self):
         return f"{self.get_full_name()} ({self.get_role_display()})"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        instancia._valores_geo = instancia._valores_indice_geo()
+        return instancia
+    
+    def _valores_indice_geo(self):
+        return tuple(self.__dict__.get(campo) for campo in self.CAMPOS_INDICE_GEO)
+    
+    def save(self, *args, **kwargs):
+        valores = self._valores_indice_geo()
+        anterior = getattr(self, '_valores_geo', None)
+        cambio = valores != anterior and 'repartidor' in (self.role, anterior[0] if anterior else None)
+        if cambio and kwargs.get('update_fields') is not None:
+            # fecha_modificacion es parte de la huella con la que los demás procesos detectan el cambio
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'fecha_modificacion'}
+        super().save(*args, **kwargs)
+        self._valores_geo = valores
+        if cambio:
+            from .geoespacial import invalidar_indice_repartidores
+            transaction.on_commit(invalidar_indice_repartidores)
+    
     def can_manage_users(self):
         """Solo SuperAdmin y Administrador pueden gestionar usuarios"""
         return self.role in ['superadmin', 'administrador']
@@ -170,30 +194,8 @@ class User(AbstractUser):
         if not (self.latitud and self.longitud and cliente.latitud and cliente.longitud):
             return None
         
-        # Fórmula de Haversine para calcular distancia entre dos puntos GPS
-        lat1, lon1 = float(self.latitud), float(self.longitud)
-        lat2, lon2 = float(cliente.latitud), float(cliente.longitud)
-        
-        # Convertir de grados a radianes
-        lat1_rad = math.radians(lat1)
-        lon1_rad = math.radians(lon1)
-        lat2_rad = math.radians(lat2)
-        lon2_rad = math.radians(lon2)
-        
-        # Diferencias
-        dlat = lat2_rad - lat1_rad
-        dlon = lon2_rad - lon1_rad
-        
-        # Fórmula de Haversine
-        a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon/2)**2
-        c = 2 * math.asin(math.sqrt(a))
-        
-        # Radio de la Tierra en km
-        radio_tierra = 6371
-        
-        # Distancia en km
-        distancia = radio_tierra * c
-        return round(distancia, 2)
+        from .distancias import distancia_km
+        return round(distancia_km(self.latitud, self.longitud, cliente.latitud, cliente.longitud), 2)
     
     def puede_atender_cliente(self, cliente):
         """Verifica si el repartidor puede atender a un cliente según su cobertura"""
@@ -216,64 +218,48 @@ class User(AbstractUser):
         self.save(update_fields=['latitud', 'longitud', 'ubicacion_actualizada'])
     
     def get_clientes_en_cobertura(self):
-        """Obtiene clientes dentro del área de cobertura del repartidor"""
-        if not (self.role == 'repartidor' and self.latitud and self.longitud):
+        """
+        Clientes dentro del área de cobertura del repartidor, del más cercano
+        al más lejano: caja envolvente en SQL y distancias vectorizadas
+        """
+        if not (self.role == 'repartidor' and self.disponible_entregas and self.latitud and self.longitud):
             return []
         
-        from ventas.models import Cliente
-        clientes_cercanos = []
-        
-        for cliente in Cliente.objects.filter(latitud__isnull=False, longitud__isnull=False):
-            if self.puede_atender_cliente(cliente):
-                distancia = self.calcular_distancia_cliente(cliente)
-                clientes_cercanos.append({
-                    'cliente': cliente,
-                    'distancia': distancia
-                })
-        
-        # Ordenar por distancia
-        clientes_cercanos.sort(key=lambda x: x['distancia'])
-        return clientes_cercanos
+        from .geoespacial import clientes_en_radio
+        return clientes_en_radio(float(self.latitud), float(self.longitud), float(self.radio_cobertura_km))
     
     @classmethod
     def encontrar_repartidor_mas_cercano(cls, cliente):
-        """Encuentra el repartidor disponible más cercano a un cliente"""
-        repartidores_disponibles = cls.objects.filter(
-            role='repartidor',
-            activo=True,
-            disponible_entregas=True,
-            latitud__isnull=False,
-            longitud__isnull=False
-        )
-        
-        mejor_repartidor = None
-        menor_distancia = float('inf')
+        """Encuentra el repartidor disponible más cercano a un cliente (índice espacial en memoria)"""
+        if cliente.latitud is None or cliente.longitud is None:
+            return {'repartidor': None, 'distancia': None}
         
-        for repartidor in repartidores_disponibles:
-            if repartidor.puede_atender_cliente(cliente):
-                distancia = repartidor.calcular_distancia_cliente(cliente)
-                if distancia and distancia < menor_distancia:
-                    menor_distancia = distancia
-                    mejor_repartidor = repartidor
+        from .geoespacial import indice_repartidores
+        resultado = indice_repartidores().mas_cercano(float(cliente.latitud), float(cliente.longitud))
+        repartidor = cls.objects.filter(pk=resultado[0]).first() if resultado else None
         
         return {
-            'repartidor': mejor_repartidor,
-            'distancia': menor_distancia if mejor_repartidor else None
+            'repartidor': repartidor,
+            'distancia': round(resultado[1], 2) if repartidor else None
         }
     
-    def optimizar_ruta_entregas(self, entregas_pendientes, bodega_origen=None):
+    def optimizar_ruta_entregas(self, entregas_pendientes, bodega_origen=None, regresar=False, tiempo_limite=None):
         """
-        Optimiza la ruta de entregas usando algoritmo nearest neighbor (TSP aproximado)
+        Optimiza la ruta de entregas: vecino más cercano mejorado con 2-opt y
+        Or-opt sobre una matriz de distancias (ventas.optimizador_rutas)
         
         Args:
             entregas_pendientes: QuerySet o lista de entregas asignadas al repartidor
             bodega_origen: Bodega de origen (si no se proporciona, se usa la principal)
+            regresar: incluir el regreso al punto de salida al final de la ruta
+            tiempo_limite: segundos para mejorar la ruta (por defecto TIEMPO_LIMITE_SEGUNDOS)
             
         Returns:
-            dict con ruta optimizada, distancia total y tiempo estimado
+            dict con ruta optimizada, distancia total, ahorro frente al vecino
+            más cercano y tiempo estimado; None si no hay punto de salida con GPS
         """
-        if not (self.latitud and self.longitud):
-            return None
+        from ventas.optimizador_rutas import TIEMPO_LIMITE_SEGUNDOS, optimizar_paradas
+        from ventas.rutas import coordenadas_desde_enlace
         
         # Obtener bodega de origen
         if not bodega_origen:
@@ -282,115 +268,52 @@ class User(AbstractUser):
             if not bodega_origen:
                 bodega_origen = Bodega.objects.filter(activa=True).first()
         
-        if not bodega_origen or not (bodega_origen.latitud and bodega_origen.longitud):
+        # Sale de la bodega (coordenadas de su enlace) o, si no las tiene, del GPS del repartidor
+        origen = coordenadas_desde_enlace(bodega_origen.link_ubicacion) if bodega_origen else None
+        if origen is None and self.latitud is not None and self.longitud is not None:
+            origen = (float(self.latitud), float(self.longitud))
+        if origen is None:
             return None
         
-        # Filtrar entregas con GPS válido
-        entregas_con_gps = []
+        paradas = []
         for entrega in entregas_pendientes:
-            cliente = entrega.cliente
-            if cliente.latitud and cliente.longitud:
-                entregas_con_gps.append(entrega)
-        
-        if not entregas_con_gps:
-            return {'entregas_ordenadas': list(entregas_pendientes), 'distancia_total': 0, 'sin_gps': True}
-        
-        # Implementar algoritmo Nearest Neighbor (TSP aproximado)
-        punto_actual = {
-            'lat': float(bodega_origen.latitud),
-            'lng': float(bodega_origen.longitud),
-            'tipo': 'bodega',
-            'nombre': bodega_origen.nombre
-        }
-        
-        entregas_no_visitadas = list(entregas_con_gps)
-        ruta_optimizada = []
-        distancia_total = 0
+            cliente = entrega.pedido.cliente
+            paradas.append({
+                'entrega': entrega,
+                'cliente': cliente,
+                'lat': float(cliente.latitud) if cliente.latitud is not None else None,
+                'lng': float(cliente.longitud) if cliente.longitud is not None else None,
+            })
         
-        # Algoritmo nearest neighbor
-        while entregas_no_visitadas:
-            entrega_mas_cercana = None
-            distancia_minima = float('inf')
-            
-            for entrega in entregas_no_visitadas:
-                cliente = entrega.cliente
-                distancia = self._calcular_distancia_puntos(
-                    punto_actual['lat'], punto_actual['lng'],
-                    float(cliente.latitud), float(cliente.longitud)
-                )
-                
-                if distancia < distancia_minima:
-                    distancia_minima = distancia
-                    entrega_mas_cercana = entrega
-            
-            # Agregar a la ruta
-            if entrega_mas_cercana:
-                ruta_optimizada.append({
-                    'entrega': entrega_mas_cercana,
-                    'orden': len(ruta_optimizada) + 1,
-                    'distancia_desde_anterior': distancia_minima,
-                    'cliente': entrega_mas_cercana.cliente
-                })
-                
-                distancia_total += distancia_minima
-                entregas_no_visitadas.remove(entrega_mas_cercana)
-                
-                # Actualizar punto actual
-                cliente = entrega_mas_cercana.cliente
-                punto_actual = {
-                    'lat': float(cliente.latitud),
-                    'lng': float(cliente.longitud),
-                    'tipo': 'cliente',
-                    'nombre': cliente.nombre_completo
-                }
+        ruta_optimizada, resumen = optimizar_paradas(
+            paradas, origen,
+            destino=origen if regresar else None,
+            tiempo_limite=tiempo_limite or TIEMPO_LIMITE_SEGUNDOS
+        )
+        entregas_sin_gps = sum(1 for item in ruta_optimizada if item.get('sin_gps'))
         
         # Calcular tiempo estimado (assumiendo 30 km/h promedio + 10 min por entrega)
-        tiempo_viaje_horas = distancia_total / 30  # 30 km/h promedio
+        tiempo_viaje_horas = resumen['distancia_total'] / 30  # 30 km/h promedio
         tiempo_entregas_horas = len(ruta_optimizada) * (10/60)  # 10 min por entrega
         tiempo_total_horas = tiempo_viaje_horas + tiempo_entregas_horas
         
-        # Agregar entregas sin GPS al final
-        entregas_sin_gps = [e for e in entregas_pendientes if e not in entregas_con_gps]
-        for entrega in entregas_sin_gps:
-            ruta_optimizada.append({
-                'entrega': entrega,
-                'orden': len(ruta_optimizada) + 1,
-                'distancia_desde_anterior': 0,
-                'cliente': entrega.cliente,
-                'sin_gps': True
-            })
-        
         return {
             'bodega_origen': bodega_origen,
             'entregas_ordenadas': [item['entrega'] for item in ruta_optimizada],
             'ruta_detallada': ruta_optimizada,
-            'distancia_total': round(distancia_total, 2),
+            'distancia_total': resumen['distancia_total'],
+            'distancia_regreso': resumen['distancia_regreso'],
+            'distancia_vecino_mas_cercano': resumen['distancia_vecino_mas_cercano'],
+            'ahorro_km': resumen['ahorro_km'],
+            'ahorro_porcentaje': resumen['ahorro_porcentaje'],
+            'regresar': regresar,
             'tiempo_estimado_horas': round(tiempo_total_horas, 2),
             'numero_entregas': len(ruta_optimizada),
-            'entregas_con_gps': len(entregas_con_gps),
-            'entregas_sin_gps': len(entregas_sin_gps)
+            'entregas_con_gps': len(ruta_optimizada) - entregas_sin_gps,
+            'entregas_sin_gps': entregas_sin_gps
         }
     
     def _calcular_distancia_puntos(self, lat1, lng1, lat2, lng2):
         """Método auxiliar para calcular distancia entre dos puntos GPS"""
-        import math
-        
-        # Convertir de grados a radianes
-        lat1_rad = math.radians(lat1)
-        lng1_rad = math.radians(lng1)
-        lat2_rad = math.radians(lat2)
-        lng2_rad = math.radians(lng2)
-        
-        # Diferencias
-        dlat = lat2_rad - lat1_rad
-        dlng = lng2_rad - lng1_rad
-        
-        # Fórmula de Haversine
-        a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlng/2)**2
-        c = 2 * math.asin(math.sqrt(a))
-        
-        # Radio de la Tierra en km
-        radio_tierra = 6371
-        
-        # Distancia en km
-        return radio_tierra * c
+        from .distancias import distancia_km
+        return distancia_km(lat1, lng1, lat2, lng2)
@@ -1,3 +1,202 @@
+import math
+import random
+from decimal import Decimal
+
+from unittest import mock
+
+import numpy as np
 from django.test import TestCase
 
-# Create your tests here.
+from accounts import geoespacial
+from accounts.distancias import CacheDistancias, cache_distancias, distancia_km
+from accounts.geoespacial import caja_envolvente, distancias_entre, haversine_km, invalidar_indice_repartidores
+from accounts.models import User
+from ventas.models import Cliente
+
+# Bogotá
+LAT_CENTRO, LNG_CENTRO = 4.65, -74.08
+
+
+def _punto(aleatorio, dispersion=0.3):
+    return (
+        Decimal(str(round(LAT_CENTRO + aleatorio.uniform(-dispersion, dispersion), 7))),
+        Decimal(str(round(LNG_CENTRO + aleatorio.uniform(-dispersion, dispersion), 7))),
+    )
+
+
+def _haversine(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * 6371 * math.asin(math.sqrt(a))
+
+
+class BusquedaEspacialTests(TestCase):
+    """Las búsquedas con caja envolvente e índice de grilla dan lo mismo que recorrer todo"""
+
+    @classmethod
+    def setUpTestData(cls):
+        aleatorio = random.Random(7)
+        cls.repartidores = []
+        for i in range(40):
+            latitud, longitud = _punto(aleatorio)
+            cls.repartidores.append(User.objects.create_user(
+                f'repartidor{i}', role='repartidor', latitud=latitud, longitud=longitud,
+                radio_cobertura_km=Decimal(aleatorio.choice(['3', '5', '10'])),
+                disponible_entregas=i % 7 != 0,
+            ))
+        Cliente.objects.bulk_create([
+            Cliente(numero_documento=str(1000 + i), nombre_completo=f'Cliente {i}', telefono='300',
+                    direccion='Calle', latitud=latitud, longitud=longitud)
+            for i, (latitud, longitud) in enumerate(_punto(aleatorio, 0.5) for _ in range(400))
+        ])
+
+    def setUp(self):
+        # Dentro de TestCase no corre on_commit: se descarta el índice de otras pruebas
+        invalidar_indice_repartidores()
+
+    def test_haversine_vectorizado(self):
+        distancias = haversine_km(LAT_CENTRO, LNG_CENTRO, [4.7, 6.25, LAT_CENTRO], [-74.1, -75.56, LNG_CENTRO])
+        for distancia, (lat, lng) in zip(distancias, [(4.7, -74.1), (6.25, -75.56), (LAT_CENTRO, LNG_CENTRO)]):
+            self.assertAlmostEqual(distancia, _haversine(LAT_CENTRO, LNG_CENTRO, lat, lng), places=6)
+
+    def test_caja_contiene_el_circulo(self):
+        for lat in (0, 4.65, 60, 85):
+            lat_min, lat_max, lng_min, lng_max = caja_envolvente(lat, 10, 50)
+            for rumbo in range(0, 360, 5):
+                # Punto a 49,9 km en cada dirección
+                delta = 49.9 / 6371
+                lat2 = math.asin(math.sin(math.radians(lat)) * math.cos(delta) +
+                                 math.cos(math.radians(lat)) * math.sin(delta) * math.cos(math.radians(rumbo)))
+                lng2 = math.radians(10) + math.atan2(
+                    math.sin(math.radians(rumbo)) * math.sin(delta) * math.cos(math.radians(lat)),
+                    math.cos(delta) - math.sin(math.radians(lat)) * math.sin(lat2),
+                )
+                self.assertTrue(lat_min <= math.degrees(lat2) <= lat_max)
+                self.assertTrue(lng_min <= math.degrees(lng2) <= lng_max)
+
+    def test_repartidor_mas_cercano_igual_a_fuerza_bruta(self):
+        for cliente in Cliente.objects.all()[:150]:
+            distancias = [
+                (_haversine(float(r.latitud), float(r.longitud), float(cliente.latitud), float(cliente.longitud)), r)
+                for r in self.repartidores if r.disponible_entregas
+            ]
+            esperados = sorted(
+                (distancia, r.pk) for distancia, r in distancias if distancia <= float(r.radio_cobertura_km)
+            )
+            resultado = User.encontrar_repartidor_mas_cercano(cliente)
+            if esperados:
+                self.assertEqual(resultado['repartidor'].pk, esperados[0][1])
+                self.assertAlmostEqual(resultado['distancia'], esperados[0][0], places=2)
+            else:
+                self.assertIsNone(resultado['repartidor'])
+
+    def test_clientes_en_cobertura_igual_a_fuerza_bruta(self):
+        repartidor = next(r for r in self.repartidores if r.disponible_entregas)
+        radio = float(repartidor.radio_cobertura_km)
+        esperados = sorted(
+            cliente.pk for cliente in Cliente.objects.all()
+            if _haversine(float(repartidor.latitud), float(repartidor.longitud),
+                          float(cliente.latitud), float(cliente.longitud)) <= radio
+        )
+        with self.assertNumQueries(1):
+            cercanos = repartidor.get_clientes_en_cobertura()
+        self.assertEqual(sorted(item['cliente'].pk for item in cercanos), esperados)
+        distancias = [item['distancia'] for item in cercanos]
+        self.assertEqual(distancias, sorted(distancias))
+
+    def test_actualizar_gps_reconstruye_el_indice(self):
+        cliente = Cliente.objects.create(
+            numero_documento='9999', nombre_completo='Lejano', telefono='300', direccion='Calle',
+            latitud=Decimal('6.2442'), longitud=Decimal('-75.5812'),
+        )
+        self.assertIsNone(User.encontrar_repartidor_mas_cercano(cliente)['repartidor'])
+
+        repartidor = User.objects.get(pk=self.repartidores[1].pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            repartidor.actualizar_ubicacion_gps(6.245, -75.58)
+        self.assertEqual(User.encontrar_repartidor_mas_cercano(cliente)['repartidor'], repartidor)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            repartidor.disponible_entregas = False
+            repartidor.save(update_fields=['disponible_entregas'])
+        self.assertIsNone(User.encontrar_repartidor_mas_cercano(cliente)['repartidor'])
+
+    def test_cambio_en_otro_proceso_se_ve_al_vencer_la_vigencia(self):
+        cliente = Cliente.objects.create(
+            numero_documento='9999', nombre_completo='Lejano', telefono='300', direccion='Calle',
+            latitud=Decimal('6.2442'), longitud=Decimal('-75.5812'),
+        )
+        self.assertIsNone(User.encontrar_repartidor_mas_cercano(cliente)['repartidor'])
+
+        # Sin ejecutar on_commit: la invalidación del proceso que guardó no llega a este
+        repartidor = User.objects.get(pk=self.repartidores[1].pk)
+        repartidor.latitud, repartidor.longitud = Decimal('6.245'), Decimal('-75.58')
+        repartidor.save(update_fields=['latitud', 'longitud'])
+        self.assertIsNone(User.encontrar_repartidor_mas_cercano(cliente)['repartidor'])
+
+        despues = geoespacial.time.monotonic() + geoespacial.VIGENCIA_VERSION
+        with mock.patch.object(geoespacial.time, 'monotonic', return_value=despues):
+            self.assertEqual(User.encontrar_repartidor_mas_cercano(cliente)['repartidor'], repartidor)
+
+
+class CacheDistanciasTests(TestCase):
+    """El caché de distancias responde lo mismo que calcular (a ~1 m) y respeta su capacidad"""
+
+    def setUp(self):
+        aleatorio = np.random.default_rng(3)
+        self.lats = LAT_CENTRO + aleatorio.uniform(-0.3, 0.3, 120)
+        self.lngs = LNG_CENTRO + aleatorio.uniform(-0.3, 0.3, 120)
+        self.esperada = distancias_entre(self.lats, self.lngs, self.lats, self.lngs)
+
+    def test_consultas_por_lote(self):
+        cache = CacheDistancias()
+        np.testing.assert_allclose(cache.matriz(self.lats, self.lngs), self.esperada, atol=0.005)
+        fallos = cache.fallos
+        np.testing.assert_allclose(cache.matriz(self.lats, self.lngs), self.esperada, atol=0.005)
+        self.assertEqual(cache.fallos, fallos)
+
+        np.testing.assert_allclose(
+            cache.matriz(self.lats[:10], self.lngs[:10], self.lats[50:], self.lngs[50:]),
+            self.esperada[:10, 50:], atol=0.005,
+        )
+        np.testing.assert_allclose(cache.desde(self.lats[7], self.lngs[7], self.lats, self.lngs), self.esperada[7], atol=0.005)
+        np.testing.assert_allclose(
+            cache.distancias(self.lats[:60], self.lngs[:60], self.lats[60:], self.lngs[60:]),
+            self.esperada[np.arange(60), np.arange(60, 120)], atol=0.005,
+        )
+        self.assertAlmostEqual(
+            cache.distancia(self.lats[1], self.lngs[1], self.lats[2], self.lngs[2]), self.esperada[1, 2], places=2
+        )
+
+    def test_descarte_lru(self):
+        cache = CacheDistancias(capacidad=50)
+        cache.matriz(self.lats[:40], self.lngs[:40])
+        cache.matriz(self.lats[:5], self.lngs[:5])
+        cache.matriz(self.lats[40:70], self.lngs[40:70])
+        self.assertEqual(len(cache), 50)
+        # Los 5 usados al último siguen; de los otros 35 solo quedan 15
+        fallos = cache.fallos
+        cache.matriz(self.lats[:5], self.lngs[:5])
+        self.assertEqual(cache.fallos, fallos)
+
+        np.testing.assert_allclose(cache.matriz(self.lats[:40], self.lngs[:40]), self.esperada[:40, :40], atol=0.005)
+        # Más puntos que la capacidad: se calcula sin el caché
+        np.testing.assert_allclose(cache.matriz(self.lats, self.lngs), self.esperada, atol=0.005)
+        self.assertEqual(len(cache), 50)
+
+    def test_mover_cliente_libera_la_posicion_anterior(self):
+        cliente = Cliente.objects.create(
+            numero_documento='777', nombre_completo='Movido', telefono='300', direccion='Calle',
+            latitud=Decimal('4.6500000'), longitud=Decimal('-74.0800000'),
+        )
+        cliente = Cliente.objects.get(pk=cliente.pk)
+        distancia_km(cliente.latitud, cliente.longitud, 4.7, -74.1)
+        self.assertIn((465000, -7408000), cache_distancias._filas)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            cliente.latitud, cliente.longitud = Decimal('4.6600000'), Decimal('-74.0500000')
+            cliente.save()
+        self.assertNotIn((465000, -7408000), cache_distancias._filas)
+        self.assertAlmostEqual(
+            distancia_km(cliente.latitud, cliente.longitud, 4.7, -74.1), _haversine(4.66, -74.05, 4.7, -74.1), places=2
+        )
@@ -5,13 +5,13 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, authenticate
 from django.contrib import messages
 from django.urls import reverse_lazy
-from django.db.models import Count, Sum, Q
+from django.db.models import Count, Q
 from django.http import JsonResponse
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from datetime import datetime, timedelta
 
-from inventario.models import Producto, Stock, MovimientoInventario
+from inventario.models import Producto, MovimientoInventario
 from ventas.models import Pedido, Cotizacion, Cliente, Entrega
 from .models import User
 from .forms import UserCreateForm, UserUpdateForm, ChangePasswordForm
@@ -180,21 +180,18 @@ class DashboardView(LoginRequiredMixin, TemplateView):
     
     def get_productos_bajo_stock(self):
         """Obtiene productos que están bajo el stock mínimo"""
-        productos_bajo_stock = []
-        
-        for producto in Producto.objects.filter(activo=True):
-            stock_total = Stock.objects.filter(producto=producto).aggregate(
-                total=Sum('cantidad')
-            )['total'] or 0
-            
-            if stock_total <= producto.stock_minimo:
-                productos_bajo_stock.append({
-                    'producto': producto,
-                    'stock_actual': stock_total,
-                    'stock_minimo': producto.stock_minimo
-                })
-        
-        return productos_bajo_stock[:10]  # Máximo 10 para el dashboard
+        productos = Producto.filtrar_por_estado_stock(
+            Producto.objects.filter(activo=True), 'bajo_minimo'
+        ).order_by('stock_actual', 'codigo')[:10]  # Máximo 10 para el dashboard
+        
+        return [
+            {
+                'producto': producto,
+                'stock_actual': producto.stock_actual,
+                'stock_minimo': producto.stock_minimo
+            }
+            for producto in productos
+        ]
 
 
 # ============= MIXINS PARA CONTROL DE ACCESO =============
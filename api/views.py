@@ -218,7 +218,7 @@ def api_producto_detalle(request, producto_id):
 def api_buscar_productos(request):
     """API para búsqueda rápida de productos"""
     try:
-        from inventario.models import Producto
+        from inventario.busqueda import buscar_productos
         
         query = request.GET.get('q', '').strip()
         if not query:
@@ -227,11 +227,7 @@ def api_buscar_productos(request):
                 'error': 'Parámetro q (query) requerido'
             }, status=400)
         
-        productos = Producto.objects.filter(
-            Q(nombre__icontains=query) | 
-            Q(codigo__icontains=query),
-            activo=True
-        )[:10]  # Máximo 10 resultados
+        productos = buscar_productos(query, limite=10)  # Máximo 10 resultados
         
         data = []
         for producto in productos:
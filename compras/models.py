@@ -1,5 +1,5 @@
 import uuid
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from django.urls import reverse
@@ -269,6 +269,7 @@ class SolicitudCompra(models.Model):
                 'fecha_requerida': 'La fecha requerida debe ser posterior a hoy'
             })
     
+    @transaction.atomic
     def crear_orden_compra(self, proveedor, usuario_comprador):
         """Crear orden de compra desde solicitud aprobada"""
         if self.estado != EstadoSolicitudCompra.APROBADA:
@@ -313,25 +314,7 @@ class SolicitudCompra(models.Model):
     
     def _generar_numero_orden_desde_solicitud(self):
         """Generar número único para la orden"""
-        from django.utils import timezone
-        hoy = timezone.now().date()
-        prefijo = f"OC-{hoy.strftime('%Y%m%d')}"
-        
-        # Buscar el último número del día
-        ultima_orden = OrdenCompra.objects.filter(
-            numero__startswith=prefijo
-        ).order_by('-numero').first()
-        
-        if ultima_orden:
-            try:
-                ultimo_numero = int(ultima_orden.numero.split('-')[-1])
-                siguiente = ultimo_numero + 1
-            except (ValueError, IndexError):
-                siguiente = 1
-        else:
-            siguiente = 1
-        
-        return f"{prefijo}-{siguiente:03d}"
+        return OrdenCompra.generar_numeros(1)[0]
 
 
 class ItemSolicitudCompra(models.Model):
@@ -694,35 +677,26 @@ class OrdenCompra(models.Model):
         return reverse('compras:orden_detail', kwargs={'pk': self.pk})
     
     def save(self, *args, **kwargs):
-        if not self.numero:
-            # Generar número único basado en fecha y secuencia
-            self.numero = self._generar_numero_orden()
+        with transaction.atomic():
+            if not self.numero:
+                # Generar número único basado en fecha y secuencia
+                self.numero = self._generar_numero_orden()
+            
+            # Calcular totales
+            self.calcular_totales()
+            super().save(*args, **kwargs)
+    
+    @classmethod
+    def generar_numeros(cls, cantidad):
+        """Reserva un bloque de números de orden del día (OC-AAAAMMDD-NNN)"""
+        from ventas.models import reservar_numeros
         
-        # Calcular totales
-        self.calcular_totales()
-        super().save(*args, **kwargs)
+        dia = timezone.now().date().strftime('%Y%m%d')
+        return reservar_numeros(cls, 'orden_compra', f"OC-{dia}-", cantidad, 3, dia)
     
     def _generar_numero_orden(self):
         """Generar número único para la orden"""
-        from django.utils import timezone
-        hoy = timezone.now().date()
-        prefijo = f"OC-{hoy.strftime('%Y%m%d')}"
-        
-        # Buscar el último número del día
-        ultima_orden = OrdenCompra.objects.filter(
-            numero__startswith=prefijo
-        ).order_by('-numero').first()
-        
-        if ultima_orden:
-            try:
-                ultimo_numero = int(ultima_orden.numero.split('-')[-1])
-                siguiente = ultimo_numero + 1
-            except (ValueError, IndexError):
-                siguiente = 1
-        else:
-            siguiente = 1
-        
-        return f"{prefijo}-{siguiente:03d}"
+        return self.generar_numeros(1)[0]
     
     def calcular_totales(self):
         """Calcular subtotal, descuentos y total"""
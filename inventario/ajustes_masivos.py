@@ -0,0 +1,156 @@
+"""
+Ajustes masivos de inventario (conteos físicos)
+
+Carga los productos y las filas de Stock afectadas en dos consultas por
+lote, calcula las diferencias en memoria y las aplica con bulk_update /
+bulk_create, conservando un MovimientoInventario por cada producto ajustado.
+"""
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from .models import MovimientoInventario, Producto, Stock
+
+TAMANO_LOTE = 500
+
+
+def _lotes(elementos, tamano):
+    for inicio in range(0, len(elementos), tamano):
+        yield elementos[inicio:inicio + tamano]
+
+
+def validar_conteos(conteos):
+    """Lanza ValidationError si el conteo {producto_id: cantidad} trae cantidades negativas"""
+    negativos = sorted(producto_id for producto_id, cantidad in conteos.items() if cantidad < 0)
+    if negativos:
+        raise ValidationError(
+            'La cantidad contada no puede ser negativa (productos %(productos)s).',
+            code='cantidad_negativa',
+            params={'productos': ', '.join(map(str, negativos))},
+        )
+
+
+def calcular_diferencias(bodega, conteos, bloquear=False, solo_activos=False):
+    """
+    Compara un conteo físico {producto_id: cantidad_nueva} contra el Stock
+    actual de la bodega. No modifica la base de datos.
+
+    Retorna (diferencias, no_encontrados): una entrada por producto cuya
+    cantidad cambia y la lista de ids de producto inexistentes.
+    """
+    producto_ids = list(conteos)
+    productos = Producto.objects.filter(id__in=producto_ids)
+    if solo_activos:
+        productos = productos.filter(activo=True)
+    productos = {
+        producto.id: producto
+        for producto in productos.only('id', 'codigo', 'nombre', 'costo_promedio').order_by()
+    }
+    stocks = Stock.objects.filter(
+        bodega=bodega,
+        producto_id__in=producto_ids,
+        variante__isnull=True,
+    )
+    if bloquear:
+        stocks = stocks.select_for_update().order_by('pk')
+    stocks = {stock.producto_id: stock for stock in stocks}
+
+    diferencias = []
+    no_encontrados = []
+    for producto_id, cantidad_nueva in conteos.items():
+        producto = productos.get(producto_id)
+        if producto is None:
+            no_encontrados.append(producto_id)
+            continue
+        stock = stocks.get(producto_id)
+        cantidad_anterior = stock.cantidad if stock else 0
+        diferencia = cantidad_nueva - cantidad_anterior
+        if diferencia == 0:
+            continue
+        diferencias.append({
+            'producto': producto,
+            'stock': stock,
+            'cantidad_anterior': cantidad_anterior,
+            'cantidad_nueva': cantidad_nueva,
+            'diferencia': diferencia,
+        })
+    return diferencias, no_encontrados
+
+
+def aplicar_ajuste_masivo(bodega, conteos, usuario=None, observaciones='', motivo='reconteo',
+                          tamano_lote=TAMANO_LOTE, solo_activos=False):
+    """
+    Aplica un conteo físico {producto_id: cantidad_nueva} en la bodega.
+
+    Todo el conteo se aplica en una sola transacción: los lotes solo acotan
+    el tamaño de cada consulta, de modo que un error a mitad de camino no deja
+    el conteo aplicado a medias. Retorna un resumen con ajustados, creados,
+    no_encontrados y el detalle de cada ajuste aplicado. Lanza ValidationError,
+    sin aplicar nada, si alguna cantidad es negativa.
+    """
+    validar_conteos(conteos)
+    resumen = {'ajustados': 0, 'creados': 0, 'no_encontrados': [], 'detalle': []}
+
+    with transaction.atomic():
+        for lote in _lotes(list(conteos), tamano_lote):
+            diferencias, no_encontrados = calcular_diferencias(
+                bodega, {producto_id: conteos[producto_id] for producto_id in lote},
+                bloquear=True, solo_activos=solo_activos
+            )
+            resumen['no_encontrados'].extend(no_encontrados)
+            if not diferencias:
+                continue
+
+            ahora = timezone.now()
+            actualizar = []
+            crear = []
+            movimientos = []
+            for ajuste in diferencias:
+                producto = ajuste['producto']
+                stock = ajuste['stock']
+                if stock is None:
+                    crear.append(Stock(
+                        producto=producto,
+                        bodega=bodega,
+                        cantidad=ajuste['cantidad_nueva'],
+                        cantidad_reservada=0,
+                    ))
+                else:
+                    stock.cantidad = ajuste['cantidad_nueva']
+                    stock.fecha_actualizacion = ahora
+                    actualizar.append(stock)
+
+                movimientos.append(MovimientoInventario(
+                    producto=producto,
+                    bodega=bodega,
+                    tipo_movimiento='entrada' if ajuste['diferencia'] > 0 else 'salida',
+                    motivo=motivo,
+                    cantidad=abs(ajuste['diferencia']),
+                    costo_unitario=producto.costo_promedio,
+                    observaciones=(
+                        f"Ajuste masivo: {ajuste['cantidad_anterior']} → {ajuste['cantidad_nueva']}. "
+                        f"{observaciones}"
+                    ),
+                    usuario=usuario,
+                ))
+
+            Stock.objects.bulk_update(actualizar, ['cantidad', 'fecha_actualizacion'], batch_size=tamano_lote)
+            Stock.objects.bulk_create(crear, batch_size=tamano_lote)
+            MovimientoInventario.objects.bulk_create(movimientos, batch_size=tamano_lote)
+            Stock.sincronizar_existencias([ajuste['producto'].id for ajuste in diferencias])
+
+            resumen['ajustados'] += len(diferencias)
+            resumen['creados'] += len(crear)
+            resumen['detalle'].extend(
+                {
+                    'producto_id': ajuste['producto'].id,
+                    'codigo': ajuste['producto'].codigo,
+                    'cantidad_anterior': ajuste['cantidad_anterior'],
+                    'cantidad_nueva': ajuste['cantidad_nueva'],
+                    'diferencia': ajuste['diferencia'],
+                }
+                for ajuste in diferencias
+            )
+
+    return resumen
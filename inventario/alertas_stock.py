@@ -0,0 +1,174 @@
+"""
+Escaneo de alertas de stock por conjuntos
+
+Lee el stock consolidado (``Producto.existencia_total``) de todos los
+productos en una sola consulta por lote, los clasifica en memoria con
+``AlertaStock.clasificar`` y crea, actualiza o resuelve las alertas con
+bulk_create / bulk_update / update. Con ``desde`` solo se re-evalúan los
+productos cuyo Stock o ficha cambió después de esa fecha; cuando una fila de
+Stock se elimina, ``Stock.sincronizar_existencias`` actualiza la
+``fecha_modificacion`` del producto.
+
+Cada escaneo de todo el catálogo que termina guarda su hora de inicio en
+``EscaneoAlertasStock``; ``escanear_desde_ultimo`` parte de esa marca (menos
+``MARGEN_ESCANEO``), así que un escaneo que no corrió o falló no deja
+cambios sin evaluar.
+"""
+
+from datetime import timedelta
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import AlertaStock, EscaneoAlertasStock, Producto, Stock
+
+TAMANO_LOTE = 2000
+# Cubre las transacciones que estaban abiertas cuando empezó el escaneo anterior
+MARGEN_ESCANEO = timedelta(seconds=30)
+CAMPOS_ACTUALIZABLES = [
+    'nivel', 'mensaje', 'stock_actual', 'stock_minimo', 'activa', 'vista',
+    'fecha_resuelto', 'resuelto_por', 'fecha_actualizacion',
+]
+
+
+def _lotes(iterable, tamano):
+    iterador = iter(iterable)
+    while True:
+        lote = list(islice(iterador, tamano))
+        if not lote:
+            return
+        yield lote
+
+
+def _productos_a_evaluar(desde=None, producto_ids=None):
+    productos = Producto.objects.order_by()
+    if producto_ids is not None:
+        productos = productos.filter(id__in=producto_ids)
+    if desde is not None:
+        con_movimiento = Stock.objects.filter(fecha_actualizacion__gt=desde).values('producto_id')
+        productos = productos.filter(Q(id__in=con_movimiento) | Q(fecha_modificacion__gt=desde))
+    return productos.values_list('id', 'nombre', 'activo', 'stock_minimo', 'existencia_total')
+
+
+def _procesar_lote(lote, resumen):
+    existentes = {}
+    for alerta in AlertaStock.objects.filter(producto_id__in=[fila[0] for fila in lote]).order_by():
+        existentes.setdefault(alerta.producto_id, {})[alerta.tipo_alerta] = alerta
+
+    ahora = timezone.now()
+    crear = []
+    actualizar = []
+    resolver = []
+    for producto_id, nombre, activo, stock_minimo, stock_actual in lote:
+        clasificacion = None
+        if activo and stock_minimo > 0:
+            clasificacion = AlertaStock.clasificar(nombre, stock_actual, stock_minimo)
+        tipo_alerta = clasificacion[0] if clasificacion else None
+
+        alertas = existentes.get(producto_id, {})
+        resolver.extend(
+            alerta.id for tipo, alerta in alertas.items()
+            if alerta.activa and tipo != tipo_alerta
+        )
+        if clasificacion is None:
+            resumen['sin_alerta'] += 1
+            continue
+
+        _, nivel, mensaje = clasificacion
+        alerta = alertas.get(tipo_alerta)
+        if alerta is None:
+            crear.append(AlertaStock(
+                producto_id=producto_id,
+                tipo_alerta=tipo_alerta,
+                nivel=nivel,
+                mensaje=mensaje,
+                stock_actual=stock_actual,
+                stock_minimo=stock_minimo,
+            ))
+            continue
+        if (alerta.activa and alerta.nivel == nivel and
+                alerta.stock_actual == stock_actual and alerta.stock_minimo == stock_minimo):
+            continue
+
+        if not alerta.activa:
+            # Reaparece una alerta resuelta: vuelve a mostrarse como nueva
+            alerta.vista = False
+            alerta.fecha_resuelto = None
+            alerta.resuelto_por = None
+        alerta.activa = True
+        alerta.nivel = nivel
+        alerta.mensaje = mensaje
+        alerta.stock_actual = stock_actual
+        alerta.stock_minimo = stock_minimo
+        alerta.fecha_actualizacion = ahora
+        actualizar.append(alerta)
+
+    if crear or actualizar or resolver:
+        with transaction.atomic():
+            # ignore_conflicts: otro escaneo simultáneo pudo crear la misma alerta
+            AlertaStock.objects.bulk_create(crear, ignore_conflicts=True)
+            AlertaStock.objects.bulk_update(actualizar, CAMPOS_ACTUALIZABLES)
+            if resolver:
+                AlertaStock.objects.filter(id__in=resolver, activa=True).update(
+                    activa=False, fecha_resuelto=ahora, fecha_actualizacion=ahora
+                )
+
+    resumen['evaluados'] += len(lote)
+    resumen['creadas'] += len(crear)
+    resumen['actualizadas'] += len(actualizar)
+    resumen['resueltas'] += len(resolver)
+
+
+def escanear_alertas_stock(desde=None, producto_ids=None, tamano_lote=TAMANO_LOTE):
+    """
+    Sincroniza AlertaStock con el stock real de los productos.
+
+    Sin ``desde`` evalúa todo el catálogo; con ``desde`` solo los productos
+    modificados después de esa fecha. Retorna un resumen con evaluados,
+    creadas, actualizadas, resueltas, sin_alerta e ``inicio`` (la fecha a
+    usar como ``desde`` en el siguiente escaneo incremental).
+    """
+    resumen = {
+        'inicio': timezone.now(),
+        'evaluados': 0,
+        'creadas': 0,
+        'actualizadas': 0,
+        'resueltas': 0,
+        'sin_alerta': 0,
+    }
+    filas = _productos_a_evaluar(desde, producto_ids).iterator(chunk_size=tamano_lote)
+    for lote in _lotes(filas, tamano_lote):
+        _procesar_lote(lote, resumen)
+    if producto_ids is None:
+        _registrar_escaneo(resumen, incremental=desde is not None)
+    return resumen
+
+
+def _registrar_escaneo(resumen, incremental):
+    # La marca solo avanza: un escaneo lento que termina tarde no retrocede la de uno posterior
+    valores = {'fin': timezone.now(), 'incremental': incremental, 'evaluados': resumen['evaluados']}
+    with transaction.atomic():
+        escaneo = EscaneoAlertasStock.objects.select_for_update().first()
+        if escaneo is None:
+            EscaneoAlertasStock.objects.create(inicio=resumen['inicio'], **valores)
+        elif escaneo.inicio < resumen['inicio']:
+            EscaneoAlertasStock.objects.filter(pk=escaneo.pk).update(inicio=resumen['inicio'], **valores)
+
+
+def ultimo_escaneo():
+    """Hora de inicio del último escaneo completado, o None si nunca se ha escaneado"""
+    return EscaneoAlertasStock.objects.values_list('inicio', flat=True).first()
+
+
+def escanear_desde_ultimo(tamano_lote=TAMANO_LOTE):
+    """
+    Escaneo incremental desde el último escaneo completado (completo si no
+    hay ninguno). El resumen incluye ``desde``, la fecha usada.
+    """
+    ultimo = ultimo_escaneo()
+    desde = ultimo - MARGEN_ESCANEO if ultimo else None
+    resumen = escanear_alertas_stock(desde=desde, tamano_lote=tamano_lote)
+    resumen['desde'] = desde
+    return resumen
@@ -5,6 +5,7 @@ from django.http import JsonResponse
 from django.db.models import Count
 from django.utils import timezone
 from .models import AlertaStock, Producto
+from .alertas_stock import escanear_alertas_stock
 
 
 @login_required
@@ -144,25 +145,18 @@ def generar_alertas_manuales(request):
     """Generar alertas manualmente para todos los productos"""
     
     if request.method == 'POST':
-        # Ejecutar verificación de stock
-        from django.core.management import call_command
-        from io import StringIO
-        
-        output = StringIO()
         try:
-            call_command('verificar_stock_bajo', '--crear-alertas', '--simular-stock', stdout=output)
-            resultado = output.getvalue()
+            resumen = escanear_alertas_stock()
             
             messages.success(
                 request, 
                 'Verificación de stock completada. Se han actualizado las alertas automáticamente.'
             )
-            
-            # Para debugging, mostrar parte del resultado
-            lines = resultado.split('\n')
-            resumen_lines = [line for line in lines if 'RESUMEN' in line or '🆕' in line or '🔄' in line or '✅' in line]
-            if resumen_lines:
-                messages.info(request, ' | '.join(resumen_lines[:3]))
+            messages.info(
+                request,
+                f"🆕 Nuevas: {resumen['creadas']} | 🔄 Actualizadas: {resumen['actualizadas']} | "
+                f"✅ Resueltas: {resumen['resueltas']}"
+            )
             
         except Exception as e:
             messages.error(request, f'Error al generar alertas: {str(e)}')
@@ -8,18 +8,21 @@ from django.http import JsonResponse, HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.db import transaction
-from django.db.models import Q, F, Sum, Count, Avg
+from django.db.models import F, Sum, Count, Avg
 from django.utils import timezone
 from decimal import Decimal
 from datetime import datetime, timedelta
 import json
 
 # Importaciones locales
+from .busqueda import buscar_productos
 from .models import (
     Producto, Categoria, Subcategoria, MovimientoInventario,
     Stock, Bodega, ProductoProveedor, PresentacionProveedorProducto,
     RecomendacionReposicion
 )
+from .ajustes_masivos import aplicar_ajuste_masivo
+from ventas.paginacion import pagina_keyset, tamano_pagina
 
 # ========================================
 # APIs PARA CARGAR DATOS DINÁMICOS
@@ -108,15 +111,14 @@ def buscar_productos_api(request):
         return JsonResponse({'productos': []})
     
     # Buscar por código o nombre
-    productos = Producto.objects.filter(
-        Q(codigo__icontains=query) | Q(nombre__icontains=query),
-        activo=True
-    ).select_related('categoria', 'subcategoria')[:limite]
+    productos = buscar_productos(
+        query, limite=limite, queryset=Producto.objects.select_related('categoria', 'subcategoria')
+    )
     
     productos_data = []
     for producto in productos:
-        # Calcular stock total de todas las bodegas
-        stock_total = sum(stock.cantidad for stock in producto.stock.all()) if hasattr(producto, 'stock') else 0
+        # Stock total consolidado de todas las bodegas
+        stock_total = producto.existencia_total
         
         productos_data.append({
             'id': producto.id,
@@ -335,60 +337,54 @@ def ajuste_masivo_inventario(request):
             resultados = []
             errores = []
             
-            # Procesar ajustes en transacción
+            # Agrupar el conteo por bodega: {bodega_id: {producto_id: cantidad}}
+            conteos_por_bodega = {}
+            negativos = []
+            for i, ajuste in enumerate(ajustes):
+                try:
+                    producto_id = int(ajuste.get('producto_id'))
+                    bodega_id = int(ajuste.get('bodega_id'))
+                    nueva_cantidad = int(ajuste.get('nueva_cantidad', 0))
+                except (TypeError, ValueError) as e:
+                    errores.append({'indice': i, 'error': str(e)})
+                    continue
+                if nueva_cantidad < 0:
+                    negativos.append({'indice': i, 'error': 'La cantidad contada no puede ser negativa'})
+                    continue
+                conteos_por_bodega.setdefault(bodega_id, {})[producto_id] = nueva_cantidad
+            
+            # Un conteo con cantidades negativas se rechaza completo, sin aplicar nada
+            if negativos:
+                return JsonResponse({'error': 'Cantidades negativas en el conteo', 'errores': negativos}, status=400)
+            
+            bodegas = Bodega.objects.filter(id__in=conteos_por_bodega, activa=True).in_bulk()
+            
+            # Aplicar todas las bodegas en una sola transacción con el pipeline masivo
+            # (bulk_update / bulk_create): un error deja el inventario sin cambios
             with transaction.atomic():
-                for i, ajuste in enumerate(ajustes):
-                    try:
-                        producto_id = ajuste.get('producto_id')
-                        bodega_id = ajuste.get('bodega_id')
-                        nueva_cantidad = int(ajuste.get('nueva_cantidad', 0))
-                        
-                        # Obtener objetos
-                        producto = Producto.objects.get(id=producto_id, activo=True)
-                        bodega = Bodega.objects.get(id=bodega_id, activa=True)
-                        
-                        # Obtener o crear stock
-                        stock, created = Stock.objects.get_or_create(
-                            producto=producto,
-                            bodega=bodega,
-                            defaults={'cantidad': 0}
-                        )
-                        
-                        stock_anterior = stock.cantidad
-                        diferencia = nueva_cantidad - stock_anterior
-                        
-                        if diferencia != 0:
-                            # Actualizar stock
-                            stock.cantidad = nueva_cantidad
-                            stock.save()
-                            
-                            # Actualizar stock total del producto
-                            producto.actualizar_stock_total()
-                            
-                            # Crear movimiento
-                            MovimientoInventario.objects.create(
-                                producto=producto,
-                                bodega_origen=bodega if diferencia < 0 else None,
-                                bodega_destino=bodega if diferencia > 0 else None,
-                                tipo='ajuste',
-                                cantidad=diferencia,
-                                motivo='ajuste_inventario',
-                                observaciones=f'{motivo_general}. Stock anterior: {stock_anterior}, Stock nuevo: {nueva_cantidad}. {observaciones_general}',
-                                usuario=request.user
-                            )
-                            
-                            resultados.append({
-                                'producto': producto.codigo,
-                                'bodega': bodega.nombre,
-                                'stock_anterior': stock_anterior,
-                                'stock_nuevo': nueva_cantidad,
-                                'diferencia': diferencia
-                            })
-                        
-                    except Exception as e:
-                        errores.append({
-                            'indice': i,
-                            'error': str(e)
+                for bodega_id, conteos in conteos_por_bodega.items():
+                    bodega = bodegas.get(bodega_id)
+                    if bodega is None:
+                        errores.append({'bodega_id': bodega_id, 'error': 'Bodega no encontrada o inactiva'})
+                        continue
+                
+                    resumen = aplicar_ajuste_masivo(
+                        bodega,
+                        conteos,
+                        usuario=request.user,
+                        observaciones=f'{motivo_general}. {observaciones_general}',
+                        motivo='ajuste_inventario',
+                        solo_activos=True,
+                    )
+                    for producto_id in resumen['no_encontrados']:
+                        errores.append({'producto_id': producto_id, 'error': 'Producto no encontrado o inactivo'})
+                    for detalle in resumen['detalle']:
+                        resultados.append({
+                            'producto': detalle['codigo'],
+                            'bodega': bodega.nombre,
+                            'stock_anterior': detalle['cantidad_anterior'],
+                            'stock_nuevo': detalle['cantidad_nueva'],
+                            'diferencia': detalle['diferencia']
                         })
             
             return JsonResponse({
@@ -430,33 +426,38 @@ def validar_codigo_producto_api(request):
     })
 
 
+@login_required
 def historial_movimientos_api(request):
-    """API para obtener historial de movimientos de un producto"""
+    """
+    API para obtener historial de movimientos de un producto, paginado por
+    cursor: la respuesta trae ``siguiente_cursor`` para pedir la página siguiente
+    """
     producto_id = request.GET.get('producto')
-    limite = int(request.GET.get('limit', 50))
+    limite = tamano_pagina(request.GET.get('limit'), por_defecto=50)
     
     if not producto_id:
         return JsonResponse({'error': 'ID de producto requerido'}, status=400)
     
     try:
         producto = Producto.objects.get(id=producto_id, activo=True)
-    except Producto.DoesNotExist:
+    except (Producto.DoesNotExist, ValueError):
         return JsonResponse({'error': 'Producto no encontrado'}, status=404)
     
     movimientos = MovimientoInventario.objects.filter(
         producto=producto
     ).select_related(
-        'bodega_origen', 'bodega_destino', 'usuario'
-    ).order_by('-fecha_movimiento')[:limite]
+        'bodega', 'bodega_destino', 'usuario'
+    )
+    pagina = pagina_keyset(movimientos, 'fecha_movimiento', request.GET.get('cursor'), limite)
     
     movimientos_data = []
-    for mov in movimientos:
+    for mov in pagina['objetos']:
         movimientos_data.append({
             'id': str(mov.id),
             'fecha': mov.fecha_movimiento.strftime('%Y-%m-%d %H:%M'),
-            'tipo': mov.tipo,
+            'tipo': mov.tipo_movimiento,
             'cantidad': mov.cantidad,
-            'bodega_origen': mov.bodega_origen.nombre if mov.bodega_origen else None,
+            'bodega_origen': mov.bodega.nombre,
             'bodega_destino': mov.bodega_destino.nombre if mov.bodega_destino else None,
             'motivo': mov.get_motivo_display(),
             'observaciones': mov.observaciones,
@@ -469,7 +470,8 @@ def historial_movimientos_api(request):
             'codigo': producto.codigo,
             'nombre': producto.nombre
         },
-        'movimientos': movimientos_data
+        'movimientos': movimientos_data,
+        'siguiente_cursor': pagina['siguiente_cursor'],
     })
 
 
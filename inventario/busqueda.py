@@ -0,0 +1,289 @@
+"""
+Búsqueda indexada de productos
+
+Un único servicio para todos los autocompletados y APIs de búsqueda:
+
+* Código exacto de producto o de variante: consulta por índice único.
+* SQLite: tabla FTS5 ``inventario_producto_busqueda`` con tokenizador
+  trigram (coincidencia por subcadena/prefijo, ranking bm25) y una segunda
+  pasada por trigramas sueltos para tolerar errores de tipeo.
+* PostgreSQL: índices GIN pg_trgm, ranking por ``word_similarity`` y el
+  operador ``%>`` para errores de tipeo.
+* Otros motores: ``icontains``.
+
+El índice FTS se mantiene en todas las escrituras del ORM:
+``Producto.save()`` y los métodos masivos del queryset de productos
+(``update``, ``bulk_create``, ``bulk_update``) reindexan las filas que
+tocan, y un trigger de SQLite quita del índice toda fila borrada, también
+en borrados en cascada. Solo las escrituras por fuera del ORM (SQL directo,
+``loaddata``) requieren el comando ``reindexar_productos``.
+"""
+
+import re
+import unicodedata
+
+from django.db import DatabaseError, connection
+from django.db.models import F, Q
+
+TABLA_FTS = 'inventario_producto_busqueda'
+TRIGGER_BORRADO = 'inventario_producto_busqueda_borrado'
+LIMITE_CANDIDATOS_TIPEO = 50
+SIMILITUD_MINIMA = 0.3  # Mismo umbral por defecto que pg_trgm
+
+_indice_sqlite = {}
+
+
+def normalizar(texto):
+    """Minúsculas y sin tildes, para indexar y consultar con el mismo criterio"""
+    texto = unicodedata.normalize('NFKD', str(texto or ''))
+    return ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+
+
+def _tokens(texto):
+    return re.findall(r'\w+', normalizar(texto))
+
+
+def _trigramas(palabra, relleno=False):
+    if relleno:
+        # Igual que pg_trgm: dos espacios al inicio y uno al final de la palabra
+        palabra = f'  {palabra} '
+    return {palabra[i:i + 3] for i in range(len(palabra) - 2)}
+
+
+def _frase(token):
+    return '"' + token.replace('"', '""') + '"'
+
+
+# ============= MANTENIMIENTO DEL ÍNDICE (SQLite) =============
+
+def indice_fts_disponible():
+    """Indica si la base de datos actual tiene la tabla FTS5 de productos"""
+    if connection.vendor != 'sqlite':
+        return False
+    clave = connection.settings_dict['NAME']
+    if clave not in _indice_sqlite:
+        _indice_sqlite[clave] = TABLA_FTS in connection.introspection.table_names()
+    return _indice_sqlite[clave]
+
+
+def crear_indice_fts(schema_editor=None):
+    """
+    Crea la tabla FTS5 si SQLite soporta el tokenizador trigram (3.34+), y
+    el trigger que quita del índice los productos borrados
+    """
+    conexion = schema_editor.connection if schema_editor else connection
+    if conexion.vendor != 'sqlite':
+        return False
+    try:
+        with conexion.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLA_FTS} "
+                f"USING fts5(codigo, nombre, tokenize='trigram')"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {TRIGGER_BORRADO} AFTER DELETE ON inventario_producto "
+                f"BEGIN DELETE FROM {TABLA_FTS} WHERE rowid = old.id; END"
+            )
+    except DatabaseError:
+        return False
+    _indice_sqlite[conexion.settings_dict['NAME']] = True
+    return True
+
+
+def indexar_producto(producto):
+    """Agrega o reemplaza un producto en el índice"""
+    if not indice_fts_disponible():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLA_FTS} WHERE rowid = %s", [producto.pk])
+        cursor.execute(
+            f"INSERT INTO {TABLA_FTS} (rowid, codigo, nombre) VALUES (%s, %s, %s)",
+            [producto.pk, normalizar(producto.codigo), normalizar(producto.nombre)]
+        )
+
+
+def indexar_productos(producto_ids, tamano_lote=2000):
+    """Agrega o reemplaza en el índice los productos dados (para escrituras masivas)"""
+    from .models import Producto
+
+    if not indice_fts_disponible():
+        return
+    producto_ids = list(producto_ids)
+    with connection.cursor() as cursor:
+        for inicio in range(0, len(producto_ids), tamano_lote):
+            lote = producto_ids[inicio:inicio + tamano_lote]
+            filas = Producto.objects.filter(pk__in=lote).order_by().values_list('id', 'codigo', 'nombre')
+            cursor.executemany(f"DELETE FROM {TABLA_FTS} WHERE rowid = %s", [(producto_id,) for producto_id in lote])
+            cursor.executemany(
+                f"INSERT INTO {TABLA_FTS} (rowid, codigo, nombre) VALUES (%s, %s, %s)",
+                [(producto_id, normalizar(codigo), normalizar(nombre)) for producto_id, codigo, nombre in filas]
+            )
+
+
+def reconstruir_indice(tamano_lote=2000):
+    """Reconstruye el índice completo. Retorna la cantidad de productos indexados"""
+    from .models import Producto
+
+    if not crear_indice_fts():
+        return 0
+
+    total = 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLA_FTS}")
+        filas = Producto.objects.order_by().values_list('id', 'codigo', 'nombre')
+        lote = []
+        for producto_id, codigo, nombre in filas.iterator(chunk_size=tamano_lote):
+            lote.append((producto_id, normalizar(codigo), normalizar(nombre)))
+            if len(lote) >= tamano_lote:
+                cursor.executemany(f"INSERT INTO {TABLA_FTS} (rowid, codigo, nombre) VALUES (%s, %s, %s)", lote)
+                total += len(lote)
+                lote = []
+        if lote:
+            cursor.executemany(f"INSERT INTO {TABLA_FTS} (rowid, codigo, nombre) VALUES (%s, %s, %s)", lote)
+            total += len(lote)
+    return total
+
+
+# ============= BÚSQUEDA =============
+
+def _ids_codigo_exacto(termino, queryset):
+    """Productos cuyo código, o el de alguna de sus variantes, es exactamente el término"""
+    codigos = {termino, termino.upper()}
+    return list(
+        queryset.filter(Q(codigo__in=codigos) | Q(variantes__codigo_variante__in=codigos))
+        .values_list('id', flat=True).distinct()
+    )
+
+
+def _consultar_fts(consulta, termino, limite, solo_activos, excluir):
+    """Ids que coinciden con la consulta FTS5, ordenados por relevancia"""
+    condiciones = [f"{TABLA_FTS} MATCH %s"]
+    parametros = [consulta]
+    if solo_activos:
+        condiciones.append("p.activo")
+    if excluir:
+        condiciones.append(f"p.id NOT IN ({', '.join(['%s'] * len(excluir))})")
+        parametros.extend(excluir)
+    prefijo = termino.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    sql = (
+        f"SELECT p.id, b.codigo, b.nombre FROM {TABLA_FTS} b "
+        f"JOIN inventario_producto p ON p.id = b.rowid "
+        f"WHERE {' AND '.join(condiciones)} "
+        # Prefijos de código y nombre primero, luego bm25 (código pesa más que nombre)
+        f"ORDER BY (b.codigo LIKE %s ESCAPE '\\') DESC, (b.nombre LIKE %s ESCAPE '\\') DESC, "
+        f"bm25({TABLA_FTS}, 10.0, 1.0) "
+        f"LIMIT %s"
+    )
+    parametros.extend([prefijo, prefijo, limite])
+    with connection.cursor() as cursor:
+        cursor.execute(sql, parametros)
+        return cursor.fetchall()
+
+
+def _similitud(tokens, codigo, nombre):
+    """Similitud trigram (como pg_trgm) de cada token con la palabra más parecida del producto, promediada"""
+    palabras = [_trigramas(palabra, relleno=True) for palabra in _tokens(f'{codigo} {nombre}')]
+    puntajes = []
+    for token in tokens:
+        trigramas = _trigramas(token, relleno=True)
+        puntajes.append(max(
+            (len(trigramas & palabra) / len(trigramas | palabra) for palabra in palabras),
+            default=0
+        ))
+    return sum(puntajes) / len(puntajes) if puntajes else 0
+
+
+def _buscar_ids_sqlite(termino, limite, solo_activos, excluir):
+    tokens = _tokens(termino)
+    largos = [token for token in tokens if len(token) >= 3]
+    if not largos:
+        return None  # Términos de 1-2 letras: el tokenizador trigram no los indexa
+
+    normalizado = ' '.join(tokens)
+    ids = [fila[0] for fila in _consultar_fts(
+        ' AND '.join(_frase(token) for token in largos), normalizado, limite, solo_activos, excluir
+    )]
+
+    # Segunda pasada tolerante a errores de tipeo, solo para palabras (los códigos
+    # parecidos entre sí no son errores de tipeo): cualquier trigrama de los términos
+    palabras = [token for token in largos if token.isalpha()]
+    if len(ids) < limite and palabras:
+        trigramas = sorted(set().union(*(_trigramas(token) for token in palabras)))
+        candidatos = _consultar_fts(
+            ' OR '.join(_frase(trigrama) for trigrama in trigramas),
+            normalizado, LIMITE_CANDIDATOS_TIPEO, solo_activos, excluir + ids
+        )
+        puntuados = sorted(
+            ((_similitud(palabras, codigo, nombre), producto_id) for producto_id, codigo, nombre in candidatos),
+            key=lambda par: -par[0]
+        )
+        ids += [producto_id for puntaje, producto_id in puntuados if puntaje >= SIMILITUD_MINIMA]
+    return ids[:limite]
+
+
+def _buscar_ids_postgresql(termino, limite, queryset, excluir):
+    from django.contrib.postgres.lookups import TrigramWordSimilar
+    from django.contrib.postgres.search import TrigramWordSimilarity
+    from django.db.models.functions import Greatest
+
+    queryset = queryset.exclude(id__in=excluir).annotate(
+        similitud=Greatest(
+            TrigramWordSimilarity(termino, 'codigo'),
+            TrigramWordSimilarity(termino, 'nombre'),
+        )
+    )
+    coincidencias = Q()
+    for token in termino.split():
+        coincidencias &= Q(codigo__icontains=token) | Q(nombre__icontains=token)
+
+    ids = list(queryset.filter(coincidencias).order_by('-similitud', 'codigo').values_list('id', flat=True)[:limite])
+    if len(ids) < limite:
+        ids += list(
+            queryset.filter(TrigramWordSimilar(F('nombre'), termino)).exclude(id__in=ids)
+            .order_by('-similitud').values_list('id', flat=True)[:limite - len(ids)]
+        )
+    return ids
+
+
+def _buscar_ids_icontains(termino, limite, queryset, excluir):
+    coincidencias = Q()
+    for token in termino.split():
+        coincidencias &= Q(codigo__icontains=token) | Q(nombre__icontains=token)
+    return list(
+        queryset.filter(coincidencias).exclude(id__in=excluir)
+        .order_by('codigo').values_list('id', flat=True)[:limite]
+    )
+
+
+def buscar_productos(termino, limite=10, solo_activos=True, queryset=None):
+    """
+    Busca productos por código o nombre y los retorna ordenados por relevancia.
+
+    ``queryset`` permite indicar select_related / only para los resultados.
+    Retorna una lista de Producto (no un queryset).
+    """
+    from .models import Producto
+
+    termino = (termino or '').strip()
+    if not termino or limite <= 0:
+        return []
+
+    queryset = Producto.objects.all() if queryset is None else queryset
+    base = Producto.objects.order_by()
+    if solo_activos:
+        base = base.filter(activo=True)
+
+    ids = _ids_codigo_exacto(termino, base)[:limite]
+    restantes = limite - len(ids)
+    if restantes > 0:
+        encontrados = None
+        if indice_fts_disponible():
+            encontrados = _buscar_ids_sqlite(termino, restantes, solo_activos, ids)
+        elif connection.vendor == 'postgresql':
+            encontrados = _buscar_ids_postgresql(termino, restantes, base, ids)
+        if encontrados is None:
+            encontrados = _buscar_ids_icontains(termino, restantes, base, ids)
+        ids += encontrados
+
+    productos = queryset.in_bulk(ids)
+    return [productos[producto_id] for producto_id in ids if producto_id in productos]
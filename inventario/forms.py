@@ -181,6 +181,24 @@ class ProductoFilterForm(forms.Form):
         label='Estado del stock'
     )
     
+    ORDEN_CHOICES = [
+        ('', 'Código'),
+        ('nombre', 'Nombre'),
+        ('stock_asc', 'Menor stock'),
+        ('stock_desc', 'Mayor stock'),
+        ('disponible_asc', 'Menor disponible'),
+        ('disponible_desc', 'Mayor disponible'),
+    ]
+    
+    orden = forms.ChoiceField(
+        choices=ORDEN_CHOICES,
+        required=False,
+        widget=forms.Select(attrs={
+            'class': 'w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-blue-500 focus:border-blue-500'
+        }),
+        label='Ordenar por'
+    )
+    
     activo = forms.ChoiceField(
         choices=[
             ('', 'Todos'),
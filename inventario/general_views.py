@@ -9,15 +9,12 @@ from django.urls import reverse_lazy
 from django.http import HttpResponse
 from django.utils import timezone
 from django.db.models import Sum, Count, Q, F
-from datetime import datetime
 from decimal import Decimal
 
-# Importaciones para Excel
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment
-
 # Importaciones locales
 from .models import Producto, Categoria, Subcategoria, Stock, Bodega
+from ventas.exportacion import definicion_exportacion
+from ventas.trabajos_exportacion import responder_exportacion
 
 # ========================================
 # MIXINS DE PERMISOS Y AUTENTICACIÓN
@@ -192,202 +189,59 @@ class InventarioMenuView(InventarioViewMixin, TemplateView):
 
 @login_required
 def exportar_productos_excel(request):
-    """Vista para exportar productos a Excel"""
+    """Vista para exportar productos a Excel (en streaming o en segundo plano)"""
     if not request.user.is_authenticated:
         return HttpResponse("No autorizado", status=401)
     
-    # Crear workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Productos"
-    
-    # Configurar estilos
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-    header_alignment = Alignment(horizontal="center", vertical="center")
-    
-    # Definir headers basándose en permisos del usuario
-    if hasattr(request.user, 'can_see_costs') and request.user.can_see_costs():
-        headers = [
-            'Código', 'Nombre', 'Categoría', 'Subcategoría', 
-            'Costo Promedio', 'Precio Minorista', 'Precio Mayorista',
-            'Stock Total', 'Stock Mínimo', 'Estado', 'Fecha Creación'
-        ]
-    else:
-        headers = [
-            'Código', 'Nombre', 'Categoría', 'Subcategoría', 
-            'Precio Minorista', 'Precio Mayorista',
-            'Stock Total', 'Stock Mínimo', 'Estado', 'Fecha Creación'
-        ]
-    
-    # Escribir headers
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col_num, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = header_alignment
-    
-    # Obtener productos
-    productos = Producto.objects.filter(activo=True).select_related(
-        'categoria', 'subcategoria'
-    ).order_by('codigo')
-    
-    # Escribir datos
-    row_num = 2
-    for producto in productos:
-        if hasattr(request.user, 'can_see_costs') and request.user.can_see_costs():
-            row_data = [
-                producto.codigo,
-                producto.nombre,
-                producto.categoria.nombre if producto.categoria else '',
-                producto.subcategoria.nombre if producto.subcategoria else '',
-                float(producto.costo_promedio) if producto.costo_promedio else 0,
-                float(producto.precio_minorista) if producto.precio_minorista else 0,
-                float(producto.precio_mayorista) if producto.precio_mayorista else 0,
-                0,  # stock_actual no existe, usar 0
-                producto.stock_minimo,
-                'Activo' if producto.activo else 'Inactivo',
-                producto.fecha_creacion.strftime('%d/%m/%Y %H:%M') if producto.fecha_creacion else ''
-            ]
-        else:
-            row_data = [
-                producto.codigo,
-                producto.nombre,
-                producto.categoria.nombre if producto.categoria else '',
-                producto.subcategoria.nombre if producto.subcategoria else '',
-                float(producto.precio_minorista) if producto.precio_minorista else 0,
-                float(producto.precio_mayorista) if producto.precio_mayorista else 0,
-                0,  # stock_actual no existe, usar 0
-                producto.stock_minimo,
-                'Activo' if producto.activo else 'Inactivo',
-                producto.fecha_creacion.strftime('%d/%m/%Y %H:%M') if producto.fecha_creacion else ''
-            ]
-        
-        for col_num, value in enumerate(row_data, 1):
-            ws.cell(row=row_num, column=col_num, value=value)
-        
-        row_num += 1
-    
-    # Ajustar ancho de columnas
-    for column in ws.columns:
-        max_length = 0
-        column_letter = column[0].column_letter
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = min(max_length + 2, 50)
-        ws.column_dimensions[column_letter].width = adjusted_width
-    
-    # Preparar respuesta
-    response = HttpResponse(
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f'productos_reyes_{timestamp}.xlsx'
-    response['Content-Disposition'] = f'attachment; filename={filename}'
-    
-    # Guardar workbook en la respuesta
-    wb.save(response)
-    
-    return response
+    return responder_exportacion(request, 'productos', 'excel')
 
 
-@login_required
-def exportar_stock_excel(request):
-    """Vista para exportar reporte de stock a Excel"""
-    if not (request.user.is_superuser or request.user.role in ['superadmin', 'administrador']):
-        return HttpResponse("No autorizado", status=403)
-    
-    # Crear workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Stock por Bodega"
-    
-    # Configurar estilos
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-    header_alignment = Alignment(horizontal="center", vertical="center")
-    
-    # Headers
+def definicion_exportacion_stock(parametros, usuario, formato):
+    """Exportación del stock por bodega de productos activos en bodegas activas"""
     headers = [
         'Código Producto', 'Nombre Producto', 'Categoría', 
-        'Bodega', 'Stock Actual', 'Stock Mínimo', 'Stock Máximo',
+        'Bodega', 'Stock Actual', 'Stock Mínimo',
         'Estado Stock', 'Última Actualización'
     ]
     
-    # Escribir headers
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col_num, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = header_alignment
-    
     # Obtener datos de stock
-    stocks = Stock.objects.select_related(
-        'producto', 'producto__categoria', 'bodega'
-    ).filter(
+    stocks = Stock.objects.filter(
         producto__activo=True,
         bodega__activa=True
     ).order_by('producto__codigo', 'bodega__nombre')
     
-    # Escribir datos
-    row_num = 2
-    for stock in stocks:
+    def convertir(fila):
+        codigo, nombre, categoria, bodega, cantidad, stock_minimo, actualizacion = fila
         # Determinar estado del stock
-        if stock.cantidad == 0:
+        if cantidad == 0:
             estado = 'Sin Stock'
-        elif stock.cantidad <= stock.stock_minimo:
+        elif cantidad <= stock_minimo:
             estado = 'Stock Crítico'
-        elif stock.cantidad <= stock.stock_minimo * 1.5:
+        elif cantidad <= stock_minimo * 1.5:
             estado = 'Stock Bajo'
         else:
             estado = 'Stock Normal'
-        
-        row_data = [
-            stock.producto.codigo,
-            stock.producto.nombre,
-            stock.producto.categoria.nombre if stock.producto.categoria else '',
-            stock.bodega.nombre,
-            stock.cantidad,
-            stock.stock_minimo,
-            stock.stock_maximo,
-            estado,
-            stock.fecha_actualizacion.strftime('%d/%m/%Y %H:%M') if stock.fecha_actualizacion else ''
+        return [
+            codigo, nombre, categoria or '', bodega, cantidad, stock_minimo, estado,
+            timezone.localtime(actualizacion).strftime('%d/%m/%Y %H:%M') if actualizacion else ''
         ]
-        
-        for col_num, value in enumerate(row_data, 1):
-            ws.cell(row=row_num, column=col_num, value=value)
-        
-        row_num += 1
     
-    # Ajustar ancho de columnas
-    for column in ws.columns:
-        max_length = 0
-        column_letter = column[0].column_letter
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = min(max_length + 2, 50)
-        ws.column_dimensions[column_letter].width = adjusted_width
-    
-    # Preparar respuesta
-    response = HttpResponse(
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    return definicion_exportacion(
+        'stock_bodegas', headers, stocks,
+        ('producto__codigo', 'producto__nombre', 'producto__categoria__nombre', 'bodega__nombre',
+         'cantidad', 'producto__stock_minimo', 'fecha_actualizacion'),
+        convertir,
+        hoja='Stock por Bodega', anchos=[18, 40, 20, 20, 12, 12, 15, 20]
     )
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f'stock_bodegas_{timestamp}.xlsx'
-    response['Content-Disposition'] = f'attachment; filename={filename}'
-    
-    # Guardar workbook en la respuesta
-    wb.save(response)
+
+
+@login_required
+def exportar_stock_excel(request):
+    """Vista para exportar reporte de stock a Excel (en streaming o en segundo plano)"""
+    if not (request.user.is_superuser or request.user.role in ['superadmin', 'administrador']):
+        return HttpResponse("No autorizado", status=403)
     
-    return response
+    return responder_exportacion(request, 'stock', 'excel')
 
 
 # ========================================
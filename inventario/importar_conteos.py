@@ -0,0 +1,214 @@
+"""
+Importación de conteos físicos desde CSV o XLSX
+
+El archivo (columnas codigo, bodega, cantidad) se lee fila por fila
+(``csv`` o openpyxl en modo read-only) y se procesa en lotes, por lo que la
+memoria usada no depende del tamaño del archivo. Los códigos se resuelven
+con un único mapa codigo→id cargado al inicio. En modo previsualización se
+calcula la diferencia contra el Stock actual sin modificar nada; al aplicar
+se usa el pipeline masivo de ``ajustes_masivos`` dentro de una sola
+transacción, de modo que un archivo con errores de lectura a mitad de camino
+no deja el conteo aplicado a medias.
+"""
+
+import csv
+import io
+import os
+import zipfile
+from contextlib import nullcontext
+
+from django.db import transaction
+
+from .ajustes_masivos import aplicar_ajuste_masivo, calcular_diferencias
+from .models import Bodega, Producto
+
+TAMANO_LOTE = 1000
+MAX_MUESTRA = 200
+MAX_ERRORES = 200
+COLUMNAS = ('codigo', 'bodega', 'cantidad')
+
+
+class ArchivoConteoInvalido(Exception):
+    """El archivo no tiene un formato de conteo reconocible"""
+
+
+def _normalizar_encabezado(fila):
+    return [str(valor or '').strip().lower() for valor in fila]
+
+
+def _posiciones(encabezado):
+    """Índices de las columnas requeridas, o None si la fila no es encabezado"""
+    if not all(columna in encabezado for columna in COLUMNAS):
+        return None
+    return [encabezado.index(columna) for columna in COLUMNAS]
+
+
+def _filas_csv(archivo):
+    texto = io.TextIOWrapper(archivo, encoding='utf-8-sig', newline='')
+    try:
+        muestra = texto.read(4096)
+        texto.seek(0)
+        try:
+            dialecto = csv.Sniffer().sniff(muestra, delimiters=',;\t')
+        except csv.Error:
+            dialecto = csv.excel
+        yield from csv.reader(texto, dialecto)
+    except UnicodeDecodeError:
+        raise ArchivoConteoInvalido('El archivo CSV debe estar codificado en UTF-8')
+    finally:
+        texto.detach()
+
+
+def _filas_xlsx(archivo):
+    from openpyxl import load_workbook
+    from openpyxl.utils.exceptions import InvalidFileException
+
+    try:
+        libro = load_workbook(archivo, read_only=True, data_only=True)
+    except (zipfile.BadZipFile, InvalidFileException, KeyError):
+        raise ArchivoConteoInvalido('El archivo XLSX está dañado o no es un libro de Excel')
+    try:
+        yield from libro.active.iter_rows(values_only=True)
+    finally:
+        libro.close()
+
+
+def leer_filas(archivo, nombre_archivo):
+    """
+    Genera (numero_fila, codigo, bodega, cantidad) a partir del archivo.
+    Si la primera fila no es un encabezado se asume el orden codigo, bodega, cantidad.
+    """
+    extension = os.path.splitext(nombre_archivo)[1].lower()
+    if extension in ('.xlsx', '.xlsm'):
+        filas = _filas_xlsx(archivo)
+    elif extension in ('.csv', '.txt'):
+        filas = _filas_csv(archivo)
+    else:
+        raise ArchivoConteoInvalido('Formato no soportado. Use un archivo .csv o .xlsx')
+
+    posiciones = [0, 1, 2]
+    for numero, fila in enumerate(filas, 1):
+        if not fila or all(valor in (None, '') for valor in fila):
+            continue
+        if numero == 1:
+            encabezado = _posiciones(_normalizar_encabezado(fila))
+            if encabezado:
+                posiciones = encabezado
+                continue
+        valores = [fila[i] if i < len(fila) else None for i in posiciones]
+        yield numero, valores[0], valores[1], valores[2]
+
+
+def _mapa_bodegas():
+    """Resuelve una bodega por id o por nombre (sin distinguir mayúsculas)"""
+    mapa = {}
+    for bodega in Bodega.objects.filter(activa=True):
+        mapa[str(bodega.id)] = bodega
+        mapa[bodega.nombre.strip().lower()] = bodega
+    return mapa
+
+
+def _cantidad(valor):
+    if isinstance(valor, str):
+        valor = valor.strip().replace(',', '.')
+    cantidad = float(valor)
+    if cantidad < 0 or cantidad != int(cantidad):
+        raise ValueError
+    return int(cantidad)
+
+
+def procesar_conteo(archivo, nombre_archivo, aplicar=False, usuario=None, observaciones='',
+                    tamano_lote=TAMANO_LOTE, max_muestra=MAX_MUESTRA, al_encontrar_diferencia=None):
+    """
+    Procesa un archivo de conteo físico en lotes.
+
+    Con ``aplicar=False`` solo calcula la diferencia contra el Stock actual;
+    con ``aplicar=True`` todo el archivo se aplica en una sola transacción.
+    Retorna un resumen con totales, una muestra acotada de diferencias y de
+    errores. ``al_encontrar_diferencia`` recibe cada diferencia (para que el
+    comando de consola pueda listarlas todas sin guardarlas en memoria).
+    """
+    codigos = dict(Producto.objects.order_by().values_list('codigo', 'id'))
+    bodegas = _mapa_bodegas()
+
+    resumen = {
+        'filas': 0,
+        'diferencias': 0,
+        'unidades_entrada': 0,
+        'unidades_salida': 0,
+        'ajustados': 0,
+        'creados': 0,
+        'errores': 0,
+        'detalle_errores': [],
+        'muestra': [],
+        'aplicado': aplicar,
+    }
+
+    def registrar_error(numero, mensaje):
+        resumen['errores'] += 1
+        if len(resumen['detalle_errores']) < MAX_ERRORES:
+            resumen['detalle_errores'].append({'fila': numero, 'error': mensaje})
+
+    def procesar_lote(lote):
+        for bodega, conteos in lote.items():
+            diferencias, _ = calcular_diferencias(bodega, conteos)
+            for ajuste in diferencias:
+                fila = {
+                    'codigo': ajuste['producto'].codigo,
+                    'nombre': ajuste['producto'].nombre,
+                    'bodega': bodega.nombre,
+                    'cantidad_anterior': ajuste['cantidad_anterior'],
+                    'cantidad_nueva': ajuste['cantidad_nueva'],
+                    'diferencia': ajuste['diferencia'],
+                }
+                resumen['diferencias'] += 1
+                if ajuste['diferencia'] > 0:
+                    resumen['unidades_entrada'] += ajuste['diferencia']
+                else:
+                    resumen['unidades_salida'] += -ajuste['diferencia']
+                if len(resumen['muestra']) < max_muestra:
+                    resumen['muestra'].append(fila)
+                if al_encontrar_diferencia:
+                    al_encontrar_diferencia(fila)
+
+            if aplicar and diferencias:
+                aplicado = aplicar_ajuste_masivo(
+                    bodega,
+                    {ajuste['producto'].id: ajuste['cantidad_nueva'] for ajuste in diferencias},
+                    usuario=usuario,
+                    observaciones=observaciones,
+                    tamano_lote=tamano_lote,
+                )
+                resumen['ajustados'] += aplicado['ajustados']
+                resumen['creados'] += aplicado['creados']
+
+    with transaction.atomic() if aplicar else nullcontext():
+        lote = {}
+        filas_lote = 0
+        for numero, codigo, nombre_bodega, cantidad in leer_filas(archivo, nombre_archivo):
+            resumen['filas'] += 1
+            producto_id = codigos.get(str(codigo or '').strip())
+            if producto_id is None:
+                registrar_error(numero, f'Código de producto no encontrado: {codigo}')
+                continue
+            bodega = bodegas.get(str(nombre_bodega or '').strip().lower())
+            if bodega is None:
+                registrar_error(numero, f'Bodega no encontrada: {nombre_bodega}')
+                continue
+            try:
+                cantidad = _cantidad(cantidad)
+            except (TypeError, ValueError):
+                registrar_error(numero, f'Cantidad inválida: {cantidad}')
+                continue
+
+            lote.setdefault(bodega, {})[producto_id] = cantidad
+            filas_lote += 1
+            if filas_lote >= tamano_lote:
+                procesar_lote(lote)
+                lote = {}
+                filas_lote = 0
+
+        if lote:
+            procesar_lote(lote)
+
+    return resumen
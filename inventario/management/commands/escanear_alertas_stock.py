@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from inventario.alertas_stock import TAMANO_LOTE, escanear_alertas_stock, escanear_desde_ultimo
+
+
+class Command(BaseCommand):
+    help = (
+        'Crea, actualiza y resuelve alertas de stock con el stock real de todos los productos. '
+        'Con --incremental solo re-evalúa los productos cuyo stock cambió desde el último '
+        'escaneo completado (pensado para ejecutarse cada minuto desde cron)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help='Solo productos con Stock o ficha modificados desde el último escaneo completado',
+        )
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=TAMANO_LOTE,
+            help=f'Productos evaluados por lote (default: {TAMANO_LOTE})',
+        )
+
+    def handle(self, *args, **options):
+        if options['incremental']:
+            resumen = escanear_desde_ultimo(tamano_lote=options['lote'])
+            if resumen['desde']:
+                desde = timezone.localtime(resumen['desde'])
+                self.stdout.write(f"🔍 Escaneo incremental de alertas (desde {desde:%Y-%m-%d %H:%M:%S})")
+            else:
+                self.stdout.write('🔍 Sin escaneos anteriores: escaneo completo de alertas de stock')
+        else:
+            self.stdout.write('🔍 Escaneo completo de alertas de stock')
+            resumen = escanear_alertas_stock(tamano_lote=options['lote'])
+
+        self.stdout.write(f"   Productos evaluados: {resumen['evaluados']}")
+        self.stdout.write(f"   🆕 Nuevas alertas: {resumen['creadas']}")
+        self.stdout.write(f"   🔄 Alertas actualizadas: {resumen['actualizadas']}")
+        self.stdout.write(f"   ✅ Alertas resueltas: {resumen['resueltas']}")
+        self.stdout.write(self.style.SUCCESS('✅ Escaneo de alertas completado'))
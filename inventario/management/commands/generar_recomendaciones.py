@@ -1,9 +1,7 @@
 from django.core.management.base import BaseCommand
-from django.utils import timezone
-from django.db.models import Sum, F, Value
-from inventario.models import Producto, RecomendacionReposicion
-from django.db.models import Sum
-import logging
+from django.db.models import F
+from inventario.models import Producto
+from inventario.recomendaciones import TAMANO_LOTE, generar_recomendaciones
 
 class Command(BaseCommand):
     help = 'Genera recomendaciones automáticas de reposición basadas en análisis de ventas y stock'
@@ -31,6 +29,18 @@ class Command(BaseCommand):
             default=30,
             help='Días de historial de ventas a analizar (default: 30)',
         )
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=TAMANO_LOTE,
+            help=f'Productos por lote (default: {TAMANO_LOTE})',
+        )
+        parser.add_argument(
+            '--procesos',
+            type=int,
+            default=1,
+            help='Procesos en paralelo para evaluar los lotes (default: 1)',
+        )
         
     def handle(self, *args, **options):
         self.stdout.write("=" * 80)
@@ -38,128 +48,55 @@ class Command(BaseCommand):
         self.stdout.write("=" * 80)
         
         # Obtener productos a analizar
+        productos = Producto.objects.filter(activo=True)
         if options['productos']:
-            productos = Producto.objects.filter(
-                codigo__in=options['productos'],
-                activo=True
-            ).annotate(
-                stock_total_calculated=Sum('stock__cantidad')
-            )
+            productos = productos.filter(codigo__in=options['productos'])
             self.stdout.write(f"📦 Analizando productos específicos: {', '.join(options['productos'])}")
         elif options['solo_criticos']:
-            productos = Producto.objects.filter(
-                activo=True
-            ).annotate(
-                stock_total_calculated=Sum('stock__cantidad')
-            ).filter(
-                stock_total_calculated__lt=F('stock_minimo')
-            )
+            productos = productos.filter(existencia_total__lt=F('stock_minimo'))
             self.stdout.write("⚠️ Analizando solo productos con alerta de stock")
         else:
-            # Analizar todos los productos activos con stock o ventas recientes
-            productos = Producto.objects.filter(activo=True).annotate(
-                stock_total_calculated=Sum('stock__cantidad')
-            )
             self.stdout.write("🔍 Analizando todos los productos activos")
         
-        self.stdout.write(f"Total de productos a analizar: {productos.count()}")
+        self.stdout.write(
+            f"Lotes de {options['lote']} productos en {options['procesos']} proceso(s)"
+        )
         self.stdout.write("-" * 80)
         
-        # Contadores
-        recomendaciones_generadas = 0
-        productos_analizados = 0
-        productos_sin_necesidad = 0
-        errores = 0
+        def mostrar_lote(parcial):
+            self.stdout.write(
+                f"   📦 Lote: {parcial['analizados']} analizados, "
+                f"{parcial['generadas']} recomendaciones, {parcial['errores']} errores"
+            )
         
-        for producto in productos:
-            productos_analizados += 1
-            
-            try:
-                self.stdout.write(f"\n📦 {producto.codigo} - {producto.nombre}")
-                
-                # Verificar si tiene stock
-                stock_actual = getattr(producto, 'stock_total_calculated', None) or producto.stock_total
-                self.stdout.write(f"   Stock actual: {stock_actual} unidades (mínimo: {producto.stock_minimo})")
-                
-                # Generar recomendación
-                recomendacion = producto.generar_recomendacion_inteligente(
-                    forzar=options['forzar']
-                )
-                
-                if recomendacion:
-                    recomendaciones_generadas += 1
-                    
-                    self.stdout.write(
-                        f"   ✅ Recomendación generada: {recomendacion.get_prioridad_display()}"
-                    )
-                    self.stdout.write(f"      💰 Cantidad sugerida: {recomendacion.cantidad_sugerida} unidades")
-                    self.stdout.write(f"      📊 Cobertura actual: {recomendacion.descripcion_cobertura}")
-                    self.stdout.write(f"      📈 Tendencia ventas: {recomendacion.tendencia_porcentaje:+.1f}%")
-                    
-                    if recomendacion.proveedor_sugerido:
-                        self.stdout.write(f"      🏭 Proveedor sugerido: {recomendacion.proveedor_sugerido.nombre}")
-                        if recomendacion.valor_total_sugerido:
-                            self.stdout.write(f"      💵 Valor estimado: ${recomendacion.valor_total_sugerido:,.0f}")
-                    
-                    if recomendacion.fecha_agotamiento_estimada:
-                        self.stdout.write(f"      ⏰ Agotamiento estimado: {recomendacion.fecha_agotamiento_estimada}")
-                    
-                    self.stdout.write(f"      📝 Razón: {recomendacion.razon_principal}")
-                    
-                    # Color según prioridad
-                    if recomendacion.prioridad == 'critica':
-                        status_style = self.style.ERROR
-                    elif recomendacion.prioridad == 'alta':
-                        status_style = self.style.WARNING  
-                    elif recomendacion.prioridad == 'media':
-                        status_style = self.style.NOTICE
-                    else:
-                        status_style = self.style.SUCCESS
-                        
-                    self.stdout.write(
-                        status_style(f"      🚨 PRIORIDAD: {recomendacion.get_prioridad_display()}")
-                    )
-                    
-                else:
-                    productos_sin_necesidad += 1
-                    self.stdout.write("   ✓ No requiere reposición en este momento")
-                    
-            except Exception as e:
-                errores += 1
-                self.stdout.write(
-                    self.style.ERROR(f"   ❌ Error al analizar: {str(e)}")
-                )
-                logging.error(f"Error analizando producto {producto.codigo}: {str(e)}")
+        resumen = generar_recomendaciones(
+            productos,
+            forzar=options['forzar'],
+            dias_analisis=options['dias_analisis'],
+            tamano_lote=options['lote'],
+            procesos=options['procesos'],
+            al_terminar_lote=mostrar_lote,
+        )
         
         # Resumen final
         self.stdout.write("\n" + "=" * 80)
         self.stdout.write(self.style.SUCCESS('📊 RESUMEN DE ANÁLISIS'))
         self.stdout.write("=" * 80)
         
-        self.stdout.write(f"📦 Productos analizados: {productos_analizados}")
-        self.stdout.write(f"✅ Recomendaciones generadas: {recomendaciones_generadas}")
-        self.stdout.write(f"✓ Productos sin necesidad: {productos_sin_necesidad}")
+        self.stdout.write(f"📦 Productos analizados: {resumen['analizados']}")
+        self.stdout.write(f"✅ Recomendaciones generadas: {resumen['generadas']}")
+        self.stdout.write(f"✓ Productos sin necesidad: {resumen['sin_necesidad']}")
+        if resumen['omitidos']:
+            self.stdout.write(f"⏭️ Con recomendación activa de hoy: {resumen['omitidos']} (use --forzar)")
         
-        if errores > 0:
-            self.stdout.write(self.style.ERROR(f"❌ Errores encontrados: {errores}"))
+        if resumen['errores'] > 0:
+            self.stdout.write(self.style.ERROR(f"❌ Errores encontrados: {resumen['errores']}"))
         
         # Estadísticas por prioridad
-        if recomendaciones_generadas > 0:
+        if resumen['generadas'] > 0:
             self.stdout.write("\n📋 RECOMENDACIONES POR PRIORIDAD:")
             
-            from django.db.models import Count
-            
-            stats = RecomendacionReposicion.objects.filter(
-                fecha_generacion__date=timezone.now().date(),
-                activa=True
-            ).values('prioridad').annotate(
-                cantidad=Count('id')
-            ).order_by('-cantidad')
-            
-            for stat in stats:
-                prioridad = stat['prioridad']
-                cantidad = stat['cantidad']
-                
+            for prioridad, cantidad in resumen['por_prioridad'].most_common():
                 if prioridad == 'critica':
                     icon = "🚨"
                     style = self.style.ERROR
@@ -178,23 +115,20 @@ class Command(BaseCommand):
                 )
         
         # Valor total de inversión sugerida
-        valor_total_inversion = RecomendacionReposicion.objects.filter(
-            fecha_generacion__date=timezone.now().date(),
-            activa=True,
-            valor_total_sugerido__isnull=False
-        ).aggregate(
-            total=Sum('valor_total_sugerido')
-        )['total'] or 0
+        if resumen['valor_total'] > 0:
+            self.stdout.write(f"\n💰 Inversión total sugerida: ${resumen['valor_total']:,.0f}")
         
-        if valor_total_inversion > 0:
-            self.stdout.write(f"\n💰 Inversión total sugerida: ${valor_total_inversion:,.0f}")
+        self.stdout.write(
+            f"\n⏱️ {resumen['segundos']:.2f} s en {resumen['lotes']} lotes "
+            f"({resumen['productos_por_segundo']:,.0f} productos/seg)"
+        )
         
         self.stdout.write("\n" + "=" * 80)
         self.stdout.write(self.style.SUCCESS('🎉 ANÁLISIS COMPLETADO'))
         self.stdout.write("=" * 80)
         
-        if recomendaciones_generadas > 0:
+        if resumen['generadas'] > 0:
             self.stdout.write("📱 Para revisar las recomendaciones, visite:")
             self.stdout.write("   http://127.0.0.1:8000/inventario/recomendaciones/")
         else:
-            self.stdout.write("✓ Todos los productos tienen stock adecuado")
\ No newline at end of file
+            self.stdout.write("✓ Todos los productos tienen stock adecuado")
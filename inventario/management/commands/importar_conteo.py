@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand, CommandError
+from inventario.importar_conteos import ArchivoConteoInvalido, TAMANO_LOTE, procesar_conteo
+
+
+class Command(BaseCommand):
+    help = 'Importa un conteo físico (codigo, bodega, cantidad) desde CSV o XLSX; por defecto solo muestra las diferencias'
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', type=str, help='Ruta del archivo .csv o .xlsx')
+        parser.add_argument(
+            '--aplicar',
+            action='store_true',
+            help='Aplicar los ajustes al inventario (sin esta opción es una simulación)',
+        )
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=TAMANO_LOTE,
+            help=f'Filas procesadas por lote (default: {TAMANO_LOTE})',
+        )
+        parser.add_argument(
+            '--observaciones',
+            type=str,
+            default='Importación de conteo físico',
+            help='Observaciones registradas en los movimientos',
+        )
+        parser.add_argument(
+            '--silencioso',
+            action='store_true',
+            help='No listar cada diferencia, solo el resumen',
+        )
+
+    def handle(self, *args, **options):
+        modo = 'APLICANDO' if options['aplicar'] else 'SIMULACIÓN'
+        self.stdout.write(f"📋 Conteo físico desde {options['archivo']} ({modo})")
+
+        def mostrar(fila):
+            self.stdout.write(
+                f"   {fila['codigo']} @ {fila['bodega']}: {fila['cantidad_anterior']} → "
+                f"{fila['cantidad_nueva']} ({fila['diferencia']:+d})"
+            )
+
+        try:
+            with open(options['archivo'], 'rb') as archivo:
+                resumen = procesar_conteo(
+                    archivo,
+                    options['archivo'],
+                    aplicar=options['aplicar'],
+                    observaciones=options['observaciones'],
+                    tamano_lote=options['lote'],
+                    max_muestra=0,
+                    al_encontrar_diferencia=None if options['silencioso'] else mostrar,
+                )
+        except FileNotFoundError:
+            raise CommandError(f"No existe el archivo {options['archivo']}")
+        except ArchivoConteoInvalido as e:
+            raise CommandError(str(e))
+
+        for error in resumen['detalle_errores']:
+            self.stdout.write(self.style.WARNING(f"🟡 Fila {error['fila']}: {error['error']}"))
+        if resumen['errores'] > len(resumen['detalle_errores']):
+            self.stdout.write(self.style.WARNING(
+                f"   ... y {resumen['errores'] - len(resumen['detalle_errores'])} errores más"
+            ))
+
+        self.stdout.write(f"   Filas leídas: {resumen['filas']}")
+        self.stdout.write(f"   Filas con errores: {resumen['errores']}")
+        self.stdout.write(f"   Diferencias: {resumen['diferencias']} "
+                          f"(+{resumen['unidades_entrada']} / -{resumen['unidades_salida']} unidades)")
+
+        if options['aplicar']:
+            self.stdout.write(self.style.SUCCESS(
+                f"✅ {resumen['ajustados']} productos ajustados ({resumen['creados']} registros de stock nuevos)"
+            ))
+        else:
+            self.stdout.write(self.style.WARNING('⚠️  Simulación: ejecuta con --aplicar para modificar el inventario'))
@@ -0,0 +1,80 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q, Sum
+from django.db.models.functions import Coalesce
+from inventario.models import Producto, VarianteProducto, Stock
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye y verifica las existencias consolidadas de productos y variantes a partir de Stock'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--productos',
+            nargs='+',
+            type=str,
+            help='Códigos específicos de productos a recalcular',
+        )
+        parser.add_argument(
+            '--solo-verificar',
+            action='store_true',
+            help='Solo reportar diferencias, sin modificar la base de datos',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('📦 Existencias consolidadas de inventario')
+
+        productos = Producto.objects.all()
+        variantes = VarianteProducto.objects.all()
+        producto_ids = None
+        if options['productos']:
+            productos = productos.filter(codigo__in=options['productos'])
+            producto_ids = list(productos.values_list('id', flat=True))
+            variantes = variantes.filter(producto_id__in=producto_ids)
+            self.stdout.write(f"   Productos: {', '.join(options['productos'])}")
+
+        descuadres_productos = self.buscar_descuadres(productos)
+        descuadres_variantes = self.buscar_descuadres(variantes)
+
+        for registro in descuadres_productos:
+            self.stdout.write(self.style.WARNING(
+                f"🟡 {registro.codigo}: guardado {registro.existencia_total}/{registro.existencia_reservada}, "
+                f"real {registro.total_real}/{registro.reservado_real}"
+            ))
+        for registro in descuadres_variantes:
+            self.stdout.write(self.style.WARNING(
+                f"🟡 {registro.codigo_variante}: guardado {registro.existencia_total}/{registro.existencia_reservada}, "
+                f"real {registro.total_real}/{registro.reservado_real}"
+            ))
+
+        total_descuadres = len(descuadres_productos) + len(descuadres_variantes)
+        self.stdout.write(f'   Productos con diferencias: {len(descuadres_productos)}')
+        self.stdout.write(f'   Variantes con diferencias: {len(descuadres_variantes)}')
+
+        if options['solo_verificar']:
+            if total_descuadres:
+                self.stdout.write(self.style.WARNING('⚠️  Existen diferencias. Ejecuta sin --solo-verificar para corregirlas'))
+            else:
+                self.stdout.write(self.style.SUCCESS('✅ Existencias consolidadas correctas'))
+            return
+
+        with transaction.atomic():
+            actualizados = Stock.sincronizar_existencias(producto_ids)
+        self.stdout.write(f'   Productos recalculados: {actualizados}')
+
+        pendientes = len(self.buscar_descuadres(productos)) + len(self.buscar_descuadres(variantes))
+        if pendientes:
+            self.stdout.write(self.style.ERROR(f'❌ Persisten {pendientes} diferencias después de reconstruir'))
+        else:
+            self.stdout.write(self.style.SUCCESS('✅ Existencias reconstruidas y verificadas'))
+
+    def buscar_descuadres(self, queryset):
+        """Registros cuyas existencias guardadas no coinciden con la suma de Stock"""
+        return list(
+            queryset.annotate(
+                total_real=Coalesce(Sum('stock__cantidad'), 0),
+                reservado_real=Coalesce(Sum('stock__cantidad_reservada'), 0),
+            ).filter(
+                ~Q(existencia_total=F('total_real')) | ~Q(existencia_reservada=F('reservado_real'))
+            )
+        )
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from inventario.busqueda import indice_fts_disponible, reconstruir_indice
+
+
+class Command(BaseCommand):
+    help = (
+        'Reconstruye el índice de búsqueda de productos (FTS5 en SQLite). '
+        'Necesario solo después de escrituras por fuera del ORM (SQL directo, loaddata)'
+    )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            self.stdout.write('ℹ️  Este motor usa índices pg_trgm mantenidos por la base de datos; no hay nada que reconstruir')
+            return
+
+        self.stdout.write('🔍 Reconstruyendo índice de búsqueda de productos...')
+        total = reconstruir_indice()
+        if not indice_fts_disponible():
+            self.stdout.write(self.style.WARNING('⚠️  SQLite sin soporte FTS5/trigram: la búsqueda usará icontains'))
+            return
+        self.stdout.write(self.style.SUCCESS(f'✅ {total} productos indexados'))
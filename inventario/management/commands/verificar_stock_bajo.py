@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.db.models import Q, F, Sum
 from inventario.models import Producto, AlertaStock
+from inventario.alertas_stock import escanear_alertas_stock
 from django.utils import timezone
 import logging
 
@@ -24,16 +25,21 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         self.stdout.write('🔍 Verificando productos con stock bajo...')
         
+        if options['crear_alertas']:
+            # Las alertas se generan por conjuntos con el stock real
+            resumen = escanear_alertas_stock()
+            self.stdout.write(self.style.SUCCESS('\n📊 RESUMEN DE ALERTAS:'))
+            self.stdout.write(f"   🆕 Nuevas alertas: {resumen['creadas']}")
+            self.stdout.write(f"   🔄 Alertas actualizadas: {resumen['actualizadas']}")
+            self.stdout.write(f"   ✅ Alertas resueltas: {resumen['resueltas']}")
+            return
+        
         # Obtener productos activos con stock mínimo definido
         productos = Producto.objects.filter(
             activo=True,
             stock_minimo__gt=0
         ).select_related('categoria')
         
-        alertas_creadas = 0
-        alertas_actualizadas = 0
-        productos_ok = 0
-        
         for producto in productos:
             # Simular stock actual para propósitos de demostración
             if options['simular_stock']:
@@ -46,69 +52,23 @@ class Command(BaseCommand):
                 else:
                     stock_actual = producto.stock_minimo + random.randint(1, 20)
             else:
-                # En un sistema real aquí se calcularía el stock real
-                # Por ahora simulamos basado en el stock mínimo
-                stock_actual = max(0, producto.stock_minimo - 2)
-            
-            # Generar alerta automática si es necesario
-            if options['crear_alertas']:
-                # Usar el método del modelo para generar alertas
-                alerta = AlertaStock.generar_alerta_automatica(producto)
-                
-                if alerta:
-                    if hasattr(alerta, '_state') and alerta._state.adding:
-                        alertas_creadas += 1
-                        self.stdout.write(
-                            self.style.WARNING(f'🚨 Nueva alerta: {producto.codigo} - {producto.nombre}')
-                        )
-                    else:
-                        alertas_actualizadas += 1
-                        self.stdout.write(
-                            self.style.WARNING(f'🔄 Alerta actualizada: {producto.codigo} - {producto.nombre}')
-                        )
-                else:
-                    productos_ok += 1
-            else:
-                # Solo mostrar información sin crear alertas
-                if stock_actual <= producto.stock_minimo:
-                    nivel_icon = '🔴' if stock_actual == 0 else '🟡'
-                    self.stdout.write(
-                        f"{nivel_icon} {producto.codigo} - {producto.nombre}: "
-                        f"Stock actual: {stock_actual}, Mínimo: {producto.stock_minimo}"
-                    )
-        
-        # Mostrar resumen
-        if options['crear_alertas']:
-            total_alertas = alertas_creadas + alertas_actualizadas
-            self.stdout.write(
-                self.style.SUCCESS(
-                    f'\\n📊 RESUMEN DE ALERTAS:'
-                )
-            )
-            self.stdout.write(f'   🆕 Nuevas alertas: {alertas_creadas}')
-            self.stdout.write(f'   � Alertas actualizadas: {alertas_actualizadas}')
-            self.stdout.write(f'   ✅ Productos OK: {productos_ok}')
+                stock_actual = producto.existencia_total
             
-            if total_alertas > 0:
-                self.stdout.write(
-                    self.style.WARNING(
-                        f'\\n⚠️  TOTAL: {total_alertas} productos requieren atención'
-                    )
-                )
-            else:
+            # Solo mostrar información sin crear alertas
+            if stock_actual <= producto.stock_minimo:
+                nivel_icon = '🔴' if stock_actual == 0 else '🟡'
                 self.stdout.write(
-                    self.style.SUCCESS(
-                        '\\n✅ Todos los productos tienen stock suficiente'
-                    )
-                )
-        else:
-            self.stdout.write(
-                self.style.SUCCESS(
-                    '\\n✅ Verificación completada (modo solo lectura)'
+                    f"{nivel_icon} {producto.codigo} - {producto.nombre}: "
+                    f"Stock actual: {stock_actual}, Mínimo: {producto.stock_minimo}"
                 )
+        
+        self.stdout.write(
+            self.style.SUCCESS(
+                '\n✅ Verificación completada (modo solo lectura)'
             )
-            self.stdout.write('   💡 Usa --crear-alertas para guardar alertas en la base de datos')
-            self.stdout.write('   💡 Usa --simular-stock para generar datos de prueba')
+        )
+        self.stdout.write('   💡 Usa --crear-alertas para guardar alertas en la base de datos')
+        self.stdout.write('   💡 Usa --simular-stock para generar datos de prueba')
     
     def crear_alertas_prueba(self):
         """Crear algunas alertas de prueba para demostración"""
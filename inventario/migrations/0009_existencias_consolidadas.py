@@ -0,0 +1,58 @@
+# Generated by Django 5.2.7 on 2026-10-17 23:47
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def poblar_existencias(apps, schema_editor):
+    """Calcular existencias consolidadas a partir del Stock actual"""
+    Stock = apps.get_model('inventario', 'Stock')
+    Producto = apps.get_model('inventario', 'Producto')
+    VarianteProducto = apps.get_model('inventario', 'VarianteProducto')
+
+    def suma(campo, relacion):
+        subconsulta = Stock.objects.filter(
+            **{relacion: OuterRef('pk')}
+        ).order_by().values(relacion).annotate(total=Sum(campo)).values('total')[:1]
+        return Coalesce(Subquery(subconsulta), 0)
+
+    Producto.objects.update(
+        existencia_total=suma('cantidad', 'producto'),
+        existencia_reservada=suma('cantidad_reservada', 'producto'),
+    )
+    VarianteProducto.objects.update(
+        existencia_total=suma('cantidad', 'variante'),
+        existencia_reservada=suma('cantidad_reservada', 'variante'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0008_alertastock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='existencia_reservada',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Existencia reservada'),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='existencia_total',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Existencia total'),
+        ),
+        migrations.AddField(
+            model_name='varianteproducto',
+            name='existencia_reservada',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Existencia reservada'),
+        ),
+        migrations.AddField(
+            model_name='varianteproducto',
+            name='existencia_total',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Existencia total'),
+        ),
+        migrations.RunPython(poblar_existencias, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 23:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0009_existencias_consolidadas'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stock',
+            name='fecha_actualizacion',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
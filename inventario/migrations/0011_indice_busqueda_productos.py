@@ -0,0 +1,56 @@
+from django.db import migrations
+
+
+def crear_indices(apps, schema_editor):
+    conexion = schema_editor.connection
+    if conexion.vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS inventario_producto_nombre_trgm '
+            'ON inventario_producto USING gin (nombre gin_trgm_ops)'
+        )
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS inventario_producto_codigo_trgm '
+            'ON inventario_producto USING gin (codigo gin_trgm_ops)'
+        )
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS inventario_producto_nombre_upper_trgm '
+            'ON inventario_producto USING gin (UPPER(nombre::text) gin_trgm_ops)'
+        )
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS inventario_producto_codigo_upper_trgm '
+            'ON inventario_producto USING gin (UPPER(codigo::text) gin_trgm_ops)'
+        )
+        return
+
+    from inventario.busqueda import TABLA_FTS, crear_indice_fts, normalizar
+    if not crear_indice_fts(schema_editor):
+        return  # SQLite sin FTS5/trigram: la búsqueda usa icontains
+
+    Producto = apps.get_model('inventario', 'Producto')
+    filas = [
+        (producto_id, normalizar(codigo), normalizar(nombre))
+        for producto_id, codigo, nombre in Producto.objects.values_list('id', 'codigo', 'nombre').iterator()
+    ]
+    with conexion.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {TABLA_FTS} (rowid, codigo, nombre) VALUES (%s, %s, %s)', filas)
+
+
+def eliminar_indices(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for indice in ('nombre_trgm', 'codigo_trgm', 'nombre_upper_trgm', 'codigo_upper_trgm'):
+            schema_editor.execute(f'DROP INDEX IF EXISTS inventario_producto_{indice}')
+    elif schema_editor.connection.vendor == 'sqlite':
+        from inventario.busqueda import TABLA_FTS
+        schema_editor.execute(f'DROP TABLE IF EXISTS {TABLA_FTS}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0010_indice_fecha_actualizacion_stock'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indices, eliminar_indices),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 00:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0011_indice_busqueda_productos'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movimientoinventario',
+            index=models.Index(fields=['fecha_movimiento', 'id'], name='movimiento_fecha_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movimientoinventario',
+            index=models.Index(fields=['producto', 'fecha_movimiento', 'id'], name='movimiento_prod_fecha_id_idx'),
+        ),
+    ]
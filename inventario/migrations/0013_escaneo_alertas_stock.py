@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-18 01:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0012_indices_paginacion_cursor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EscaneoAlertasStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('inicio', models.DateTimeField(verbose_name='Inicio del último escaneo')),
+                ('fin', models.DateTimeField(verbose_name='Fin del último escaneo')),
+                ('incremental', models.BooleanField(default=False, verbose_name='Incremental')),
+                ('evaluados', models.PositiveIntegerField(default=0, verbose_name='Productos evaluados')),
+            ],
+            options={
+                'verbose_name': 'Escaneo de Alertas de Stock',
+                'verbose_name_plural': 'Escaneos de Alertas de Stock',
+            },
+        ),
+    ]
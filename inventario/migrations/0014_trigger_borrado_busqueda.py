@@ -0,0 +1,26 @@
+from django.db import migrations
+
+
+def crear_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    from inventario.busqueda import TABLA_FTS, crear_indice_fts
+    if TABLA_FTS in schema_editor.connection.introspection.table_names():
+        crear_indice_fts(schema_editor)
+
+
+def eliminar_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        from inventario.busqueda import TRIGGER_BORRADO
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {TRIGGER_BORRADO}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0013_escaneo_alertas_stock'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_trigger, eliminar_trigger),
+    ]
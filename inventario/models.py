@@ -1,4 +1,7 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator
 from decimal import Decimal
@@ -6,6 +9,67 @@ import uuid
 
 User = get_user_model()
 
+CAMPOS_EXISTENCIA = ('existencia_total', 'existencia_reservada')
+
+
+def _proteger_existencias(instancia, kwargs):
+    """
+    Evita que un save() completo sobrescriba las existencias consolidadas
+    con valores viejos cargados en memoria. Solo Stock las actualiza.
+    """
+    if instancia._state.adding or kwargs.get('force_insert') or kwargs.get('update_fields') is not None:
+        return
+    kwargs['update_fields'] = [
+        campo.name for campo in instancia._meta.concrete_fields
+        if not campo.primary_key and campo.name not in CAMPOS_EXISTENCIA
+    ]
+
+CAMPOS_BUSQUEDA = {'codigo', 'nombre'}
+
+
+class ProductoQuerySet(models.QuerySet):
+    """
+    Mantiene el índice de búsqueda (ver ``busqueda``) en las escrituras
+    masivas que no pasan por ``Producto.save()``. Los borrados los cubre el
+    trigger del índice.
+    """
+    
+    def update(self, **kwargs):
+        from .busqueda import indexar_productos, indice_fts_disponible
+        
+        if not (CAMPOS_BUSQUEDA & kwargs.keys() and indice_fts_disponible()):
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db):
+            # Los ids se leen antes: el filtro puede depender de los campos que cambian
+            producto_ids = list(self.values_list('pk', flat=True))
+            filas = super().update(**kwargs)
+            indexar_productos(producto_ids)
+        return filas
+    
+    def bulk_create(self, objs, *args, **kwargs):
+        from .busqueda import indexar_productos
+        
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            producto_ids = [obj.pk for obj in objs if obj.pk is not None]
+            # Con ignore_conflicts/update_conflicts algunos motores no retornan los ids
+            sin_id = [obj.codigo for obj in objs if obj.pk is None]
+            if sin_id:
+                producto_ids += self.model.objects.filter(codigo__in=sin_id).values_list('pk', flat=True)
+            indexar_productos(producto_ids)
+        return objs
+    
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        from .busqueda import indexar_productos
+        
+        if not CAMPOS_BUSQUEDA & set(fields):
+            return super().bulk_update(objs, fields, *args, **kwargs)
+        with transaction.atomic(using=self.db):
+            filas = super().bulk_update(objs, fields, *args, **kwargs)
+            indexar_productos(obj.pk for obj in objs)
+        return filas
+
+
 class Proveedor(models.Model):
     """Proveedor de productos"""
     codigo = models.CharField(
@@ -144,6 +208,10 @@ class Producto(models.Model):
     stock_minimo = models.PositiveIntegerField(default=0, verbose_name='Stock mínimo')
     maneja_variantes = models.BooleanField(default=False, verbose_name='Maneja variantes')
     
+    # Existencias consolidadas (mantenidas por Stock, no editar a mano)
+    existencia_total = models.IntegerField(default=0, editable=False, verbose_name='Existencia total')
+    existencia_reservada = models.IntegerField(default=0, editable=False, verbose_name='Existencia reservada')
+    
     # Metadatos
     activo = models.BooleanField(default=True, verbose_name='Activo')
     fecha_creacion = models.DateTimeField(auto_now_add=True)
@@ -153,6 +221,8 @@ class Producto(models.Model):
     # Imagen
     # imagen = models.ImageField(upload_to='productos/', blank=True, null=True, verbose_name='Imagen')
     
+    objects = ProductoQuerySet.as_manager()
+    
     class Meta:
         verbose_name = 'Producto'
         verbose_name_plural = 'Productos'
@@ -179,7 +249,13 @@ class Producto(models.Model):
             
             self.codigo = f"{nuevo_numero:06d}"
         
+        _proteger_existencias(self, kwargs)
         super().save(*args, **kwargs)
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'codigo', 'nombre'} & set(update_fields):
+            from .busqueda import indexar_producto
+            indexar_producto(self)
     
     @property
     def utilidad_minorista(self):
@@ -307,9 +383,18 @@ class Producto(models.Model):
     @property
     def stock_total(self):
         """Stock total en todas las bodegas"""
-        return self.stock.aggregate(
-            total=models.Sum('cantidad')
-        )['total'] or 0
+        return self.existencia_total
+    
+    @property
+    def stock_disponible(self):
+        """Stock disponible para venta en todas las bodegas (total - reservado)"""
+        return self.existencia_total - self.existencia_reservada
+    
+    def actualizar_stock_total(self):
+        """Recalcula las existencias consolidadas del producto desde Stock"""
+        Stock.sincronizar_existencias([self.pk])
+        self.refresh_from_db(fields=['existencia_total', 'existencia_reservada'])
+        return self.existencia_total
     
     @property
     def stock_critico(self):
@@ -348,17 +433,39 @@ class Producto(models.Model):
     @classmethod
     def productos_con_alerta_stock(cls):
         """Productos que necesitan reabastecimiento"""
-        from django.db.models import Sum, Case, When, IntegerField
-        
-        productos = cls.objects.annotate(
-            stock_total_calculated=Sum('stock__cantidad')
-        ).filter(
+        productos = cls.objects.filter(
             activo=True,
-            stock_total_calculated__lte=models.F('stock_minimo') * Decimal('1.2')  # 20% por encima del mínimo
+            existencia_total__lte=models.F('stock_minimo') * Decimal('1.2')  # 20% por encima del mínimo
         ).prefetch_related('producto_proveedores__proveedor')
         
         return productos
     
+    @classmethod
+    def anotar_niveles_stock(cls, queryset=None):
+        """
+        Anota stock_actual y cantidad_disponible (total - reservado) a partir
+        de las existencias consolidadas, para filtrar y ordenar en la base de datos
+        """
+        queryset = cls.objects.all() if queryset is None else queryset
+        if 'stock_actual' in queryset.query.annotations:
+            return queryset
+        return queryset.annotate(
+            stock_actual=F('existencia_total'),
+            cantidad_disponible=F('existencia_total') - F('existencia_reservada'),
+        )
+    
+    @classmethod
+    def filtrar_por_estado_stock(cls, queryset, estado):
+        """Filtra por estado de stock: 'sin_stock', 'bajo_minimo' o 'disponible'"""
+        queryset = cls.anotar_niveles_stock(queryset)
+        if estado == 'sin_stock':
+            return queryset.filter(stock_actual=0)
+        if estado == 'bajo_minimo':
+            return queryset.filter(stock_actual__lte=F('stock_minimo'))
+        if estado == 'disponible':
+            return queryset.filter(stock_actual__gt=0)
+        return queryset
+    
     def analizar_patron_ventas(self, dias=30):
         """Analiza el patrón de ventas del producto en los últimos N días"""
         from django.utils import timezone
@@ -411,36 +518,33 @@ class Producto(models.Model):
         dias_restantes = self.stock_total / promedio_diario
         return timezone.now().date() + timedelta(days=int(dias_restantes))
     
+    @staticmethod
+    def elegir_proveedor_reposicion(relaciones):
+        """
+        Elige la mejor relación ProductoProveedor entre las candidatas:
+        primero el proveedor preferido, luego el mejor balance precio/tiempo de entrega.
+        """
+        candidatas = [
+            relacion for relacion in relaciones
+            if relacion.disponible and relacion.activo and relacion.proveedor.activo
+        ]
+        if not candidatas:
+            return None
+        return min(candidatas, key=lambda relacion: (
+            not relacion.proveedor_preferido,
+            relacion.precio_compra + relacion.tiempo_entrega_dias * 10,
+        ))
+    
     def obtener_mejor_proveedor_para_reposicion(self):
         """Obtiene el mejor proveedor considerando precio, disponibilidad y tiempo"""
-        from django.db.models import Case, When, Value, F
-        
-        # Priorizar proveedor preferido si está disponible
-        proveedor_preferido = self.producto_proveedores.filter(
-            proveedor_preferido=True,
-            disponible=True,
-            activo=True,
-            proveedor__activo=True
-        ).first()
-        
-        if proveedor_preferido and proveedor_preferido.stock_proveedor > 0:
-            return proveedor_preferido.proveedor
-        
-        # Si no hay preferido disponible, buscar el mejor balance precio/disponibilidad
-        mejor_proveedor = self.producto_proveedores.filter(
-            disponible=True,
-            activo=True,
-            proveedor__activo=True,
-            stock_proveedor__gt=0
-        ).annotate(
-            # Puntaje basado en precio (menor es mejor) y tiempo de entrega
-            score=Case(
-                When(proveedor_preferido=True, then=Value(0)),  # Preferido tiene mejor score
-                default=F('precio_compra') + (F('tiempo_entrega_dias') * 10)
-            )
-        ).order_by('score').first()
-        
-        return mejor_proveedor.proveedor if mejor_proveedor else None
+        relacion = self.elegir_proveedor_reposicion(
+            self.producto_proveedores.filter(
+                disponible=True,
+                activo=True,
+                proveedor__activo=True
+            ).select_related('proveedor')
+        )
+        return relacion.proveedor if relacion else None
     
     def calcular_cantidad_recomendada(self, patron_ventas, factor_seguridad=1.5):
         """Calcula cantidad recomendada basada en patrón de ventas"""
@@ -491,8 +595,20 @@ class Producto(models.Model):
             if recomendacion_existente:
                 return None
         
+        recomendacion = self.construir_recomendacion()
+        if recomendacion:
+            recomendacion.save()
+        return recomendacion
+    
+    def construir_recomendacion(self, dias_analisis=30, proveedores=None):
+        """
+        Evalúa el producto y retorna una RecomendacionReposicion sin guardar,
+        o None si no necesita reposición. ``proveedores`` permite pasar las
+        relaciones ProductoProveedor ya cargadas (con su proveedor) para no
+        consultarlas por cada producto.
+        """
         # Analizar patrón de ventas
-        patron_ventas = self.analizar_patron_ventas(30)
+        patron_ventas = self.analizar_patron_ventas(dias_analisis)
         
         # Determinar prioridad basada en stock y ventas
         if self.stock_total <= 0:
@@ -524,20 +640,17 @@ class Producto(models.Model):
         else:
             cantidad_sugerida = self.cantidad_sugerida_compra
         
-        # Obtener mejor proveedor
-        proveedor_sugerido = self.obtener_mejor_proveedor_para_reposicion()
-        
-        # Calcular precios si hay proveedor
-        precio_sugerido = None
-        valor_total = None
-        if proveedor_sugerido:
-            producto_proveedor = self.producto_proveedores.filter(
-                proveedor=proveedor_sugerido,
-                activo=True
-            ).first()
-            if producto_proveedor:
-                precio_sugerido = producto_proveedor.precio_compra
-                valor_total = precio_sugerido * cantidad_sugerida
+        # Obtener mejor proveedor y calcular precios
+        if proveedores is None:
+            proveedores = self.producto_proveedores.filter(
+                disponible=True,
+                activo=True,
+                proveedor__activo=True
+            ).select_related('proveedor')
+        relacion = self.elegir_proveedor_reposicion(proveedores)
+        proveedor_sugerido = relacion.proveedor if relacion else None
+        precio_sugerido = relacion.precio_compra if relacion else None
+        valor_total = precio_sugerido * cantidad_sugerida if relacion else None
         
         # Factores considerados
         factores = [
@@ -547,13 +660,12 @@ class Producto(models.Model):
             f"Cobertura actual: {patron_ventas['dias_cobertura']} días"
         ]
         
-        # Crear la recomendación
-        recomendacion = RecomendacionReposicion.objects.create(
+        return RecomendacionReposicion(
             producto=self,
             proveedor_sugerido=proveedor_sugerido,
             prioridad=prioridad,
             tipo_analisis=tipo_analisis,
-            stock_actual=self.stock_total,
+            stock_actual=max(self.stock_total, 0),
             stock_minimo=self.stock_minimo,
             cantidad_sugerida=cantidad_sugerida,
             dias_cobertura_actual=patron_ventas['dias_cobertura'],
@@ -568,8 +680,6 @@ class Producto(models.Model):
             es_automatica=True,
             activa=True
         )
-        
-        return recomendacion
 
 class PresentacionProducto(models.Model):
     """Diferentes presentaciones de un producto (unidad, caja x6, caja x12, etc.)"""
@@ -957,6 +1067,10 @@ class VarianteProducto(models.Model):
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     fecha_modificacion = models.DateTimeField(auto_now=True)
     
+    # Existencias consolidadas (mantenidas por Stock, no editar a mano)
+    existencia_total = models.IntegerField(default=0, editable=False, verbose_name='Existencia total')
+    existencia_reservada = models.IntegerField(default=0, editable=False, verbose_name='Existencia reservada')
+    
     class Meta:
         verbose_name = 'Variante de producto'
         verbose_name_plural = 'Variantes de productos'
@@ -970,7 +1084,13 @@ class VarianteProducto(models.Model):
         # Generar código de variante automático
         if not self.codigo_variante:
             self.codigo_variante = f"{self.producto.codigo}-{self.valor.upper()}"
+        _proteger_existencias(self, kwargs)
         super().save(*args, **kwargs)
+    
+    @property
+    def stock_disponible(self):
+        """Stock disponible de la variante en todas las bodegas"""
+        return self.existencia_total - self.existencia_reservada
 
 class Bodega(models.Model):
     """Bodegas/Sucursales para control de inventario"""
@@ -997,6 +1117,24 @@ class Bodega(models.Model):
     
     def __str__(self):
         return self.nombre
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        instancia._link_guardado = instancia.__dict__.get('link_ubicacion')
+        return instancia
+    
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        anterior = getattr(self, '_link_guardado', None)
+        if anterior and anterior != self.link_ubicacion:
+            # La ubicación anterior ya no sirve en el caché de distancias
+            from accounts.distancias import invalidar_punto
+            from ventas.rutas import coordenadas_desde_enlace
+            coordenadas = coordenadas_desde_enlace(anterior)
+            if coordenadas:
+                transaction.on_commit(lambda: invalidar_punto(*coordenadas))
+        self._link_guardado = self.link_ubicacion
 
 class Stock(models.Model):
     """Control de stock por producto/variante en cada bodega"""
@@ -1007,7 +1145,7 @@ class Stock(models.Model):
     cantidad = models.IntegerField(default=0, verbose_name='Cantidad')
     cantidad_reservada = models.IntegerField(default=0, verbose_name='Cantidad reservada')
     
-    fecha_actualizacion = models.DateTimeField(auto_now=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True, db_index=True)
     
     class Meta:
         verbose_name = 'Stock'
@@ -1020,17 +1158,113 @@ class Stock(models.Model):
             return f"{self.producto.codigo} ({self.variante.valor}) - {self.bodega.nombre}: {self.cantidad}"
         return f"{self.producto.codigo} - {self.bodega.nombre}: {self.cantidad}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        instancia._producto_guardado = instancia.__dict__.get('producto_id')
+        return instancia
+    
+    def save(self, *args, **kwargs):
+        # Si la fila pasa a otro producto, el anterior también pierde estas existencias
+        producto_ids = {self.producto_id, getattr(self, '_producto_guardado', None)} - {None}
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            Stock.sincronizar_existencias(producto_ids)
+        self._producto_guardado = self.producto_id
+        self._refrescar_existencias_en_memoria()
+    
+    def delete(self, *args, **kwargs):
+        producto_id = self.producto_id
+        with transaction.atomic():
+            resultado = super().delete(*args, **kwargs)
+            Stock.sincronizar_existencias([producto_id])
+        self._refrescar_existencias_en_memoria()
+        return resultado
+    
+    def _refrescar_existencias_en_memoria(self):
+        """Refresca las existencias del producto/variante ya cargados en esta instancia"""
+        for relacion in ('producto', 'variante'):
+            campo = self._meta.get_field(relacion)
+            if campo.is_cached(self) and getattr(self, relacion) is not None:
+                getattr(self, relacion).refresh_from_db(fields=list(CAMPOS_EXISTENCIA))
+    
+    @staticmethod
+    def sincronizar_existencias(producto_ids=None):
+        """
+        Recalcula en la base de datos las existencias consolidadas de los
+        productos indicados (y de sus variantes) a partir de Stock.
+        
+        Se ejecuta como UPDATE con subconsulta, por lo que el resultado es
+        consistente aunque otras transacciones estén modificando Stock.
+        Cualquier escritura masiva sobre Stock (update/bulk_update) debe
+        llamar este método con los productos afectados.
+        
+        Los productos cuya existencia cambia reciben una nueva
+        ``fecha_modificacion``: así el escaneo incremental de alertas también
+        los encuentra cuando la fila de Stock que cambió fue eliminada.
+        """
+        def suma(campo, relacion):
+            subconsulta = Stock.objects.filter(
+                **{relacion: OuterRef('pk')}
+            ).order_by().values(relacion).annotate(
+                total=models.Sum(campo)
+            ).values('total')[:1]
+            return Coalesce(Subquery(subconsulta), 0)
+        
+        productos = Producto.objects.all()
+        variantes = VarianteProducto.objects.all()
+        if producto_ids is not None:
+            producto_ids = list(producto_ids)
+            if not producto_ids:
+                return 0
+            productos = productos.filter(pk__in=producto_ids)
+            variantes = variantes.filter(producto_id__in=producto_ids)
+        
+        total = suma('cantidad', 'producto')
+        reservada = suma('cantidad_reservada', 'producto')
+        actualizados = productos.update(
+            # Va primero: se compara contra las existencias previas de la fila
+            fecha_modificacion=Case(
+                When(Q(existencia_total=total, existencia_reservada=reservada), then=F('fecha_modificacion')),
+                default=Value(timezone.now()),
+            ),
+            existencia_total=total,
+            existencia_reservada=reservada,
+        )
+        variantes.update(
+            existencia_total=suma('cantidad', 'variante'),
+            existencia_reservada=suma('cantidad_reservada', 'variante'),
+        )
+        return actualizados
+    
     @property
     def cantidad_disponible(self):
         """Cantidad disponible para venta (total - reservada)"""
         return self.cantidad - self.cantidad_reservada
     
+    def _actualizar_condicional(self, condicion, **cambios):
+        """
+        Aplica un UPDATE atómico sobre esta fila solo si se cumple la condición
+        (evita la sobreventa entre bodegueros concurrentes) y refresca la instancia.
+        Retorna True si la fila fue actualizada.
+        """
+        with transaction.atomic():
+            actualizadas = Stock.objects.filter(condicion, pk=self.pk).update(
+                fecha_actualizacion=timezone.now(), **cambios
+            )
+            if actualizadas:
+                Stock.sincronizar_existencias([self.producto_id])
+        self.refresh_from_db(fields=['cantidad', 'cantidad_reservada', 'fecha_actualizacion'])
+        self._refrescar_existencias_en_memoria()
+        return bool(actualizadas)
+    
     def reservar(self, cantidad, usuario=None, pedido_id=None, observaciones=""):
         """Reserva stock para una venta"""
-        if self.cantidad_disponible >= cantidad:
-            self.cantidad_reservada += cantidad
-            self.save()
-            
+        reservado = self._actualizar_condicional(
+            Q(cantidad__gte=F('cantidad_reservada') + cantidad),
+            cantidad_reservada=F('cantidad_reservada') + cantidad
+        )
+        if reservado:
             # Registrar movimiento de reserva
             MovimientoInventario.registrar_reserva(
                 producto=self.producto,
@@ -1048,10 +1282,10 @@ class Stock(models.Model):
     def liberar_reserva(self, cantidad, usuario=None, pedido_id=None, observaciones=""):
         """Libera stock reservado"""
         cantidad_a_liberar = min(cantidad, self.cantidad_reservada)
-        if cantidad_a_liberar > 0:
-            self.cantidad_reservada -= cantidad_a_liberar
-            self.save()
-            
+        if cantidad_a_liberar > 0 and self._actualizar_condicional(
+            Q(cantidad_reservada__gt=0),
+            cantidad_reservada=Greatest(F('cantidad_reservada') - cantidad_a_liberar, 0)
+        ):
             # Registrar movimiento de liberación
             MovimientoInventario.liberar_reserva(
                 producto=self.producto,
@@ -1068,16 +1302,16 @@ class Stock(models.Model):
     
     def confirmar_venta(self, cantidad, usuario=None, pedido_id=None, factura_id=None, observaciones=""):
         """Confirma una venta descontando del stock físico y liberando reserva"""
-        if self.cantidad >= cantidad:
-            # Descontar del stock físico
-            self.cantidad -= cantidad
-            
-            # Liberar de reserva si estaba reservado
-            if self.cantidad_reservada >= cantidad:
-                self.cantidad_reservada -= cantidad
-            
-            self.save()
-            
+        vendido = self._actualizar_condicional(
+            Q(cantidad__gte=cantidad),
+            # Descontar del stock físico y liberar de reserva si estaba reservado
+            cantidad=F('cantidad') - cantidad,
+            cantidad_reservada=Case(
+                When(cantidad_reservada__gte=cantidad, then=F('cantidad_reservada') - cantidad),
+                default=F('cantidad_reservada')
+            )
+        )
+        if vendido:
             # Registrar movimiento de venta
             MovimientoInventario.registrar_venta(
                 producto=self.producto,
@@ -1159,6 +1393,11 @@ class MovimientoInventario(models.Model):
         verbose_name = 'Movimiento de inventario'
         verbose_name_plural = 'Movimientos de inventario'
         ordering = ['-fecha_movimiento']
+        # Paginación por cursor (fecha_movimiento, id), general y por producto
+        indexes = [
+            models.Index(fields=['fecha_movimiento', 'id'], name='movimiento_fecha_id_idx'),
+            models.Index(fields=['producto', 'fecha_movimiento', 'id'], name='movimiento_prod_fecha_id_idx'),
+        ]
     
     def __str__(self):
         return f"{self.get_tipo_movimiento_display()} - {self.producto.codigo} - {self.cantidad} - {self.fecha_movimiento}"
@@ -2100,39 +2339,47 @@ class AlertaStock(models.Model):
             self.stock_actual == 0
         )
     
+    @classmethod
+    def clasificar(cls, nombre_producto, stock_actual, stock_minimo):
+        """
+        Determina la alerta que corresponde a un nivel de stock.
+        Retorna (tipo_alerta, nivel, mensaje) o None si no requiere alerta.
+        """
+        if stock_actual <= 0:
+            return (
+                'agotado', 'critico',
+                f"PRODUCTO AGOTADO: {nombre_producto} no tiene stock disponible"
+            )
+        if stock_actual <= stock_minimo:
+            return (
+                'stock_bajo',
+                'critico' if stock_actual <= stock_minimo * 0.5 else 'advertencia',
+                f"STOCK BAJO: {nombre_producto} - Stock actual: {stock_actual}, Mínimo: {stock_minimo}"
+            )
+        if stock_actual <= stock_minimo * 1.2:  # 20% por encima del mínimo
+            return (
+                'cerca_minimo', 'advertencia',
+                f"CERCA DEL MÍNIMO: {nombre_producto} - Stock actual: {stock_actual}, Mínimo: {stock_minimo}"
+            )
+        return None
+    
     @classmethod
     def generar_alerta_automatica(cls, producto):
-        """Genera o actualiza una alerta automática para un producto"""
+        """Genera o actualiza la alerta automática de un producto según su stock real"""
         from django.utils import timezone
         
-        # Calcular stock actual (simplificado)
-        try:
-            # Aquí iría la lógica real de cálculo de stock
-            stock_actual = max(0, producto.stock_minimo - 2)  # Simulación
-        except:
-            stock_actual = 0
+        stock_actual = producto.existencia_total
+        clasificacion = cls.clasificar(producto.nombre, stock_actual, producto.stock_minimo)
         
-        # Determinar tipo y nivel de alerta
-        if stock_actual == 0:
-            tipo_alerta = 'agotado'
-            nivel = 'critico'
-            mensaje = f"PRODUCTO AGOTADO: {producto.nombre} no tiene stock disponible"
-        elif stock_actual <= producto.stock_minimo:
-            tipo_alerta = 'stock_bajo'
-            nivel = 'critico' if stock_actual <= producto.stock_minimo * 0.5 else 'advertencia'
-            mensaje = f"STOCK BAJO: {producto.nombre} - Stock actual: {stock_actual}, Mínimo: {producto.stock_minimo}"
-        elif stock_actual <= producto.stock_minimo * 1.2:  # 20% por encima del mínimo
-            tipo_alerta = 'cerca_minimo'
-            nivel = 'advertencia'
-            mensaje = f"CERCA DEL MÍNIMO: {producto.nombre} - Stock actual: {stock_actual}, Mínimo: {producto.stock_minimo}"
-        else:
-            # No necesita alerta
-            # Resolver alertas existentes si las hay
-            cls.objects.filter(producto=producto, activa=True).update(
-                activa=False,
-                fecha_resuelto=timezone.now()
-            )
+        # Resolver alertas de otro tipo (o todas si ya no necesita alerta)
+        activas = cls.objects.filter(producto=producto, activa=True)
+        if clasificacion:
+            activas = activas.exclude(tipo_alerta=clasificacion[0])
+        activas.update(activa=False, fecha_resuelto=timezone.now())
+        
+        if clasificacion is None:
             return None
+        tipo_alerta, nivel, mensaje = clasificacion
         
         # Crear o actualizar alerta
         alerta, created = cls.objects.get_or_create(
@@ -2151,6 +2398,7 @@ class AlertaStock(models.Model):
             # Actualizar alerta existente
             alerta.mensaje = mensaje
             alerta.stock_actual = stock_actual
+            alerta.stock_minimo = producto.stock_minimo
             alerta.nivel = nivel
             alerta.activa = True
             alerta.fecha_actualizacion = timezone.now()
@@ -2176,3 +2424,22 @@ class AlertaStock(models.Model):
         )[:limit]
         
         return alertas
+
+
+class EscaneoAlertasStock(models.Model):
+    """
+    Registro del último escaneo de alertas terminado (una sola fila).
+    Su ``inicio`` es el punto de partida del siguiente escaneo incremental.
+    """
+    
+    inicio = models.DateTimeField(verbose_name='Inicio del último escaneo')
+    fin = models.DateTimeField(verbose_name='Fin del último escaneo')
+    incremental = models.BooleanField(default=False, verbose_name='Incremental')
+    evaluados = models.PositiveIntegerField(default=0, verbose_name='Productos evaluados')
+    
+    class Meta:
+        verbose_name = 'Escaneo de Alertas de Stock'
+        verbose_name_plural = 'Escaneos de Alertas de Stock'
+    
+    def __str__(self):
+        return f"Escaneo de alertas {self.inicio:%Y-%m-%d %H:%M:%S}"
@@ -6,10 +6,12 @@ Extraído de inventario/views.py para mejorar organización
 from django.shortcuts import render, get_object_or_404, redirect
 from django.views.generic import ListView, CreateView, DetailView, UpdateView
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.contrib.auth.decorators import login_required
 from django.urls import reverse_lazy
 from django.db.models import Q, Sum, Count
 from django.contrib import messages
 from django.http import HttpResponse, JsonResponse
+from django.core.exceptions import ValidationError
 from django.db import transaction
 from django.utils import timezone
 from datetime import datetime, timedelta
@@ -23,6 +25,11 @@ from reportlab.lib.units import inch
 from reportlab.lib import colors
 
 from .models import MovimientoInventario, Producto, Bodega, Stock
+from .ajustes_masivos import aplicar_ajuste_masivo
+from .importar_conteos import ArchivoConteoInvalido, procesar_conteo
+from ventas.exportacion import definicion_exportacion, nombre_persona
+from ventas.paginacion import PaginacionKeysetMixin
+from ventas.trabajos_exportacion import responder_exportacion, solicitud_con_filtros
 
 
 class AdminInventarioMixin(UserPassesTestMixin):
@@ -34,12 +41,13 @@ class AdminInventarioMixin(UserPassesTestMixin):
 
 # ============= VISTAS DE MOVIMIENTOS =============
 
-class MovimientoInventarioListView(AdminInventarioMixin, ListView):
-    """Vista de movimientos de inventario - Solo para administradores"""
+class MovimientoInventarioListView(AdminInventarioMixin, PaginacionKeysetMixin, ListView):
+    """Vista de movimientos de inventario - Solo para administradores (paginada por cursor)"""
     model = MovimientoInventario
     template_name = 'inventario/movimiento_list.html'
     context_object_name = 'movimientos'
     paginate_by = 30
+    campo_fecha_keyset = 'fecha_movimiento'
     
     def get_queryset(self):
         queryset = MovimientoInventario.objects.select_related(
@@ -85,10 +93,15 @@ class MovimientoInventarioListView(AdminInventarioMixin, ListView):
             except ValueError:
                 pass
         
-        return queryset.order_by('-fecha_movimiento')
+        return queryset.order_by('-fecha_movimiento', '-pk')
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        
+        # "Cargar más" solo necesita las filas, no las estadísticas
+        if not context['page_obj']['primera']:
+            return context
+        
         context['bodegas'] = Bodega.objects.filter(activa=True)
         
         # Estadísticas de movimientos
@@ -154,6 +167,53 @@ class MovimientoInventarioDetailView(AdminInventarioMixin, DetailView):
         return context
 
 
+# ============= EXPORTACIÓN DE MOVIMIENTOS =============
+
+def definicion_exportacion_movimientos(parametros, usuario, formato):
+    """Exportación de movimientos con los filtros de la lista"""
+    movimientos_view = MovimientoInventarioListView()
+    movimientos_view.request = solicitud_con_filtros(parametros, usuario)
+    movimientos = movimientos_view.get_queryset()
+    
+    tipos = dict(MovimientoInventario.TIPO_MOVIMIENTO_CHOICES)
+    motivos = dict(MovimientoInventario.MOTIVO_CHOICES)
+    
+    def convertir(fila):
+        fecha, tipo, motivo, codigo, nombre, bodega, destino, cantidad, costo, documento, nombre_usuario, apellido = fila
+        return [
+            timezone.localtime(fecha).strftime('%d/%m/%Y %H:%M'),
+            tipos.get(tipo, tipo), motivos.get(motivo, motivo),
+            codigo, nombre, bodega, destino or '',
+            cantidad, float(costo), float(costo * cantidad),
+            documento, nombre_persona(nombre_usuario, apellido, ''),
+        ]
+    
+    return definicion_exportacion(
+        'movimientos_inventario',
+        ['Fecha', 'Tipo', 'Motivo', 'Código', 'Producto', 'Bodega', 'Bodega Destino',
+         'Cantidad', 'Costo Unitario', 'Costo Total', 'Documento', 'Usuario'],
+        movimientos,
+        ('fecha_movimiento', 'tipo_movimiento', 'motivo', 'producto__codigo', 'producto__nombre',
+         'bodega__nombre', 'bodega_destino__nombre', 'cantidad', 'costo_unitario',
+         'documento_referencia', 'usuario__first_name', 'usuario__last_name'),
+        convertir,
+        hoja='Movimientos', anchos=[17, 14, 22, 15, 35, 20, 20, 10, 15, 15, 20, 25], columnas_moneda=[8, 9],
+    )
+
+
+@login_required
+def exportar_movimientos(request):
+    """
+    Exporta los movimientos filtrados (``formato=excel|csv``). Con
+    ``?segundo_plano=1`` se procesa como trabajo y se responde su estado.
+    """
+    if not (request.user.is_superuser or request.user.role in ['superadmin', 'administrador', 'bodega']):
+        return HttpResponse("Sin permisos", status=403)
+    
+    formato = 'csv' if request.GET.get('formato') == 'csv' else 'excel'
+    return responder_exportacion(request, 'movimientos', formato)
+
+
 # ============= FUNCIONES DE AJUSTE DE INVENTARIO =============
 
 def ajuste_inventario(request):
@@ -282,53 +342,21 @@ def ajuste_masivo_inventario(request):
                 })
             
             bodega = get_object_or_404(Bodega, id=bodega_id)
-            ajustes_realizados = 0
             
-            # Procesar ajustes
-            with transaction.atomic():
-                for key, value in request.POST.items():
-                    if key.startswith('ajuste_') and value:
-                        try:
-                            producto_id = key.replace('ajuste_', '')
-                            cantidad_nueva = int(value)
-                            
-                            if cantidad_nueva < 0:
-                                continue
-                            
-                            producto = Producto.objects.get(id=producto_id)
-                            
-                            # Obtener o crear stock
-                            stock, created = Stock.objects.get_or_create(
-                                producto=producto,
-                                bodega=bodega,
-                                defaults={'cantidad': 0, 'cantidad_reservada': 0}
-                            )
-                            
-                            cantidad_anterior = stock.cantidad
-                            diferencia = cantidad_nueva - cantidad_anterior
-                            
-                            if diferencia != 0:
-                                # Actualizar stock
-                                stock.cantidad = cantidad_nueva
-                                stock.save()
-                                
-                                # Registrar movimiento
-                                tipo_movimiento = 'entrada' if diferencia > 0 else 'salida'
-                                MovimientoInventario.objects.create(
-                                    producto=producto,
-                                    bodega=bodega,
-                                    tipo_movimiento=tipo_movimiento,
-                                    motivo='reconteo',
-                                    cantidad=abs(diferencia),
-                                    costo_unitario=producto.costo_promedio,
-                                    observaciones=f'Ajuste masivo: {cantidad_anterior} → {cantidad_nueva}. {observaciones_generales}',
-                                    usuario=request.user
-                                )
-                                
-                                ajustes_realizados += 1
-                        
-                        except (ValueError, Producto.DoesNotExist):
-                            continue
+            # Recolectar el conteo físico enviado en el formulario
+            conteos = {}
+            for key, value in request.POST.items():
+                if key.startswith('ajuste_') and value:
+                    try:
+                        conteos[int(key.replace('ajuste_', ''))] = int(value)
+                    except ValueError:
+                        continue
+            
+            # Aplicar todos los ajustes por lotes (bulk_update / bulk_create)
+            resumen = aplicar_ajuste_masivo(
+                bodega, conteos, usuario=request.user, observaciones=observaciones_generales
+            )
+            ajustes_realizados = resumen['ajustados']
             
             messages.success(
                 request, 
@@ -337,6 +365,8 @@ def ajuste_masivo_inventario(request):
             
             return redirect('inventario:stock_list')
             
+        except ValidationError as e:
+            messages.error(request, ' '.join(e.messages))
         except Exception as e:
             messages.error(request, f'Error en ajuste masivo: {str(e)}')
     
@@ -360,6 +390,47 @@ def ajuste_masivo_inventario(request):
     return render(request, 'inventario/ajuste_masivo_form.html', context)
 
 
+def importar_conteo_inventario(request):
+    """Carga un conteo físico desde CSV/XLSX: previsualiza las diferencias o las aplica"""
+    if not request.user.can_adjust_inventory():
+        messages.error(request, 'No tiene permisos para ajustar inventario.')
+        return redirect('inventario:stock_list')
+    
+    context = {}
+    if request.method == 'POST':
+        archivo = request.FILES.get('archivo')
+        aplicar = 'aplicar' in request.POST
+        if not archivo:
+            messages.error(request, 'Debe seleccionar un archivo CSV o XLSX.')
+            return render(request, 'inventario/importar_conteo.html', context)
+        
+        try:
+            resumen = procesar_conteo(
+                archivo,
+                archivo.name,
+                aplicar=aplicar,
+                usuario=request.user,
+                observaciones=request.POST.get('observaciones', ''),
+            )
+        except ArchivoConteoInvalido as e:
+            messages.error(request, str(e))
+            return render(request, 'inventario/importar_conteo.html', context)
+        except Exception as e:
+            messages.error(request, f'Error al procesar el archivo: {str(e)}')
+            return render(request, 'inventario/importar_conteo.html', context)
+        
+        if aplicar:
+            messages.success(
+                request,
+                f"Conteo aplicado: {resumen['ajustados']} productos ajustados "
+                f"({resumen['creados']} registros de stock nuevos)"
+            )
+        context['resumen'] = resumen
+        context['nombre_archivo'] = archivo.name
+    
+    return render(request, 'inventario/importar_conteo.html', context)
+
+
 # ============= GENERACIÓN DE PDFs =============
 
 def generar_pdf_transferencia(request, movimiento_id):
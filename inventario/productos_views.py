@@ -9,14 +9,15 @@ from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.urls import reverse_lazy
 from django.db.models import Q, Sum, Count
 from django.contrib import messages
+from django.utils import timezone
 from django.http import HttpResponse, JsonResponse
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment
-from datetime import datetime
 from decimal import Decimal
 
 from .models import Producto, Categoria, Subcategoria, Stock, Bodega
+from .busqueda import buscar_productos
 from .forms import ProductoFilterForm, ProductoForm
+from ventas.exportacion import definicion_exportacion
+from ventas.trabajos_exportacion import responder_exportacion, solicitud_con_filtros
 
 
 class InventarioViewMixin(UserPassesTestMixin):
@@ -41,8 +42,19 @@ class ProductoListView(InventarioViewMixin, ListView):
     context_object_name = 'productos'
     paginate_by = 20
     
+    ORDENES = {
+        'nombre': ('nombre', 'codigo'),
+        'stock_asc': ('stock_actual', 'codigo'),
+        'stock_desc': ('-stock_actual', 'codigo'),
+        'disponible_asc': ('cantidad_disponible', 'codigo'),
+        'disponible_desc': ('-cantidad_disponible', 'codigo'),
+    }
+    
     def get_queryset(self):
-        queryset = Producto.objects.select_related('categoria', 'subcategoria').prefetch_related('stock__bodega')
+        # Los totales de stock se anotan una vez para filtros, orden y plantilla
+        queryset = Producto.anotar_niveles_stock(
+            Producto.objects.select_related('categoria', 'subcategoria')
+        )
         
         # Aplicar filtros
         form = ProductoFilterForm(self.request.GET)
@@ -80,35 +92,14 @@ class ProductoListView(InventarioViewMixin, ListView):
             if activo:
                 queryset = queryset.filter(activo=(activo == 'True'))
             
-            # Filtro por stock
+            # Filtro por stock (en la base de datos, sobre las existencias consolidadas)
             stock_status = form.cleaned_data.get('stock_status')
             if stock_status:
-                if stock_status == 'sin_stock':
-                    # Productos sin stock
-                    productos_sin_stock = []
-                    for producto in queryset:
-                        stock_total = producto.stock.aggregate(total=Sum('cantidad'))['total'] or 0
-                        if stock_total == 0:
-                            productos_sin_stock.append(producto.id)
-                    queryset = queryset.filter(id__in=productos_sin_stock)
-                
-                elif stock_status == 'bajo_minimo':
-                    # Productos bajo el mínimo
-                    productos_bajo_minimo = []
-                    for producto in queryset:
-                        stock_total = producto.stock.aggregate(total=Sum('cantidad'))['total'] or 0
-                        if stock_total <= producto.stock_minimo:
-                            productos_bajo_minimo.append(producto.id)
-                    queryset = queryset.filter(id__in=productos_bajo_minimo)
-                
-                elif stock_status == 'disponible':
-                    # Productos con stock disponible
-                    productos_con_stock = []
-                    for producto in queryset:
-                        stock_total = producto.stock.aggregate(total=Sum('cantidad'))['total'] or 0
-                        if stock_total > 0:
-                            productos_con_stock.append(producto.id)
-                    queryset = queryset.filter(id__in=productos_con_stock)
+                queryset = Producto.filtrar_por_estado_stock(queryset, stock_status)
+            
+            orden = self.ORDENES.get(form.cleaned_data.get('orden'))
+            if orden:
+                return queryset.order_by(*orden)
         
         return queryset.order_by('codigo')
     
@@ -125,13 +116,9 @@ class ProductoListView(InventarioViewMixin, ListView):
     
     def _get_productos_bajo_minimo_count(self):
         """Contar productos bajo stock mínimo"""
-        count = 0
-        productos = Producto.objects.filter(activo=True)
-        for producto in productos:
-            stock_total = producto.stock.aggregate(total=Sum('cantidad'))['total'] or 0
-            if stock_total <= producto.stock_minimo:
-                count += 1
-        return count
+        return Producto.filtrar_por_estado_stock(
+            Producto.objects.filter(activo=True), 'bajo_minimo'
+        ).count()
 
 
 class ProductoCreateView(AdminOnlyMixin, CreateView):
@@ -250,114 +237,52 @@ class ProductoDeleteView(AdminOnlyMixin, DeleteView):
 
 # ============= FUNCIONES DE PRODUCTOS =============
 
-def exportar_productos_excel(request):
-    """Vista para exportar productos a Excel"""
-    if not request.user.is_authenticated:
-        return HttpResponse("No autorizado", status=401)
-    
-    if not (request.user.can_adjust_inventory() or request.user.can_view_inventory()):
-        return HttpResponse("Sin permisos", status=403)
-    
-    # Crear workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Productos"
-    
-    # Configurar estilos
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-    header_alignment = Alignment(horizontal="center", vertical="center")
-    
-    # Definir headers basándose en permisos del usuario
-    if request.user.can_see_costs():
-        headers = [
-            'Código', 'Nombre', 'Categoría', 'Subcategoría', 
-            'Costo Promedio', 'Precio Minorista', 'Precio Mayorista',
-            'Stock Total', 'Stock Mínimo', 'Estado', 'Fecha Creación'
-        ]
-    else:
-        headers = [
-            'Código', 'Nombre', 'Categoría', 'Subcategoría', 
-            'Precio Minorista', 'Precio Mayorista',
-            'Stock Total', 'Stock Mínimo', 'Estado', 'Fecha Creación'
-        ]
-    
-    # Escribir headers
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col_num, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = header_alignment
-    
+def definicion_exportacion_productos(parametros, usuario, formato):
+    """
+    Exportación de productos con los filtros de la lista. Las columnas de
+    costo solo se incluyen si el usuario puede ver costos; el stock sale de la
+    existencia consolidada del producto.
+    """
     # Obtener productos con los mismos filtros que la vista de lista
     productos_view = ProductoListView()
-    productos_view.request = request
+    productos_view.request = solicitud_con_filtros(parametros, usuario)
     productos = productos_view.get_queryset()
     
-    # Escribir datos
-    row_num = 2
-    for producto in productos:
-        # Calcular stock total
-        stock_total = producto.stock.aggregate(total=Sum('cantidad'))['total'] or 0
-        
-        if request.user.can_see_costs():
-            row_data = [
-                producto.codigo,
-                producto.nombre,
-                producto.categoria.nombre if producto.categoria else '',
-                producto.subcategoria.nombre if producto.subcategoria else '',
-                float(producto.costo_promedio),
-                float(producto.precio_minorista),
-                float(producto.precio_mayorista),
-                stock_total,
-                producto.stock_minimo,
-                'Activo' if producto.activo else 'Inactivo',
-                producto.fecha_creacion.strftime('%d/%m/%Y %H:%M')
-            ]
-        else:
-            row_data = [
-                producto.codigo,
-                producto.nombre,
-                producto.categoria.nombre if producto.categoria else '',
-                producto.subcategoria.nombre if producto.subcategoria else '',
-                float(producto.precio_minorista),
-                float(producto.precio_mayorista),
-                stock_total,
-                producto.stock_minimo,
-                'Activo' if producto.activo else 'Inactivo',
-                producto.fecha_creacion.strftime('%d/%m/%Y %H:%M')
-            ]
-        
-        for col_num, value in enumerate(row_data, 1):
-            ws.cell(row=row_num, column=col_num, value=value)
-        
-        row_num += 1
+    ver_costos = hasattr(usuario, 'can_see_costs') and usuario.can_see_costs()
     
-    # Ajustar ancho de columnas
-    for column in ws.columns:
-        max_length = 0
-        column_letter = column[0].column_letter
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = min(max_length + 2, 50)
-        ws.column_dimensions[column_letter].width = adjusted_width
+    encabezados = ['Código', 'Nombre', 'Categoría', 'Subcategoría']
+    campos = ['codigo', 'nombre', 'categoria__nombre', 'subcategoria__nombre']
+    if ver_costos:
+        encabezados.append('Costo Promedio')
+        campos.append('costo_promedio')
+    encabezados += ['Precio Minorista', 'Precio Mayorista', 'Stock Total', 'Stock Mínimo', 'Estado', 'Fecha Creación']
+    campos += ['precio_minorista', 'precio_mayorista', 'existencia_total', 'stock_minimo', 'activo', 'fecha_creacion']
+    anchos = [18, 40, 20, 20] + [15] * (len(encabezados) - 6) + [10, 18]
+    
+    def convertir(fila):
+        *inicio, activo, fecha = fila
+        return [
+            *(valor or '' for valor in inicio[:4]),
+            *(float(valor or 0) for valor in inicio[4:-2]),
+            *inicio[-2:],
+            'Activo' if activo else 'Inactivo',
+            timezone.localtime(fecha).strftime('%d/%m/%Y %H:%M') if fecha else '',
+        ]
     
-    # Preparar respuesta
-    response = HttpResponse(
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    return definicion_exportacion(
+        'productos_reyes', encabezados, productos, campos, convertir, hoja='Productos', anchos=anchos
     )
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f'productos_reyes_{timestamp}.xlsx'
-    response['Content-Disposition'] = f'attachment; filename={filename}'
+
+
+def exportar_productos_excel(request):
+    """Vista para exportar productos a Excel con los filtros de la lista (en streaming o en segundo plano)"""
+    if not request.user.is_authenticated:
+        return HttpResponse("No autorizado", status=401)
     
-    # Guardar workbook en la respuesta
-    wb.save(response)
+    if not (request.user.can_adjust_inventory() or request.user.can_view_inventory()):
+        return HttpResponse("Sin permisos", status=403)
     
-    return response
+    return responder_exportacion(request, 'productos', 'excel')
 
 
 def duplicar_producto(request, pk):
@@ -399,15 +324,11 @@ def buscar_productos_api(request):
     if len(term) < 2:
         return JsonResponse([], safe=False)
     
-    productos = Producto.objects.filter(
-        Q(nombre__icontains=term) |
-        Q(codigo__icontains=term),
-        activo=True
-    )[:10]
+    productos = buscar_productos(term, limite=10, queryset=Producto.objects.select_related('categoria'))
     
     results = []
     for producto in productos:
-        stock_total = producto.stock.aggregate(total=Sum('cantidad'))['total'] or 0
+        stock_total = producto.existencia_total
         
         results.append({
             'id': producto.id,
@@ -0,0 +1,149 @@
+"""
+Generación de recomendaciones de reposición por lotes
+
+Para cada lote de productos se cargan en tres consultas los productos (con
+su stock consolidado), las recomendaciones activas del día y las relaciones
+con proveedores; la evaluación se hace en memoria con
+``Producto.construir_recomendacion`` y las recomendaciones se guardan con un
+único bulk_create. Los lotes pueden repartirse entre varios procesos.
+"""
+
+import logging
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, time as hora
+
+from django.db import connections
+from django.utils import timezone
+
+from .models import Producto, ProductoProveedor, RecomendacionReposicion
+
+logger = logging.getLogger(__name__)
+
+TAMANO_LOTE = 500
+
+
+def _inicio_del_dia():
+    return timezone.make_aware(datetime.combine(timezone.localdate(), hora.min))
+
+
+def _resumen_vacio():
+    return {
+        'analizados': 0,
+        'generadas': 0,
+        'omitidos': 0,
+        'sin_necesidad': 0,
+        'errores': 0,
+        'por_prioridad': Counter(),
+        'valor_total': 0,
+    }
+
+
+def generar_recomendaciones_lote(producto_ids, forzar=False, dias_analisis=30):
+    """
+    Evalúa un lote de productos y guarda sus recomendaciones.
+    Retorna un resumen serializable (se usa también desde procesos hijos).
+    """
+    resumen = _resumen_vacio()
+
+    productos = list(Producto.objects.filter(id__in=producto_ids).order_by('id'))
+
+    con_recomendacion = set()
+    if not forzar:
+        con_recomendacion = set(RecomendacionReposicion.objects.filter(
+            producto_id__in=producto_ids,
+            activa=True,
+            estado__in=['pendiente', 'procesando'],
+            fecha_generacion__gte=_inicio_del_dia(),
+        ).values_list('producto_id', flat=True))
+
+    proveedores = {}
+    relaciones = ProductoProveedor.objects.filter(
+        producto_id__in=producto_ids,
+        disponible=True,
+        activo=True,
+        proveedor__activo=True,
+    ).select_related('proveedor').order_by('pk')
+    for relacion in relaciones:
+        proveedores.setdefault(relacion.producto_id, []).append(relacion)
+
+    nuevas = []
+    for producto in productos:
+        resumen['analizados'] += 1
+        if producto.id in con_recomendacion:
+            resumen['omitidos'] += 1
+            continue
+        try:
+            recomendacion = producto.construir_recomendacion(
+                dias_analisis, proveedores.get(producto.id, [])
+            )
+        except Exception as e:
+            resumen['errores'] += 1
+            logger.error(f"Error analizando producto {producto.codigo}: {str(e)}")
+            continue
+
+        if recomendacion is None:
+            resumen['sin_necesidad'] += 1
+            continue
+        nuevas.append(recomendacion)
+        resumen['por_prioridad'][recomendacion.prioridad] += 1
+        if recomendacion.valor_total_sugerido:
+            resumen['valor_total'] += recomendacion.valor_total_sugerido
+
+    RecomendacionReposicion.objects.bulk_create(nuevas)
+    resumen['generadas'] = len(nuevas)
+    return resumen
+
+
+def _inicializar_proceso():
+    import django
+    django.setup()
+
+
+def _acumular(total, parcial):
+    for clave, valor in parcial.items():
+        total[clave] += valor
+
+
+def generar_recomendaciones(productos, forzar=False, dias_analisis=30, tamano_lote=TAMANO_LOTE,
+                            procesos=1, al_terminar_lote=None):
+    """
+    Genera recomendaciones para un queryset de productos, por lotes de ids.
+
+    Con ``procesos`` > 1 los lotes se reparten en un ProcessPoolExecutor;
+    cada proceso abre su propia conexión a la base de datos. Retorna el
+    resumen acumulado más ``segundos`` y ``productos_por_segundo``.
+    ``al_terminar_lote`` recibe el resumen de cada lote al completarse.
+    """
+    inicio = time.perf_counter()
+    ids = list(productos.order_by('id').values_list('id', flat=True))
+    lotes = [ids[i:i + tamano_lote] for i in range(0, len(ids), tamano_lote)]
+
+    total = _resumen_vacio()
+    if procesos > 1 and len(lotes) > 1:
+        # Los hijos no deben heredar la conexión abierta del proceso padre
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=procesos, initializer=_inicializar_proceso) as pool:
+            futuros = [
+                pool.submit(generar_recomendaciones_lote, lote, forzar, dias_analisis)
+                for lote in lotes
+            ]
+            for futuro in as_completed(futuros):
+                parcial = futuro.result()
+                _acumular(total, parcial)
+                if al_terminar_lote:
+                    al_terminar_lote(parcial)
+    else:
+        for lote in lotes:
+            parcial = generar_recomendaciones_lote(lote, forzar, dias_analisis)
+            _acumular(total, parcial)
+            if al_terminar_lote:
+                al_terminar_lote(parcial)
+
+    total['lotes'] = len(lotes)
+    total['segundos'] = time.perf_counter() - inicio
+    total['productos_por_segundo'] = (
+        total['analizados'] / total['segundos'] if total['segundos'] > 0 else 0
+    )
+    return total
@@ -23,6 +23,7 @@ from .models import (
     RecomendacionReposicion
 )
 from .general_views import AdminInventarioMixin, BodegaMixin
+from .recomendaciones import generar_recomendaciones
 
 # ========================================
 # DASHBOARDS Y REPORTES PRINCIPALES
@@ -278,28 +279,15 @@ def generar_recomendaciones_ajax(request):
             except Producto.DoesNotExist:
                 return JsonResponse({'error': 'Producto no encontrado'}, status=404)
                 
-        elif modo == 'criticos':
-            # Analizar solo productos críticos (sin stock o stock mínimo)
-            productos_criticos = Producto.objects.filter(
-                activo=True,
-                stock_actual__lte=F('stock_minimo')
-            )
-            
-            for producto in productos_criticos:
-                productos_analizados += 1
-                recomendacion = producto.generar_recomendacion_inteligente(forzar=forzar)
-                if recomendacion:
-                    recomendaciones_generadas += 1
-                    
-        else:  # modo == 'todos'
-            # Analizar todos los productos activos
+        else:
+            # Analizar todos los productos activos, o solo los críticos, por lotes
             productos = Producto.objects.filter(activo=True)
+            if modo == 'criticos':
+                productos = productos.filter(existencia_total__lte=F('stock_minimo'))
             
-            for producto in productos:
-                productos_analizados += 1
-                recomendacion = producto.generar_recomendacion_inteligente(forzar=forzar)
-                if recomendacion:
-                    recomendaciones_generadas += 1
+            resumen = generar_recomendaciones(productos, forzar=forzar)
+            productos_analizados = resumen['analizados']
+            recomendaciones_generadas = resumen['generadas']
         
         return JsonResponse({
             'success': True,
@@ -0,0 +1,253 @@
+"""
+Motor de reservas de stock por pedido completo
+
+Reserva todas las líneas de un pedido en una sola transacción. Como en el
+alistamiento original, el disponible de un producto es la suma de todas sus
+filas de Stock en la bodega (con y sin variante); la reserva se reparte entre
+esas filas con un UPDATE condicional por fila
+(``cantidad - cantidad_reservada >= n``) para que dos bodegueros que
+procesan pedidos al mismo tiempo no puedan sobrevender, y los movimientos
+de inventario se registran con un único bulk_create.
+"""
+
+import uuid
+from collections import OrderedDict, defaultdict
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Bodega, MovimientoInventario, Producto, Stock
+
+
+class StockInsuficiente(Exception):
+    """Se lanza dentro de la transacción para deshacer una reserva parcial"""
+
+    def __init__(self, faltantes):
+        super().__init__('Stock insuficiente')
+        self.faltantes = faltantes
+
+
+def bodega_para_usuario(usuario):
+    """Bodega desde la que se despacha: la asignada al usuario o la principal"""
+    if usuario is not None and getattr(usuario, 'bodega_id', None):
+        return usuario.bodega
+    return (Bodega.objects.filter(es_principal=True, activa=True).first() or
+            Bodega.objects.filter(activa=True).first())
+
+
+def _lineas_pedido(pedido):
+    """
+    Agrupa las cantidades del pedido por producto (una consulta).
+
+    El Stock se lleva en unidades enteras: una línea con cantidad fraccionaria
+    (p. ej. 2.50) lanza ValidationError en lugar de reservarse truncada.
+    """
+    lineas = OrderedDict()
+    fraccionarios = []
+    for item in pedido.items.select_related('producto'):
+        if item.cantidad != item.cantidad.to_integral_value():
+            fraccionarios.append(f'{item.producto.nombre} ({item.cantidad})')
+            continue
+        linea = lineas.setdefault(item.producto_id, {
+            'producto': item.producto,
+            'items': [],
+            'cantidad_pedida': 0,
+        })
+        linea['items'].append(item)
+        linea['cantidad_pedida'] += int(item.cantidad)
+    if fraccionarios:
+        raise ValidationError(
+            'Las cantidades a reservar deben ser enteras: %(lineas)s.',
+            code='cantidad_fraccionaria',
+            params={'lineas': ', '.join(fraccionarios)},
+        )
+    return lineas
+
+
+def _stocks_bloqueados(bodega, producto_ids):
+    """Todas las filas de Stock (con y sin variante) de los productos en la bodega, bloqueadas en PostgreSQL"""
+    stocks = Stock.objects.select_for_update().filter(
+        bodega=bodega,
+        producto_id__in=producto_ids,
+    ).order_by('pk')  # orden fijo de bloqueo para evitar interbloqueos
+    por_producto = defaultdict(list)
+    for stock in stocks:
+        por_producto[stock.producto_id].append(stock)
+    return por_producto
+
+
+def _faltantes(lineas, stocks, disponible):
+    """Calcula el faltante por línea sumando las filas de Stock leídas"""
+    resultado = []
+    for producto_id, linea in lineas.items():
+        stock_disponible = sum(max(disponible(stock), 0) for stock in stocks.get(producto_id, []))
+        faltante = linea['cantidad_pedida'] - stock_disponible
+        resultado.append({
+            'producto': linea['producto'],
+            'items': linea['items'],
+            'cantidad_pedida': linea['cantidad_pedida'],
+            'stock_disponible': stock_disponible,
+            'faltante': max(faltante, 0),
+        })
+    return resultado
+
+
+def _movimiento(stock, producto, cantidad, pedido, usuario, tipo_movimiento, motivo,
+                prefijo, observaciones):
+    return MovimientoInventario(
+        producto=producto,
+        variante_id=stock.variante_id,
+        bodega_id=stock.bodega_id,
+        tipo_movimiento=tipo_movimiento,
+        motivo=motivo,
+        cantidad=cantidad,
+        costo_unitario=producto.costo_promedio,
+        usuario=usuario,
+        pedido_referencia=uuid.UUID(int=pedido.pk),
+        documento_referencia=f"{prefijo}-{pedido.pk}",
+        observaciones=observaciones,
+    )
+
+
+def _aplicar(pedido, bodega, usuario, disponible, condicion, cambios, movimiento):
+    """
+    Aplica una operación a todas las líneas del pedido o a ninguna.
+
+    La cantidad de cada línea se reparte entre las filas de Stock del
+    producto, en orden de pk, según lo que ``disponible`` deja en cada una.
+    Retorna un dict con ``exito`` y ``lineas`` (una entrada por producto con
+    cantidad pedida, stock disponible y faltante). Si alguna línea no alcanza,
+    no se modifica nada y se reportan todos los faltantes juntos.
+    """
+    lineas = _lineas_pedido(pedido)
+    if not lineas:
+        return {'exito': True, 'lineas': []}
+
+    try:
+        with transaction.atomic():
+            stocks = _stocks_bloqueados(bodega, list(lineas))
+            resultado = _faltantes(lineas, stocks, disponible)
+            if any(linea['faltante'] for linea in resultado):
+                raise StockInsuficiente(resultado)
+
+            ahora = timezone.now()
+            movimientos = []
+            for producto_id, linea in lineas.items():
+                restante = linea['cantidad_pedida']
+                for stock in stocks.get(producto_id, []):
+                    cantidad = min(restante, disponible(stock))
+                    if cantidad <= 0:
+                        continue
+                    actualizadas = Stock.objects.filter(
+                        pk=stock.pk, **condicion(cantidad)
+                    ).update(fecha_actualizacion=ahora, **cambios(cantidad))
+                    if not actualizadas:
+                        # Otra transacción consumió el stock entre la lectura y la escritura
+                        stocks = _stocks_bloqueados(bodega, list(lineas))
+                        raise StockInsuficiente(_faltantes(lineas, stocks, disponible))
+                    movimientos.append(movimiento(stock, linea['producto'], cantidad))
+                    restante -= cantidad
+                    if not restante:
+                        break
+
+            MovimientoInventario.objects.bulk_create(movimientos)
+            Stock.sincronizar_existencias(list(lineas))
+    except StockInsuficiente as error:
+        return {'exito': False, 'lineas': error.faltantes}
+
+    return {'exito': True, 'lineas': resultado}
+
+
+def reservar_pedido(pedido, bodega=None, usuario=None):
+    """
+    Reserva en la bodega el stock de todas las líneas del pedido. Lanza
+    ValidationError, sin reservar nada, si alguna cantidad no es entera.
+    """
+    bodega = bodega or bodega_para_usuario(usuario)
+    return _aplicar(
+        pedido, bodega, usuario,
+        disponible=lambda stock: stock.cantidad - stock.cantidad_reservada,
+        condicion=lambda n: {'cantidad__gte': F('cantidad_reservada') + n},
+        cambios=lambda n: {'cantidad_reservada': F('cantidad_reservada') + n},
+        movimiento=lambda stock, producto, n: _movimiento(
+            stock, producto, 0, pedido, usuario, 'salida', 'reserva', 'RESERVA',
+            f"Reserva para pedido {pedido.numero}"
+        ),
+    )
+
+
+def _bodega_alternativa(por_bodega, cantidad, excluir, nombres_bodega):
+    """Bodega (distinta de ``excluir``) que cubre sola la cantidad, la de más disponible"""
+    candidatas = [
+        (disponible, bodega_id) for bodega_id, disponible in por_bodega.items()
+        if bodega_id != excluir and disponible >= cantidad
+    ]
+    if not candidatas:
+        return None
+    disponible, bodega_id = max(candidatas, key=lambda par: (par[0], -par[1]))
+    return {'bodega_id': bodega_id, 'bodega_nombre': nombres_bodega[bodega_id], 'stock_disponible': disponible}
+
+
+def verificar_disponibilidad(lineas, bodega_id=None, sugerir_bodega=False):
+    """
+    Disponibilidad (cantidad - reservada) de las líneas de un carrito con una
+    sola consulta, sin reservar nada.
+
+    ``lineas`` son dicts con ``producto_id``, ``variante_id`` (None = sin
+    variante) y ``cantidad``. Con ``bodega_id`` se mira solo esa bodega; sin
+    ella, la suma de las bodegas activas. Si un producto se repite, las líneas
+    siguientes consumen lo que dejaron las anteriores. Con ``sugerir_bodega``
+    cada línea con faltante trae ``bodega_sugerida``: otra bodega que puede
+    despachar sola todo lo pedido de ese producto (o None).
+    """
+    producto_ids = {linea['producto_id'] for linea in lineas}
+    filas = Producto.objects.filter(pk__in=producto_ids, activo=True).order_by().values_list(
+        'pk', 'nombre', 'stock__variante_id', 'stock__bodega_id', 'stock__bodega__nombre',
+        'stock__bodega__activa', 'stock__cantidad', 'stock__cantidad_reservada',
+    )
+
+    nombres = {}
+    nombres_bodega = {}
+    existencias = defaultdict(dict)  # (producto, variante) -> {bodega: disponible}
+    for producto_id, nombre, variante_id, bodega, bodega_nombre, activa, cantidad, reservada in filas:
+        nombres[producto_id] = nombre
+        if bodega is None or not activa:
+            continue
+        existencias[(producto_id, variante_id)][bodega] = max(cantidad - reservada, 0)
+        nombres_bodega[bodega] = bodega_nombre
+
+    solicitado = defaultdict(int)
+    resultados = []
+    for linea in lineas:
+        producto_id, variante_id, cantidad = linea['producto_id'], linea.get('variante_id'), linea['cantidad']
+        if producto_id not in nombres:
+            resultados.append({'producto_id': producto_id, 'error': 'Producto no encontrado', 'suficiente': False})
+            continue
+
+        clave = (producto_id, variante_id)
+        solicitado[clave] += cantidad
+        por_bodega = existencias.get(clave, {})
+        stock_disponible = por_bodega.get(bodega_id, 0) if bodega_id else sum(por_bodega.values())
+        faltante = min(cantidad, max(solicitado[clave] - stock_disponible, 0))
+
+        resultado = {
+            'producto_id': producto_id,
+            'producto_nombre': nombres[producto_id],
+            'variante_id': variante_id,
+            'cantidad_solicitada': cantidad,
+            'stock_disponible': stock_disponible,
+            'suficiente': not faltante,
+            'faltante': faltante,
+        }
+        if sugerir_bodega and faltante:
+            resultado['bodega_sugerida'] = _bodega_alternativa(
+                por_bodega, solicitado[clave], bodega_id, nombres_bodega
+            )
+        resultados.append(resultado)
+
+    return {
+        'stock_suficiente': all(resultado['suficiente'] for resultado in resultados),
+        'productos': resultados,
+    }
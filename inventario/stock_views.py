@@ -74,11 +74,7 @@ class StockListView(InventarioViewMixin, ListView):
             queryset = queryset.filter(cantidad=0)
         elif stock_status == 'bajo_minimo':
             # Solo productos bajo el mínimo
-            productos_bajo_minimo = []
-            for stock in queryset:
-                if stock.cantidad <= stock.producto.stock_minimo:
-                    productos_bajo_minimo.append(stock.id)
-            queryset = queryset.filter(id__in=productos_bajo_minimo)
+            queryset = queryset.filter(cantidad__lte=F('producto__stock_minimo'))
         elif stock_status == 'disponible':
             queryset = queryset.filter(cantidad__gt=0)
         
@@ -114,11 +110,9 @@ class StockListView(InventarioViewMixin, ListView):
     
     def _calcular_valor_total_inventario(self):
         """Calcular valor total del inventario"""
-        valor_total = 0
-        stocks = Stock.objects.select_related('producto').filter(cantidad__gt=0)
-        for stock in stocks:
-            valor_total += stock.cantidad * stock.producto.costo_promedio
-        return valor_total
+        return Stock.objects.filter(cantidad__gt=0).aggregate(
+            total=Sum(F('cantidad') * F('producto__costo_promedio'))
+        )['total'] or 0
 
 
 class StockDetailView(InventarioViewMixin, DetailView):
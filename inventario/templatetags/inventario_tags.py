@@ -1,21 +1,26 @@
 from django import template
-from django.db.models import Sum
 
 register = template.Library()
 
 @register.filter
 def stock_total(producto):
-    """Calcula el stock total de un producto en todas las bodegas"""
-    return producto.stock.aggregate(total=Sum('cantidad'))['total'] or 0
+    """
+    Stock total de un producto en todas las bodegas.
+    Usa la anotación de Producto.anotar_niveles_stock si existe y si no las
+    existencias consolidadas (sin consultas).
+    """
+    total = getattr(producto, 'stock_actual', None)
+    if total is not None:
+        return total
+    return producto.existencia_total
 
 @register.filter
 def stock_disponible_total(producto):
-    """Calcula el stock disponible total (cantidad - reservada)"""
-    stocks = producto.stock.all()
-    total = 0
-    for stock in stocks:
-        total += (stock.cantidad - stock.cantidad_reservada)
-    return total
+    """Calcula el stock disponible total (cantidad - reservada), con la misma estrategia que stock_total"""
+    total = getattr(producto, 'cantidad_disponible', None)
+    if total is not None:
+        return total
+    return producto.existencia_total - producto.existencia_reservada
 
 @register.simple_tag
 def url_replace(request, field, value):
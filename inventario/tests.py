@@ -1,3 +1,534 @@
+import io
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import Prefetch
+from django.template import Context, Template
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from . import alertas_stock, busqueda
+from .ajustes_masivos import aplicar_ajuste_masivo
+from .importar_conteos import ArchivoConteoInvalido, procesar_conteo
+from .models import AlertaStock, Bodega, Categoria, MovimientoInventario, Producto, Stock, Subcategoria, VarianteProducto
+
+
+class StockTemplateFiltersTests(TestCase):
+    """Los filtros de stock no deben consultar la base de datos por fila"""
+
+    PLANTILLA = Template(
+        '{% load inventario_tags %}'
+        '{% for producto in productos %}{{ producto|stock_total }}/{{ producto|stock_disponible_total }};{% endfor %}'
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre='General')
+        subcategoria = Subcategoria.objects.create(nombre='Varios', categoria=categoria)
+        bodegas = [
+            Bodega.objects.create(nombre='Principal', direccion='Calle 1', es_principal=True),
+            Bodega.objects.create(nombre='Secundaria', direccion='Calle 2'),
+        ]
+        productos = Producto.objects.bulk_create([
+            Producto(codigo=f'P{i:03}', nombre=f'Producto {i}', categoria=categoria,
+                     subcategoria=subcategoria, stock_minimo=5)
+            for i in range(100)
+        ])
+        Stock.objects.bulk_create([
+            Stock(producto=producto, bodega=bodega, cantidad=i + 10, cantidad_reservada=2)
+            for i, producto in enumerate(productos)
+            for bodega in bodegas
+        ])
+        Stock.sincronizar_existencias()
+        cls.esperado = ''.join(f'{2 * (i + 10)}/{2 * (i + 8)};' for i in range(100))
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+
+    def renderizar(self, productos):
+        return self.PLANTILLA.render(Context({'productos': productos}))
+
+    def test_filtros_con_totales_anotados(self):
+        with self.assertNumQueries(1):
+            html = self.renderizar(Producto.anotar_niveles_stock().order_by('codigo'))
+        self.assertEqual(html, self.esperado)
+
+    def test_filtros_con_stock_precargado(self):
+        productos = Producto.objects.order_by('codigo').prefetch_related(
+            Prefetch('stock', queryset=Stock.objects.order_by())
+        )
+        with self.assertNumQueries(2):
+            html = self.renderizar(productos)
+        self.assertEqual(html, self.esperado)
+
+    def test_filtros_con_existencias_consolidadas(self):
+        with self.assertNumQueries(1):
+            html = self.renderizar(Producto.objects.order_by('codigo'))
+        self.assertEqual(html, self.esperado)
+
+    def test_lista_de_productos_no_crece_con_las_filas(self):
+        self.client.force_login(self.usuario)
+        url = reverse('inventario:producto_list')
+
+        with CaptureQueriesContext(connection) as pagina_completa:
+            respuesta = self.client.get(url)
+        self.assertEqual(len(respuesta.context['productos']), 20)
+
+        Producto.objects.filter(codigo__gte='P005').delete()
+        with CaptureQueriesContext(connection) as pagina_corta:
+            respuesta = self.client.get(url)
+        self.assertEqual(len(respuesta.context['productos']), 5)
+
+        self.assertEqual(len(pagina_completa), len(pagina_corta))
+
+
+class MoverStockTests(TestCase):
+    """Mover una fila de Stock a otro producto actualiza las existencias de ambos"""
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre='General')
+        subcategoria = Subcategoria.objects.create(nombre='Varios', categoria=categoria)
+        bodegas = [
+            Bodega.objects.create(nombre='Principal', direccion='Calle 1', es_principal=True),
+            Bodega.objects.create(nombre='Secundaria', direccion='Calle 2'),
+        ]
+        cls.origen, cls.destino = Producto.objects.bulk_create([
+            Producto(codigo=f'P{i:03}', nombre=f'Producto {i}', categoria=categoria, subcategoria=subcategoria)
+            for i in range(2)
+        ])
+        Stock.objects.bulk_create([
+            Stock(producto=producto, bodega=bodega, cantidad=10 + i, cantidad_reservada=2)
+            for i, producto in enumerate((cls.origen, cls.destino))
+            for bodega in bodegas
+        ])
+        Stock.sincronizar_existencias()
+
+    def test_mover_stock_a_otro_producto(self):
+        stock = Stock.objects.filter(producto=self.origen).first()
+        stock.producto = self.destino
+        stock.bodega = Bodega.objects.create(nombre='Tercera', direccion='Calle 3')
+        stock.save()
+
+        self.origen.refresh_from_db()
+        self.destino.refresh_from_db()
+        self.assertEqual((self.origen.existencia_total, self.origen.existencia_reservada), (10, 2))
+        self.assertEqual((self.destino.existencia_total, self.destino.existencia_reservada), (32, 6))
+
+
+class AjusteMasivoTests(TestCase):
+    """Un ajuste masivo se aplica completo o no se aplica"""
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre='General')
+        subcategoria = Subcategoria.objects.create(nombre='Varios', categoria=categoria)
+        cls.bodega = Bodega.objects.create(nombre='Principal', direccion='Calle 1', es_principal=True)
+        cls.productos = Producto.objects.bulk_create([
+            Producto(codigo=f'P{i:03}', nombre=f'Producto {i}', categoria=categoria, subcategoria=subcategoria)
+            for i in range(3)
+        ])
+        Stock.objects.bulk_create([
+            Stock(producto=producto, bodega=cls.bodega, cantidad=10) for producto in cls.productos
+        ])
+        Stock.sincronizar_existencias()
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+
+    def test_error_en_un_lote_revierte_los_anteriores(self):
+        conteos = {producto.pk: 25 for producto in self.productos}
+
+        with mock.patch.object(
+            Stock, 'sincronizar_existencias', side_effect=[None, RuntimeError('falla en el segundo lote')]
+        ):
+            with self.assertRaises(RuntimeError):
+                aplicar_ajuste_masivo(self.bodega, conteos, usuario=self.usuario, tamano_lote=1)
+
+        self.assertEqual(
+            list(Stock.objects.filter(bodega=self.bodega).values_list('cantidad', flat=True)), [10, 10, 10]
+        )
+        self.assertFalse(MovimientoInventario.objects.exists())
+
+    def test_rechaza_cantidades_negativas(self):
+        primero, segundo = self.productos[:2]
+
+        with self.assertRaises(ValidationError):
+            aplicar_ajuste_masivo(self.bodega, {primero.pk: 50, segundo.pk: -3}, usuario=self.usuario)
+
+        self.assertEqual(Stock.objects.get(producto=primero, bodega=self.bodega).cantidad, 10)
+        self.assertFalse(MovimientoInventario.objects.exists())
+
+    def test_aplica_todos_los_lotes(self):
+        resumen = aplicar_ajuste_masivo(
+            self.bodega, {producto.pk: 25 for producto in self.productos}, usuario=self.usuario, tamano_lote=1
+        )
+
+        self.assertEqual(resumen['ajustados'], 3)
+        self.assertEqual(MovimientoInventario.objects.count(), 3)
+        self.assertEqual(
+            list(Producto.objects.order_by('codigo').values_list('existencia_total', flat=True)), [25, 25, 25]
+        )
+
+
+class ImportarConteoTests(TestCase):
+    """Importación de conteos físicos: formatos, archivos inválidos, simulación y aplicación"""
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre='General')
+        subcategoria = Subcategoria.objects.create(nombre='Varios', categoria=categoria)
+        cls.bodega = Bodega.objects.create(nombre='Principal', direccion='Calle 1', es_principal=True)
+        cls.secundaria = Bodega.objects.create(nombre='Secundaria', direccion='Calle 2')
+        productos = Producto.objects.bulk_create([
+            Producto(codigo=f'P{i:03}', nombre=f'Producto {i}', categoria=categoria, subcategoria=subcategoria)
+            for i in range(3)
+        ])
+        Stock.objects.bulk_create([Stock(producto=producto, bodega=cls.bodega, cantidad=10) for producto in productos])
+        Stock.sincronizar_existencias()
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+
+    CSV = (
+        'codigo;bodega;cantidad\n'
+        'P000;principal;12\n'
+        'P001;Principal;10\n'
+        'P002;{secundaria};4\n'
+        'X999;Principal;1\n'
+        'P000;Inexistente;1\n'
+        'P001;Principal;-3\n'
+        'P001;Principal;2,5\n'
+    )
+
+    def csv(self):
+        return io.BytesIO(self.CSV.format(secundaria=self.secundaria.pk).encode())
+
+    def xlsx(self, filas):
+        from openpyxl import Workbook
+
+        libro = Workbook()
+        for fila in filas:
+            libro.active.append(fila)
+        archivo = io.BytesIO()
+        libro.save(archivo)
+        archivo.seek(0)
+        return archivo
+
+    def test_simulacion_calcula_diferencias_sin_modificar(self):
+        resumen = procesar_conteo(self.csv(), 'conteo.csv')
+
+        self.assertEqual(resumen['filas'], 7)
+        self.assertEqual(resumen['diferencias'], 2)
+        self.assertEqual((resumen['unidades_entrada'], resumen['unidades_salida']), (6, 0))
+        self.assertEqual(
+            [(fila['codigo'], fila['bodega'], fila['diferencia']) for fila in resumen['muestra']],
+            [('P000', 'Principal', 2), ('P002', 'Secundaria', 4)],
+        )
+        self.assertEqual([error['fila'] for error in resumen['detalle_errores']], [5, 6, 7, 8])
+        self.assertFalse(resumen['aplicado'])
+        self.assertEqual(Stock.objects.count(), 3)
+        self.assertEqual(set(Stock.objects.values_list('cantidad', flat=True)), {10})
+        self.assertFalse(MovimientoInventario.objects.exists())
+
+    def test_aplicar_csv_sin_encabezado(self):
+        archivo = io.BytesIO(b'P000,Principal,7\nP001,Secundaria,3\n')
+
+        resumen = procesar_conteo(archivo, 'conteo.txt', aplicar=True, usuario=self.usuario)
+
+        self.assertEqual((resumen['ajustados'], resumen['creados'], resumen['errores']), (2, 1, 0))
+        self.assertEqual(Stock.objects.get(producto__codigo='P000', bodega=self.bodega).cantidad, 7)
+        self.assertEqual(Stock.objects.get(producto__codigo='P001', bodega=self.secundaria).cantidad, 3)
+        self.assertEqual(
+            sorted(MovimientoInventario.objects.values_list('tipo_movimiento', 'cantidad')),
+            [('entrada', 3), ('salida', 3)],
+        )
+
+    def test_xlsx_con_encabezado_en_otro_orden(self):
+        archivo = self.xlsx([('Cantidad', 'Codigo', 'Bodega'), (15, 'P001', 'Principal'), (None, None, None)])
+
+        resumen = procesar_conteo(archivo, 'conteo.XLSX', aplicar=True, usuario=self.usuario)
+
+        self.assertEqual((resumen['filas'], resumen['ajustados']), (1, 1))
+        self.assertEqual(Stock.objects.get(producto__codigo='P001', bodega=self.bodega).cantidad, 15)
+
+    def test_archivos_invalidos(self):
+        for contenido, nombre in [
+            (b'P000,Principal,1', 'conteo.pdf'),
+            (b'no es un libro', 'conteo.xlsx'),
+            ('P000;Principal;1'.encode('utf-16'), 'conteo.csv'),
+        ]:
+            with self.subTest(nombre=nombre):
+                with self.assertRaises(ArchivoConteoInvalido):
+                    procesar_conteo(io.BytesIO(contenido), nombre)
+
+    def test_error_al_aplicar_revierte_el_archivo_completo(self):
+        archivo = io.BytesIO(b'P000,Principal,1\nP001,Principal,2\nP002,Principal,3\n')
+
+        with mock.patch.object(
+            Stock, 'sincronizar_existencias', side_effect=[None, RuntimeError('falla en el segundo lote')]
+        ):
+            with self.assertRaises(RuntimeError):
+                procesar_conteo(archivo, 'conteo.csv', aplicar=True, tamano_lote=1)
+
+        self.assertEqual(set(Stock.objects.values_list('cantidad', flat=True)), {10})
+        self.assertFalse(MovimientoInventario.objects.exists())
+
+    def test_comando(self):
+        with tempfile.TemporaryDirectory() as directorio:
+            ruta = os.path.join(directorio, 'conteo.csv')
+            with open(ruta, 'w', encoding='utf-8') as archivo:
+                archivo.write(self.CSV.format(secundaria=self.secundaria.pk))
+
+            salida = io.StringIO()
+            call_command('importar_conteo', ruta, stdout=salida)
+            self.assertIn('P000 @ Principal: 10 → 12 (+2)', salida.getvalue())
+            self.assertIn('Fila 5: Código de producto no encontrado: X999', salida.getvalue())
+            self.assertIn('Simulación', salida.getvalue())
+            self.assertFalse(MovimientoInventario.objects.exists())
+
+            salida = io.StringIO()
+            call_command('importar_conteo', ruta, '--aplicar', '--silencioso', stdout=salida)
+            self.assertIn('2 productos ajustados (1 registros de stock nuevos)', salida.getvalue())
+            self.assertNotIn('→', salida.getvalue())
+            self.assertEqual(MovimientoInventario.objects.count(), 2)
+
+            with self.assertRaises(CommandError):
+                call_command('importar_conteo', os.path.join(directorio, 'no_existe.csv'), stdout=io.StringIO())
+
+    def test_vista_previsualiza_y_aplica(self):
+        self.client.force_login(self.usuario)
+        url = reverse('inventario:importar_conteo')
+
+        def subir(**datos):
+            archivo = SimpleUploadedFile('conteo.csv', self.CSV.format(secundaria=self.secundaria.pk).encode())
+            return self.client.post(url, {'archivo': archivo, **datos})
+
+        respuesta = subir()
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertFalse(respuesta.context['resumen']['aplicado'])
+        self.assertEqual(respuesta.context['resumen']['diferencias'], 2)
+        self.assertFalse(MovimientoInventario.objects.exists())
+
+        respuesta = subir(aplicar='1', observaciones='Conteo anual')
+        self.assertTrue(respuesta.context['resumen']['aplicado'])
+        self.assertEqual(respuesta.context['resumen']['ajustados'], 2)
+        self.assertEqual(
+            set(MovimientoInventario.objects.values_list('usuario', flat=True)), {self.usuario.pk}
+        )
+        self.assertTrue(all(
+            observaciones.endswith('Conteo anual')
+            for observaciones in MovimientoInventario.objects.values_list('observaciones', flat=True)
+        ))
+
+        respuesta = self.client.post(url, {'archivo': SimpleUploadedFile('conteo.pdf', b'x')})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotIn('resumen', respuesta.context)
+        self.assertIn('Formato no soportado', ' '.join(str(m) for m in respuesta.context['messages']))
+
+
+class BusquedaProductosTests(TestCase):
+    """Ranking, tolerancia a errores de tipeo, códigos exactos y mantenimiento del índice FTS"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categoria = Categoria.objects.create(nombre='Ferretería')
+        cls.subcategoria = Subcategoria.objects.create(nombre='Varios', categoria=cls.categoria)
+        Producto.objects.bulk_create([
+            cls.producto('F100', 'Tornillo de acero'),
+            cls.producto('F200', 'Tuerca para tornillo'),
+            cls.producto('F300', 'Arandela plana'),
+            cls.producto('F400', 'Café molido'),
+            cls.producto('ARA-5', 'Llave inglesa'),
+            cls.producto('AB', 'Abrazadera'),
+            cls.producto('F500', 'Tornillo inactivo', activo=False),
+        ])
+        VarianteProducto.objects.create(
+            producto=Producto.objects.get(codigo='F300'), tipo_variante='talla', valor='M', codigo_variante='F300-M'
+        )
+
+    @classmethod
+    def producto(cls, codigo, nombre, **campos):
+        return Producto(codigo=codigo, nombre=nombre, categoria=cls.categoria, subcategoria=cls.subcategoria, **campos)
+
+    def setUp(self):
+        if not busqueda.indice_fts_disponible():
+            self.skipTest('SQLite sin FTS5/trigram')
+
+    def codigos(self, termino, **opciones):
+        return [producto.codigo for producto in busqueda.buscar_productos(termino, **opciones)]
+
+    def test_ranking(self):
+        # Prefijo de código, luego prefijo de nombre, luego subcadena
+        self.assertEqual(self.codigos('ara'), ['ARA-5', 'F300', 'F200'])
+        self.assertEqual(self.codigos('tornillo'), ['F100', 'F200'])
+
+        todos = self.codigos('tornillo', solo_activos=False)
+        self.assertEqual(sorted(todos[:2]), ['F100', 'F500'])
+        self.assertEqual(todos[2:], ['F200'])
+        self.assertEqual(self.codigos('tornillo', limite=1), ['F100'])
+
+    def test_tolera_errores_de_tipeo_y_tildes(self):
+        self.assertEqual(self.codigos('tornilo'), ['F100', 'F200'])
+        self.assertEqual(self.codigos('arandla')[0], 'F300')
+        self.assertEqual(self.codigos('CAFE'), ['F400'])
+        self.assertEqual(self.codigos('zzzzzz'), [])
+
+    def test_codigo_exacto_de_producto_o_variante(self):
+        self.assertEqual(self.codigos('ab'), ['AB'])
+        self.assertEqual(self.codigos('f300-m'), ['F300'])
+        # Solo la consulta por código y la carga de resultados, sin pasar por el índice
+        with self.assertNumQueries(2):
+            self.assertEqual(self.codigos('F200', limite=1), ['F200'])
+
+    def test_el_indice_sigue_las_escrituras_del_orm(self):
+        tornillo = Producto.objects.get(codigo='F100')
+        tornillo.nombre = 'Perno hexagonal'
+        tornillo.save()
+        self.assertEqual(self.codigos('perno'), ['F100'])
+
+        Producto.objects.filter(codigo='F200').update(nombre='Tuerca de seguridad')
+        self.assertEqual(self.codigos('seguridad'), ['F200'])
+        self.assertEqual(self.codigos('tornillo', solo_activos=False), ['F500'])
+
+        Producto.objects.bulk_create([self.producto('F600', 'Clavo galvanizado')])
+        self.assertEqual(self.codigos('galvanizado'), ['F600'])
+
+        arandela = Producto.objects.get(codigo='F300')
+        arandela.nombre = 'Empaque de caucho'
+        Producto.objects.bulk_update([arandela], ['nombre'])
+        self.assertEqual(self.codigos('caucho'), ['F300'])
+
+        Producto.objects.filter(codigo='F400').delete()
+        self.assertEqual(self.codigos('molido'), [])
+
+        # Borrado en cascada: el trigger quita las filas del índice
+        self.categoria.delete()
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {busqueda.TABLA_FTS}')
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_reindexar_despues_de_sql_directo(self):
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE inventario_producto SET nombre = 'Taladro' WHERE codigo = 'F400'")
+        self.assertEqual(self.codigos('taladro'), [])
+
+        salida = io.StringIO()
+        call_command('reindexar_productos', stdout=salida)
+        self.assertIn('7 productos indexados', salida.getvalue())
+        self.assertEqual(self.codigos('taladro'), ['F400'])
+
+
+class EscaneoAlertasIncrementalTests(TestCase):
+    """El escaneo incremental parte del último escaneo completado, no de una ventana fija"""
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre='General')
+        subcategoria = Subcategoria.objects.create(nombre='Varios', categoria=categoria)
+        bodega = Bodega.objects.create(nombre='Principal', direccion='Calle 1', es_principal=True)
+        productos = Producto.objects.bulk_create([
+            Producto(codigo=f'P{i:03}', nombre=f'Producto {i}', categoria=categoria,
+                     subcategoria=subcategoria, stock_minimo=5)
+            for i in range(10)
+        ])
+        Stock.objects.bulk_create([Stock(producto=producto, bodega=bodega, cantidad=20) for producto in productos])
+        Stock.sincronizar_existencias()
+
+    def envejecer(self, antes_de):
+        hace_una_hora = antes_de - timedelta(hours=1)
+        Stock.objects.update(fecha_actualizacion=hace_una_hora)
+        Producto.objects.update(fecha_modificacion=hace_una_hora)
+
+    def tocar(self, producto):
+        Stock.objects.filter(producto=producto).update(fecha_actualizacion=timezone.now())
+
+    def test_sin_escaneo_previo_evalua_todo(self):
+        resumen = alertas_stock.escanear_desde_ultimo()
+        self.assertIsNone(resumen['desde'])
+        self.assertEqual(resumen['evaluados'], 10)
+        self.assertEqual(alertas_stock.ultimo_escaneo(), resumen['inicio'])
+
+    def test_incremental_parte_del_ultimo_escaneo(self):
+        completo = alertas_stock.escanear_alertas_stock()
+        self.envejecer(completo['inicio'])
+        self.tocar(Producto.objects.get(codigo='P003'))
+
+        resumen = alertas_stock.escanear_desde_ultimo()
+        self.assertEqual(resumen['desde'], completo['inicio'] - alertas_stock.MARGEN_ESCANEO)
+        self.assertEqual(resumen['evaluados'], 1)
+        self.assertEqual(alertas_stock.ultimo_escaneo(), resumen['inicio'])
+
+    def test_incremental_detecta_stock_eliminado(self):
+        completo = alertas_stock.escanear_alertas_stock()
+        self.envejecer(completo['inicio'])
+        # Sincronizar sin cambios no marca los productos como modificados
+        Stock.sincronizar_existencias()
+        Stock.objects.get(producto__codigo='P003').delete()
+
+        resumen = alertas_stock.escanear_desde_ultimo()
+        self.assertEqual(resumen['evaluados'], 1)
+        self.assertEqual(resumen['creadas'], 1)
+        self.assertTrue(AlertaStock.objects.filter(producto__codigo='P003', activa=True).exists())
+
+    def test_escaneo_fallido_no_avanza_la_marca(self):
+        completo = alertas_stock.escanear_alertas_stock()
+        self.envejecer(completo['inicio'])
+        self.tocar(Producto.objects.get(codigo='P003'))
+
+        with mock.patch.object(alertas_stock, '_procesar_lote', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                alertas_stock.escanear_desde_ultimo()
+        self.assertEqual(alertas_stock.ultimo_escaneo(), completo['inicio'])
+
+        # El siguiente escaneo incluye lo que el fallido no alcanzó a evaluar
+        self.tocar(Producto.objects.get(codigo='P007'))
+        self.assertEqual(alertas_stock.escanear_desde_ultimo()['evaluados'], 2)
+
+
+class GenerarRecomendacionesAjaxTests(TestCase):
+    """El endpoint de recomendaciones responde en todos sus modos"""
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre='General')
+        subcategoria = Subcategoria.objects.create(nombre='Varios', categoria=categoria)
+        bodega = Bodega.objects.create(nombre='Principal', direccion='Calle 1', es_principal=True)
+        productos = Producto.objects.bulk_create([
+            Producto(codigo=f'P{i:03}', nombre=f'Producto {i}', categoria=categoria,
+                     subcategoria=subcategoria, stock_minimo=10)
+            for i in range(4)
+        ])
+        # Dos bajo el mínimo y dos por encima
+        Stock.objects.bulk_create([
+            Stock(producto=producto, bodega=bodega, cantidad=5 if i < 2 else 50)
+            for i, producto in enumerate(productos)
+        ])
+        Stock.sincronizar_existencias()
+        cls.producto = productos[0]
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def generar(self, **datos):
+        return self.client.post(reverse('inventario:generar_recomendaciones_ajax'), datos)
+
+    def test_modos(self):
+        for datos, analizados in [
+            ({'modo': 'todos'}, 4),
+            ({'modo': 'criticos'}, 2),
+            ({'modo': 'especifico', 'producto_id': self.producto.pk}, 1),
+        ]:
+            with self.subTest(modo=datos['modo']):
+                respuesta = self.generar(**datos)
+                self.assertEqual(respuesta.status_code, 200, respuesta.content)
+                self.assertTrue(respuesta.json()['success'])
+                self.assertEqual(respuesta.json()['productos_analizados'], analizados)
 
-# Create your tests here.
+    def test_producto_inexistente(self):
+        self.assertEqual(self.generar(modo='especifico', producto_id=0).status_code, 404)
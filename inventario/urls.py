@@ -18,17 +18,18 @@ from .stock_views import (
 )
 from .movimientos_views import (
     MovimientoInventarioListView, MovimientoInventarioDetailView,
-    generar_pdf_transferencia, ajuste_inventario, generar_pdf_ajuste
+    generar_pdf_transferencia, ajuste_inventario, generar_pdf_ajuste,
+    importar_conteo_inventario, exportar_movimientos
     # transferencia_producto - No existe en movimientos_views
 )
 from .reportes_views import (
     DashboardRecomendacionesView, generar_recomendaciones_ajax
 )
 from .api_views import (
-    subcategorias_api, stock_api, obtener_presentaciones_proveedor
+    subcategorias_api, stock_api, obtener_presentaciones_proveedor, historial_movimientos_api
 )
 from .general_views import (
-    exportar_productos_excel, InventarioHomeView, InventarioMenuView
+    exportar_stock_excel, InventarioHomeView, InventarioMenuView
 )
 
 # Importaciones para vistas que no fueron refactorizadas aún
@@ -77,15 +78,18 @@ urlpatterns = [
     # Stock
     path('stock/', StockListView.as_view(), name='stock_list'),
     path('stock/<int:pk>/', StockDetailView.as_view(), name='stock_detail'),
+    path('stock/exportar-excel/', exportar_stock_excel, name='exportar_stock_excel'),
     path('alertas-stock/', views.AlertasStockView.as_view(), name='alertas_stock'),
     
     # Movimientos
     path('movimientos/', MovimientoInventarioListView.as_view(), name='movimiento_list'),
     path('movimientos/<uuid:movimiento_id>/', MovimientoInventarioDetailView.as_view(), name='movimiento_detail'),
+    path('movimientos/exportar/', exportar_movimientos, name='exportar_movimientos'),
     
     # Ajustes de inventario
     path('ajustes/', views.AjusteInventarioView.as_view(), name='ajuste_inventario'),
     path('ajustes/crear/', views.crear_ajuste_inventario, name='crear_ajuste_inventario'),
+    path('ajustes/importar/', importar_conteo_inventario, name='importar_conteo'),
     path('ajustes/<uuid:movimiento_id>/pdf/', generar_pdf_ajuste, name='ajuste_pdf'),
     
     # Transferencias
@@ -126,6 +130,7 @@ urlpatterns = [
     path('api/generar-recomendaciones/', generar_recomendaciones_ajax, name='generar_recomendaciones_ajax'),
     path('api/subcategorias/', subcategorias_api, name='subcategorias_api'),
     path('api/stock/', stock_api, name='stock_api'),
+    path('api/movimientos/historial/', historial_movimientos_api, name='historial_movimientos_api'),
     path('api/presentaciones-proveedor/<int:proveedor_id>/<int:producto_id>/', obtener_presentaciones_proveedor, name='presentaciones_proveedor_api'),
     
     # Vistas simples (sin templates complejos)
@@ -96,10 +96,26 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Base de pruebas en archivo: la de memoria compartida no admite escritores
+        # concurrentes ("database table is locked") y las pruebas de concurrencia los usan
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
 
+# Cache
+# Con varios workers de gunicorn la caché debe ser compartida (Redis): con la
+# LocMemCache por defecto cada proceso tiene la suya y una invalidación solo
+# llega al worker que la hizo. Ver ventas.metricas.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -142,6 +158,12 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Caché en disco de PDF de documentos finalizados (facturas)
+PDF_CACHE_DIR = MEDIA_ROOT / 'pdf_cache'
+
+# Segundos durante los que una exportación idéntica reutiliza el archivo ya generado
+EXPORTACION_TTL = 30 * 60
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Cliente, Cotizacion, Pedido, Factura, Entrega, ItemRechazado
+from .models import Cliente, Cotizacion, Pedido, Factura, Entrega, ItemRechazado, PosicionRepartidor, SecuenciaDocumento, TrabajoExportacion
 
 @admin.register(Cliente)
 class ClienteAdmin(admin.ModelAdmin):
@@ -46,3 +46,23 @@ class ItemRechazadoAdmin(admin.ModelAdmin):
     def valor_rechazado(self, obj):
         return f"${obj.valor_rechazado:,.2f}"
     valor_rechazado.short_description = "Valor Rechazado"
+
+@admin.register(PosicionRepartidor)
+class PosicionRepartidorAdmin(admin.ModelAdmin):
+    list_display = ['repartidor', 'registrada', 'latitud', 'longitud']
+    list_filter = ['repartidor']
+    date_hierarchy = 'registrada'
+    list_select_related = ['repartidor']
+
+@admin.register(SecuenciaDocumento)
+class SecuenciaDocumentoAdmin(admin.ModelAdmin):
+    list_display = ['tipo', 'periodo', 'ultimo_valor']
+    list_filter = ['tipo']
+    ordering = ['tipo', '-periodo']
+
+@admin.register(TrabajoExportacion)
+class TrabajoExportacionAdmin(admin.ModelAdmin):
+    list_display = ['tipo', 'formato', 'usuario', 'estado', 'filas_procesadas', 'total_filas', 'fecha_creacion', 'fecha_fin']
+    list_filter = ['estado', 'tipo', 'formato']
+    search_fields = ['usuario__username', 'nombre_archivo']
+    readonly_fields = ['huella', 'fecha_creacion', 'fecha_inicio', 'fecha_fin']
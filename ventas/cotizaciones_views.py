@@ -107,10 +107,6 @@ class CotizacionCreateView(VentasRequiredMixin, CreateView):
             items_formset.instance = cotizacion
             items_formset.save()
             
-            # Calcular totales
-            cotizacion.calcular_totales()
-            cotizacion.save()
-            
             messages.success(self.request, f'Cotización {cotizacion.numero} creada exitosamente.')
             return redirect('ventas:cotizacion_detail', pk=cotizacion.pk)
         else:
@@ -156,10 +152,7 @@ class CotizacionUpdateView(VentasRequiredMixin, UpdateView):
         if form.is_valid():
             cotizacion = form.save()
             # items_formset.save()
-            
-            # Recalcular totales
-            cotizacion.calcular_totales()
-            cotizacion.save()
+            # El total lo mantienen las líneas al guardarse
             
             messages.success(self.request, f'Cotización {cotizacion.numero} actualizada exitosamente.')
             return redirect('ventas:cotizacion_detail', pk=cotizacion.pk)
@@ -276,7 +269,6 @@ def convertir_cotizacion_pedido(request, pk):
     pedido = Pedido.objects.create(
         numero=numero_formateado,
         cliente=cotizacion.cliente,
-        total=cotizacion.total,
         estado='pendiente'
     )
     
@@ -0,0 +1,313 @@
+"""
+Despacho del día: reparte las entregas pendientes entre los repartidores disponibles
+
+1. Agrupación. Cada repartidor es una semilla: su GPS o, si no tiene, el
+   centro de un sector angular de las paradas alrededor de la bodega. Las
+   paradas se asignan por arrepentimiento: primero las que más pierden si
+   no quedan con su repartidor más cercano. Se respeta el radio de cobertura
+   y un cupo parejo (la carga promedio más ``HOLGURA_BALANCE``, sin pasar de
+   ``capacidad``). Los centros se recalculan ``ITERACIONES_AGRUPACION`` veces.
+2. Rutas. Cada grupo se ordena desde la bodega con ``optimizador_rutas``.
+3. Jornada. Si una ruta pasa de ``jornada_horas``, se le quita la parada
+   cuyo retiro más ahorra (criterio de ahorros). Esa parada se inserta donde
+   menos cueste en otra ruta con holgura; si no cabe en ninguna, queda sin
+   asignar.
+
+Las distancias se calculan con matrices NumPy: 1.000 paradas y 30
+repartidores se planifican en pocos segundos. ``despachar_dia`` carga los
+datos y guarda repartidor y orden con un ``bulk_update``, que también
+libera las entregas de un despacho anterior que esta vez quedaron sin ruta.
+"""
+
+import math
+
+import numpy as np
+from django.db import transaction
+
+from accounts.geoespacial import distancias_entre, distancias_pares, haversine_km
+from .optimizador_rutas import optimizar_recorrido
+
+VELOCIDAD_PROMEDIO_KMH = 30
+MINUTOS_POR_ENTREGA = 10
+CAPACIDAD_POR_DEFECTO = 40
+JORNADA_HORAS_POR_DEFECTO = 8
+HOLGURA_BALANCE = 1.2
+ITERACIONES_AGRUPACION = 4
+TIEMPO_LIMITE_RUTA = 0.1
+ESTADOS_PLANIFICABLES = ('pendiente', 'programada', 'asignada')
+
+MOTIVOS_SIN_ASIGNAR = {
+    'sin_gps': 'Cliente sin coordenadas',
+    'sin_repartidores': 'No hay repartidores disponibles',
+    'fuera_de_cobertura': 'Fuera del radio de cobertura de todos los repartidores',
+    'sin_capacidad': 'Los repartidores que la cubren ya están llenos',
+    'jornada': 'No cabe en la jornada de ningún repartidor',
+}
+
+
+def duracion_horas(distancia_km, paradas):
+    """Horas de una ruta: viaje a velocidad promedio más el tiempo en cada entrega"""
+    return distancia_km / VELOCIDAD_PROMEDIO_KMH + paradas * MINUTOS_POR_ENTREGA / 60
+
+
+def _asignar(costo, cupos, asignacion):
+    """
+    Completa ``asignacion`` (índice de repartidor por parada, -1 libre) por
+    arrepentimiento. ``costo`` es paradas×repartidores con inf donde no hay
+    cobertura; ``cupos`` es cuántas paradas más puede recibir cada uno.
+    """
+    libres = np.flatnonzero(asignacion < 0)
+    if not len(libres):
+        return asignacion
+    costo = costo[libres]
+    if costo.shape[1] > 1:
+        dos_mejores = np.partition(costo, 1, axis=1)[:, :2]
+        with np.errstate(invalid='ignore'):
+            arrepentimiento = dos_mejores[:, 1] - dos_mejores[:, 0]
+    else:
+        arrepentimiento = np.zeros(len(libres))
+    # Con una sola opción el arrepentimiento es infinito (va primero); sin opciones, nan (va al final)
+    arrepentimiento = np.nan_to_num(arrepentimiento, nan=-1.0, posinf=np.finfo(float).max)
+
+    cupos = cupos.copy()
+    for fila in np.argsort(-arrepentimiento, kind='stable'):
+        for repartidor in np.argsort(costo[fila]):
+            if not np.isfinite(costo[fila, repartidor]):
+                break
+            if cupos[repartidor] > 0:
+                asignacion[libres[fila]] = repartidor
+                cupos[repartidor] -= 1
+                break
+    return asignacion
+
+
+def _tramos(deposito, lats, lngs, regresar):
+    """Extremos (lat, lng) de cada arista de la ruta: de la bodega a la primera parada, ..., y el regreso"""
+    nodos_lats = np.concatenate(([deposito[0]], lats, [deposito[0]] if regresar else []))
+    nodos_lngs = np.concatenate(([deposito[1]], lngs, [deposito[1]] if regresar else []))
+    return nodos_lats[:-1], nodos_lngs[:-1], nodos_lats[1:], nodos_lngs[1:]
+
+
+def _mejor_insercion(deposito, lats, lngs, lat, lng, regresar):
+    """(posición, km extra) más barata para insertar el punto en la ruta"""
+    a_lat, a_lng, b_lat, b_lng = _tramos(deposito, lats, lngs, regresar)
+    costo = (
+        haversine_km(lat, lng, a_lat, a_lng) + haversine_km(lat, lng, b_lat, b_lng)
+        - distancias_pares(a_lat, a_lng, b_lat, b_lng)
+    )
+    if not regresar:
+        # En una ruta abierta también se puede agregar al final
+        ultimo = (lats[-1], lngs[-1]) if len(lats) else deposito
+        costo = np.append(costo, haversine_km(lat, lng, [ultimo[0]], [ultimo[1]])[0])
+    posicion = int(np.argmin(costo))
+    return posicion, float(costo[posicion])
+
+
+def _ahorro_por_retiro(deposito, lats, lngs, regresar):
+    """Km que se ahorran al quitar cada parada de la ruta"""
+    nodos_lats = np.concatenate(([deposito[0]], lats, [deposito[0]] if regresar else []))
+    nodos_lngs = np.concatenate(([deposito[1]], lngs, [deposito[1]] if regresar else []))
+    n = len(lats)
+    entrada = distancias_pares(nodos_lats[:n], nodos_lngs[:n], lats, lngs)
+    if regresar:
+        salida = distancias_pares(lats, lngs, nodos_lats[2:n + 2], nodos_lngs[2:n + 2])
+        atajo = distancias_pares(nodos_lats[:n], nodos_lngs[:n], nodos_lats[2:n + 2], nodos_lngs[2:n + 2])
+        return entrada + salida - atajo
+    salida = np.append(distancias_pares(lats[:-1], lngs[:-1], lats[1:], lngs[1:]), 0.0)
+    atajo = np.append(distancias_pares(nodos_lats[:n - 1], nodos_lngs[:n - 1], lats[1:], lngs[1:]), 0.0)
+    return entrada + salida - atajo
+
+
+def planificar(paradas, repartidores, deposito, capacidad=CAPACIDAD_POR_DEFECTO,
+               jornada_horas=JORNADA_HORAS_POR_DEFECTO, regresar=False):
+    """
+    Reparte ``paradas`` (dicts con ``id``, ``lat``, ``lng``) entre
+    ``repartidores`` (dicts con ``id``, ``lat``, ``lng`` —None sin GPS— y
+    ``radio_km``) saliendo de ``deposito`` (lat, lng de la bodega).
+
+    Retorna un dict con ``rutas`` (por repartidor: ``repartidor_id``,
+    ``paradas`` en orden de visita, ``distancia_km`` y ``duracion_horas``),
+    ``sin_asignar`` (``id`` y ``motivo``) y ``resumen``.
+    """
+    sin_asignar = [
+        {'id': parada['id'], 'motivo': 'sin_gps'}
+        for parada in paradas if parada.get('lat') is None or parada.get('lng') is None
+    ]
+    con_gps = [parada for parada in paradas if parada.get('lat') is not None and parada.get('lng') is not None]
+    if not repartidores:
+        sin_asignar += [{'id': parada['id'], 'motivo': 'sin_repartidores'} for parada in con_gps]
+        con_gps = []
+
+    n, k = len(con_gps), len(repartidores)
+    lats = np.array([float(parada['lat']) for parada in con_gps], dtype=float)
+    lngs = np.array([float(parada['lng']) for parada in con_gps], dtype=float)
+    rutas = {}
+    if n:
+        base_lats = np.array([np.nan if r.get('lat') is None else float(r['lat']) for r in repartidores])
+        base_lngs = np.array([np.nan if r.get('lng') is None else float(r['lng']) for r in repartidores])
+        radios = np.array([float(r['radio_km']) if r.get('radio_km') else np.inf for r in repartidores])
+        tiene_gps = ~np.isnan(base_lats)
+
+        # Cobertura: el radio se mide desde el GPS del repartidor; sin GPS cubre todo
+        cobertura = np.ones((n, k), dtype=bool)
+        if tiene_gps.any():
+            desde_base = distancias_entre(lats, lngs, base_lats[tiene_gps], base_lngs[tiene_gps])
+            cobertura[:, tiene_gps] = desde_base <= radios[tiene_gps]
+
+        # Semillas: GPS del repartidor o centro de un sector angular alrededor de la bodega
+        centros_lats, centros_lngs = base_lats.copy(), base_lngs.copy()
+        sin_gps = np.flatnonzero(~tiene_gps)
+        if len(sin_gps):
+            angulos = np.arctan2(lats - deposito[0], (lngs - deposito[1]) * math.cos(math.radians(deposito[0])))
+            for repartidor, sector in zip(sin_gps, np.array_split(np.argsort(angulos), len(sin_gps))):
+                centros_lats[repartidor] = lats[sector].mean() if len(sector) else deposito[0]
+                centros_lngs[repartidor] = lngs[sector].mean() if len(sector) else deposito[1]
+
+        cupo_parejo = min(capacidad, max(1, math.ceil(n / k * HOLGURA_BALANCE)))
+        for _ in range(ITERACIONES_AGRUPACION):
+            costo = np.where(cobertura, distancias_entre(lats, lngs, centros_lats, centros_lngs), np.inf)
+            asignacion = _asignar(costo, np.full(k, cupo_parejo), np.full(n, -1))
+            for repartidor in range(k):
+                grupo = asignacion == repartidor
+                if grupo.any():
+                    centros_lats[repartidor], centros_lngs[repartidor] = lats[grupo].mean(), lngs[grupo].mean()
+
+        # Las que no entraron con el cupo parejo (cobertura desigual) usan la capacidad completa
+        carga = np.bincount(asignacion[asignacion >= 0], minlength=k)
+        asignacion = _asignar(costo, capacidad - carga, asignacion)
+        for fila in np.flatnonzero(asignacion < 0):
+            motivo = 'sin_capacidad' if cobertura[fila].any() else 'fuera_de_cobertura'
+            sin_asignar.append({'id': con_gps[fila]['id'], 'motivo': motivo})
+
+        for repartidor in range(k):
+            grupo = np.flatnonzero(asignacion == repartidor)
+            rutas[repartidor] = {'filas': [], 'distancia': 0.0}
+            if not len(grupo):
+                continue
+            resultado = optimizar_recorrido(
+                deposito, list(zip(lats[grupo], lngs[grupo])),
+                destino=deposito if regresar else None, tiempo_limite=TIEMPO_LIMITE_RUTA,
+            )
+            rutas[repartidor] = {'filas': list(grupo[resultado['orden']]), 'distancia': resultado['distancia_total']}
+
+        _ajustar_jornadas(rutas, lats, lngs, cobertura, deposito, capacidad, jornada_horas, regresar, con_gps, sin_asignar)
+
+    resultado_rutas = []
+    for repartidor, ruta in sorted(rutas.items()):
+        if not ruta['filas']:
+            continue
+        resultado_rutas.append({
+            'repartidor_id': repartidores[repartidor]['id'],
+            'paradas': [con_gps[fila]['id'] for fila in ruta['filas']],
+            'distancia_km': round(ruta['distancia'], 2),
+            'duracion_horas': round(duracion_horas(ruta['distancia'], len(ruta['filas'])), 2),
+        })
+    duraciones = [ruta['duracion_horas'] for ruta in resultado_rutas]
+    return {
+        'rutas': resultado_rutas,
+        'sin_asignar': sin_asignar,
+        'resumen': {
+            'paradas': len(paradas),
+            'asignadas': sum(len(ruta['paradas']) for ruta in resultado_rutas),
+            'sin_asignar': len(sin_asignar),
+            'repartidores_disponibles': k,
+            'repartidores_con_ruta': len(resultado_rutas),
+            'distancia_total_km': round(sum(ruta['distancia_km'] for ruta in resultado_rutas), 2),
+            'duracion_maxima_horas': max(duraciones, default=0),
+            'duracion_minima_horas': min(duraciones, default=0),
+        },
+    }
+
+
+def _ajustar_jornadas(rutas, lats, lngs, cobertura, deposito, capacidad, jornada_horas, regresar, con_gps, sin_asignar):
+    """Saca paradas de las rutas que pasan de la jornada y las reubica en otras rutas con holgura"""
+    for repartidor, ruta in rutas.items():
+        while ruta['filas'] and duracion_horas(ruta['distancia'], len(ruta['filas'])) > jornada_horas:
+            filas = np.array(ruta['filas'])
+            ahorros = _ahorro_por_retiro(deposito, lats[filas], lngs[filas], regresar)
+            posicion = int(np.argmax(ahorros))
+            fila = ruta['filas'].pop(posicion)
+            ruta['distancia'] -= float(ahorros[posicion])
+
+            mejor = None
+            for otro, destino in rutas.items():
+                if otro == repartidor or not cobertura[fila, otro] or len(destino['filas']) >= capacidad:
+                    continue
+                otras = np.array(destino['filas'], dtype=int)
+                insercion, extra = _mejor_insercion(deposito, lats[otras], lngs[otras], lats[fila], lngs[fila], regresar)
+                cabe = duracion_horas(destino['distancia'] + extra, len(otras) + 1) <= jornada_horas
+                if cabe and (mejor is None or extra < mejor[2]):
+                    mejor = (otro, insercion, extra)
+            if mejor is None:
+                sin_asignar.append({'id': con_gps[fila]['id'], 'motivo': 'jornada'})
+            else:
+                otro, insercion, extra = mejor
+                rutas[otro]['filas'].insert(insercion, fila)
+                rutas[otro]['distancia'] += extra
+
+
+def despachar_dia(fecha, capacidad=CAPACIDAD_POR_DEFECTO, jornada_horas=JORNADA_HORAS_POR_DEFECTO,
+                  regresar=False, guardar=True):
+    """
+    Planifica las entregas de ``fecha`` en estado planificable entre los
+    repartidores disponibles y, con ``guardar``, escribe repartidor y
+    ``orden_ruta`` en un solo ``bulk_update`` (las pendientes pasan a
+    asignadas). Las que quedan sin asignar pierden el repartidor y el orden
+    de un despacho anterior (las asignadas vuelven a pendientes) y se marcan
+    con ``desasignada`` en ``sin_asignar``. Retorna el plan de
+    ``planificar``. Lanza ValueError si la bodega principal no tiene
+    coordenadas en su enlace de ubicación.
+    """
+    from accounts.models import User
+    from .models import Entrega
+    from .rutas import coordenadas_bodega_principal
+
+    deposito = coordenadas_bodega_principal()
+    if deposito is None:
+        raise ValueError('La bodega principal no tiene un enlace de ubicación con coordenadas')
+
+    entregas = Entrega.objects.filter(
+        fecha_programada__date=fecha, estado__in=ESTADOS_PLANIFICABLES
+    ).values_list('id', 'pedido__cliente__latitud', 'pedido__cliente__longitud')
+    paradas = [{'id': pk, 'lat': lat, 'lng': lng} for pk, lat, lng in entregas]
+    repartidores = [
+        {'id': pk, 'lat': lat, 'lng': lng, 'radio_km': radio}
+        for pk, lat, lng, radio in User.objects.filter(
+            role='repartidor', activo=True, disponible_entregas=True
+        ).order_by('id').values_list('id', 'latitud', 'longitud', 'radio_cobertura_km')
+    ]
+    plan = planificar(paradas, repartidores, deposito, capacidad, jornada_horas, regresar)
+
+    if guardar:
+        asignaciones = {
+            entrega_id: (ruta['repartidor_id'], orden)
+            for ruta in plan['rutas']
+            for orden, entrega_id in enumerate(ruta['paradas'], start=1)
+        }
+        sin_asignar = {item['id']: item for item in plan['sin_asignar']}
+        with transaction.atomic():
+            # Solo las que siguen planificables (un repartidor pudo haber salido ya con alguna)
+            entregas = Entrega.objects.select_for_update().filter(
+                pk__in=[*asignaciones, *sin_asignar], estado__in=ESTADOS_PLANIFICABLES
+            ).only('id', 'estado', 'repartidor', 'orden_ruta')
+            actualizar = []
+            desasignadas = 0
+            for entrega in entregas:
+                if entrega.pk in asignaciones:
+                    entrega.repartidor_id, entrega.orden_ruta = asignaciones[entrega.pk]
+                    if entrega.estado == 'pendiente':
+                        entrega.estado = 'asignada'
+                elif entrega.repartidor_id is not None or entrega.orden_ruta is not None:
+                    # Asignada en un despacho anterior y ahora sin ruta: no debe quedar en la de su repartidor
+                    entrega.repartidor_id = entrega.orden_ruta = None
+                    if entrega.estado == 'asignada':
+                        entrega.estado = 'pendiente'
+                    sin_asignar[entrega.pk]['desasignada'] = True
+                    desasignadas += 1
+                else:
+                    continue
+                actualizar.append(entrega)
+            Entrega.objects.bulk_update(actualizar, ['repartidor', 'orden_ruta', 'estado'], batch_size=500)
+        plan['resumen']['guardadas'] = len(actualizar) - desasignadas
+        plan['resumen']['desasignadas'] = desasignadas
+    return plan
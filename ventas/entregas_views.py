@@ -288,26 +288,98 @@ def obtener_entregas_repartidor(request):
 
 @login_required
 def actualizar_ubicacion_repartidor(request):
-    """API para actualizar ubicación del repartidor"""
+    """
+    API para reportar la ubicación del repartidor. POST JSON con ``pings``
+    (lista de ``{latitud, longitud, registrada}``, la hora ISO del
+    dispositivo es opcional) o un solo ping con ``latitud``/``longitud``.
+    Los pings se guardan en bloque cada pocos segundos (ventas.seguimiento_gps).
+    """
     if not request.user.can_deliver_orders():
         return JsonResponse({'error': 'Sin permisos'}, status=403)
     
-    if request.method == 'POST':
-        import json
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+    
+    import json
+    from .seguimiento_gps import MAXIMO_POR_LOTE, registrar_pings
+    
+    try:
         data = json.loads(request.body)
-        
-        latitud = data.get('latitud')
-        longitud = data.get('longitud')
-        
-        # Actualizar ubicación en el perfil del usuario o crear un modelo de seguimiento
-        # Por ahora solo devolvemos éxito
-        
-        return JsonResponse({
-            'success': True,
-            'message': 'Ubicación actualizada'
-        })
+    except ValueError:
+        return JsonResponse({'error': 'JSON inválido'}, status=400)
     
-    return JsonResponse({'error': 'Método no permitido'}, status=405)
+    pings = data.get('pings', [data]) if isinstance(data, dict) else None
+    if not isinstance(pings, list):
+        return JsonResponse({'error': 'Se esperaba una lista de pings'}, status=400)
+    if len(pings) > MAXIMO_POR_LOTE:
+        return JsonResponse({'error': f'Máximo {MAXIMO_POR_LOTE} pings por envío'}, status=400)
+    
+    recibidos = registrar_pings(request.user.pk, pings)
+    return JsonResponse({
+        'success': True,
+        'recibidos': recibidos,
+        'descartados': len(pings) - recibidos,
+    })
+
+
+@login_required
+def recorrido_entrega_api(request, pk):
+    """API con el recorrido GPS del repartidor durante una entrega (para reproducirlo en un mapa)"""
+    entrega = get_object_or_404(Entrega, pk=pk)
+    if not (request.user.can_create_sales() or entrega.repartidor_id == request.user.pk):
+        return JsonResponse({'error': 'Sin permisos'}, status=403)
+    
+    from .seguimiento_gps import recorrido_entrega
+    
+    return JsonResponse({
+        'entrega': entrega.numero,
+        'repartidor_id': entrega.repartidor_id,
+        'estado': entrega.estado,
+        **recorrido_entrega(entrega),
+    })
+
+
+@login_required
+def despachar_entregas_api(request):
+    """
+    API para repartir las entregas de un día entre los repartidores disponibles
+    (ventas.despacho). POST JSON: ``fecha`` (YYYY-MM-DD, default hoy),
+    ``capacidad``, ``jornada_horas``, ``regresar`` y ``simular`` (no guarda).
+    """
+    if not request.user.can_manage_users():
+        return JsonResponse({'error': 'Sin permisos'}, status=403)
+    
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+    
+    import json
+    from .despacho import (
+        CAPACIDAD_POR_DEFECTO, JORNADA_HORAS_POR_DEFECTO, MOTIVOS_SIN_ASIGNAR, despachar_dia
+    )
+    
+    try:
+        data = json.loads(request.body or '{}')
+        fecha = datetime.date.fromisoformat(data['fecha']) if data.get('fecha') else timezone.localdate()
+        capacidad = int(data.get('capacidad') or CAPACIDAD_POR_DEFECTO)
+        jornada_horas = float(data.get('jornada_horas') or JORNADA_HORAS_POR_DEFECTO)
+    except (ValueError, TypeError) as e:
+        return JsonResponse({'error': f'Datos inválidos: {str(e)}'}, status=400)
+    
+    if capacidad < 1 or jornada_horas <= 0:
+        return JsonResponse({'error': 'La capacidad y la jornada deben ser positivas'}, status=400)
+    
+    try:
+        plan = despachar_dia(
+            fecha, capacidad=capacidad, jornada_horas=jornada_horas,
+            regresar=bool(data.get('regresar')), guardar=not data.get('simular')
+        )
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    for item in plan['sin_asignar']:
+        item['motivo_display'] = MOTIVOS_SIN_ASIGNAR[item['motivo']]
+    
+    return JsonResponse({'success': True, 'fecha': fecha.isoformat(), **plan})
 
 
 # ============= REPORTES DE ENTREGAS =============
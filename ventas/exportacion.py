@@ -0,0 +1,369 @@
+"""
+Exportación en streaming a CSV y Excel
+
+Las filas se leen con ``values_list(...).iterator(chunk_size=...)`` y se
+envían al cliente en un ``StreamingHttpResponse`` a medida que se generan,
+así que la memoria del worker no depende del tamaño de la exportación y la
+descarga empieza de inmediato.
+
+El XLSX se escribe directamente como un zip en streaming (el modo
+write-only de openpyxl sigue armando el archivo completo en ``save()``):
+una hoja con strings en línea, encabezado con estilo, formato de moneda,
+fechas como número de serie con formato de fecha y anchos de columna fijos.
+
+Cada exportación se describe con ``definicion_exportacion`` (queryset,
+campos, conversión de filas y opciones de formato); la misma definición se
+usa para responder en streaming y para escribir el archivo de un
+``TrabajoExportacion`` en segundo plano (ver ``trabajos_exportacion``).
+"""
+
+import csv
+from datetime import date, datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+import zipfile
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+TAMANO_LOTE = 2000
+TAMANO_ENVIO = 64 * 1024
+
+EXTENSIONES = {'excel': 'xlsx', 'csv': 'csv', 'pdf': 'pdf', 'zip': 'zip'}
+TIPO_CSV = 'text/csv'
+TIPO_EXCEL = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+FORMATO_MONEDA = '_-$* #,##0.00_-;-$* #,##0.00_-;_-$* "-"??_-;_-@_-'
+FORMATO_FECHA_HORA = 'yyyy-mm-dd hh:mm'
+FORMATO_FECHA = 'yyyy-mm-dd'
+
+
+def nombre_con_fecha(prefijo, extension):
+    """``<prefijo>_AAAAMMDD_HHMMSS.<extension>``"""
+    return f"{prefijo}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+
+
+def nombre_persona(nombre, apellido, por_defecto='Sin asignar'):
+    """Equivalente a ``get_full_name()`` sobre columnas de ``values_list``"""
+    if nombre is None and apellido is None:
+        return por_defecto
+    return f'{nombre or ""} {apellido or ""}'.strip()
+
+
+def definicion_exportacion(nombre, encabezados, queryset, campos, convertir=None, **opciones):
+    """
+    Describe una exportación para escribirla en streaming o en segundo plano.
+    ``opciones``: ``pie`` (filas finales), ``con_fecha`` (sufijo de fecha en el
+    nombre, por defecto True), ``hoja``, ``anchos`` y ``columnas_moneda``.
+    Con ``escribir(definicion, formato, archivo, al_avanzar)`` el archivo no
+    es una tabla (p. ej. los PDF de facturas) y lo genera esa función.
+    """
+    return {
+        'nombre': nombre,
+        'encabezados': encabezados,
+        'queryset': queryset,
+        'campos': campos,
+        'convertir': convertir,
+        **opciones,
+    }
+
+
+def nombre_archivo_exportacion(definicion, formato):
+    extension = EXTENSIONES[formato]
+    if definicion.get('con_fecha', True):
+        return nombre_con_fecha(definicion['nombre'], extension)
+    return f"{definicion['nombre']}.{extension}"
+
+
+def filas_definicion(definicion, al_avanzar=None, cada=TAMANO_LOTE):
+    """
+    Filas del queryset seguidas de las filas de pie. ``al_avanzar(filas)`` se
+    llama cada ``cada`` filas del queryset y al terminarlas.
+    """
+    escritas = 0
+    for fila in filas_queryset(definicion['queryset'], definicion['campos'], definicion['convertir']):
+        yield fila
+        escritas += 1
+        if al_avanzar and escritas % cada == 0:
+            al_avanzar(escritas)
+    if al_avanzar:
+        al_avanzar(escritas)
+    yield from definicion.get('pie', ())
+
+
+def filas_queryset(queryset, campos, convertir=None, tamano_lote=TAMANO_LOTE):
+    """
+    Itera ``queryset.values_list(*campos)`` por lotes sin cachear resultados.
+    ``convertir`` recibe la tupla de la base de datos y retorna la fila a escribir.
+    """
+    for fila in queryset.values_list(*campos).iterator(chunk_size=tamano_lote):
+        yield convertir(fila) if convertir else fila
+
+
+# ============= CSV =============
+
+class _Eco:
+    """Objeto tipo archivo que retorna lo escrito en vez de guardarlo"""
+
+    def write(self, valor):
+        return valor
+
+
+def _generar_csv(encabezados, filas):
+    escritor = csv.writer(_Eco())
+    yield escritor.writerow(encabezados)
+    pendiente = []
+    tamano = 0
+    for fila in filas:
+        linea = escritor.writerow(fila)
+        pendiente.append(linea)
+        tamano += len(linea)
+        if tamano >= TAMANO_ENVIO:
+            yield ''.join(pendiente)
+            pendiente, tamano = [], 0
+    if pendiente:
+        yield ''.join(pendiente)
+
+
+def respuesta_csv(nombre_archivo, encabezados, filas):
+    """StreamingHttpResponse con el CSV de ``filas`` (cualquier iterable)"""
+    response = StreamingHttpResponse(_generar_csv(encabezados, filas), content_type=TIPO_CSV)
+    response['Content-Disposition'] = f'attachment; filename="{nombre_archivo}"'
+    return response
+
+
+# ============= EXCEL =============
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+
+_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/>'
+    '</Relationships>'
+)
+
+# Estilos: 0 normal, 1 encabezado (negrita blanca sobre azul, centrado), 2 moneda, 3 fecha y hora, 4 fecha
+ESTILO_FECHA_HORA = 3
+ESTILO_FECHA = 4
+_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<numFmts count="3"><numFmt numFmtId="164" formatCode="'
+    + escape(FORMATO_MONEDA, {'"': '&quot;'}) + '"/>'
+    f'<numFmt numFmtId="165" formatCode="{FORMATO_FECHA_HORA}"/>'
+    f'<numFmt numFmtId="166" formatCode="{FORMATO_FECHA}"/></numFmts>'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><color rgb="FFFFFFFF"/><name val="Calibri"/></font></fonts>'
+    '<fills count="3"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill>'
+    '<fill><patternFill patternType="solid"><fgColor rgb="FF366092"/><bgColor rgb="FF366092"/></patternFill></fill>'
+    '</fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="5">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="2" borderId="0" xfId="0" applyFont="1" applyFill="1" applyAlignment="1">'
+    '<alignment horizontal="center" vertical="center"/></xf>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="166" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '</cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+
+def _workbook(hoja):
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name="{escape(hoja[:31])}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    )
+
+
+_EPOCA_EXCEL = datetime(1899, 12, 30)
+
+
+def _letra_columna(indice):
+    """0 → A, 25 → Z, 26 → AA"""
+    letras = ''
+    indice += 1
+    while indice:
+        indice, resto = divmod(indice - 1, 26)
+        letras = chr(65 + resto) + letras
+    return letras
+
+
+def _serie_excel(valor):
+    """Número de serie de Excel (días desde 1899-12-30, sistema 1900) de una fecha u hora local"""
+    if isinstance(valor, datetime):
+        if timezone.is_aware(valor):
+            valor = timezone.localtime(valor).replace(tzinfo=None)
+        diferencia = valor - _EPOCA_EXCEL
+        return diferencia.days + (diferencia.seconds + diferencia.microseconds / 1e6) / 86400
+    return (valor - _EPOCA_EXCEL.date()).days
+
+
+def _celda(referencia, valor, estilo):
+    if valor is None or valor == '':
+        return ''
+    if isinstance(valor, date):
+        estilo = ESTILO_FECHA_HORA if isinstance(valor, datetime) else ESTILO_FECHA
+        return f'<c r="{referencia}" s="{estilo}"><v>{_serie_excel(valor)}</v></c>'
+    atributo = f' r="{referencia}"' + (f' s="{estilo}"' if estilo else '')
+    if isinstance(valor, bool):
+        return f'<c t="b"{atributo}><v>{int(valor)}</v></c>'
+    if isinstance(valor, (int, float, Decimal)):
+        return f'<c{atributo}><v>{valor}</v></c>'
+    # Los caracteres de control (salvo tab y saltos de línea) no son XML válido: Excel no abriría el archivo
+    texto = escape(ILLEGAL_CHARACTERS_RE.sub('', str(valor)))
+    espacio = ' xml:space="preserve"' if texto != texto.strip() else ''
+    return f'<c t="inlineStr"{atributo}><is><t{espacio}>{texto}</t></is></c>'
+
+
+def _fila(numero, valores, columnas, estilos):
+    celdas = ''.join(
+        _celda(f'{columna}{numero}', valor, estilo)
+        for valor, columna, estilo in zip(valores, columnas, estilos)
+    )
+    return f'<row r="{numero}">{celdas}</row>'
+
+
+class _Salida:
+    """Destino no posicionable para ``zipfile``: acumula bytes hasta que se recogen"""
+
+    def __init__(self):
+        self.partes = []
+
+    def write(self, datos):
+        self.partes.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def recoger(self):
+        datos = b''.join(self.partes)
+        self.partes = []
+        return datos
+
+
+def _generar_excel(encabezados, filas, hoja, anchos, columnas_moneda):
+    salida = _Salida()
+    with zipfile.ZipFile(salida, 'w', zipfile.ZIP_DEFLATED) as archivo:
+        archivo.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        archivo.writestr('_rels/.rels', _RELS)
+        archivo.writestr('xl/workbook.xml', _workbook(hoja))
+        archivo.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS)
+        archivo.writestr('xl/styles.xml', _STYLES)
+        yield salida.recoger()
+
+        letras = [_letra_columna(indice) for indice in range(len(encabezados))]
+        estilos = [2 if indice in columnas_moneda else 0 for indice in range(len(encabezados))]
+        columnas = ''.join(
+            f'<col min="{indice}" max="{indice}" width="{ancho}" customWidth="1"/>'
+            for indice, ancho in enumerate(anchos or (), 1)
+        )
+        with archivo.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as hoja_xml:
+            hoja_xml.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                '<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" '
+                'activePane="bottomLeft" state="frozen"/></sheetView></sheetViews>'
+                + (f'<cols>{columnas}</cols>' if columnas else '')
+                + '<sheetData>'
+                + _fila(1, encabezados, letras, [1] * len(encabezados))
+            ).encode())
+            pendiente = []
+            tamano = 0
+            for numero, fila in enumerate(filas, 2):
+                xml = _fila(numero, fila, letras, estilos)
+                pendiente.append(xml)
+                tamano += len(xml)
+                if tamano >= TAMANO_ENVIO:
+                    hoja_xml.write(''.join(pendiente).encode())
+                    pendiente, tamano = [], 0
+                    yield salida.recoger()
+            hoja_xml.write((''.join(pendiente) + '</sheetData></worksheet>').encode())
+    yield salida.recoger()
+
+
+def respuesta_excel(nombre_archivo, encabezados, filas, hoja='Datos', anchos=None, columnas_moneda=()):
+    """
+    StreamingHttpResponse con un XLSX de una hoja. ``anchos`` es la lista de
+    anchos por columna y ``columnas_moneda`` los índices (desde 0) que llevan
+    formato de moneda.
+    """
+    response = StreamingHttpResponse(
+        _generar_excel(encabezados, filas, hoja, anchos, set(columnas_moneda)),
+        content_type=TIPO_EXCEL,
+    )
+    response['Content-Disposition'] = f'attachment; filename="{nombre_archivo}"'
+    return response
+
+
+# ============= DEFINICIONES =============
+
+def _opciones_excel(definicion):
+    return {
+        'hoja': definicion.get('hoja', 'Datos'),
+        'anchos': definicion.get('anchos'),
+        'columnas_moneda': definicion.get('columnas_moneda', ()),
+    }
+
+
+def respuesta_exportacion(definicion, formato):
+    """StreamingHttpResponse de una definición en ``formato`` ('excel' o 'csv')"""
+    nombre = nombre_archivo_exportacion(definicion, formato)
+    filas = filas_definicion(definicion)
+    if formato == 'csv':
+        return respuesta_csv(nombre, definicion['encabezados'], filas)
+    return respuesta_excel(nombre, definicion['encabezados'], filas, **_opciones_excel(definicion))
+
+
+def escribir_exportacion(definicion, formato, archivo, al_avanzar=None, cada=TAMANO_LOTE):
+    """Escribe la exportación en ``archivo`` (binario), reportando el avance con ``al_avanzar``"""
+    if definicion.get('escribir'):
+        definicion['escribir'](definicion, formato, archivo, al_avanzar)
+        return
+    filas = filas_definicion(definicion, al_avanzar, cada)
+    if formato == 'csv':
+        for parte in _generar_csv(definicion['encabezados'], filas):
+            archivo.write(parte.encode())
+    else:
+        opciones = _opciones_excel(definicion)
+        partes = _generar_excel(
+            definicion['encabezados'], filas, opciones['hoja'], opciones['anchos'], set(opciones['columnas_moneda'])
+        )
+        for parte in partes:
+            archivo.write(parte)
@@ -0,0 +1,43 @@
+# ventas/exportaciones_views.py
+"""
+Vistas de exportaciones en segundo plano
+Las exportaciones se solicitan desde cada vista de exportación con
+``?segundo_plano=1``; aquí se consulta su avance y se descarga el archivo.
+"""
+import os
+
+from django.contrib.auth.decorators import login_required
+from django.http import FileResponse, Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+
+from .models import TrabajoExportacion
+from .trabajos_exportacion import estado_trabajo
+
+
+def _trabajo_del_usuario(request, pk):
+    trabajo = get_object_or_404(TrabajoExportacion, pk=pk)
+    if trabajo.usuario_id != request.user.pk and not request.user.is_superuser:
+        raise Http404("Exportación no encontrada")
+    return trabajo
+
+
+@login_required
+def mis_exportaciones(request):
+    """API: últimas exportaciones del usuario con su estado"""
+    trabajos = TrabajoExportacion.objects.filter(usuario=request.user)[:20]
+    return JsonResponse({'exportaciones': [estado_trabajo(trabajo) for trabajo in trabajos]})
+
+
+@login_required
+def estado_exportacion(request, pk):
+    """API: estado y progreso de una exportación"""
+    return JsonResponse(estado_trabajo(_trabajo_del_usuario(request, pk)))
+
+
+@login_required
+def descargar_exportacion(request, pk):
+    """Descarga el archivo de una exportación completada"""
+    trabajo = _trabajo_del_usuario(request, pk)
+    if trabajo.estado != 'completado' or not trabajo.archivo or not os.path.exists(trabajo.archivo.path):
+        raise Http404("El archivo de la exportación no está disponible")
+    return FileResponse(trabajo.archivo.open('rb'), as_attachment=True, filename=trabajo.nombre_archivo)
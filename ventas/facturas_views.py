@@ -22,10 +22,18 @@ from io import BytesIO
 import datetime
 
 from .models import Factura, ItemFactura, Cliente
+from .paginacion import PaginacionKeysetMixin
+from .exportacion import definicion_exportacion
+from .pdf_facturas import escribir_lote_pdf, escribir_lote_zip, renderizar_lote_pdf, renderizar_lote_zip
+from .trabajos_exportacion import estado_trabajo, parametros_de_consulta, responder_exportacion, solicitar_exportacion
 from inventario.models import Producto
 from .forms import FacturaForm
 # from .forms import FacturaItemFormSet  # No existe
 
+MAXIMO_FACTURAS_LOTE = 2000
+# Lotes de este tamaño o más se imprimen en segundo plano, fuera de la petición
+LOTE_EN_LINEA = 100
+
 
 class VentasRequiredMixin(UserPassesTestMixin):
     """Mixin para verificar permisos de ventas"""
@@ -35,8 +43,8 @@ class VentasRequiredMixin(UserPassesTestMixin):
 
 # ============= VISTAS DE FACTURAS =============
 
-class FacturaListView(VentasRequiredMixin, ListView):
-    """Lista de facturas"""
+class FacturaListView(VentasRequiredMixin, PaginacionKeysetMixin, ListView):
+    """Lista de facturas (paginada por cursor sobre fecha_creacion, id)"""
     model = Factura
     template_name = 'ventas/factura_list.html'
     context_object_name = 'facturas'
@@ -70,16 +78,22 @@ class FacturaListView(VentasRequiredMixin, ListView):
         if fecha_hasta:
             queryset = queryset.filter(fecha_creacion__date__lte=fecha_hasta)
         
-        return queryset.order_by('-fecha_creacion')
+        return queryset.order_by('-fecha_creacion', '-pk')
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['total_facturas'] = Factura.objects.count()
-        context['facturas_pendientes'] = Factura.objects.filter(estado='pendiente').count()
-        context['facturas_pagadas'] = Factura.objects.filter(estado='pagada').count()
-        context['total_por_cobrar'] = Factura.objects.filter(
-            estado='pendiente'
-        ).aggregate(Sum('total'))['total__sum'] or 0
+        
+        # "Cargar más" solo necesita las filas, no las estadísticas
+        if not context['page_obj']['primera']:
+            return context
+        
+        context.update(Factura.objects.aggregate(
+            total_facturas=Count('id'),
+            facturas_pendientes=Count('id', filter=Q(estado='pendiente')),
+            facturas_pagadas=Count('id', filter=Q(estado='pagada')),
+            total_por_cobrar=Sum('total', filter=Q(estado='pendiente')),
+        ))
+        context['total_por_cobrar'] = context['total_por_cobrar'] or 0
         return context
 
 
@@ -371,6 +385,20 @@ def reporte_ventas_periodo(request):
 
 # ============= API FACTURAS =============
 
+@login_required
+def exportar_facturas(request):
+    """
+    Exporta facturas con los filtros del reporte de ventas (fecha_inicio,
+    fecha_fin, cliente, vendedor, estado) en ``formato=excel|csv``. Con
+    ``?segundo_plano=1`` se procesa como trabajo y se responde su estado.
+    """
+    if not request.user.can_create_sales():
+        return HttpResponse('Sin permisos', status=403)
+    
+    formato = 'csv' if request.GET.get('formato') == 'csv' else 'excel'
+    return responder_exportacion(request, 'facturas', formato)
+
+
 @login_required
 def estadisticas_ventas_api(request):
     """API para estadísticas de ventas"""
@@ -402,4 +430,81 @@ def estadisticas_ventas_api(request):
         'ventas_mes': float(ventas_mes),
         'facturas_pendientes': float(facturas_pendientes),
         'ventas_hoy': ventas_hoy
-    })
\ No newline at end of file
+    })
+
+
+def facturas_para_lote(datos):
+    """
+    Ids de las facturas a imprimir según ``ids`` (repetible) o ``fecha``
+    (AAAA-MM-DD, facturas emitidas o pagadas de ese día), en orden de número.
+    Lanza ValueError con el mensaje para el usuario si los parámetros no sirven.
+    """
+    facturas = Factura.objects.order_by('numero')
+    if datos.getlist('ids'):
+        try:
+            ids = [int(factura_id) for factura_id in datos.getlist('ids')]
+        except ValueError:
+            raise ValueError('ids inválidos')
+        facturas = facturas.filter(pk__in=ids)
+    elif datos.get('fecha'):
+        try:
+            fecha = datetime.date.fromisoformat(datos['fecha'])
+        except ValueError:
+            raise ValueError('Fecha inválida, use AAAA-MM-DD')
+        facturas = facturas.filter(fecha_creacion__date=fecha, estado__in=['emitida', 'pagada'])
+    else:
+        raise ValueError('Indique ids o fecha')
+    return list(facturas.values_list('pk', flat=True)[:MAXIMO_FACTURAS_LOTE])
+
+
+def _escribir_lote(definicion, formato, archivo, al_avanzar):
+    escribir = escribir_lote_zip if formato == 'zip' else escribir_lote_pdf
+    escribir(definicion['factura_ids'], archivo, al_avanzar)
+
+
+def definicion_lote_facturas(parametros, usuario, formato):
+    """Impresión por lotes como trabajo de ``trabajos_exportacion`` (formato 'pdf' o 'zip')"""
+    factura_ids = facturas_para_lote(parametros)
+    nombre = f"facturas_{parametros.get('fecha') or timezone.localdate().isoformat()}"
+    return definicion_exportacion(
+        nombre, [], Factura.objects.filter(pk__in=factura_ids), (),
+        con_fecha=False, factura_ids=factura_ids, escribir=_escribir_lote,
+    )
+
+
+@login_required
+def imprimir_facturas_lote(request):
+    """
+    Imprime varias facturas en un solo archivo: ``ids`` (repetible) o
+    ``fecha`` (AAAA-MM-DD, facturas emitidas o pagadas de ese día), con
+    ``formato=pdf`` (un PDF para imprimir, por defecto) o ``formato=zip``
+    (un PDF por factura). Desde ``LOTE_EN_LINEA`` facturas (o con
+    ``segundo_plano=1``) el lote se encola en los trabajos de exportación y se
+    responde su estado en JSON (202), como las exportaciones grandes.
+    """
+    if not request.user.can_create_sales():
+        return HttpResponse('Sin permisos', status=403)
+    
+    datos = request.POST if request.method == 'POST' else request.GET
+    try:
+        factura_ids = facturas_para_lote(datos)
+    except ValueError as e:
+        return HttpResponse(str(e), status=400)
+    if not factura_ids:
+        return HttpResponse('No hay facturas para imprimir', status=404)
+    
+    formato = 'zip' if datos.get('formato') == 'zip' else 'pdf'
+    if len(factura_ids) >= LOTE_EN_LINEA or datos.get('segundo_plano'):
+        trabajo, reutilizado = solicitar_exportacion(
+            request.user, 'facturas_pdf', formato, parametros_de_consulta(datos)
+        )
+        return JsonResponse({**estado_trabajo(trabajo), 'reutilizado': reutilizado}, status=202)
+    
+    nombre = f"facturas_{datos.get('fecha') or timezone.localdate().isoformat()}"
+    if formato == 'zip':
+        response = HttpResponse(renderizar_lote_zip(factura_ids), content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="{nombre}.zip"'
+    else:
+        response = HttpResponse(renderizar_lote_pdf(factura_ids), content_type='application/pdf')
+        response['Content-Disposition'] = f'inline; filename="{nombre}.pdf"'
+    return response
@@ -6,13 +6,16 @@ Dashboard, búsquedas generales y funcionalidades compartidas
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.http import JsonResponse
-from django.db.models import Q, Sum, Count
+from django.http import HttpResponse, JsonResponse
+from django.db.models import Sum, Count
 from django.utils import timezone
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 
 from .models import Cliente, Cotizacion, Pedido, Factura, Entrega
 from inventario.models import Producto
+from inventario.busqueda import buscar_productos
+from .exportacion import definicion_exportacion, nombre_persona
+from .trabajos_exportacion import responder_exportacion
 
 
 class VentasRequiredMixin(UserPassesTestMixin):
@@ -159,22 +162,12 @@ def buscar_productos_api(request):
     if len(term) < 2:
         return JsonResponse({'productos': []})
     
-    # Verificar si Producto está importado
-    try:
-        from inventario.models import Producto
-    except ImportError:
-        return JsonResponse({'error': 'Modelo Producto no disponible'}, status=500)
-    
-    productos = Producto.objects.filter(
-        Q(nombre__icontains=term) |
-        Q(codigo__icontains=term),
-        activo=True
-    )[:10]
+    productos = buscar_productos(term, limite=10, queryset=Producto.objects.select_related('categoria'))
     
     results = []
     for producto in productos:
-        # Obtener stock total de todas las bodegas
-        stock_total = sum(stock.cantidad for stock in producto.stock.all()) if hasattr(producto, 'stock') else 0
+        # Stock total consolidado de todas las bodegas
+        stock_total = producto.existencia_total
         
         results.append({
             'id': producto.id,
@@ -207,49 +200,6 @@ def obtener_precio_producto(request, producto_id):
         return JsonResponse({'error': 'Producto no encontrado'}, status=404)
 
 
-@login_required
-def verificar_stock_disponible(request):
-    """API para verificar stock de múltiples productos"""
-    if not request.user.can_create_sales():
-        return JsonResponse({'error': 'Sin permisos'}, status=403)
-    
-    import json
-    
-    if request.method == 'POST':
-        data = json.loads(request.body)
-        productos_verificar = data.get('productos', [])
-        
-        results = []
-        for item in productos_verificar:
-            producto_id = item.get('producto_id')
-            cantidad_solicitada = item.get('cantidad', 0)
-            
-            try:
-                producto = Producto.objects.get(id=producto_id, activo=True)
-                disponible = producto.stock >= cantidad_solicitada
-                
-                results.append({
-                    'producto_id': producto_id,
-                    'nombre': producto.nombre,
-                    'stock_actual': producto.stock,
-                    'cantidad_solicitada': cantidad_solicitada,
-                    'disponible': disponible,
-                    'faltante': max(0, cantidad_solicitada - producto.stock)
-                })
-            except Producto.DoesNotExist:
-                results.append({
-                    'producto_id': producto_id,
-                    'error': 'Producto no encontrado'
-                })
-        
-        return JsonResponse({
-            'productos': results,
-            'todos_disponibles': all(r.get('disponible', False) for r in results if 'error' not in r)
-        })
-    
-    return JsonResponse({'error': 'Método no permitido'}, status=405)
-
-
 # ============= FUNCIONES DE UTILIDAD =============
 
 def calcular_estadisticas_periodo(fecha_inicio, fecha_fin):
@@ -526,43 +476,11 @@ def reporte_ventas(request):
     if not request.user.can_create_sales():
         return JsonResponse({'error': 'Sin permisos'}, status=403)
     
-    # Obtener parámetros de filtro
-    fecha_inicio = request.GET.get('fecha_inicio')
-    fecha_fin = request.GET.get('fecha_fin')
-    cliente_id = request.GET.get('cliente')
-    vendedor_id = request.GET.get('vendedor')
-    estado = request.GET.get('estado')
     formato = request.GET.get('formato', 'html')
+    if formato in ['excel', 'csv']:
+        return responder_exportacion(request, 'facturas', formato)
     
-    # Construir query base
-    queryset = Factura.objects.all()
-    
-    # Aplicar filtros
-    if fecha_inicio:
-        try:
-            fecha_inicio = datetime.strptime(fecha_inicio, '%Y-%m-%d').date()
-            queryset = queryset.filter(fecha_creacion__date__gte=fecha_inicio)
-        except ValueError:
-            pass
-    
-    if fecha_fin:
-        try:
-            fecha_fin = datetime.strptime(fecha_fin, '%Y-%m-%d').date()
-            queryset = queryset.filter(fecha_creacion__date__lte=fecha_fin)
-        except ValueError:
-            pass
-    
-    if cliente_id:
-        queryset = queryset.filter(cliente_id=cliente_id)
-    
-    if vendedor_id:
-        queryset = queryset.filter(vendedor_id=vendedor_id)
-    
-    if estado:
-        queryset = queryset.filter(estado=estado)
-    
-    # Ordenar por fecha más reciente
-    facturas = queryset.order_by('-fecha_creacion')
+    facturas, filtros = _filtrar_reporte_ventas(request.GET)
     
     # Calcular totales
     total_ventas = facturas.aggregate(Sum('total'))['total__sum'] or 0
@@ -575,11 +493,10 @@ def reporte_ventas(request):
         total=Sum('total')
     ).order_by('estado')
     
-    # Si es export, generar archivo
-    if formato in ['excel', 'csv', 'pdf']:
+    if formato == 'pdf':
         return export_reporte_ventas(facturas, formato, {
-            'fecha_inicio': fecha_inicio,
-            'fecha_fin': fecha_fin,
+            'fecha_inicio': filtros['fecha_inicio'],
+            'fecha_fin': filtros['fecha_fin'],
             'total_ventas': total_ventas,
             'total_facturas': total_facturas
         })
@@ -592,13 +509,7 @@ def reporte_ventas(request):
         'total_facturas': total_facturas,
         'promedio_factura': promedio_factura,
         'stats_estado': stats_estado,
-        'filtros': {
-            'fecha_inicio': fecha_inicio,
-            'fecha_fin': fecha_fin,
-            'cliente_id': cliente_id,
-            'vendedor_id': vendedor_id,
-            'estado': estado,
-        },
+        'filtros': filtros,
         'clientes': Cliente.objects.filter(activo=True)[:50],
         'vendedores': request.user.__class__.objects.filter(
             groups__name='Vendedores'
@@ -614,40 +525,15 @@ def reporte_inventario(request):
     if not request.user.can_adjust_inventory():
         return JsonResponse({'error': 'Sin permisos'}, status=403)
     
-    from inventario.models import Producto, MovimientoInventario, AlertaStock
+    from inventario.models import AlertaStock
     
-    # Parámetros de filtro
-    categoria_id = request.GET.get('categoria')
-    stock_bajo = request.GET.get('stock_bajo')
-    fecha_inicio = request.GET.get('fecha_inicio')
-    fecha_fin = request.GET.get('fecha_fin')
     formato = request.GET.get('formato', 'html')
+    if formato in ['excel', 'csv']:
+        return responder_exportacion(request, 'inventario', formato)
+    if formato == 'pdf':
+        return HttpResponse("Formato no soportado", status=400)
     
-    # Query base productos
-    productos = Producto.objects.filter(activo=True)
-    
-    if categoria_id:
-        productos = productos.filter(categoria_id=categoria_id)
-    
-    if stock_bajo == 'true':
-        productos = productos.filter(stock_minimo__gt=0)  # Placeholder hasta encontrar el campo correcto
-    
-    # Movimientos de inventario
-    movimientos = MovimientoInventario.objects.all()
-    
-    if fecha_inicio:
-        try:
-            fecha_inicio = datetime.strptime(fecha_inicio, '%Y-%m-%d').date()
-            movimientos = movimientos.filter(fecha_movimiento__date__gte=fecha_inicio)
-        except ValueError:
-            pass
-    
-    if fecha_fin:
-        try:
-            fecha_fin = datetime.strptime(fecha_fin, '%Y-%m-%d').date()
-            movimientos = movimientos.filter(fecha_movimiento__date__lte=fecha_fin)
-        except ValueError:
-            pass
+    productos, movimientos, filtros = _filtrar_reporte_inventario(request.GET)
     
     # Estadísticas generales  
     total_productos = productos.count()
@@ -670,14 +556,6 @@ def reporte_inventario(request):
         cantidad_total=Sum('cantidad')
     ).order_by('-total_movimientos')[:10]
     
-    if formato in ['excel', 'csv', 'pdf']:
-        return export_reporte_inventario(productos, formato, {
-            'total_productos': total_productos,
-            'productos_stock_bajo': productos_stock_bajo,
-            'valor_inventario': valor_inventario,
-            'alertas_activas': alertas_activas
-        })
-    
     # Calcular valores totales para cada producto
     productos_con_valores = []
     for producto in productos[:100]:
@@ -697,12 +575,7 @@ def reporte_inventario(request):
         'valor_inventario': valor_inventario,
         'alertas_activas': alertas_activas,
         'top_movimientos': top_movimientos,
-        'filtros': {
-            'categoria_id': categoria_id,
-            'stock_bajo': stock_bajo,
-            'fecha_inicio': fecha_inicio,
-            'fecha_fin': fecha_fin,
-        }
+        'filtros': filtros
     }
     
     return render(request, 'ventas/reporte_inventario.html', context)
@@ -717,31 +590,13 @@ def reporte_compras(request):
     # Este es un placeholder - asumo que hay un módulo de compras
     # Por ahora mostraremos los pedidos como "compras internas"
     
-    fecha_inicio = request.GET.get('fecha_inicio')
-    fecha_fin = request.GET.get('fecha_fin')
-    estado = request.GET.get('estado')
     formato = request.GET.get('formato', 'html')
+    if formato in ['excel', 'csv']:
+        return responder_exportacion(request, 'compras', formato)
+    if formato == 'pdf':
+        return HttpResponse("Formato no soportado", status=400)
     
-    queryset = Pedido.objects.all()
-    
-    if fecha_inicio:
-        try:
-            fecha_inicio = datetime.strptime(fecha_inicio, '%Y-%m-%d').date()
-            queryset = queryset.filter(fecha_creacion__date__gte=fecha_inicio)
-        except ValueError:
-            pass
-    
-    if fecha_fin:
-        try:
-            fecha_fin = datetime.strptime(fecha_fin, '%Y-%m-%d').date()
-            queryset = queryset.filter(fecha_creacion__date__lte=fecha_fin)
-        except ValueError:
-            pass
-    
-    if estado:
-        queryset = queryset.filter(estado=estado)
-    
-    pedidos = queryset.order_by('-fecha_creacion')
+    pedidos, filtros = _filtrar_reporte_compras(request.GET)
     
     # Estadísticas
     total_pedidos = pedidos.count()
@@ -753,13 +608,6 @@ def reporte_compras(request):
         total=Sum('total')
     ).order_by('estado')
     
-    if formato in ['excel', 'csv', 'pdf']:
-        return export_reporte_compras(pedidos, formato, {
-            'total_pedidos': total_pedidos,
-            'total_valor': total_valor,
-            'promedio_pedido': promedio_pedido
-        })
-    
     context = {
         'titulo': 'Reporte de Compras/Pedidos',
         'pedidos': pedidos[:100],
@@ -767,86 +615,162 @@ def reporte_compras(request):
         'total_valor': total_valor,
         'promedio_pedido': promedio_pedido,
         'stats_estado': stats_estado,
-        'filtros': {
-            'fecha_inicio': fecha_inicio,
-            'fecha_fin': fecha_fin,
-            'estado': estado,
-        }
+        'filtros': filtros
     }
     
     return render(request, 'ventas/reporte_compras.html', context)
 
 
+# ============= FILTROS DE REPORTES =============
+
+def _fecha_parametro(parametros, nombre):
+    """Fecha YYYY-MM-DD de los parámetros, o el valor original si no es válida"""
+    valor = parametros.get(nombre)
+    if valor:
+        try:
+            return datetime.strptime(valor, '%Y-%m-%d').date()
+        except ValueError:
+            pass
+    return valor
+
+
+def _filtrar_reporte_ventas(parametros):
+    """(facturas, filtros) del reporte de ventas según los parámetros GET"""
+    filtros = {
+        'fecha_inicio': _fecha_parametro(parametros, 'fecha_inicio'),
+        'fecha_fin': _fecha_parametro(parametros, 'fecha_fin'),
+        'cliente_id': parametros.get('cliente'),
+        'vendedor_id': parametros.get('vendedor'),
+        'estado': parametros.get('estado'),
+    }
+    
+    queryset = Factura.objects.all()
+    if isinstance(filtros['fecha_inicio'], date):
+        queryset = queryset.filter(fecha_creacion__date__gte=filtros['fecha_inicio'])
+    if isinstance(filtros['fecha_fin'], date):
+        queryset = queryset.filter(fecha_creacion__date__lte=filtros['fecha_fin'])
+    if filtros['cliente_id']:
+        queryset = queryset.filter(cliente_id=filtros['cliente_id'])
+    if filtros['vendedor_id']:
+        queryset = queryset.filter(cliente__vendedor_asignado_id=filtros['vendedor_id'])
+    if filtros['estado']:
+        queryset = queryset.filter(estado=filtros['estado'])
+    
+    # Ordenar por fecha más reciente
+    return queryset.order_by('-fecha_creacion'), filtros
+
+
+def _filtrar_reporte_inventario(parametros):
+    """(productos, movimientos, filtros) del reporte de inventario según los parámetros GET"""
+    from inventario.models import Producto, MovimientoInventario
+    
+    filtros = {
+        'categoria_id': parametros.get('categoria'),
+        'stock_bajo': parametros.get('stock_bajo'),
+        'fecha_inicio': _fecha_parametro(parametros, 'fecha_inicio'),
+        'fecha_fin': _fecha_parametro(parametros, 'fecha_fin'),
+    }
+    
+    productos = Producto.objects.filter(activo=True)
+    if filtros['categoria_id']:
+        productos = productos.filter(categoria_id=filtros['categoria_id'])
+    if filtros['stock_bajo'] == 'true':
+        productos = productos.filter(stock_minimo__gt=0)  # Placeholder hasta encontrar el campo correcto
+    
+    movimientos = MovimientoInventario.objects.all()
+    if isinstance(filtros['fecha_inicio'], date):
+        movimientos = movimientos.filter(fecha_movimiento__date__gte=filtros['fecha_inicio'])
+    if isinstance(filtros['fecha_fin'], date):
+        movimientos = movimientos.filter(fecha_movimiento__date__lte=filtros['fecha_fin'])
+    
+    return productos, movimientos, filtros
+
+
+def _filtrar_reporte_compras(parametros):
+    """(pedidos, filtros) del reporte de compras según los parámetros GET"""
+    filtros = {
+        'fecha_inicio': _fecha_parametro(parametros, 'fecha_inicio'),
+        'fecha_fin': _fecha_parametro(parametros, 'fecha_fin'),
+        'estado': parametros.get('estado'),
+    }
+    
+    queryset = Pedido.objects.all()
+    if isinstance(filtros['fecha_inicio'], date):
+        queryset = queryset.filter(fecha_creacion__date__gte=filtros['fecha_inicio'])
+    if isinstance(filtros['fecha_fin'], date):
+        queryset = queryset.filter(fecha_creacion__date__lte=filtros['fecha_fin'])
+    if filtros['estado']:
+        queryset = queryset.filter(estado=filtros['estado'])
+    
+    return queryset.order_by('-fecha_creacion'), filtros
+
+
 # ============= FUNCIONES DE EXPORT =============
 
+def definicion_reporte_ventas(parametros, usuario, formato):
+    """Exportación Excel/CSV del reporte de ventas; el Excel termina con el total"""
+    facturas, _ = _filtrar_reporte_ventas(parametros)
+    pie = []
+    if formato == 'excel':
+        total_ventas = facturas.aggregate(Sum('total'))['total__sum'] or 0
+        pie = [[], ['', '', '', '', 'TOTAL:', float(total_ventas)]]
+    
+    return definicion_exportacion(
+        'reporte_ventas',
+        ['Fecha', 'Número', 'Cliente', 'Vendedor', 'Estado', 'Total'],
+        facturas,
+        ('fecha_creacion', 'numero', 'cliente__nombre_completo',
+         'cliente__vendedor_asignado__first_name', 'cliente__vendedor_asignado__last_name',
+         'estado', 'total'),
+        lambda fila: [
+            timezone.localtime(fila[0]).strftime('%Y-%m-%d'), fila[1], fila[2],
+            nombre_persona(fila[3], fila[4], 'N/A'), fila[5].title(), float(fila[6]),
+        ],
+        pie=pie, con_fecha=False,
+        hoja='Reporte Ventas', anchos=[12, 18, 30, 25, 12, 15], columnas_moneda=[5],
+    )
+
+
+def definicion_reporte_inventario(parametros, usuario, formato):
+    """Exportación Excel/CSV del reporte de inventario"""
+    productos, _, _ = _filtrar_reporte_inventario(parametros)
+    return definicion_exportacion(
+        'reporte_inventario',
+        ['Código', 'Nombre', 'Categoría', 'Stock', 'Precio', 'Valor Total'],
+        productos.order_by('codigo'),
+        ('codigo', 'nombre', 'categoria__nombre', 'existencia_total', 'precio_minorista'),
+        lambda fila: [
+            fila[0], fila[1], fila[2] or 'N/A', fila[3],
+            float(fila[4]), float(fila[3] * fila[4]),
+        ],
+        con_fecha=False,
+        hoja='Reporte Inventario', anchos=[15, 40, 20, 10, 15, 15], columnas_moneda=[4, 5],
+    )
+
+
+def definicion_reporte_compras(parametros, usuario, formato):
+    """Exportación Excel/CSV del reporte de compras/pedidos"""
+    pedidos, _ = _filtrar_reporte_compras(parametros)
+    estados = dict(Pedido.ESTADO_CHOICES)
+    return definicion_exportacion(
+        'reporte_compras',
+        ['Fecha', 'Número', 'Cliente', 'Estado', 'Total'],
+        pedidos,
+        ('fecha_creacion', 'numero', 'cliente__nombre_completo', 'estado', 'total'),
+        lambda fila: [
+            timezone.localtime(fila[0]).strftime('%Y-%m-%d'), fila[1], fila[2],
+            estados.get(fila[3], fila[3]), float(fila[4]),
+        ],
+        con_fecha=False,
+        hoja='Reporte Compras', anchos=[12, 18, 30, 15, 15], columnas_moneda=[4],
+    )
+
+
 def export_reporte_ventas(facturas, formato, stats):
-    """Exportar reporte de ventas en diferentes formatos"""
+    """Exportar reporte de ventas en PDF (Excel y CSV usan ``definicion_reporte_ventas``)"""
     from django.http import HttpResponse
-    import io
-    
-    if formato == 'excel':
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, Alignment
-        
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Reporte Ventas"
-        
-        # Headers
-        headers = ['Fecha', 'Número', 'Cliente', 'Vendedor', 'Estado', 'Total']
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = Font(bold=True)
-            cell.alignment = Alignment(horizontal='center')
-        
-        # Data
-        for row, factura in enumerate(facturas, 2):
-            ws.cell(row=row, column=1, value=factura.fecha_creacion.strftime('%Y-%m-%d'))
-            ws.cell(row=row, column=2, value=factura.numero_factura)
-            ws.cell(row=row, column=3, value=str(factura.cliente))
-            ws.cell(row=row, column=4, value=str(factura.vendedor) if factura.vendedor else 'N/A')
-            ws.cell(row=row, column=5, value=factura.get_estado_display())
-            ws.cell(row=row, column=6, value=float(factura.total))
-        
-        # Totales al final
-        total_row = len(facturas) + 3
-        ws.cell(row=total_row, column=5, value="TOTAL:").font = Font(bold=True)
-        ws.cell(row=total_row, column=6, value=float(stats['total_ventas'])).font = Font(bold=True)
-        
-        # Preparar respuesta
-        output = io.BytesIO()
-        wb.save(output)
-        output.seek(0)
-        
-        response = HttpResponse(
-            output.getvalue(),
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        response['Content-Disposition'] = 'attachment; filename="reporte_ventas.xlsx"'
-        return response
-    
-    elif formato == 'csv':
-        import csv
-        
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="reporte_ventas.csv"'
-        
-        writer = csv.writer(response)
-        writer.writerow(['Fecha', 'Número', 'Cliente', 'Vendedor', 'Estado', 'Total'])
-        
-        for factura in facturas:
-            writer.writerow([
-                factura.fecha_creacion.strftime('%Y-%m-%d'),
-                factura.numero_factura,
-                str(factura.cliente),
-                str(factura.vendedor) if factura.vendedor else 'N/A',
-                factura.get_estado_display(),
-                float(factura.total)
-            ])
-        
-        return response
     
-    elif formato == 'pdf':
+    if formato == 'pdf':
         from reportlab.lib.pagesizes import letter, A4
         from reportlab.lib import colors
         from reportlab.lib.styles import getSampleStyleSheet
@@ -871,12 +795,12 @@ def export_reporte_ventas(facturas, formato, stats):
         
         # Tabla de datos
         data = [['Fecha', 'Número', 'Cliente', 'Estado', 'Total']]
-        for factura in facturas[:50]:  # Limitar para PDF
+        for factura in facturas.select_related('cliente')[:50]:  # Limitar para PDF
             data.append([
                 factura.fecha_creacion.strftime('%Y-%m-%d'),
-                factura.numero_factura,
+                factura.numero,
                 str(factura.cliente)[:30],  # Truncar nombres largos
-                factura.get_estado_display(),
+                factura.estado.title(),
                 f"${factura.total:,.2f}"
             ])
         
@@ -895,127 +819,3 @@ def export_reporte_ventas(facturas, formato, stats):
         story.append(table)
         doc.build(story)
         return response
-
-
-def export_reporte_inventario(productos, formato, stats):
-    """Exportar reporte de inventario"""
-    from django.http import HttpResponse
-    import io
-    
-    if formato == 'excel':
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, Alignment
-        
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Reporte Inventario"
-        
-        headers = ['Código', 'Nombre', 'Categoría', 'Stock', 'Precio', 'Valor Total']
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = Font(bold=True)
-            cell.alignment = Alignment(horizontal='center')
-        
-        for row, producto in enumerate(productos, 2):
-            ws.cell(row=row, column=1, value=producto.codigo)
-            ws.cell(row=row, column=2, value=producto.nombre)
-            ws.cell(row=row, column=3, value=str(producto.categoria) if producto.categoria else 'N/A')
-            ws.cell(row=row, column=4, value=0)  # Stock placeholder
-            ws.cell(row=row, column=5, value=float(producto.precio_minorista))
-            ws.cell(row=row, column=6, value=float(0 * producto.precio_minorista))
-        
-        output = io.BytesIO()
-        wb.save(output)
-        output.seek(0)
-        
-        response = HttpResponse(
-            output.getvalue(),
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        response['Content-Disposition'] = 'attachment; filename="reporte_inventario.xlsx"'
-        return response
-    
-    elif formato == 'csv':
-        import csv
-        
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="reporte_inventario.csv"'
-        
-        writer = csv.writer(response)
-        writer.writerow(['Código', 'Nombre', 'Categoría', 'Stock', 'Precio', 'Valor Total'])
-        
-        for producto in productos:
-            writer.writerow([
-                producto.codigo,
-                producto.nombre,
-                str(producto.categoria) if producto.categoria else 'N/A',
-                0,  # Stock placeholder
-                float(producto.precio_minorista),
-                float(0 * producto.precio_minorista)
-            ])
-        
-        return response
-    
-    # Si no es excel o csv, retornar respuesta por defecto
-    return HttpResponse("Formato no soportado", status=400)
-
-
-def export_reporte_compras(pedidos, formato, stats):
-    """Exportar reporte de compras/pedidos"""
-    from django.http import HttpResponse
-    import io
-    
-    if formato == 'excel':
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, Alignment
-        
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Reporte Compras"
-        
-        headers = ['Fecha', 'Número', 'Cliente', 'Estado', 'Total']
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = Font(bold=True)
-            cell.alignment = Alignment(horizontal='center')
-        
-        for row, pedido in enumerate(pedidos, 2):
-            ws.cell(row=row, column=1, value=pedido.fecha_creacion.strftime('%Y-%m-%d'))
-            ws.cell(row=row, column=2, value=pedido.numero)
-            ws.cell(row=row, column=3, value=str(pedido.cliente))
-            ws.cell(row=row, column=4, value=pedido.get_estado_display())
-            ws.cell(row=row, column=5, value=float(pedido.total))
-        
-        output = io.BytesIO()
-        wb.save(output)
-        output.seek(0)
-        
-        response = HttpResponse(
-            output.getvalue(),
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        response['Content-Disposition'] = 'attachment; filename="reporte_compras.xlsx"'
-        return response
-    
-    elif formato == 'csv':
-        import csv
-        
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="reporte_compras.csv"'
-        
-        writer = csv.writer(response)
-        writer.writerow(['Fecha', 'Número', 'Cliente', 'Estado', 'Total'])
-        
-        for pedido in pedidos:
-            writer.writerow([
-                pedido.fecha_creacion.strftime('%Y-%m-%d'),
-                pedido.numero,
-                str(pedido.cliente),
-                pedido.get_estado_display(),
-                float(pedido.total)
-            ])
-        
-        return response
-    
-    # Si no es excel o csv, retornar respuesta por defecto
-    return HttpResponse("Formato no soportado", status=400)
\ No newline at end of file
@@ -0,0 +1,91 @@
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from ventas.models import SecuenciaDocumento
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide la asignación de números de documento con N escritores concurrentes: '
+        'latencia por cuartil (debe ser constante), duplicados y huecos'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hilos', type=int, default=32, help='Escritores concurrentes (default: 32)')
+        parser.add_argument('--por-hilo', type=int, default=200, help='Reservas por escritor (default: 200)')
+        parser.add_argument('--bloque', type=int, default=1, help='Números por reserva (default: 1)')
+        parser.add_argument('--conservar', action='store_true', help='No borrar la secuencia de prueba al terminar')
+
+    def handle(self, *args, **options):
+        hilos = options['hilos']
+        por_hilo = options['por_hilo']
+        bloque = options['bloque']
+        tipo = 'benchmark'
+        periodo = str(int(time.time()))
+
+        self.stdout.write(
+            f'⏱️  {hilos} escritores × {por_hilo} reservas de {bloque} número(s) ({connection.vendor})'
+        )
+
+        resultados = []  # (instante, latencia, números)
+        errores = []
+        candado = threading.Lock()
+        barrera = threading.Barrier(hilos)
+
+        def escritor():
+            propios = []
+            try:
+                barrera.wait()
+                for _ in range(por_hilo):
+                    inicio = time.perf_counter()
+                    numeros = SecuenciaDocumento.reservar(tipo, periodo, bloque)
+                    fin = time.perf_counter()
+                    propios.append((fin, fin - inicio, numeros))
+            except Exception as e:
+                errores.append(str(e))
+            finally:
+                connection.close()
+                with candado:
+                    resultados.extend(propios)
+
+        inicio_total = time.perf_counter()
+        trabajadores = [threading.Thread(target=escritor) for _ in range(hilos)]
+        for trabajador in trabajadores:
+            trabajador.start()
+        for trabajador in trabajadores:
+            trabajador.join()
+        segundos = time.perf_counter() - inicio_total
+
+        if not options['conservar']:
+            SecuenciaDocumento.objects.filter(tipo=tipo, periodo=periodo).delete()
+
+        for error in errores[:5]:
+            self.stdout.write(self.style.ERROR(f'❌ {error}'))
+        if not resultados:
+            return
+
+        numeros = [numero for _, _, rango in resultados for numero in rango]
+        duplicados = len(numeros) - len(set(numeros))
+        huecos = (max(numeros) - min(numeros) + 1) - len(set(numeros))
+
+        resultados.sort()
+        cuarto = max(len(resultados) // 4, 1)
+        self.stdout.write(f'   Reservas: {len(resultados)} ({len(numeros)} números) en {segundos:.2f}s')
+        self.stdout.write(f'   Rendimiento: {len(resultados) / segundos:.0f} reservas/s')
+        for indice in range(4):
+            latencias = [latencia for _, latencia, _ in resultados[indice * cuarto:(indice + 1) * cuarto]]
+            if latencias:
+                self.stdout.write(
+                    f'   Cuartil {indice + 1}: mediana {statistics.median(latencias) * 1000:.2f} ms, '
+                    f'máx {max(latencias) * 1000:.2f} ms'
+                )
+
+        if duplicados or huecos or errores:
+            self.stdout.write(self.style.ERROR(
+                f'❌ Duplicados: {duplicados}, huecos: {huecos}, errores: {len(errores)}'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS('✅ Sin duplicados ni huecos'))
@@ -0,0 +1,75 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from ventas.despacho import (
+    CAPACIDAD_POR_DEFECTO, JORNADA_HORAS_POR_DEFECTO, MOTIVOS_SIN_ASIGNAR, despachar_dia
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Reparte las entregas pendientes de un día entre los repartidores disponibles '
+        '(agrupación por cobertura y cupo parejo, rutas 2-opt/Or-opt y límite de jornada) '
+        'y guarda repartidor y orden de ruta. Con --simular solo muestra el plan'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fecha', type=date.fromisoformat, help='Día a despachar, YYYY-MM-DD (default: hoy)')
+        parser.add_argument(
+            '--capacidad',
+            type=int,
+            default=CAPACIDAD_POR_DEFECTO,
+            help=f'Máximo de entregas por repartidor (default: {CAPACIDAD_POR_DEFECTO})',
+        )
+        parser.add_argument(
+            '--jornada',
+            type=float,
+            default=JORNADA_HORAS_POR_DEFECTO,
+            help=f'Horas máximas de cada ruta, viaje más entregas (default: {JORNADA_HORAS_POR_DEFECTO})',
+        )
+        parser.add_argument('--regresar', action='store_true', help='Las rutas terminan en la bodega')
+        parser.add_argument('--simular', action='store_true', help='Mostrar el plan sin guardar asignaciones')
+
+    def handle(self, *args, **options):
+        fecha = options['fecha'] or timezone.localdate()
+        self.stdout.write(f'🚚 Despacho de entregas del {fecha:%d/%m/%Y}')
+
+        inicio = time.perf_counter()
+        try:
+            plan = despachar_dia(
+                fecha,
+                capacidad=options['capacidad'],
+                jornada_horas=options['jornada'],
+                regresar=options['regresar'],
+                guardar=not options['simular'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        segundos = time.perf_counter() - inicio
+
+        resumen = plan['resumen']
+        for ruta in plan['rutas']:
+            self.stdout.write(
+                f"   Repartidor {ruta['repartidor_id']}: {len(ruta['paradas'])} entregas, "
+                f"{ruta['distancia_km']} km, {ruta['duracion_horas']} h"
+            )
+        for item in plan['sin_asignar'][:50]:
+            liberada = ' (se le quitó el repartidor anterior)' if item.get('desasignada') else ''
+            self.stdout.write(self.style.WARNING(
+                f"🟡 Entrega {item['id']}: {MOTIVOS_SIN_ASIGNAR[item['motivo']]}{liberada}"
+            ))
+
+        self.stdout.write(
+            f"   {resumen['asignadas']} de {resumen['paradas']} entregas en {resumen['repartidores_con_ruta']} rutas, "
+            f"{resumen['distancia_total_km']} km en total ({segundos:.1f} s)"
+        )
+        if options['simular']:
+            self.stdout.write(self.style.SUCCESS('✅ Simulación terminada, no se guardó nada'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"✅ {resumen['guardadas']} entregas asignadas"))
+            if resumen['desasignadas']:
+                self.stdout.write(self.style.WARNING(
+                    f"🟡 {resumen['desasignadas']} entregas de un despacho anterior quedaron sin repartidor"
+                ))
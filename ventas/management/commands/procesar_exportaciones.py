@@ -0,0 +1,97 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from ventas.pdf_facturas import detener_pool, iniciar_pool
+from ventas.trabajos_exportacion import (
+    ABANDONO_MINUTOS, limpiar_vencidos, procesar_trabajo, reencolar_abandonados, tomar_siguiente
+)
+
+# Segundos entre revisiones de trabajos abandonados mientras la cola está vacía
+REVISION_ABANDONADOS = 60
+
+
+class Command(BaseCommand):
+    help = (
+        'Worker de exportaciones en segundo plano: procesa los trabajos pendientes de la cola '
+        '(tabla TrabajoExportacion). Sin --una-vez sigue esperando trabajos nuevos'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--una-vez', action='store_true', help='Vaciar la cola y terminar')
+        parser.add_argument('--intervalo', type=float, default=2.0, help='Segundos entre consultas a la cola (default: 2)')
+        parser.add_argument(
+            '--abandonados',
+            type=int,
+            default=ABANDONO_MINUTOS,
+            help=(
+                'Minutos sin latido tras los que un trabajo en proceso se considera abandonado '
+                f'y se reencola (default: {ABANDONO_MINUTOS})'
+            ),
+        )
+        parser.add_argument(
+            '--procesos',
+            type=int,
+            default=0,
+            help='Procesos para renderizar lotes grandes de facturas en ZIP; 0 o 1 no usa pool (default: 0)',
+        )
+        parser.add_argument(
+            '--limpiar-dias',
+            type=int,
+            default=1,
+            help='Borrar trabajos terminados y sus archivos con más de N días; 0 no borra (default: 1)',
+        )
+
+    def reencolar(self, minutos):
+        reencolados = reencolar_abandonados(minutos)
+        if reencolados:
+            self.stdout.write(self.style.WARNING(f'🟡 {reencolados} trabajo(s) abandonado(s) reencolado(s)'))
+        return time.monotonic()
+
+    def handle(self, *args, **options):
+        self.stdout.write('📤 Worker de exportaciones')
+
+        ultima_revision = self.reencolar(options['abandonados'])
+        if options['limpiar_dias']:
+            borrados = limpiar_vencidos(options['limpiar_dias'])
+            if borrados:
+                self.stdout.write(f'   {borrados} exportación(es) vencida(s) eliminada(s)')
+
+        if options['procesos'] > 1:
+            # Pool de larga vida: se crea una vez por worker, no por lote
+            iniciar_pool(options['procesos'])
+            self.stdout.write(f"   Lotes de facturas en {options['procesos']} procesos")
+
+        procesados = 0
+        try:
+            while True:
+                trabajo = tomar_siguiente()
+                if trabajo is None:
+                    if options['una_vez']:
+                        break
+                    if time.monotonic() - ultima_revision >= REVISION_ABANDONADOS:
+                        ultima_revision = self.reencolar(options['abandonados'])
+                        continue
+                    connection.close()
+                    time.sleep(options['intervalo'])
+                    continue
+
+                inicio = time.perf_counter()
+                procesar_trabajo(trabajo)
+                trabajo.refresh_from_db()
+                procesados += 1
+                if trabajo.estado == 'completado':
+                    self.stdout.write(self.style.SUCCESS(
+                        f'✅ #{trabajo.pk} {trabajo.tipo} ({trabajo.formato}): '
+                        f'{trabajo.filas_procesadas} filas en {time.perf_counter() - inicio:.1f}s'
+                    ))
+                elif trabajo.estado == 'error':
+                    self.stdout.write(self.style.ERROR(f'❌ #{trabajo.pk} {trabajo.tipo}: {trabajo.error}'))
+                else:
+                    self.stdout.write(self.style.WARNING(f'🟡 #{trabajo.pk} {trabajo.tipo}: reencolado mientras se procesaba'))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            detener_pool()
+
+        self.stdout.write(f'   Trabajos procesados: {procesados}')
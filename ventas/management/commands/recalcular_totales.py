@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from ventas.models import ItemCotizacion, ItemPedido
+
+
+class Command(BaseCommand):
+    help = (
+        'Verifica y repara el total de pedidos y cotizaciones contra la suma de sus items. '
+        'Con --solo-verificar revisa una muestra aleatoria y reporta descuadres sin modificar nada'
+    )
+
+    DOCUMENTOS = {
+        'pedidos': ItemPedido,
+        'cotizaciones': ItemCotizacion,
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--documentos',
+            choices=list(self.DOCUMENTOS),
+            nargs='+',
+            default=list(self.DOCUMENTOS),
+            help='Tipos de documento a procesar (default: todos)',
+        )
+        parser.add_argument(
+            '--solo-verificar',
+            action='store_true',
+            help='Solo reportar descuadres, sin modificar la base de datos',
+        )
+        parser.add_argument(
+            '--muestra',
+            type=int,
+            default=500,
+            help='Documentos revisados al azar con --solo-verificar; 0 revisa todos (default: 500)',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('🧮 Totales de pedidos y cotizaciones')
+        total_descuadres = 0
+
+        for nombre in options['documentos']:
+            item = self.DOCUMENTOS[nombre]
+            modelo = item._meta.get_field(item.campo_documento).related_model
+
+            if options['solo_verificar']:
+                documentos = modelo.objects.all()
+                if options['muestra']:
+                    ids = modelo.objects.order_by('?').values_list('pk', flat=True)[:options['muestra']]
+                    documentos = modelo.objects.filter(pk__in=list(ids))
+                descuadres = item.descuadres(documentos)
+                for documento in descuadres[:50]:
+                    self.stdout.write(self.style.WARNING(
+                        f"🟡 {documento.numero}: guardado {documento.total}, real {documento.total_real}"
+                    ))
+                revisados = documentos.count()
+                self.stdout.write(f'   {nombre.title()}: {revisados} revisados, {len(descuadres)} con diferencias')
+                total_descuadres += len(descuadres)
+                continue
+
+            with transaction.atomic():
+                actualizados = item.recalcular_totales()
+            self.stdout.write(f'   {nombre.title()}: {actualizados} recalculados')
+            total_descuadres += len(item.descuadres(modelo.objects.all()))
+
+        if options['solo_verificar']:
+            if total_descuadres:
+                self.stdout.write(self.style.WARNING('⚠️  Existen diferencias. Ejecuta sin --solo-verificar para corregirlas'))
+            else:
+                self.stdout.write(self.style.SUCCESS('✅ Totales correctos en la muestra'))
+        elif total_descuadres:
+            self.stdout.write(self.style.ERROR(f'❌ Persisten {total_descuadres} diferencias después de recalcular'))
+        else:
+            self.stdout.write(self.style.SUCCESS('✅ Totales recalculados y verificados'))
@@ -0,0 +1,192 @@
+"""
+Métricas del dashboard de ventas
+
+Todos los KPIs salen de pocas consultas: una agregación condicional por
+modelo (mes actual, mes anterior, periodo y periodo anterior, pendientes),
+una agrupación por estado, la serie diaria agrupada con TruncDate, el top
+de productos y la actividad reciente. El resultado se guarda en caché por
+(alcance del usuario, día, rango); ``Pedido.save`` y ``Factura.save``
+invalidan la caché al crear un documento o cambiar su estado o total.
+
+La invalidación solo llega a todos los workers si la caché es compartida
+(``REDIS_URL`` en settings). Con la caché en memoria de cada proceso, los
+demás workers siguen mostrando sus métricas hasta que vencen, por eso ahí
+duran solo ``DURACION_CACHE_LOCAL``.
+"""
+
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Factura, ItemPedido, Pedido
+
+RANGOS_DIAS = (7, 30, 90, 365)
+RANGO_POR_DEFECTO = 30
+DURACION_CACHE = 60 * 60
+DURACION_CACHE_LOCAL = 2 * 60
+CLAVE_VERSION = 'ventas:dashboard:version'
+
+ESTADOS_FACTURADOS = ['emitida', 'pagada']
+ESTADOS_PEDIDO_PENDIENTE = ['borrador', 'pendiente', 'proceso']
+
+
+def _inicio(dia):
+    return timezone.make_aware(datetime.combine(dia, time.min))
+
+
+def _crecimiento(actual, anterior):
+    if anterior == 0:
+        return 100 if actual > 0 else 0
+    return ((actual - anterior) / anterior) * 100
+
+
+def alcance_usuario(usuario):
+    """
+    Alcance de datos del usuario para la clave de caché. Pedido y Factura no
+    tienen vendedor en los modelos actuales, así que todos ven lo mismo.
+    """
+    return 'todos'
+
+
+def duracion_cache():
+    """Segundos que duran las métricas en caché según si la caché es compartida entre procesos"""
+    return DURACION_CACHE_LOCAL if isinstance(caches['default'], LocMemCache) else DURACION_CACHE
+
+
+def invalidar_metricas_dashboard():
+    """Descarta todas las métricas en caché (cambia la versión de las claves)"""
+    try:
+        cache.incr(CLAVE_VERSION)
+    except ValueError:
+        cache.set(CLAVE_VERSION, 1, None)
+
+
+def _totales(queryset, estados_validos, periodos, estados_pendientes):
+    """Una sola consulta con Count/Sum condicionales para cada periodo"""
+    agregados = {}
+    for nombre, (desde, hasta) in periodos.items():
+        condicion = Q(estado__in=estados_validos, fecha_creacion__gte=desde, fecha_creacion__lt=hasta)
+        agregados[f'{nombre}_cantidad'] = Count('id', filter=condicion)
+        agregados[f'{nombre}_total'] = Sum('total', filter=condicion)
+    agregados['pendientes'] = Count('id', filter=Q(estado__in=estados_pendientes))
+    resultado = queryset.aggregate(**agregados)
+    return {
+        clave: (valor or Decimal('0.00')) if clave.endswith('_total') else valor
+        for clave, valor in resultado.items()
+    }
+
+
+def _serie_diaria(queryset, desde, dias):
+    """Ventas por día agrupadas en la base de datos; los días sin ventas quedan en 0"""
+    por_dia = dict(
+        queryset.filter(estado='completado', fecha_creacion__gte=_inicio(desde))
+        .annotate(dia=TruncDate('fecha_creacion'))
+        .values('dia')
+        .annotate(total=Sum('total'))
+        .values_list('dia', 'total')
+        .order_by()
+    )
+    fechas = [desde + timedelta(days=i) for i in range(dias)]
+    return {
+        'labels': [fecha.strftime('%d/%m') for fecha in fechas],
+        'data': [float(por_dia.get(fecha) or 0) for fecha in fechas],
+    }
+
+
+def _actividad_reciente(pedidos, facturas):
+    actividad = []
+    for tipo, queryset, url in (('pedido', pedidos, '/ventas/pedidos/'), ('factura', facturas, '/ventas/facturas/')):
+        for documento in queryset.select_related('cliente').order_by('-fecha_creacion')[:3]:
+            actividad.append({
+                'tipo': tipo,
+                'titulo': f'{tipo.title()} {documento.numero}',
+                'descripcion': f'Cliente: {documento.cliente.nombre_completo}',
+                'valor': documento.total,
+                'fecha': documento.fecha_creacion,
+                'estado': documento.estado,
+                'url': f'{url}{documento.id}/'
+            })
+    actividad.sort(key=lambda x: x['fecha'], reverse=True)
+    return actividad[:6]
+
+
+def calcular_metricas_dashboard(dias=RANGO_POR_DEFECTO, hoy=None, pedidos=None, facturas=None):
+    """Calcula las métricas del dashboard sin usar la caché"""
+    hoy = hoy or timezone.localdate()
+    pedidos = Pedido.objects.all() if pedidos is None else pedidos
+    facturas = Factura.objects.all() if facturas is None else facturas
+
+    inicio_mes = hoy.replace(day=1)
+    inicio_mes_anterior = (inicio_mes - timedelta(days=1)).replace(day=1)
+    inicio_periodo = hoy - timedelta(days=dias - 1)
+    inicio_periodo_anterior = inicio_periodo - timedelta(days=dias)
+    manana = hoy + timedelta(days=1)
+    periodos = {
+        'mes': (_inicio(inicio_mes), _inicio(manana)),
+        'mes_anterior': (_inicio(inicio_mes_anterior), _inicio(inicio_mes)),
+        'periodo': (_inicio(inicio_periodo), _inicio(manana)),
+        'periodo_anterior': (_inicio(inicio_periodo_anterior), _inicio(inicio_periodo)),
+    }
+
+    totales_pedidos = _totales(pedidos, ['completado'], periodos, ESTADOS_PEDIDO_PENDIENTE)
+    totales_facturas = _totales(facturas, ESTADOS_FACTURADOS, periodos, ['emitida'])
+
+    estadisticas_pedidos = list(
+        pedidos.values('estado').annotate(cantidad=Count('id'), valor_total=Sum('total')).order_by('-cantidad')
+    )
+
+    top_productos = list(
+        ItemPedido.objects.filter(
+            pedido__in=pedidos,
+            pedido__fecha_creacion__gte=periodos['mes'][0],
+            pedido__estado='completado'
+        ).values(
+            'producto__codigo', 'producto__nombre'
+        ).annotate(
+            cantidad_vendida=Sum('cantidad'),
+            valor_total=Sum(F('cantidad') * F('precio_unitario'))
+        ).order_by('-cantidad_vendida')[:5]
+    )
+
+    def kpi(totales, periodo, anterior):
+        return {
+            'valor': totales[f'{periodo}_cantidad'],
+            'total': totales[f'{periodo}_total'],
+            'crecimiento': _crecimiento(float(totales[f'{periodo}_total']), float(totales[f'{anterior}_total'])),
+        }
+
+    return {
+        'dias': dias,
+        'kpis': {
+            'pedidos_mes': kpi(totales_pedidos, 'mes', 'mes_anterior'),
+            'facturas_mes': kpi(totales_facturas, 'mes', 'mes_anterior'),
+            'pedidos_periodo': kpi(totales_pedidos, 'periodo', 'periodo_anterior'),
+            'facturas_periodo': kpi(totales_facturas, 'periodo', 'periodo_anterior'),
+            'pedidos_pendientes': totales_pedidos['pendientes'],
+            'facturas_pendientes': totales_facturas['pendientes'],
+        },
+        'estadisticas_pedidos': estadisticas_pedidos,
+        'top_productos': top_productos,
+        'actividad_reciente': _actividad_reciente(pedidos, facturas),
+        'ventas_por_dia': _serie_diaria(pedidos, inicio_periodo, dias),
+    }
+
+
+def metricas_dashboard(usuario, dias=RANGO_POR_DEFECTO):
+    """Métricas del dashboard para el usuario, desde la caché si están vigentes"""
+    if dias not in RANGOS_DIAS:
+        dias = RANGO_POR_DEFECTO
+    hoy = timezone.localdate()
+    version = cache.get(CLAVE_VERSION, 0)
+    clave = f'ventas:dashboard:{version}:{alcance_usuario(usuario)}:{hoy.isoformat()}:{dias}'
+
+    metricas = cache.get(clave)
+    if metricas is None:
+        metricas = calcular_metricas_dashboard(dias, hoy)
+        cache.set(clave, metricas, duracion_cache())
+    return metricas
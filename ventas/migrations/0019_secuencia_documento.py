@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-18 00:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ventas', '0018_alter_itemfactura_factura'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SecuenciaDocumento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(max_length=30)),
+                ('periodo', models.CharField(max_length=10)),
+                ('ultimo_valor', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Secuencia de Documento',
+                'verbose_name_plural': 'Secuencias de Documentos',
+                'unique_together': {('tipo', 'periodo')},
+            },
+        ),
+    ]
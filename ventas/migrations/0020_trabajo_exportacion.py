@@ -0,0 +1,42 @@
+# Generated by Django 5.2.7 on 2026-10-18 00:18
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ventas', '0019_secuencia_documento'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrabajoExportacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(max_length=30)),
+                ('formato', models.CharField(choices=[('excel', 'Excel'), ('csv', 'CSV')], max_length=10)),
+                ('parametros', models.JSONField(blank=True, default=dict)),
+                ('huella', models.CharField(db_index=True, help_text='Hash de usuario, tipo, formato y filtros', max_length=64)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('procesando', 'Procesando'), ('completado', 'Completado'), ('error', 'Error')], default='pendiente', max_length=20)),
+                ('total_filas', models.PositiveIntegerField(blank=True, null=True)),
+                ('filas_procesadas', models.PositiveIntegerField(default=0)),
+                ('archivo', models.FileField(blank=True, upload_to='exportaciones/')),
+                ('nombre_archivo', models.CharField(blank=True, max_length=150)),
+                ('error', models.TextField(blank=True)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('fecha_inicio', models.DateTimeField(blank=True, null=True)),
+                ('fecha_fin', models.DateTimeField(blank=True, null=True)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exportaciones', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Trabajo de Exportación',
+                'verbose_name_plural': 'Trabajos de Exportación',
+                'ordering': ['-fecha_creacion'],
+                'indexes': [models.Index(fields=['estado', 'fecha_creacion'], name='ventas_trab_estado_0a4e16_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.7 on 2026-10-18 00:24
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def tomar_coordenadas_de_enlaces(apps, schema_editor):
+    from ventas.rutas import coordenadas_desde_enlace
+
+    Cliente = apps.get_model('ventas', 'Cliente')
+    actualizados = []
+    for cliente in Cliente.objects.exclude(enlace_maps='').only('pk', 'enlace_maps').iterator():
+        coordenadas = coordenadas_desde_enlace(cliente.enlace_maps)
+        if coordenadas:
+            cliente.latitud, cliente.longitud = (Decimal(str(round(valor, 7))) for valor in coordenadas)
+            actualizados.append(cliente)
+    Cliente.objects.bulk_update(actualizados, ['latitud', 'longitud'], batch_size=500)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ventas', '0020_trabajo_exportacion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cliente',
+            name='latitud',
+            field=models.DecimalField(blank=True, decimal_places=7, max_digits=10, null=True, verbose_name='Latitud GPS'),
+        ),
+        migrations.AddField(
+            model_name='cliente',
+            name='longitud',
+            field=models.DecimalField(blank=True, decimal_places=7, max_digits=10, null=True, verbose_name='Longitud GPS'),
+        ),
+        migrations.RunPython(tomar_coordenadas_de_enlaces, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-18 00:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ventas', '0021_cliente_coordenadas'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='factura',
+            index=models.Index(fields=['fecha_creacion', 'id'], name='factura_fecha_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='factura',
+            index=models.Index(fields=['estado', 'fecha_creacion', 'id'], name='factura_estado_fecha_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['fecha_creacion', 'id'], name='pedido_fecha_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['estado', 'fecha_creacion', 'id'], name='pedido_estado_fecha_id_idx'),
+        ),
+    ]
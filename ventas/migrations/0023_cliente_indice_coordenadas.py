@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-18 00:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ventas', '0022_indices_paginacion_cursor'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cliente',
+            index=models.Index(fields=['latitud', 'longitud'], name='cliente_lat_lng_idx'),
+        ),
+    ]
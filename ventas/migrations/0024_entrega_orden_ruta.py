@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 00:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ventas', '0023_cliente_indice_coordenadas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entrega',
+            name='orden_ruta',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.7 on 2026-10-18 00:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ventas', '0024_entrega_orden_ruta'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entrega',
+            name='fecha_entrega',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='entrega',
+            name='fecha_inicio',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='PosicionRepartidor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('latitud', models.DecimalField(decimal_places=7, max_digits=10)),
+                ('longitud', models.DecimalField(decimal_places=7, max_digits=10)),
+                ('registrada', models.DateTimeField(help_text='Hora del ping en el dispositivo')),
+                ('repartidor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='posiciones_gps', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Posición de repartidor',
+                'verbose_name_plural': 'Posiciones de repartidores',
+                'indexes': [models.Index(fields=['repartidor', 'registrada'], name='posicion_repartidor_fecha_idx')],
+            },
+        ),
+    ]
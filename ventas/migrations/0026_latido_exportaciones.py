@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 01:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ventas', '0025_posiciones_repartidor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trabajoexportacion',
+            name='intento',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='trabajoexportacion',
+            name='ultimo_latido',
+            field=models.DateTimeField(blank=True, help_text='Último avance reportado por el worker', null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 01:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ventas', '0026_latido_exportaciones'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='trabajoexportacion',
+            name='formato',
+            field=models.CharField(choices=[('excel', 'Excel'), ('csv', 'CSV'), ('pdf', 'PDF'), ('zip', 'ZIP')], max_length=10),
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.db.models import F
 from django.contrib.auth import get_user_model
 from decimal import Decimal
@@ -38,6 +38,9 @@ class Cliente(models.Model):
     direccion = models.TextField()
     ciudad = models.CharField(max_length=100, default='Bogotá')
     enlace_maps = models.URLField(blank=True)
+    # Coordenadas tomadas de enlace_maps al guardar (para ordenar rutas de entrega)
+    latitud = models.DecimalField(max_digits=10, decimal_places=7, null=True, blank=True, verbose_name='Latitud GPS')
+    longitud = models.DecimalField(max_digits=10, decimal_places=7, null=True, blank=True, verbose_name='Longitud GPS')
     tipo_cliente = models.CharField(max_length=20, choices=TIPO_CLIENTE_CHOICES, default='minorista')
     limite_credito = models.DecimalField(max_digits=12, decimal_places=2, default=0, help_text="Límite de crédito en pesos")
     dias_credito = models.IntegerField(default=0, help_text="Días de crédito permitidos")
@@ -45,8 +48,74 @@ class Cliente(models.Model):
     activo = models.BooleanField(default=True)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        # Caja envolvente de las búsquedas por cobertura (accounts.geoespacial)
+        indexes = [
+            models.Index(fields=['latitud', 'longitud'], name='cliente_lat_lng_idx'),
+        ]
+    
     def __str__(self):
         return self.nombre_completo
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        instancia._coordenadas_guardadas = (instancia.__dict__.get('latitud'), instancia.__dict__.get('longitud'))
+        return instancia
+    
+    def save(self, *args, **kwargs):
+        if self.enlace_maps:
+            self.actualizar_coordenadas()
+        super().save(*args, **kwargs)
+        anteriores = getattr(self, '_coordenadas_guardadas', (None, None))
+        if None not in anteriores and anteriores != (self.latitud, self.longitud):
+            # La posición anterior ya no sirve en el caché de distancias
+            from accounts.distancias import invalidar_punto
+            transaction.on_commit(lambda: invalidar_punto(*anteriores))
+        self._coordenadas_guardadas = (self.latitud, self.longitud)
+    
+    def actualizar_coordenadas(self):
+        """Toma latitud/longitud de enlace_maps (deja las actuales si el enlace no trae coordenadas)"""
+        from .rutas import coordenadas_desde_enlace
+
+        coordenadas = coordenadas_desde_enlace(self.enlace_maps)
+        if coordenadas:
+            self.latitud, self.longitud = (Decimal(str(round(valor, 7))) for valor in coordenadas)
+
+def _proteger_total(instancia, kwargs):
+    """
+    Evita que un save() completo sobrescriba el ``total`` que mantienen las
+    líneas (UPDATE sobre F('total')) con el valor viejo cargado en memoria.
+    Retorna True si lo excluyó; el llamador debe refrescarlo después.
+    """
+    if instancia._state.adding or kwargs.get('force_insert') or kwargs.get('update_fields') is not None:
+        return False
+    kwargs['update_fields'] = [
+        campo.name for campo in instancia._meta.concrete_fields
+        if not campo.primary_key and campo.name != 'total'
+    ]
+    return True
+
+
+class MetricasDashboardMixin:
+    """
+    Invalida la caché de métricas del dashboard de ventas cuando se crea el
+    documento o cambia su estado o total.
+    """
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        instancia._valores_metricas = (instancia.__dict__.get('estado'), instancia.__dict__.get('total'))
+        return instancia
+    
+    def _metricas_cambiaron(self):
+        return self._state.adding or getattr(self, '_valores_metricas', None) != (self.estado, self.total)
+    
+    def _invalidar_metricas(self):
+        from .metricas import invalidar_metricas_dashboard
+        transaction.on_commit(invalidar_metricas_dashboard)
+        self._valores_metricas = (self.estado, self.total)
 
 class Cotizacion(models.Model):
     numero = models.CharField(max_length=20, unique=True)
@@ -56,47 +125,31 @@ class Cotizacion(models.Model):
     total = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
     
     def save(self, *args, **kwargs):
-        if not self.numero:
-            self.numero = self.generar_numero()
-        super().save(*args, **kwargs)
-    
-    def generar_numero(self):
-        """Genera un número único para la cotización"""
+        with transaction.atomic():
+            if not self.numero:
+                self.numero = self.generar_numero()
+            total_protegido = _proteger_total(self, kwargs)
+            super().save(*args, **kwargs)
+            if total_protegido:
+                self.refresh_from_db(fields=['total'])
+    
+    @classmethod
+    def generar_numeros(cls, cantidad):
+        """Reserva un bloque de números de cotización del año actual (para creación masiva)"""
         from datetime import datetime
         
-        # Obtener año actual
         año_actual = datetime.now().year
-        
-        # Buscar el último número del año
-        prefijo = f"COT{año_actual}"
-        
-        ultimas_cotizaciones = Cotizacion.objects.filter(
-            numero__startswith=prefijo
-        ).order_by('-numero')
-        
-        if ultimas_cotizaciones.exists():
-            ultimo_numero = ultimas_cotizaciones.first().numero
-            try:
-                # Extraer el número secuencial
-                parte_numerica = ultimo_numero.replace(prefijo, '').lstrip('0') or '0'
-                siguiente_numero = int(parte_numerica) + 1
-            except ValueError:
-                siguiente_numero = 1
-        else:
-            siguiente_numero = 1
-        
-        # Formatear con ceros a la izquierda
-        numero_formateado = f"{prefijo}{siguiente_numero:03d}"
-        
-        # Verificar que no exista
-        while Cotizacion.objects.filter(numero=numero_formateado).exists():
-            siguiente_numero += 1
-            numero_formateado = f"{prefijo}{siguiente_numero:03d}"
-        
-        return numero_formateado
+        return reservar_numeros(cls, 'cotizacion', f"COT{año_actual}", cantidad, 3, año_actual)
+    
+    def generar_numero(self):
+        """Genera un número único para la cotización"""
+        return self.generar_numeros(1)[0]
     
     def calcular_totales(self):
-        """Calcula y actualiza el total de la cotización basado en sus items"""
+        """
+        Recalcula el total de la cotización sumando todos sus items. Las líneas ya
+        mantienen el total al guardarse; esto es para reparar descuadres.
+        """
         from django.db.models import Sum
         total_items = self.items.aggregate(
             total=Sum(F('cantidad') * F('precio_unitario'))
@@ -109,7 +162,7 @@ class Cotizacion(models.Model):
     def __str__(self):
         return self.numero
 
-class Pedido(models.Model):
+class Pedido(MetricasDashboardMixin, models.Model):
     ESTADO_CHOICES = [
         ('borrador', 'Borrador'),
         ('pendiente', 'Pendiente'),
@@ -126,8 +179,55 @@ class Pedido(models.Model):
     total = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
     asignado_a = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='pedidos_asignados')
     
+    class Meta:
+        # Paginación por cursor (fecha_creacion, id), con y sin filtro de estado
+        indexes = [
+            models.Index(fields=['fecha_creacion', 'id'], name='pedido_fecha_id_idx'),
+            models.Index(fields=['estado', 'fecha_creacion', 'id'], name='pedido_estado_fecha_id_idx'),
+        ]
+    
+    # Estados desde los que un pedido todavía se puede completar
+    ESTADOS_ABIERTOS = ('borrador', 'pendiente', 'proceso', 'en_proceso')
+    
+    def save(self, *args, **kwargs):
+        cambiaron = self._metricas_cambiaron()
+        with transaction.atomic():
+            total_protegido = _proteger_total(self, kwargs)
+            super().save(*args, **kwargs)
+            if total_protegido:
+                self.refresh_from_db(fields=['total'])
+        if cambiaron:
+            self._invalidar_metricas()
+    
+    def completar_reservando(self, bodega=None, usuario=None, estados_origen=('proceso',)):
+        """
+        Pasa el pedido a 'completado' y reserva el stock de todas sus líneas en
+        una sola transacción (si la reserva falla, el estado no cambia). El
+        estado cambia con un UPDATE condicional sobre ``estados_origen``, así
+        un doble envío reserva una sola vez. Retorna el dict de
+        ``reservar_pedido`` (``exito``, ``lineas``) con ``conflicto``: True si
+        el pedido ya no estaba en uno de ``estados_origen``. Una cantidad no
+        entera lanza ValidationError y deja el estado sin cambios.
+        """
+        from inventario.reservas import reservar_pedido
+        
+        with transaction.atomic():
+            cambiados = Pedido.objects.filter(pk=self.pk, estado__in=estados_origen).update(estado='completado')
+            if not cambiados:
+                return {'exito': False, 'lineas': [], 'conflicto': True}
+            resultado = reservar_pedido(self, bodega=bodega, usuario=usuario)
+            if not resultado['exito']:
+                transaction.set_rollback(True)
+                return {**resultado, 'conflicto': False}
+            self.estado = 'completado'
+            self._invalidar_metricas()
+        return {**resultado, 'conflicto': False}
+    
     def calcular_totales(self):
-        """Calcula y actualiza el total del pedido basado en sus items"""
+        """
+        Recalcula el total del pedido sumando todos sus items. Las líneas ya
+        mantienen el total al guardarse; esto es para reparar descuadres.
+        """
         from django.db.models import Sum
         total_items = self.items.aggregate(
             total=Sum(F('cantidad') * F('precio_unitario'))
@@ -140,55 +240,175 @@ class Pedido(models.Model):
     def __str__(self):
         return self.numero
 
-class Factura(models.Model):
+class Factura(MetricasDashboardMixin, models.Model):
     numero = models.CharField(max_length=20, unique=True)
     cliente = models.ForeignKey(Cliente, on_delete=models.CASCADE)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     estado = models.CharField(max_length=20, default='borrador')
     total = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
     
-    def save(self, *args, **kwargs):
-        if not self.numero:
-            self.numero = self.generar_numero()
-        super().save(*args, **kwargs)
+    # Estados en los que el contenido impreso ya no cambia (su PDF se guarda en caché)
+    ESTADOS_FINALIZADOS = ('emitida', 'pagada', 'cancelada')
     
-    def generar_numero(self):
-        """Genera un número único para la factura"""
+    class Meta:
+        # Paginación por cursor (fecha_creacion, id), con y sin filtro de estado
+        indexes = [
+            models.Index(fields=['fecha_creacion', 'id'], name='factura_fecha_id_idx'),
+            models.Index(fields=['estado', 'fecha_creacion', 'id'], name='factura_estado_fecha_id_idx'),
+        ]
+    
+    def save(self, *args, **kwargs):
+        cambiaron = self._metricas_cambiaron()
+        with transaction.atomic():
+            if not self.numero:
+                self.numero = self.generar_numero()
+            super().save(*args, **kwargs)
+        if cambiaron:
+            self._invalidar_metricas()
+            if self.estado in self.ESTADOS_FINALIZADOS:
+                # Dejar el PDF listo en caché para la impresión
+                from .pdf_facturas import programar_prerenderizado
+                factura_id = self.pk
+                transaction.on_commit(lambda: programar_prerenderizado(factura_id))
+    
+    @classmethod
+    def generar_numeros(cls, cantidad):
+        """Reserva un bloque de números de factura del año actual (para creación masiva)"""
         from datetime import datetime
         
-        # Obtener año actual
         año_actual = datetime.now().year
-        
-        # Buscar el último número del año
-        prefijo = f"FAC{año_actual}"
-        
-        ultimas_facturas = Factura.objects.filter(
-            numero__startswith=prefijo
-        ).order_by('-numero')
-        
-        if ultimas_facturas.exists():
-            ultimo_numero = ultimas_facturas.first().numero
-            try:
-                # Extraer el número secuencial
-                numero_secuencial = int(ultimo_numero.replace(prefijo, ""))
-                nuevo_numero = numero_secuencial + 1
-            except (ValueError, IndexError):
-                nuevo_numero = 1
-        else:
-            nuevo_numero = 1
-        
-        # Formatear con ceros a la izquierda
-        return f"{prefijo}{nuevo_numero:06d}"
+        return reservar_numeros(cls, 'factura', f"FAC{año_actual}", cantidad, 6, año_actual)
+    
+    def generar_numero(self):
+        """Genera un número único para la factura"""
+        return self.generar_numeros(1)[0]
     
     def __str__(self):
         return self.numero
 
-class ItemCotizacion(models.Model):
+class ItemConTotalIncrementalMixin:
+    """
+    Mantiene el ``total`` del documento padre al crear, modificar o eliminar
+    una línea: aplica la diferencia de subtotal con un UPDATE sobre
+    F('total') en la misma transacción, sin volver a sumar todas las líneas.
+    ``campo_documento`` es el nombre de la FK al documento.
+    """
+    campo_documento = None
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        campos = instancia.__dict__
+        if {'cantidad', 'precio_unitario', f'{cls.campo_documento}_id'} <= campos.keys():
+            instancia._aporte_guardado = (
+                campos[f'{cls.campo_documento}_id'], campos['cantidad'] * campos['precio_unitario']
+            )
+        return instancia
+    
+    def _aporte_en_bd(self):
+        """(documento_id, subtotal) de la línea tal como está guardada"""
+        if self._state.adding:
+            return None, 0
+        if hasattr(self, '_aporte_guardado'):
+            return self._aporte_guardado
+        fila = type(self).objects.filter(pk=self.pk).values_list(
+            f'{self.campo_documento}_id', 'cantidad', 'precio_unitario'
+        ).first()
+        return (fila[0], fila[1] * fila[2]) if fila else (None, 0)
+    
+    @classmethod
+    def _aplicar_delta(cls, documento_id, delta):
+        if documento_id is None or not delta:
+            return
+        modelo = cls._meta.get_field(cls.campo_documento).related_model
+        modelo.objects.filter(pk=documento_id).update(total=F('total') + delta)
+        if issubclass(modelo, MetricasDashboardMixin):
+            from .metricas import invalidar_metricas_dashboard
+            transaction.on_commit(invalidar_metricas_dashboard)
+    
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        relevantes = {'cantidad', 'precio_unitario', self.campo_documento, f'{self.campo_documento}_id'}
+        if update_fields is not None and not relevantes & set(update_fields):
+            return super().save(*args, **kwargs)
+        
+        with transaction.atomic():
+            documento_anterior, subtotal_anterior = self._aporte_en_bd()
+            super().save(*args, **kwargs)
+            documento_id = getattr(self, f'{self.campo_documento}_id')
+            if documento_anterior == documento_id:
+                self._aplicar_delta(documento_id, self.subtotal - subtotal_anterior)
+            else:
+                self._aplicar_delta(documento_anterior, -subtotal_anterior)
+                self._aplicar_delta(documento_id, self.subtotal)
+        self._aporte_guardado = (documento_id, self.subtotal)
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            documento_id, subtotal = self._aporte_en_bd()
+            resultado = super().delete(*args, **kwargs)
+            self._aplicar_delta(documento_id, -subtotal)
+        return resultado
+    
+    @classmethod
+    def eliminar_lineas(cls, queryset):
+        """Elimina varias líneas descontando sus subtotales de cada documento (QuerySet.delete() no lo hace)"""
+        campo = f'{cls.campo_documento}_id'
+        with transaction.atomic():
+            subtotales = list(
+                queryset.order_by().values(campo).annotate(subtotal=models.Sum(F('cantidad') * F('precio_unitario')))
+            )
+            resultado = queryset.delete()
+            for fila in subtotales:
+                cls._aplicar_delta(fila[campo], -fila['subtotal'])
+        return resultado
+
+    @classmethod
+    def _total_real(cls):
+        """Subconsulta con la suma de subtotales de las líneas de cada documento"""
+        from django.db.models import DecimalField, OuterRef, Subquery
+        from django.db.models.functions import Coalesce
+        
+        suma = cls.objects.filter(**{cls.campo_documento: OuterRef('pk')}).order_by().values(
+            cls.campo_documento
+        ).annotate(
+            total=models.Sum(F('cantidad') * F('precio_unitario'))
+        ).values('total')
+        return Coalesce(
+            Subquery(suma, output_field=DecimalField(max_digits=12, decimal_places=2)),
+            Decimal('0.00'),
+            output_field=DecimalField(max_digits=12, decimal_places=2)
+        )
+    
+    @classmethod
+    def recalcular_totales(cls, documentos=None):
+        """
+        Recalcula el total de los documentos (todos si ``documentos`` es None)
+        con un único UPDATE. Retorna la cantidad de documentos actualizados.
+        """
+        modelo = cls._meta.get_field(cls.campo_documento).related_model
+        documentos = modelo.objects.all() if documentos is None else documentos
+        actualizados = documentos.update(total=cls._total_real())
+        if issubclass(modelo, MetricasDashboardMixin):
+            from .metricas import invalidar_metricas_dashboard
+            transaction.on_commit(invalidar_metricas_dashboard)
+        return actualizados
+    
+    @classmethod
+    def descuadres(cls, documentos):
+        """Documentos cuyo total guardado no coincide con la suma de sus líneas (anotados con ``total_real``)"""
+        return list(
+            documentos.annotate(total_real=cls._total_real()).exclude(total=F('total_real'))
+        )
+
+class ItemCotizacion(ItemConTotalIncrementalMixin, models.Model):
     cotizacion = models.ForeignKey(Cotizacion, on_delete=models.CASCADE, related_name='items')
     producto = models.ForeignKey('inventario.Producto', on_delete=models.CASCADE)
     cantidad = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('1.00'))
     precio_unitario = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
     
+    campo_documento = 'cotizacion'
+    
     @property
     def subtotal(self):
         return self.cantidad * self.precio_unitario
@@ -196,12 +416,14 @@ class ItemCotizacion(models.Model):
     def __str__(self):
         return f"{self.producto.nombre} - {self.cotizacion.numero}"
 
-class ItemPedido(models.Model):
+class ItemPedido(ItemConTotalIncrementalMixin, models.Model):
     pedido = models.ForeignKey(Pedido, on_delete=models.CASCADE, related_name='items')
     producto = models.ForeignKey('inventario.Producto', on_delete=models.CASCADE)
     cantidad = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('1.00'))
     precio_unitario = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
     
+    campo_documento = 'pedido'
+    
     @property
     def subtotal(self):
         return self.cantidad * self.precio_unitario
@@ -225,46 +447,77 @@ class Entrega(models.Model):
     telefono_contacto = models.CharField(max_length=20)
     fecha_programada = models.DateTimeField()
     estado = models.CharField(max_length=20, default='programada')
+    # Posición en la ruta del repartidor asignada por el despacho del día (ventas.despacho)
+    orden_ruta = models.PositiveIntegerField(null=True, blank=True)
+    # Salida (en_ruta) y llegada (entregada): ventana del recorrido GPS (ventas.seguimiento_gps)
+    fecha_inicio = models.DateTimeField(null=True, blank=True)
+    fecha_entrega = models.DateTimeField(null=True, blank=True)
     
     def save(self, *args, **kwargs):
-        if not self.numero:
-            self.numero = self.generar_numero()
-        super().save(*args, **kwargs)
-    
-    def generar_numero(self):
-        """Genera un número único para la entrega"""
+        with transaction.atomic():
+            if not self.numero:
+                self.numero = self.generar_numero()
+            super().save(*args, **kwargs)
+    
+    @classmethod
+    def generar_numeros(cls, cantidad):
+        """Reserva un bloque de números de entrega del año actual (para creación masiva)"""
         from datetime import datetime
         
-        # Obtener año actual
         año_actual = datetime.now().year
-        
-        # Buscar el último número del año
-        prefijo = f"ENT{año_actual}"
-        
-        ultimas_entregas = Entrega.objects.filter(
-            numero__startswith=prefijo
-        ).order_by('-numero')
-        
-        if ultimas_entregas.exists():
-            ultimo_numero = ultimas_entregas.first().numero
-            try:
-                # Extraer el número secuencial
-                parte_numerica = ultimo_numero.replace(prefijo, '').lstrip('0') or '0'
-                siguiente_numero = int(parte_numerica) + 1
-            except ValueError:
-                siguiente_numero = 1
-        else:
-            siguiente_numero = 1
-        
-        # Formatear con ceros a la izquierda
-        numero_formateado = f"{prefijo}{siguiente_numero:03d}"
-        
-        # Verificar que no exista
-        while Entrega.objects.filter(numero=numero_formateado).exists():
-            siguiente_numero += 1
-            numero_formateado = f"{prefijo}{siguiente_numero:03d}"
-        
-        return numero_formateado
+        return reservar_numeros(cls, 'entrega', f"ENT{año_actual}", cantidad, 3, año_actual)
+    
+    def generar_numero(self):
+        """Genera un número único para la entrega"""
+        return self.generar_numeros(1)[0]
+    
+    @classmethod
+    def crear_en_lote(cls, pedido_ids, repartidor, fecha_programada, estado='asignada'):
+        """
+        Crea una entrega por pedido en una sola transacción: clientes cargados
+        con el pedido, un bloque de números y un bulk_create. Los pedidos deben
+        estar completados y sin entrega; si alguno no lo está se lanza
+        ValueError y no se crea ninguna. Retorna las entregas (con id) en el
+        orden de ``pedido_ids``.
+        """
+        pedido_ids = list(dict.fromkeys(int(pk) for pk in pedido_ids))
+        with transaction.atomic():
+            pedidos = {
+                pedido.pk: pedido
+                for pedido in Pedido.objects.select_for_update(of=('self',)).select_related('cliente').filter(
+                    id__in=pedido_ids, estado='completado', entregas__isnull=True
+                )
+            }
+            if len(pedidos) != len(pedido_ids):
+                raise ValueError('Algunos pedidos ya no están disponibles')
+
+            numeros = cls.generar_numeros(len(pedido_ids))
+            entregas = [
+                cls(
+                    numero=numero,
+                    pedido=pedidos[pk],
+                    repartidor=repartidor,
+                    direccion_entrega=pedidos[pk].cliente.direccion,
+                    telefono_contacto=pedidos[pk].cliente.telefono,
+                    estado=estado,
+                    fecha_programada=fecha_programada,
+                )
+                for pk, numero in zip(pedido_ids, numeros)
+            ]
+            return cls.objects.bulk_create(entregas)
+    
+    @classmethod
+    def con_conciliacion(cls, queryset=None):
+        """
+        Carga en bloque los items del pedido y los rechazos de cada entrega,
+        para conciliar (get_items_entregados_efectivamente, get_total_rechazado)
+        muchas entregas con un número fijo de consultas
+        """
+        queryset = cls.objects.all() if queryset is None else queryset
+        return queryset.select_related('pedido__cliente').prefetch_related(
+            models.Prefetch('pedido__items', queryset=ItemPedido.objects.select_related('producto')),
+            models.Prefetch('items_rechazados', queryset=ItemRechazado.objects.select_related('item_pedido')),
+        )
     
     def __str__(self):
         return self.numero
@@ -273,17 +526,26 @@ class Entrega(models.Model):
         """Obtiene los items del pedido que pueden ser rechazados"""
         return self.pedido.items.all()
     
+    def _rechazos_cargados(self):
+        return 'items_rechazados' in getattr(self, '_prefetched_objects_cache', {})
+    
+    def rechazos_por_item(self):
+        """{item_pedido_id: rechazo} de la entrega (usa los rechazos precargados si los hay)"""
+        return {rechazo.item_pedido_id: rechazo for rechazo in self.items_rechazados.all()}
+    
     def get_total_rechazado(self):
         """Calcula el valor total de items rechazados"""
-        total = sum(item.valor_rechazado for item in self.items_rechazados.all())
-        return total
+        if self._rechazos_cargados():
+            return sum((item.valor_rechazado for item in self.items_rechazados.all()), Decimal('0.00'))
+        return self.items_rechazados.aggregate(total=ItemRechazado.VALOR_RECHAZADO)['total'] or Decimal('0.00')
     
     def get_items_entregados_efectivamente(self):
         """Obtiene los items que efectivamente se entregaron (no rechazados)"""
+        rechazos = self.rechazos_por_item()
         items_entregados = []
         for item in self.pedido.items.all():
             # Verificar si hay rechazo para este item
-            rechazo = self.items_rechazados.filter(item_pedido=item).first()
+            rechazo = rechazos.get(item.pk)
             if rechazo:
                 cantidad_entregada = item.cantidad - rechazo.cantidad_rechazada
                 if cantidad_entregada > 0:
@@ -302,6 +564,8 @@ class Entrega(models.Model):
     
     def tiene_items_rechazados(self):
         """Verifica si la entrega tiene items rechazados"""
+        if self._rechazos_cargados():
+            return bool(self.items_rechazados.all())
         return self.items_rechazados.exists()
 
 
@@ -332,7 +596,203 @@ class ItemRechazado(models.Model):
     def __str__(self):
         return f"{self.item_pedido.producto.nombre} - {self.cantidad_rechazada} rechazado(s) en {self.entrega.numero}"
     
+    # Valor rechazado calculado en la base de datos (para agregados)
+    VALOR_RECHAZADO = models.Sum(
+        F('cantidad_rechazada') * F('item_pedido__precio_unitario'),
+        output_field=models.DecimalField(max_digits=14, decimal_places=2),
+    )
+    
     @property
     def valor_rechazado(self):
         """Calcula el valor monetario de los items rechazados"""
         return self.cantidad_rechazada * self.item_pedido.precio_unitario
+    
+    @classmethod
+    def resumen(cls, queryset=None):
+        """
+        Totales y valor rechazado agrupado por motivo, producto y repartidor,
+        una consulta agregada por grupo sin importar cuántas entregas haya
+        """
+        queryset = cls.objects.all() if queryset is None else queryset
+        totales = queryset.aggregate(
+            total_items=models.Count('pk'),
+            valor_total=cls.VALOR_RECHAZADO,
+            entregas=models.Count('entrega', distinct=True),
+        )
+        motivos = dict(cls.MOTIVOS_RECHAZO)
+        
+        def agrupar(*campos):
+            return list(
+                queryset.values(*campos).annotate(
+                    items=models.Count('pk'),
+                    cantidad=models.Sum('cantidad_rechazada'),
+                    valor=cls.VALOR_RECHAZADO,
+                ).order_by('-valor', *campos)
+            )
+        
+        por_motivo = agrupar('motivo')
+        for fila in por_motivo:
+            fila['motivo_display'] = motivos.get(fila['motivo'], fila['motivo'])
+        
+        return {
+            'total_items': totales['total_items'],
+            'valor_total': totales['valor_total'] or Decimal('0.00'),
+            'entregas': totales['entregas'],
+            'por_motivo': por_motivo,
+            'por_producto': agrupar('item_pedido__producto_id', 'item_pedido__producto__codigo', 'item_pedido__producto__nombre'),
+            'por_repartidor': agrupar(
+                'entrega__repartidor_id', 'entrega__repartidor__first_name',
+                'entrega__repartidor__last_name', 'entrega__repartidor__username'
+            ),
+        }
+
+
+class PosicionRepartidor(models.Model):
+    """
+    Historial GPS de los repartidores, una fila por ping. Se escribe en
+    bloque desde el buffer de ventas.seguimiento_gps; la última posición
+    queda además en el usuario.
+    """
+    repartidor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='posiciones_gps')
+    latitud = models.DecimalField(max_digits=10, decimal_places=7)
+    longitud = models.DecimalField(max_digits=10, decimal_places=7)
+    registrada = models.DateTimeField(help_text='Hora del ping en el dispositivo')
+    
+    class Meta:
+        verbose_name = 'Posición de repartidor'
+        verbose_name_plural = 'Posiciones de repartidores'
+        indexes = [
+            models.Index(fields=['repartidor', 'registrada'], name='posicion_repartidor_fecha_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.repartidor_id} @ {self.registrada:%Y-%m-%d %H:%M:%S} ({self.latitud}, {self.longitud})"
+
+
+class SecuenciaDocumento(models.Model):
+    """
+    Contador de numeración por tipo de documento y periodo (año, o día en
+    órdenes de compra). El incremento es un UPDATE atómico sobre una sola
+    fila: no hay que buscar el último número ni reintentar por colisiones, y
+    como se hace dentro de la transacción que guarda el documento, un
+    rollback devuelve el número (numeración sin huecos).
+    """
+    tipo = models.CharField(max_length=30)
+    periodo = models.CharField(max_length=10)
+    ultimo_valor = models.PositiveBigIntegerField(default=0)
+    
+    class Meta:
+        verbose_name = "Secuencia de Documento"
+        verbose_name_plural = "Secuencias de Documentos"
+        unique_together = [['tipo', 'periodo']]
+    
+    def __str__(self):
+        return f"{self.tipo} {self.periodo}: {self.ultimo_valor}"
+    
+    @classmethod
+    def reservar(cls, tipo, periodo, cantidad=1, inicial=None):
+        """
+        Reserva ``cantidad`` números consecutivos y retorna un range con ellos.
+        
+        ``inicial`` es un callable que retorna el último número ya usado; solo
+        se invoca la primera vez que se usa el (tipo, periodo), para continuar
+        la numeración de documentos creados antes de existir la secuencia.
+        Debe llamarse dentro de la transacción que guarda los documentos.
+        """
+        from django.db import IntegrityError, transaction
+        
+        periodo = str(periodo)
+        secuencia = cls.objects.filter(tipo=tipo, periodo=periodo)
+        with transaction.atomic():
+            if not secuencia.update(ultimo_valor=F('ultimo_valor') + cantidad):
+                base = inicial() if inicial else 0
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(tipo=tipo, periodo=periodo, ultimo_valor=base + cantidad)
+                    return range(base + 1, base + cantidad + 1)
+                except IntegrityError:
+                    # Otra transacción creó la secuencia al mismo tiempo
+                    secuencia.update(ultimo_valor=F('ultimo_valor') + cantidad)
+            ultimo = secuencia.values_list('ultimo_valor', flat=True).get()
+        return range(ultimo - cantidad + 1, ultimo + 1)
+    
+    @staticmethod
+    def ultimo_numero(queryset, prefijo, campo='numero'):
+        """Mayor número secuencial ya usado con ese prefijo (comparación numérica, no de texto)"""
+        maximo = 0
+        for numero in queryset.filter(**{f'{campo}__startswith': prefijo}).values_list(campo, flat=True).iterator():
+            sufijo = numero[len(prefijo):].lstrip('-')
+            if sufijo.isdigit():
+                maximo = max(maximo, int(sufijo))
+        return maximo
+
+
+def reservar_numeros(modelo, tipo, prefijo, cantidad, digitos, periodo):
+    """
+    Reserva ``cantidad`` números consecutivos de un tipo de documento con la
+    secuencia del periodo y los retorna formateados (prefijo + número con ceros).
+    """
+    numeros = SecuenciaDocumento.reservar(
+        tipo, periodo, cantidad,
+        inicial=lambda: SecuenciaDocumento.ultimo_numero(modelo.objects.all(), prefijo)
+    )
+    return [f"{prefijo}{numero:0{digitos}d}" for numero in numeros]
+
+
+class TrabajoExportacion(models.Model):
+    """
+    Exportación (Excel, CSV o lote de facturas en PDF/ZIP) procesada en segundo plano. La tabla es la cola:
+    un worker toma el trabajo pendiente más antiguo con un UPDATE condicional,
+    así dos workers nunca procesan el mismo, escribe el archivo en
+    MEDIA_ROOT/exportaciones y va dejando el avance en ``filas_procesadas``
+    y ``ultimo_latido``. Cada toma incrementa ``intento``: las escrituras de
+    un intento reencolado ya no afectan al trabajo.
+    """
+    ESTADO_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('procesando', 'Procesando'),
+        ('completado', 'Completado'),
+        ('error', 'Error'),
+    ]
+    
+    FORMATO_CHOICES = [
+        ('excel', 'Excel'),
+        ('csv', 'CSV'),
+        ('pdf', 'PDF'),
+        ('zip', 'ZIP'),
+    ]
+    
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='exportaciones')
+    tipo = models.CharField(max_length=30)
+    formato = models.CharField(max_length=10, choices=FORMATO_CHOICES)
+    parametros = models.JSONField(default=dict, blank=True)
+    huella = models.CharField(max_length=64, db_index=True, help_text="Hash de usuario, tipo, formato y filtros")
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='pendiente')
+    total_filas = models.PositiveIntegerField(null=True, blank=True)
+    filas_procesadas = models.PositiveIntegerField(default=0)
+    archivo = models.FileField(upload_to='exportaciones/', blank=True)
+    nombre_archivo = models.CharField(max_length=150, blank=True)
+    error = models.TextField(blank=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_inicio = models.DateTimeField(null=True, blank=True)
+    fecha_fin = models.DateTimeField(null=True, blank=True)
+    ultimo_latido = models.DateTimeField(null=True, blank=True, help_text="Último avance reportado por el worker")
+    intento = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        verbose_name = "Trabajo de Exportación"
+        verbose_name_plural = "Trabajos de Exportación"
+        ordering = ['-fecha_creacion']
+        indexes = [models.Index(fields=['estado', 'fecha_creacion'])]
+    
+    def __str__(self):
+        return f"{self.tipo} ({self.formato}) - {self.get_estado_display()}"
+    
+    @property
+    def progreso(self):
+        """Porcentaje de filas escritas (0-100)"""
+        if self.estado == 'completado':
+            return 100
+        if not self.total_filas:
+            return 0
+        return min(99, int(self.filas_procesadas * 100 / self.total_filas))
@@ -0,0 +1,158 @@
+"""
+Optimización del orden de paradas de una ruta de entregas
+
+La matriz de distancias sale del caché de ``accounts.distancias`` (las
+paradas de un repartidor se repiten entre consultas del día). El recorrido
+inicial es el de vecino más cercano, y se mejora con búsqueda local:
+
+* 2-opt: invertir un tramo de la ruta.
+* Or-opt: mover de 1 a 3 paradas seguidas a otro punto, al derecho o al revés.
+
+La mejora sigue hasta que ninguna jugada acorta la ruta o se agota
+``tiempo_limite``. La ruta sale de un origen fijo. Puede terminar en la
+última parada o regresar a un destino, normalmente la bodega.
+"""
+
+import time
+
+import numpy as np
+
+from accounts.distancias import matriz_distancias
+
+TIEMPO_LIMITE_SEGUNDOS = 0.5
+LARGO_MAXIMO_OR_OPT = 3
+_EPSILON = 1e-9
+
+
+def _vecino_mas_cercano(matriz, n):
+    """Recorrido [0, paradas 1..n, n+1] eligiendo siempre la parada más cercana"""
+    visitado = np.zeros(n + 2, dtype=bool)
+    visitado[0] = visitado[n + 1] = True
+    recorrido = [0]
+    actual = 0
+    for _ in range(n):
+        actual = int(np.argmin(np.where(visitado, np.inf, matriz[actual])))
+        visitado[actual] = True
+        recorrido.append(actual)
+    recorrido.append(n + 1)
+    return np.array(recorrido)
+
+
+def _largo(matriz, recorrido):
+    return float(matriz[recorrido[:-1], recorrido[1:]].sum())
+
+
+def _dos_opt(matriz, recorrido, limite):
+    """Una pasada de 2-opt: para cada i invierte el tramo i..j que más acorta. Retorna si hubo mejora."""
+    mejoro = False
+    n = len(recorrido) - 2
+    for i in range(1, n):
+        if time.perf_counter() > limite:
+            break
+        a, b = recorrido[i - 1], recorrido[i]
+        j = np.arange(i + 1, n + 1)
+        c, d = recorrido[j], recorrido[j + 1]
+        delta = matriz[a, c] + matriz[b, d] - matriz[a, b] - matriz[c, d]
+        mejor = int(np.argmin(delta))
+        if delta[mejor] < -_EPSILON:
+            fin = j[mejor]
+            recorrido[i:fin + 1] = recorrido[i:fin + 1][::-1].copy()
+            mejoro = True
+    return mejoro
+
+
+def _or_opt(matriz, recorrido, limite):
+    """Una pasada de Or-opt: mueve cada tramo de 1 a 3 paradas a la arista donde más acorta. Retorna si hubo mejora."""
+    mejoro = False
+    n = len(recorrido) - 2
+    for largo in range(1, LARGO_MAXIMO_OR_OPT + 1):
+        for i in range(1, n - largo + 2):
+            if time.perf_counter() > limite:
+                return mejoro
+            fin = i + largo - 1
+            anterior, primero, ultimo, siguiente = recorrido[i - 1], recorrido[i], recorrido[fin], recorrido[fin + 1]
+            ganancia = matriz[anterior, primero] + matriz[ultimo, siguiente] - matriz[anterior, siguiente]
+
+            # Aristas (u, v) de la ruta sin el tramo; la i-1 es donde estaba
+            resto = np.concatenate((recorrido[:i], recorrido[fin + 1:]))
+            u, v = resto[:-1], resto[1:]
+            costo = matriz[u, primero] + matriz[ultimo, v] - matriz[u, v]
+            costo_invertido = matriz[u, ultimo] + matriz[primero, v] - matriz[u, v]
+            costo[i - 1] = costo_invertido[i - 1] = np.inf
+
+            mejor = int(np.argmin(np.minimum(costo, costo_invertido)))
+            invertir = costo_invertido[mejor] < costo[mejor]
+            if ganancia - min(costo[mejor], costo_invertido[mejor]) > _EPSILON:
+                tramo = recorrido[i:fin + 1][::-1] if invertir else recorrido[i:fin + 1]
+                recorrido[:] = np.concatenate((resto[:mejor + 1], tramo, resto[mejor + 1:]))
+                mejoro = True
+    return mejoro
+
+
+def optimizar_recorrido(origen, puntos, destino=None, tiempo_limite=TIEMPO_LIMITE_SEGUNDOS):
+    """
+    Orden de visita de ``puntos`` (lista de (lat, lng)) saliendo de ``origen``.
+
+    Con ``destino`` la ruta termina ahí (regreso a bodega); sin él termina en
+    la última parada. Retorna un dict con ``orden`` (índices de ``puntos``),
+    ``tramos`` (km de cada parada desde la anterior), ``distancia_total``,
+    ``distancia_regreso``, ``distancia_vecino_mas_cercano``, ``ahorro_km`` y
+    ``ahorro_porcentaje``.
+    """
+    n = len(puntos)
+    coordenadas = [origen, *puntos, destino or origen]
+    matriz = matriz_distancias([punto[0] for punto in coordenadas], [punto[1] for punto in coordenadas])
+    if destino is None:
+        # Nodo final ficticio a distancia 0 de todos: la ruta queda abierta
+        matriz[:, n + 1] = 0
+        matriz[n + 1, :] = 0
+
+    limite = time.perf_counter() + tiempo_limite
+    recorrido = _vecino_mas_cercano(matriz, n)
+    distancia_inicial = _largo(matriz, recorrido)
+    mejoro = n > 1
+    while mejoro and time.perf_counter() < limite:
+        mejoro = _dos_opt(matriz, recorrido, limite)
+        mejoro = _or_opt(matriz, recorrido, limite) or mejoro
+
+    distancia = _largo(matriz, recorrido)
+    ahorro = distancia_inicial - distancia
+    return {
+        'orden': [int(nodo) - 1 for nodo in recorrido[1:-1]],
+        'tramos': [round(float(tramo), 2) for tramo in matriz[recorrido[:-2], recorrido[1:-1]]],
+        'distancia_total': round(distancia, 2),
+        'distancia_regreso': round(float(matriz[recorrido[-2], recorrido[-1]]), 2),
+        'distancia_vecino_mas_cercano': round(distancia_inicial, 2),
+        'ahorro_km': round(ahorro, 2),
+        'ahorro_porcentaje': round(100 * ahorro / distancia_inicial, 1) if distancia_inicial else 0,
+    }
+
+
+def optimizar_paradas(paradas, origen=None, destino=None, tiempo_limite=TIEMPO_LIMITE_SEGUNDOS):
+    """
+    Como ``rutas.ordenar_paradas`` pero con el orden mejorado por 2-opt y
+    Or-opt. Retorna (ordenadas, resumen): las copias de las paradas con
+    ``orden`` y ``distancia_desde_anterior`` (las que no tienen coordenadas
+    van al final con ``sin_gps``) y el resumen de distancias y ahorro de
+    ``optimizar_recorrido``.
+    """
+    con_gps = [p for p in paradas if p.get('lat') is not None and p.get('lng') is not None]
+    sin_gps = [p for p in paradas if p.get('lat') is None or p.get('lng') is None]
+    if origen is None and con_gps:
+        origen = (con_gps[0]['lat'], con_gps[0]['lng'])
+
+    if con_gps:
+        resultado = optimizar_recorrido(origen, [(p['lat'], p['lng']) for p in con_gps], destino, tiempo_limite)
+    else:
+        resultado = {
+            'orden': [], 'tramos': [], 'distancia_total': 0, 'distancia_regreso': 0,
+            'distancia_vecino_mas_cercano': 0, 'ahorro_km': 0, 'ahorro_porcentaje': 0,
+        }
+
+    ordenadas = [
+        {**con_gps[indice], 'orden': posicion, 'distancia_desde_anterior': tramo}
+        for posicion, (indice, tramo) in enumerate(zip(resultado.pop('orden'), resultado.pop('tramos')), start=1)
+    ]
+    for parada in sin_gps:
+        ordenadas.append({**parada, 'orden': len(ordenadas) + 1, 'distancia_desde_anterior': 0, 'sin_gps': True})
+    return ordenadas, resultado
@@ -0,0 +1,148 @@
+"""
+Paginación por cursor (keyset) para listados que crecen sin fin
+
+En lugar de ``OFFSET`` + ``COUNT(*)`` por página, cada página continúa
+desde la última fila vista con ``(fecha, id) < (fecha_cursor, id_cursor)``
+sobre un índice compuesto, así la página N cuesta lo mismo que la primera.
+El cursor es opaco para el cliente (base64 de la fecha y el id). El total se
+calcula una sola vez, en la primera página, y se limita a ``LIMITE_CONTEO``
+filas (o se estima en PostgreSQL cuando no hay filtros).
+"""
+
+import base64
+import json
+
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+TAMANO_POR_DEFECTO = 20
+TAMANO_MAXIMO = 200
+LIMITE_CONTEO = 10000
+
+# Parámetros de la URL que no se conservan al pedir la siguiente página
+PARAMETROS_PAGINA = ('cursor', 'page', 'conteo')
+
+
+def codificar_cursor(fecha, pk):
+    contenido = json.dumps([fecha.isoformat(), str(pk)])
+    return base64.urlsafe_b64encode(contenido.encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """(fecha, pk) de un cursor, o None si no hay cursor o no es válido (se vuelve a la primera página)"""
+    if not cursor:
+        return None
+    try:
+        contenido = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        fecha, pk = json.loads(contenido)
+        fecha = parse_datetime(fecha)
+        pk = int(pk)
+    except (ValueError, TypeError):
+        return None
+    return (fecha, pk) if fecha else None
+
+
+def tamano_pagina(valor, por_defecto=TAMANO_POR_DEFECTO):
+    """Tamaño de página pedido por el cliente, acotado a 1..TAMANO_MAXIMO"""
+    try:
+        return max(1, min(int(valor), TAMANO_MAXIMO))
+    except (TypeError, ValueError):
+        return por_defecto
+
+
+def pagina_keyset(queryset, campo_fecha, cursor=None, tamano=TAMANO_POR_DEFECTO):
+    """
+    Página de ``queryset`` en orden (-campo_fecha, -pk) que sigue al cursor.
+
+    Retorna un dict con ``objetos``, ``has_next``, ``siguiente_cursor`` (None
+    en la última página) y ``primera``. Se lee una fila de más para saber si
+    hay otra página, sin contar.
+    """
+    queryset = queryset.order_by(f'-{campo_fecha}', '-pk')
+    posicion = decodificar_cursor(cursor)
+    if posicion:
+        fecha, pk = posicion
+        queryset = queryset.filter(
+            Q(**{f'{campo_fecha}__lt': fecha}) | Q(**{campo_fecha: fecha, 'pk__lt': pk})
+        )
+
+    objetos = list(queryset[:tamano + 1])
+    has_next = len(objetos) > tamano
+    objetos = objetos[:tamano]
+    return {
+        'objetos': objetos,
+        'has_next': has_next,
+        'siguiente_cursor': codificar_cursor(getattr(objetos[-1], campo_fecha), objetos[-1].pk) if has_next else None,
+        'primera': posicion is None,
+    }
+
+
+def _formato_miles(numero):
+    return f"{numero:,}".replace(',', '.')
+
+
+def _estimado_postgres(queryset):
+    conexion = connections[queryset.db]
+    if conexion.vendor != 'postgresql' or queryset.query.where:
+        return None
+    with conexion.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+            [queryset.model._meta.db_table],
+        )
+        fila = cursor.fetchone()
+    return fila[0] if fila and fila[0] > 0 else None
+
+
+def conteo_aproximado(queryset, limite=LIMITE_CONTEO, exacto=False):
+    """
+    Total de filas sin recorrer toda la tabla: con ``exacto=False`` cuenta
+    hasta ``limite`` filas (o usa la estimación de PostgreSQL si la tabla no
+    está filtrada). Retorna ``valor``, ``exacto`` y ``texto`` para mostrar.
+    """
+    if exacto:
+        valor = queryset.order_by().count()
+        return {'valor': valor, 'exacto': True, 'texto': _formato_miles(valor)}
+
+    estimado = _estimado_postgres(queryset)
+    if estimado and estimado > limite:
+        return {'valor': estimado, 'exacto': False, 'texto': f"~{_formato_miles(estimado)}"}
+
+    valor = queryset.order_by()[:limite + 1].count()
+    if valor > limite:
+        return {'valor': limite, 'exacto': False, 'texto': f"{_formato_miles(limite)}+"}
+    return {'valor': valor, 'exacto': True, 'texto': _formato_miles(valor)}
+
+
+def url_siguiente(request, cursor):
+    """Query string de la página siguiente conservando los filtros actuales"""
+    parametros = request.GET.copy()
+    for nombre in PARAMETROS_PAGINA:
+        parametros.pop(nombre, None)
+    parametros['cursor'] = cursor
+    return f"?{parametros.urlencode()}"
+
+
+class PaginacionKeysetMixin:
+    """
+    Para ListView: pagina por cursor sobre (``campo_fecha_keyset``, id) en vez
+    de número de página. En el contexto deja ``page_obj`` (dict de
+    ``pagina_keyset``), ``url_siguiente`` para "Cargar más" y, solo en la
+    primera página, ``conteo`` (``?conteo=exacto`` para el total exacto).
+    """
+    campo_fecha_keyset = 'fecha_creacion'
+
+    def paginate_queryset(self, queryset, page_size):
+        pagina = pagina_keyset(queryset, self.campo_fecha_keyset, self.request.GET.get('cursor'), page_size)
+        return None, pagina, pagina['objetos'], pagina['has_next']
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        pagina = context['page_obj']
+        context['url_siguiente'] = url_siguiente(self.request, pagina['siguiente_cursor']) if pagina['has_next'] else None
+        if pagina['primera']:
+            context['conteo'] = conteo_aproximado(
+                self.object_list, exacto=self.request.GET.get('conteo') == 'exacto'
+            )
+        return context
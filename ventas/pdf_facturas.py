@@ -0,0 +1,352 @@
+"""
+Generación de PDF de facturas con caché en disco
+
+El PDF de una factura finalizada (emitida, pagada o cancelada) se guarda en
+``PDF_CACHE_DIR/facturas/<id>-<huella>.pdf``; la huella es un hash del
+contenido impreso, así que cualquier cambio (estado, cliente, items) genera
+un archivo nuevo y el anterior se borra. Las facturas se pre-renderizan al
+emitirse.
+
+La impresión por lotes produce un ZIP (un PDF por factura, leído de la caché)
+o un único PDF para imprimir; este último se guarda en
+``PDF_CACHE_DIR/lotes`` con la huella de todas sus facturas. Los lotes
+grandes se procesan en la cola de ``trabajos_exportacion``, fuera de la
+petición web; el worker ``procesar_exportaciones --procesos N`` mantiene un
+pool de procesos de larga vida con el que reparte el ZIP por bloques. El PDF
+único es un solo documento ReportLab y se construye en un proceso.
+"""
+
+import hashlib
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from decimal import Decimal
+from io import BytesIO
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.db import connections
+
+from .models import Factura
+
+logger = logging.getLogger(__name__)
+
+IVA_PORCENTAJE = Decimal('0.19')
+TAMANO_BLOQUE = 50
+MINIMO_PARA_PROCESOS = 100
+# Segundos que se conserva un PDF de lote sin volver a pedirse
+VIGENCIA_LOTES = 24 * 60 * 60
+
+_prerenderizador = ThreadPoolExecutor(max_workers=1)
+# Pool de procesos del worker de la cola (ver ``iniciar_pool``); nunca se crea en una petición web
+_pool = None
+
+
+def _directorio_cache(subcarpeta='facturas'):
+    directorio = Path(getattr(settings, 'PDF_CACHE_DIR', Path(settings.MEDIA_ROOT) / 'pdf_cache')) / subcarpeta
+    directorio.mkdir(parents=True, exist_ok=True)
+    return directorio
+
+
+def _cargar(facturas):
+    return facturas.select_related('cliente').prefetch_related('items')
+
+
+def huella_factura(factura):
+    """Hash del contenido que aparece en el PDF (usa los items precargados)"""
+    cliente = factura.cliente
+    partes = [
+        factura.numero, factura.estado, str(factura.total), factura.fecha_creacion.isoformat(),
+        cliente.nombre_completo, cliente.numero_documento, cliente.telefono or '', cliente.direccion or '',
+    ]
+    partes += [f'{item.id}:{item.cantidad}:{item.precio}' for item in factura.items.all()]
+    return hashlib.sha256('\x1f'.join(partes).encode()).hexdigest()[:16]
+
+
+# ============= RENDERIZADO =============
+
+def _elementos_factura(factura, styles):
+    """Flowables de ReportLab de una factura (se usan solos o concatenados en un lote)"""
+    from reportlab.lib import colors
+    from reportlab.platypus import Paragraph, Spacer, Table, TableStyle
+
+    elements = []
+
+    # Título
+    elements.append(Paragraph(f"FACTURA {factura.numero}", styles['Title']))
+    elements.append(Spacer(1, 12))
+
+    # Información del cliente
+    cliente_info = f"""
+    <b>Cliente:</b> {factura.cliente.nombre_completo}<br/>
+    <b>Documento:</b> {factura.cliente.numero_documento}<br/>
+    <b>Teléfono:</b> {factura.cliente.telefono}<br/>
+    <b>Dirección:</b> {factura.cliente.direccion}
+    """
+    elements.append(Paragraph(cliente_info, styles['Normal']))
+    elements.append(Spacer(1, 12))
+
+    # Información de la factura
+    factura_info = f"""
+    <b>Fecha de Emisión:</b> {factura.fecha_creacion.strftime('%d/%m/%Y')}<br/>
+    <b>Estado:</b> {factura.estado.title()}<br/>
+    <b>Método de Pago:</b> Efectivo/Transferencia
+    """
+    elements.append(Paragraph(factura_info, styles['Normal']))
+    elements.append(Spacer(1, 12))
+
+    # Tabla de items
+    data = [['Descripción', 'Cantidad', 'Precio Unit.', 'Subtotal']]
+    items = list(factura.items.all())
+    total_general = Decimal('0.00')
+    if items:
+        for item in items:
+            subtotal = item.cantidad * item.precio
+            total_general += subtotal
+            data.append([
+                f'Item Factura #{item.id}',
+                str(item.cantidad),
+                f'${item.precio:,.2f}',
+                f'${subtotal:,.2f}'
+            ])
+    else:
+        # Sin items detallados - usar total de factura
+        total_general = factura.total
+        data.append([
+            'Productos y servicios',
+            '1',
+            f'${factura.total:,.2f}',
+            f'${factura.total:,.2f}'
+        ])
+
+    # Calcular impuestos (19% IVA incluido en los precios)
+    subtotal_sin_iva = total_general / (1 + IVA_PORCENTAJE)
+    iva_valor = total_general - subtotal_sin_iva
+    data.append(['', '', 'Subtotal:', f'${subtotal_sin_iva:,.2f}'])
+    data.append(['', '', 'IVA (19%):', f'${iva_valor:,.2f}'])
+
+    table = Table(data)
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 14),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-3, -3), colors.beige),
+        ('BACKGROUND', (-3, -2), (-1, -1), colors.lightgrey),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('FONTNAME', (-3, -2), (-1, -1), 'Helvetica-Bold'),
+    ]))
+    elements.append(table)
+    elements.append(Spacer(1, 12))
+
+    # Total final
+    elements.append(Paragraph(f"<b>TOTAL A PAGAR:</b> ${total_general:,.2f}", styles['Heading2']))
+    elements.append(Spacer(1, 24))
+
+    # Términos y condiciones
+    terminos = """
+    <b>Términos y Condiciones:</b><br/>
+    • Esta factura debe ser cancelada en los términos acordados.<br/>
+    • Los precios incluyen IVA cuando aplique.<br/>
+    • Documento válido como soporte contable.
+    """
+    elements.append(Paragraph(terminos, styles['Normal']))
+    return elements
+
+
+def _construir_pdf(facturas):
+    """Un PDF con las facturas dadas, cada una desde una página nueva"""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import PageBreak, SimpleDocTemplate
+
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    styles = getSampleStyleSheet()
+    elements = []
+    for indice, factura in enumerate(facturas):
+        if indice:
+            elements.append(PageBreak())
+        elements.extend(_elementos_factura(factura, styles))
+    doc.build(elements)
+    return buffer.getvalue()
+
+
+def _escribir_atomico(ruta, contenido):
+    """Escritura atómica: otro proceso nunca lee un PDF a medio escribir"""
+    descriptor, temporal = tempfile.mkstemp(dir=ruta.parent, suffix='.tmp')
+    with os.fdopen(descriptor, 'wb') as archivo:
+        archivo.write(contenido)
+    os.replace(temporal, ruta)
+
+
+def _guardar(ruta, contenido):
+    """Guarda el PDF de una factura y borra los de versiones anteriores de su contenido"""
+    _escribir_atomico(ruta, contenido)
+    for anterior in ruta.parent.glob(f"{ruta.name.split('-')[0]}-*.pdf"):
+        if anterior != ruta:
+            anterior.unlink(missing_ok=True)
+
+
+def pdf_factura(factura):
+    """
+    Bytes del PDF de la factura. Las finalizadas se leen de la caché en disco
+    si su contenido no cambió; los borradores se renderizan siempre.
+    ``factura`` debe venir con cliente e items precargados (ver ``_cargar``).
+    """
+    if factura.estado not in Factura.ESTADOS_FINALIZADOS:
+        return _construir_pdf([factura])
+
+    ruta = _directorio_cache() / f'{factura.pk}-{huella_factura(factura)}.pdf'
+    try:
+        return ruta.read_bytes()
+    except FileNotFoundError:
+        pass
+    contenido = _construir_pdf([factura])
+    _guardar(ruta, contenido)
+    return contenido
+
+
+def obtener_pdf_factura(factura_id):
+    """Carga la factura y retorna (factura, bytes del PDF)"""
+    factura = _cargar(Factura.objects.filter(pk=factura_id)).get()
+    return factura, pdf_factura(factura)
+
+
+# ============= PRE-RENDERIZADO =============
+
+def _prerenderizar(factura_id):
+    try:
+        obtener_pdf_factura(factura_id)
+    except Exception as e:
+        logger.error(f"Error pre-renderizando factura {factura_id}: {str(e)}")
+    finally:
+        connections.close_all()
+
+
+def programar_prerenderizado(factura_id):
+    """Deja el PDF en caché en segundo plano (se llama al emitir la factura); retorna el Future"""
+    return _prerenderizador.submit(_prerenderizar, factura_id)
+
+
+# ============= LOTES =============
+
+def iniciar_pool(procesos):
+    """
+    Crea el pool de procesos para los lotes. Lo llama el worker de la cola al
+    arrancar; los hijos se lanzan con 'spawn' (no heredan las conexiones del
+    padre) y ejecutan ``django.setup()`` una sola vez.
+    """
+    global _pool
+    detener_pool()
+    _pool = ProcessPoolExecutor(
+        max_workers=procesos, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup
+    )
+    return _pool
+
+
+def detener_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+def _renderizar_bloque(ids):
+    """Renderiza (o lee de caché) un bloque de facturas. Retorna [(numero, bytes)] en el orden de ``ids``"""
+    facturas = _cargar(Factura.objects.filter(pk__in=ids)).in_bulk()
+    return [(facturas[pk].numero, pdf_factura(facturas[pk])) for pk in ids if pk in facturas]
+
+
+def escribir_lote_zip(factura_ids, archivo, al_avanzar=None):
+    """
+    Escribe en ``archivo`` un ZIP con un PDF por factura. Con el pool del
+    worker iniciado, los bloques de un lote grande se reparten entre procesos.
+    ``al_avanzar(facturas)`` se llama después de cada bloque.
+    """
+    ids = list(factura_ids)
+    bloques = [ids[i:i + TAMANO_BLOQUE] for i in range(0, len(ids), TAMANO_BLOQUE)]
+    if _pool is not None and len(ids) >= MINIMO_PARA_PROCESOS:
+        resultados = _pool.map(_renderizar_bloque, bloques)
+    else:
+        resultados = map(_renderizar_bloque, bloques)
+
+    escritas = 0
+    with zipfile.ZipFile(archivo, 'w', zipfile.ZIP_STORED) as zip_lote:
+        # Los PDF ya están comprimidos: ZIP_STORED evita gastar CPU en recomprimirlos
+        for bloque in resultados:
+            for numero, contenido in bloque:
+                zip_lote.writestr(f'factura_{numero}.pdf', contenido)
+            escritas += len(bloque)
+            if al_avanzar:
+                al_avanzar(escritas)
+
+
+def renderizar_lote_zip(factura_ids):
+    """Bytes del ZIP con un PDF por factura (ver ``escribir_lote_zip``)"""
+    buffer = BytesIO()
+    escribir_lote_zip(factura_ids, buffer)
+    return buffer.getvalue()
+
+
+def _cargar_en_orden(ids):
+    facturas = []
+    for i in range(0, len(ids), TAMANO_BLOQUE * 10):
+        bloque = ids[i:i + TAMANO_BLOQUE * 10]
+        cargadas = _cargar(Factura.objects.filter(pk__in=bloque)).in_bulk()
+        facturas.extend(cargadas[pk] for pk in bloque if pk in cargadas)
+    return facturas
+
+
+def _borrar_lotes_vencidos(directorio):
+    limite = time.time() - VIGENCIA_LOTES
+    for ruta in directorio.glob('*.pdf'):
+        try:
+            if ruta.stat().st_mtime < limite:
+                ruta.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def renderizar_lote_pdf(factura_ids):
+    """
+    Un solo PDF con todas las facturas para impresión. Se construye como un
+    único documento ReportLab (sin librería para unir PDFs, los archivos en
+    caché no se pueden concatenar), cargando los datos por bloques. Si todas
+    las facturas están finalizadas el resultado se guarda en caché con la
+    huella de cada una: reimprimir el mismo lote no vuelve a renderizarlo.
+    """
+    facturas = _cargar_en_orden(list(factura_ids))
+    if not facturas or any(factura.estado not in Factura.ESTADOS_FINALIZADOS for factura in facturas):
+        return _construir_pdf(facturas)
+
+    huella = hashlib.sha256(
+        '\x1f'.join(f'{factura.pk}:{huella_factura(factura)}' for factura in facturas).encode()
+    ).hexdigest()[:32]
+    directorio = _directorio_cache('lotes')
+    ruta = directorio / f'{huella}.pdf'
+    try:
+        contenido = ruta.read_bytes()
+        ruta.touch()
+        return contenido
+    except FileNotFoundError:
+        pass
+    contenido = _construir_pdf(facturas)
+    _escribir_atomico(ruta, contenido)
+    _borrar_lotes_vencidos(directorio)
+    return contenido
+
+
+def escribir_lote_pdf(factura_ids, archivo, al_avanzar=None):
+    """Escribe en ``archivo`` el PDF único del lote (ver ``renderizar_lote_pdf``)"""
+    ids = list(factura_ids)
+    archivo.write(renderizar_lote_pdf(ids))
+    if al_avanzar:
+        al_avanzar(len(ids))
@@ -9,6 +9,7 @@ from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.urls import reverse_lazy
 from django.db.models import Q, Sum, Count
 from django.contrib import messages
+from django.core.exceptions import ValidationError
 from django.http import JsonResponse, HttpResponse
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
@@ -17,6 +18,8 @@ import datetime
 from .models import Pedido, ItemPedido, Cliente
 from inventario.models import Producto
 from .forms import PedidoForm
+from .paginacion import TAMANO_MAXIMO, PaginacionKeysetMixin, pagina_keyset, tamano_pagina
+from .rutas import ruta_entregas
 # from .forms import CambiarEstadoPedidoForm  # No existe
 
 
@@ -41,8 +44,8 @@ class VentasYBodegaMixin(UserPassesTestMixin):
                 self.request.user.can_prepare_orders() or
                 self.request.user.can_deliver_orders())
 
-class PedidoListView(VentasYBodegaMixin, ListView):
-    """Lista de pedidos"""
+class PedidoListView(VentasYBodegaMixin, PaginacionKeysetMixin, ListView):
+    """Lista de pedidos (paginada por cursor sobre fecha_creacion, id)"""
     model = Pedido
     template_name = 'ventas/pedido_list.html'
     context_object_name = 'pedidos'
@@ -86,11 +89,15 @@ class PedidoListView(VentasYBodegaMixin, ListView):
         if fecha_hasta:
             queryset = queryset.filter(fecha_creacion__date__lte=fecha_hasta)
         
-        return queryset.order_by('-fecha_creacion')
+        return queryset.order_by('-fecha_creacion', '-pk')
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
+        # "Cargar más" solo necesita las filas, no las estadísticas
+        if not context['page_obj']['primera']:
+            return context
+        
         # Contexto específico para repartidores
         if self.request.user.can_deliver_orders() and not self.request.user.can_create_sales():
             context['es_repartidor'] = True
@@ -101,10 +108,12 @@ class PedidoListView(VentasYBodegaMixin, ListView):
             context['title'] = 'Pedidos Disponibles para Entrega'
         else:
             context['es_repartidor'] = False
-            context['total_pedidos'] = Pedido.objects.count()
-            context['pedidos_pendientes'] = Pedido.objects.filter(estado='pendiente').count()
-            context['pedidos_alistamiento'] = Pedido.objects.filter(estado='alistamiento').count()
-            context['pedidos_completados'] = Pedido.objects.filter(estado='completado').count()
+            context.update(Pedido.objects.aggregate(
+                total_pedidos=Count('id'),
+                pedidos_pendientes=Count('id', filter=Q(estado='pendiente')),
+                pedidos_alistamiento=Count('id', filter=Q(estado='alistamiento')),
+                pedidos_completados=Count('id', filter=Q(estado='completado')),
+            ))
             context['title'] = 'Lista de Pedidos'
         
         return context
@@ -136,11 +145,6 @@ class PedidoCreateView(VentasRequiredMixin, CreateView):
             form.instance.vendedor = self.request.user
             pedido = form.save()
             
-            
-            # Calcular totales
-            pedido.calcular_totales()
-            pedido.save()
-            
             messages.success(self.request, f'Pedido {pedido.numero} creado exitosamente.')
             return redirect('ventas:pedido_detail', pk=pedido.pk)
         else:
@@ -190,9 +194,7 @@ class PedidoUpdateView(VentasRequiredMixin, UpdateView):
         if form.is_valid():
             pedido = form.save()
             # items_formset.save()
-            # Recalcular totales
-            pedido.calcular_totales()
-            pedido.save()
+            # El total lo mantienen las líneas al guardarse
             messages.success(self.request, f'Pedido {pedido.numero} actualizado exitosamente.')
             return redirect('ventas:pedido_detail', pk=pedido.pk)
         else:
@@ -439,40 +441,33 @@ def completar_alistamiento(request, pk):
     if pedido.estado != 'proceso':
         return JsonResponse({'error': 'Pedido no está en proceso'}, status=400)
 
-    # Validar que todos los items tengan suficiente stock en la bodega del usuario
+    # Reservar todas las líneas en la bodega del usuario en una sola transacción
     bodega_usuario = request.user.bodega
-    from inventario.models import Stock
-    items_sin_stock = []
-    for item in pedido.items.all():
-        if bodega_usuario:
-            stock_qs = Stock.objects.filter(producto=item.producto, bodega=bodega_usuario)
-            stock_disponible = sum([s.cantidad - s.cantidad_reservada for s in stock_qs])
-        else:
-            stock_disponible = 0
-        if stock_disponible < item.cantidad:
-            items_sin_stock.append(f"{item.producto.nombre} (Disponible: {stock_disponible}, Requerido: {item.cantidad})")
+    if not bodega_usuario:
+        return JsonResponse({'error': 'El usuario no tiene bodega asignada'}, status=400)
+
+    # Estado y reserva en una transacción; un doble envío reserva una sola vez
+    try:
+        resultado = pedido.completar_reservando(bodega=bodega_usuario, usuario=request.user)
+    except ValidationError as e:
+        return JsonResponse({'error': ' '.join(e.messages)}, status=400)
+
+    if resultado['conflicto']:
+        return JsonResponse({'error': 'Pedido no está en proceso'}, status=400)
 
-    if items_sin_stock:
+    if not resultado['exito']:
+        items_sin_stock = [
+            f"{linea['producto'].nombre} (Disponible: {linea['stock_disponible']}, Requerido: {linea['cantidad_pedida']})"
+            for linea in resultado['lineas'] if linea['faltante'] > 0
+        ]
         return JsonResponse({
             'error': 'No se puede completar el alistamiento. Stock insuficiente en los siguientes productos:',
             'items': items_sin_stock
         }, status=400)
 
-    # Reservar el stock de cada item en la bodega del usuario
     import logging
     logger = logging.getLogger("django")
-    for item in pedido.items.all():
-        if bodega_usuario:
-            from inventario.models import Stock
-            stock_obj = Stock.objects.filter(producto=item.producto, bodega=bodega_usuario).first()
-            if stock_obj:
-                resultado = stock_obj.reservar(item.cantidad, usuario=request.user, pedido_id=pedido.id, observaciones="Reserva por alistamiento")
-                logger.info(f"Reserva pedido {pedido.numero} - Producto: {item.producto.codigo} - Cantidad: {item.cantidad} - Resultado: {resultado} - Reservado ahora: {stock_obj.cantidad_reservada}")
-            else:
-                logger.warning(f"No se encontró Stock para producto {item.producto.codigo} en bodega {bodega_usuario}")
-
-    pedido.estado = 'completado'
-    pedido.save()
+    logger.info(f"Reserva pedido {pedido.numero} - {len(resultado['lineas'])} productos reservados en {bodega_usuario}")
 
     from django.shortcuts import redirect
     return redirect('ventas:pedidos_alistamiento')
@@ -523,23 +518,33 @@ def tomar_pedido_repartidor(request, pk):
 @login_required
 def obtener_pedidos_pendientes(request):
     """API para obtener pedidos pendientes"""
-    if not request.user.can_manage_inventory():
+    if not request.user.can_view_inventory():
         return JsonResponse({'error': 'Sin permisos'}, status=403)
     
-    pedidos = Pedido.objects.filter(estado='pendiente').select_related('cliente')
+    pedidos = Pedido.objects.filter(estado='pendiente').select_related('cliente').annotate(
+        items_count=Count('items')
+    )
+    # Paginado por cursor: ?cursor= con el valor del encabezado X-Siguiente-Cursor
+    pagina = pagina_keyset(
+        pedidos, 'fecha_creacion', request.GET.get('cursor'),
+        tamano_pagina(request.GET.get('limit'), por_defecto=TAMANO_MAXIMO)
+    )
     
     data = []
-    for pedido in pedidos:
+    for pedido in pagina['objetos']:
         data.append({
             'id': pedido.id,
             'numero': pedido.numero,
             'cliente': pedido.cliente.nombre_completo,
             'total': float(pedido.total),
             'fecha_creacion': pedido.fecha_creacion.strftime('%d/%m/%Y %H:%M'),
-            'items_count': pedido.items.count()
+            'items_count': pedido.items_count
         })
     
-    return JsonResponse(data, safe=False)
+    respuesta = JsonResponse(data, safe=False)
+    if pagina['siguiente_cursor']:
+        respuesta['X-Siguiente-Cursor'] = pagina['siguiente_cursor']
+    return respuesta
 
 
 @login_required
@@ -560,44 +565,31 @@ def crear_entregas_masivas(request):
         if not pedido_ids:
             return JsonResponse({'error': 'No se seleccionaron pedidos'}, status=400)
         
-        # Verificar que los pedidos estén disponibles
-        pedidos = Pedido.objects.filter(
-            id__in=pedido_ids,
-            estado='completado',
-            entregas__isnull=True
-        )
-        
-        if pedidos.count() != len(pedido_ids):
-            return JsonResponse({'error': 'Algunos pedidos ya no están disponibles'}, status=400)
-        
         # Procesar fecha programada
         if fecha_programada:
             from datetime import datetime
             try:
-                fecha_programada = datetime.strptime(fecha_programada, '%Y-%m-%d %H:%M')
+                fecha_programada = timezone.make_aware(datetime.strptime(fecha_programada, '%Y-%m-%d %H:%M'))
             except ValueError:
                 fecha_programada = timezone.now()
         else:
             fecha_programada = timezone.now()
         
-        # Crear entregas
+        # Crear entregas en bloque (una transacción, números reservados de una vez)
         from .models import Entrega
-        entregas_creadas = []
+        try:
+            entregas_creadas = Entrega.crear_en_lote(pedido_ids, request.user, fecha_programada)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
         
-        for pedido in pedidos:
-            entrega = Entrega.objects.create(
-                pedido=pedido,
-                repartidor=request.user,
-                direccion_entrega=pedido.cliente.direccion,
-                telefono_contacto=pedido.cliente.telefono,
-                estado='asignada',
-                fecha_programada=fecha_programada
-            )
-            entregas_creadas.append(entrega)
+        ruta, distancia_total = ruta_entregas(entregas_creadas, request.user)
         
         return JsonResponse({
             'success': True,
-            'message': f'Se crearon {len(entregas_creadas)} entregas exitosamente'
+            'message': f'Se crearon {len(entregas_creadas)} entregas exitosamente',
+            'entregas': [entrega.pk for entrega in entregas_creadas],
+            'ruta': ruta,
+            'distancia_total_km': distancia_total,
         })
         
     except Exception as e:
@@ -0,0 +1,137 @@
+"""
+Utilidades de rutas de entrega
+
+Las coordenadas salen de los enlaces de mapas que ya se guardan
+(``Cliente.enlace_maps``, ``Bodega.link_ubicacion``). ``ordenar_paradas`` es
+un vecino más cercano desde el punto de salida, sin consultas a la base de
+datos; ``ruta_entregas`` lo mejora con ``optimizador_rutas``.
+"""
+
+import math
+import re
+from urllib.parse import parse_qs, unquote, urlparse
+
+RADIO_TIERRA_KM = 6371
+
+_PAR = r'(-?\d{1,2}(?:\.\d+)?),\s*(-?\d{1,3}(?:\.\d+)?)'
+# Formatos de Google Maps/Waze: .../@lat,lng,15z  ...!3dlat!4dlng  ?q=lat,lng  ?ll=lat,lng
+_PATRON_ARROBA = re.compile(r'@' + _PAR)
+_PATRON_DATA = re.compile(r'!3d(-?\d+(?:\.\d+)?)!4d(-?\d+(?:\.\d+)?)')
+_PATRON_PAR = re.compile(r'^\s*' + _PAR + r'\s*$')
+PARAMETROS_COORDENADAS = ('q', 'query', 'll', 'destination', 'daddr', 'center')
+
+
+def _validas(lat, lng):
+    lat, lng = float(lat), float(lng)
+    if -90 <= lat <= 90 and -180 <= lng <= 180:
+        return lat, lng
+    return None
+
+
+def coordenadas_desde_enlace(enlace):
+    """(lat, lng) de un enlace de Google Maps/Waze, o None si no trae coordenadas (p. ej. enlaces cortos)"""
+    if not enlace:
+        return None
+    enlace = unquote(enlace)
+
+    # El marcador (!3d!4d) es más preciso que el centro del mapa (@)
+    for patron in (_PATRON_DATA, _PATRON_ARROBA):
+        coincidencia = patron.search(enlace)
+        if coincidencia:
+            return _validas(*coincidencia.groups())
+
+    parametros = parse_qs(urlparse(enlace).query)
+    for nombre in PARAMETROS_COORDENADAS:
+        for valor in parametros.get(nombre, []):
+            coincidencia = _PATRON_PAR.match(valor)
+            if coincidencia:
+                return _validas(*coincidencia.groups())
+    return None
+
+
+def distancia_km(lat1, lng1, lat2, lng2):
+    """Distancia Haversine en km entre dos puntos GPS"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * math.asin(math.sqrt(a))
+
+
+def coordenadas_bodega_principal():
+    """(lat, lng) de la bodega principal activa (o de la primera activa con enlace), o None"""
+    from inventario.models import Bodega
+
+    enlaces = Bodega.objects.filter(activa=True).exclude(link_ubicacion__isnull=True).exclude(
+        link_ubicacion=''
+    ).order_by('-es_principal', 'nombre').values_list('link_ubicacion', flat=True)
+    for enlace in enlaces:
+        coordenadas = coordenadas_desde_enlace(enlace)
+        if coordenadas:
+            return coordenadas
+    return None
+
+
+def ordenar_paradas(paradas, origen=None):
+    """
+    Orden de visita por vecino más cercano.
+
+    ``paradas`` es una lista de dicts con ``lat`` y ``lng`` (None si no hay
+    coordenadas). Sin ``origen`` se arranca en la primera parada con
+    coordenadas. Retorna (ordenadas, distancia_total_km): copias de las
+    paradas con ``orden`` y ``distancia_desde_anterior``; las que no tienen
+    coordenadas van al final con ``sin_gps``.
+    """
+    pendientes = [p for p in paradas if p.get('lat') is not None and p.get('lng') is not None]
+    sin_gps = [p for p in paradas if p.get('lat') is None or p.get('lng') is None]
+
+    ordenadas = []
+    distancia_total = 0
+    actual = origen
+    while pendientes:
+        if actual is None:
+            indice, distancia = 0, 0
+        else:
+            indice, distancia = min(
+                ((i, distancia_km(actual[0], actual[1], p['lat'], p['lng'])) for i, p in enumerate(pendientes)),
+                key=lambda par: par[1],
+            )
+        parada = pendientes.pop(indice)
+        ordenadas.append({**parada, 'orden': len(ordenadas) + 1, 'distancia_desde_anterior': round(distancia, 2)})
+        distancia_total += distancia
+        actual = (parada['lat'], parada['lng'])
+
+    for parada in sin_gps:
+        ordenadas.append({**parada, 'orden': len(ordenadas) + 1, 'distancia_desde_anterior': 0, 'sin_gps': True})
+    return ordenadas, round(distancia_total, 2)
+
+
+def ruta_entregas(entregas, repartidor=None):
+    """
+    Paradas ordenadas (dicts serializables) para la app del repartidor y la
+    distancia total. Sale de la ubicación GPS del repartidor o, si no la
+    tiene, de la bodega principal; el orden es el de vecino más cercano
+    mejorado con 2-opt/Or-opt. Las entregas deben traer pedido y cliente
+    cargados.
+    """
+    from .optimizador_rutas import optimizar_paradas
+
+    if repartidor is not None and repartidor.latitud is not None and repartidor.longitud is not None:
+        origen = (float(repartidor.latitud), float(repartidor.longitud))
+    else:
+        origen = coordenadas_bodega_principal()
+
+    paradas = []
+    for entrega in entregas:
+        cliente = entrega.pedido.cliente
+        paradas.append({
+            'entrega_id': entrega.pk,
+            'numero': entrega.numero,
+            'pedido': entrega.pedido.numero,
+            'cliente': cliente.nombre_completo,
+            'direccion': entrega.direccion_entrega,
+            'telefono': entrega.telefono_contacto,
+            'enlace_maps': cliente.enlace_maps,
+            'lat': float(cliente.latitud) if cliente.latitud is not None else None,
+            'lng': float(cliente.longitud) if cliente.longitud is not None else None,
+        })
+    ordenadas, resumen = optimizar_paradas(paradas, origen)
+    return ordenadas, resumen['distancia_total']
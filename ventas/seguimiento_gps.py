@@ -0,0 +1,241 @@
+"""
+Ingesta de pings GPS de los repartidores
+
+Los pings llegan en lotes (``api/repartidor/ubicacion/``) y se acumulan en
+un buffer en memoria del proceso, sin tocar la base de datos. El buffer se
+vuelca cuando pasaron ``INTERVALO_VOLCADO`` segundos desde el último volcado
+o cuando junta ``MAXIMO_EN_BUFFER`` pings. Lo primero se revisa al llegar
+cada lote y también en un hilo del proceso (``iniciar_volcador``, arrancado
+con el primer lote), así los últimos pings se guardan aunque no lleguen
+más. Cada volcado es una transacción con:
+
+* un ``bulk_create`` de los pings en ``PosicionRepartidor``;
+* un ``bulk_update`` del usuario con el ping más reciente de cada
+  repartidor, solo si es más nuevo que la posición que ya tiene;
+* una invalidación del índice de repartidores al confirmar.
+
+Si la escritura falla, los pings vuelven al buffer para el siguiente
+volcado. Lo pendiente se escribe también al terminar el proceso.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.db import connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from accounts.geoespacial import distancias_pares, invalidar_indice_repartidores
+from accounts.models import User
+
+from .models import PosicionRepartidor
+
+logger = logging.getLogger(__name__)
+
+INTERVALO_VOLCADO = 5
+MAXIMO_EN_BUFFER = 5000
+MAXIMO_POR_LOTE = 500
+# Un ping con la hora del dispositivo más adelantada que esto se guarda con la del servidor
+TOLERANCIA_RELOJ = timedelta(minutes=2)
+
+# Tuplas (repartidor_id, latitud, longitud, registrada)
+_buffer = []
+_lock = threading.Lock()
+_estado = {'ultimo_volcado': time.monotonic()}
+_volcador = {'hilo': None, 'detener': None, 'pid': None}
+
+
+def interpretar_ping(ping, ahora):
+    """(latitud, longitud, registrada) de un ping ``{latitud, longitud, registrada}``, o None si no es válido"""
+    try:
+        latitud, longitud = float(ping['latitud']), float(ping['longitud'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not (-90 <= latitud <= 90 and -180 <= longitud <= 180):
+        return None
+
+    registrada = ping.get('registrada')
+    if registrada:
+        try:
+            registrada = parse_datetime(str(registrada))
+        except ValueError:
+            registrada = None
+        if registrada is None:
+            return None
+        if timezone.is_naive(registrada):
+            registrada = timezone.make_aware(registrada)
+        if registrada > ahora + TOLERANCIA_RELOJ:
+            registrada = ahora
+    else:
+        registrada = ahora
+    return Decimal(str(round(latitud, 7))), Decimal(str(round(longitud, 7))), registrada
+
+
+def registrar_pings(repartidor_id, pings):
+    """Agrega al buffer los pings válidos del repartidor; retorna cuántos se aceptaron"""
+    ahora = timezone.now()
+    validos = [(repartidor_id, *ping) for ping in (interpretar_ping(p, ahora) for p in pings) if ping]
+    with _lock:
+        _buffer.extend(validos)
+        toca_volcar = (
+            len(_buffer) >= MAXIMO_EN_BUFFER
+            or time.monotonic() - _estado['ultimo_volcado'] >= INTERVALO_VOLCADO
+        )
+    iniciar_volcador()
+    if toca_volcar:
+        volcar()
+    return len(validos)
+
+
+def pendientes():
+    """Cantidad de pings en el buffer de este proceso"""
+    return len(_buffer)
+
+
+def volcar():
+    """Escribe el buffer en la base de datos; retorna cuántos pings se guardaron"""
+    with _lock:
+        lote = _buffer[:]
+        _buffer.clear()
+        _estado['ultimo_volcado'] = time.monotonic()
+    if not lote:
+        return 0
+
+    try:
+        return _guardar(lote)
+    except Exception:
+        logger.exception('No se pudieron guardar %s pings GPS; se reintentará', len(lote))
+        with _lock:
+            _buffer[:0] = lote
+            # Con la base caída por mucho tiempo se conservan los más recientes
+            del _buffer[:-MAXIMO_EN_BUFFER]
+        return 0
+
+
+def _guardar(lote):
+    ultimos = {}
+    for repartidor_id, latitud, longitud, registrada in lote:
+        if repartidor_id not in ultimos or registrada >= ultimos[repartidor_id][2]:
+            ultimos[repartidor_id] = (latitud, longitud, registrada)
+
+    with transaction.atomic():
+        usuarios = list(
+            User.objects.select_for_update().filter(pk__in=ultimos).only('pk', 'ubicacion_actualizada')
+        )
+        # Los pings de usuarios borrados mientras estaban en el buffer se descartan
+        existentes = {usuario.pk for usuario in usuarios}
+        posiciones = PosicionRepartidor.objects.bulk_create(
+            [
+                PosicionRepartidor(repartidor_id=repartidor_id, latitud=latitud, longitud=longitud, registrada=registrada)
+                for repartidor_id, latitud, longitud, registrada in lote
+                if repartidor_id in existentes
+            ],
+            batch_size=MAXIMO_POR_LOTE,
+        )
+
+        actualizados = []
+        ahora = timezone.now()
+        for usuario in usuarios:
+            latitud, longitud, registrada = ultimos[usuario.pk]
+            if usuario.ubicacion_actualizada is None or registrada > usuario.ubicacion_actualizada:
+                usuario.latitud, usuario.longitud, usuario.ubicacion_actualizada = latitud, longitud, registrada
+                # Renueva la huella con la que los demás procesos reconstruyen el índice de repartidores
+                usuario.fecha_modificacion = ahora
+                actualizados.append(usuario)
+        if actualizados:
+            User.objects.bulk_update(
+                actualizados, ['latitud', 'longitud', 'ubicacion_actualizada', 'fecha_modificacion']
+            )
+            transaction.on_commit(invalidar_indice_repartidores)
+    return len(posiciones)
+
+
+def _volcar_periodicamente(detener, intervalo):
+    while not detener.wait(intervalo):
+        # Si un lote entrante ya volcó hace poco, se espera al siguiente turno
+        if not _buffer or time.monotonic() - _estado['ultimo_volcado'] < intervalo:
+            continue
+        try:
+            volcar()
+        finally:
+            # Conexiones de este hilo: no quedan abiertas entre volcados
+            connections.close_all()
+
+
+def iniciar_volcador(intervalo=INTERVALO_VOLCADO):
+    """Arranca (una vez por proceso) el hilo que vuelca el buffer cada ``intervalo`` segundos"""
+    with _lock:
+        hilo = _volcador['hilo']
+        # Tras un fork (workers de gunicorn) el hilo del proceso padre no existe en el hijo
+        if hilo is not None and hilo.is_alive() and _volcador['pid'] == os.getpid():
+            return hilo
+        detener = threading.Event()
+        hilo = threading.Thread(
+            target=_volcar_periodicamente, args=(detener, intervalo), name='volcado-gps', daemon=True
+        )
+        _volcador.update(hilo=hilo, detener=detener, pid=os.getpid())
+        hilo.start()
+    return hilo
+
+
+def detener_volcador():
+    """Detiene el hilo de volcado periódico (lo pendiente queda en el buffer)"""
+    with _lock:
+        hilo, detener = _volcador['hilo'], _volcador['detener']
+        _volcador.update(hilo=None, detener=None, pid=None)
+    if hilo is not None:
+        detener.set()
+        hilo.join()
+
+
+atexit.register(volcar)
+
+
+def ventana_entrega(entrega):
+    """
+    (desde, hasta) del recorrido de una entrega: de la salida a la llegada.
+    Sin salida registrada se usa el día programado; en ruta, hasta ahora.
+    """
+    dia = timezone.localtime(entrega.fecha_programada).date()
+    inicio_dia = timezone.make_aware(datetime.combine(dia, datetime.min.time()))
+    desde = entrega.fecha_inicio or inicio_dia
+    if entrega.fecha_entrega:
+        hasta = entrega.fecha_entrega
+    elif entrega.fecha_inicio:
+        hasta = timezone.now()
+    else:
+        hasta = inicio_dia + timedelta(days=1)
+    return desde, hasta
+
+
+def recorrido_entrega(entrega):
+    """
+    Pings del repartidor durante la entrega, en orden. Retorna un dict con
+    ``desde``, ``hasta``, ``puntos`` (listas [lat, lng, hora ISO]) y
+    ``distancia_km`` recorrida. Vuelca antes el buffer de este proceso.
+    """
+    volcar()
+    desde, hasta = ventana_entrega(entrega)
+    filas = []
+    if entrega.repartidor_id:
+        filas = list(
+            PosicionRepartidor.objects.filter(
+                repartidor_id=entrega.repartidor_id, registrada__range=(desde, hasta)
+            ).order_by('registrada', 'pk').values_list('latitud', 'longitud', 'registrada')
+        )
+
+    lats = np.array([float(fila[0]) for fila in filas])
+    lngs = np.array([float(fila[1]) for fila in filas])
+    distancia = float(distancias_pares(lats[:-1], lngs[:-1], lats[1:], lngs[1:]).sum()) if len(filas) > 1 else 0.0
+    return {
+        'desde': desde.isoformat(),
+        'hasta': hasta.isoformat(),
+        'puntos': [[float(lat), float(lng), registrada.isoformat()] for lat, lng, registrada in filas],
+        'distancia_km': round(distancia, 2),
+    }
@@ -1,3 +1,1246 @@
-from django.test import TestCase
+import base64
+import csv
+import io
+import itertools
+import json
+import random
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.http import QueryDict
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from openpyxl import load_workbook
+
+from accounts.geoespacial import matriz_distancias
+from accounts.models import User
+from inventario.models import (
+    Bodega, Categoria, MovimientoInventario, Producto, Stock, Subcategoria, VarianteProducto,
+)
+from inventario.reservas import verificar_disponibilidad
+from ventas import exportacion, facturas_views, metricas, pdf_facturas, seguimiento_gps, trabajos_exportacion, views
+from ventas.despacho import despachar_dia, duracion_horas, planificar
+from ventas.models import (
+    Cliente, Cotizacion, Entrega, Factura, ItemCotizacion, ItemFactura, ItemPedido, ItemRechazado, Pedido,
+    PosicionRepartidor, SecuenciaDocumento, TrabajoExportacion, reservar_numeros,
+)
+from ventas.optimizador_rutas import optimizar_paradas, optimizar_recorrido
+from ventas.paginacion import codificar_cursor, conteo_aproximado, decodificar_cursor, pagina_keyset
+from ventas.rutas import coordenadas_desde_enlace, distancia_km, ordenar_paradas, ruta_entregas
+
+
+class VerificarStockDisponibleTests(TestCase):
+    """La verificación del carrito hace una consulta de stock sin importar cuántas líneas tenga"""
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre='General')
+        subcategoria = Subcategoria.objects.create(nombre='Varios', categoria=categoria)
+        cls.principal = Bodega.objects.create(nombre='Principal', direccion='Calle 1', es_principal=True)
+        cls.secundaria = Bodega.objects.create(nombre='Secundaria', direccion='Calle 2')
+        inactiva = Bodega.objects.create(nombre='Cerrada', direccion='Calle 3', activa=False)
+        cls.productos = Producto.objects.bulk_create([
+            Producto(codigo=f'P{i:03}', nombre=f'Producto {i}', categoria=categoria, subcategoria=subcategoria)
+            for i in range(30)
+        ])
+        # Principal: 5 disponibles (7 - 2 reservadas); Secundaria: 20; Cerrada no cuenta
+        Stock.objects.bulk_create([
+            Stock(producto=producto, bodega=bodega, cantidad=cantidad, cantidad_reservada=reservada)
+            for producto in cls.productos
+            for bodega, cantidad, reservada in [(cls.principal, 7, 2), (cls.secundaria, 20, 0), (inactiva, 100, 0)]
+        ])
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def lineas(self, cantidad_lineas, cantidad=1):
+        return [
+            {'producto_id': producto.pk, 'variante_id': None, 'cantidad': cantidad}
+            for producto in self.productos[:cantidad_lineas]
+        ]
+
+    def verificar(self, lineas, **opciones):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.post(
+                reverse('ventas:api_verificar_stock'),
+                json.dumps({'productos': lineas, **opciones}),
+                content_type='application/json',
+            )
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta.json(), len(consultas)
+
+    def test_una_consulta_por_carrito(self):
+        with self.assertNumQueries(1):
+            verificar_disponibilidad(self.lineas(30), bodega_id=self.principal.pk, sugerir_bodega=True)
+
+        _, consultas_pocas = self.verificar(self.lineas(2))
+        _, consultas_muchas = self.verificar(self.lineas(30), bodega_id=self.principal.pk, sugerir_bodega=True)
+        self.assertEqual(consultas_pocas, consultas_muchas)
+
+    def test_disponibilidad_por_linea(self):
+        datos, _ = self.verificar(self.lineas(3, cantidad=25))
+        self.assertTrue(datos['stock_suficiente'])
+        self.assertEqual([linea['stock_disponible'] for linea in datos['productos']], [25, 25, 25])
+
+        datos, _ = self.verificar(self.lineas(1, cantidad=6), bodega_id=self.principal.pk)
+        self.assertFalse(datos['stock_suficiente'])
+        self.assertEqual(datos['productos'][0]['faltante'], 1)
+        self.assertNotIn('bodega_sugerida', datos['productos'][0])
+
+    def test_lineas_repetidas_consumen_el_mismo_stock(self):
+        producto_id = self.productos[0].pk
+        lineas = [{'producto_id': producto_id, 'cantidad': 4}, {'producto_id': producto_id, 'cantidad': 4}]
+        datos, _ = self.verificar(lineas, bodega_id=self.principal.pk)
+        self.assertEqual([linea['faltante'] for linea in datos['productos']], [0, 3])
+
+    def test_sugiere_bodega_alternativa(self):
+        datos, _ = self.verificar(self.lineas(2, cantidad=10), bodega_id=self.principal.pk, sugerir_bodega=True)
+        for linea in datos['productos']:
+            self.assertEqual(linea['bodega_sugerida']['bodega_id'], self.secundaria.pk)
+            self.assertEqual(linea['bodega_sugerida']['stock_disponible'], 20)
+
+        datos, _ = self.verificar(self.lineas(1, cantidad=50), bodega_id=self.principal.pk, sugerir_bodega=True)
+        self.assertIsNone(datos['productos'][0]['bodega_sugerida'])
+
+    def test_producto_inexistente(self):
+        datos, _ = self.verificar([{'producto_id': 999999, 'cantidad': 1}])
+        self.assertFalse(datos['stock_suficiente'])
+        self.assertEqual(datos['productos'][0]['error'], 'Producto no encontrado')
+
+
+class BuscarProductosApiTests(TestCase):
+    """La búsqueda de productos resuelve precio y stock sin consultas por resultado"""
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre='Ferretería')
+        subcategoria = Subcategoria.objects.create(nombre='Varios', categoria=categoria)
+        principal = Bodega.objects.create(nombre='Principal', direccion='Calle 1', es_principal=True)
+        secundaria = Bodega.objects.create(nombre='Secundaria', direccion='Calle 2')
+        cls.productos = Producto.objects.bulk_create([
+            Producto(codigo=f'T{i:03}', nombre=f'Tornillo {i}', categoria=categoria, subcategoria=subcategoria,
+                     precio_minorista=1000, precio_mayorista=800)
+            for i in range(12)
+        ])
+        # 5 disponibles en Principal (7 - 2 reservadas) y 20 en Secundaria; el primero no tiene nada en Secundaria
+        Stock.objects.bulk_create([
+            Stock(producto=producto, bodega=bodega, cantidad=cantidad, cantidad_reservada=reservada)
+            for i, producto in enumerate(cls.productos)
+            for bodega, cantidad, reservada in [(principal, 7, 2), (secundaria, 0 if i == 0 else 20, 0)]
+        ])
+        Stock.sincronizar_existencias()
+        cls.mayorista = Cliente.objects.create(
+            numero_documento='1', nombre_completo='Cliente', telefono='300', direccion='Calle', tipo_cliente='mayorista'
+        )
+        cls.usuario = User.objects.create_user('vendedor', role='vendedor')
+
+    def llamar(self, usuario, **parametros):
+        peticion = RequestFactory().get('/ventas/api/productos/', parametros)
+        peticion.user = usuario
+        return views.buscar_productos_api(peticion)
+
+    def buscar(self, **parametros):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.llamar(self.usuario, **parametros)
+        self.assertEqual(respuesta.status_code, 200)
+        consultas_stock = [q['sql'] for q in consultas.captured_queries if '"inventario_stock"' in q['sql']]
+        return json.loads(respuesta.content)['productos'], len(consultas), len(consultas_stock)
+
+    def test_una_consulta_de_stock(self):
+        productos, consultas_muchos, consultas_stock = self.buscar(q='Tornillo')
+        self.assertEqual(len(productos), 10)
+        self.assertEqual(consultas_stock, 1)
+
+        productos, consultas_uno, _ = self.buscar(q='T000')
+        self.assertEqual([producto['codigo'] for producto in productos], ['T000'])
+        self.assertEqual(consultas_uno, consultas_muchos)
+        self.assertEqual(productos[0]['stock_total'], 5)
+        self.assertEqual(productos[0]['stock_bodegas'], [
+            {'bodega': 'Principal', 'cantidad_total': 7, 'cantidad_reservada': 2, 'cantidad_disponible': 5},
+        ])
+
+        productos, _, _ = self.buscar(q='T001')
+        self.assertEqual(productos[0]['stock_total'], 25)
+        self.assertEqual(
+            sorted(bodega['bodega'] for bodega in productos[0]['stock_bodegas']), ['Principal', 'Secundaria']
+        )
+
+    def test_precio_segun_cliente(self):
+        for parametros, precio, tipo in [
+            ({}, 1000, 'minorista'),
+            ({'cliente_id': self.mayorista.pk}, 800, 'mayorista'),
+            ({'cliente_id': 999999}, 1000, 'minorista'),
+        ]:
+            with self.subTest(**parametros):
+                productos, _, _ = self.buscar(q='T002', **parametros)
+                self.assertEqual(productos[0]['precio'], precio)
+                self.assertEqual(productos[0]['tipo_cliente_precio'], tipo)
+                self.assertEqual((productos[0]['precio_minorista'], productos[0]['precio_mayorista']), (1000, 800))
+
+                productos, _, _ = self.buscar(q='T002', formato='compacto', **parametros)
+                self.assertEqual(productos[0]['precio'], precio)
+
+    def test_formato_compacto(self):
+        productos, _, consultas_stock = self.buscar(q='Tornillo', formato='compacto')
+        self.assertEqual(len(productos), 10)
+        self.assertEqual(consultas_stock, 0)
+        self.assertEqual(set(productos[0]), {'id', 'codigo', 'nombre', 'precio', 'disponible'})
+        disponibles = {producto['codigo']: producto['disponible'] for producto in productos}
+        self.assertEqual(disponibles.get('T000', 5), 5)
+        self.assertEqual(disponibles['T001'], 25)
+
+    def test_termino_corto_y_permisos(self):
+        self.assertEqual(self.buscar(q='T')[0], [])
+
+        respuesta = self.llamar(User.objects.create_user('bodeguero', role='bodega'), q='Tornillo')
+        self.assertEqual(respuesta.status_code, 401)
+
+
+class CompletarPedidoTests(TestCase):
+    """Completar un pedido cambia el estado y reserva el stock juntos, una sola vez"""
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre='General')
+        subcategoria = Subcategoria.objects.create(nombre='Varios', categoria=categoria)
+        cls.bodega = Bodega.objects.create(nombre='Principal', direccion='Calle 1', es_principal=True)
+        cls.producto = Producto.objects.create(codigo='P001', nombre='Producto', categoria=categoria, subcategoria=subcategoria)
+        cls.stock = Stock.objects.create(producto=cls.producto, bodega=cls.bodega, cantidad=10)
+        cls.usuario = User.objects.create_user('bodeguero', role='bodega', bodega=cls.bodega)
+        cliente = Cliente.objects.create(numero_documento='1', nombre_completo='Cliente', telefono='300', direccion='Calle')
+        cls.pedido = Pedido.objects.create(numero='PED1', cliente=cliente, estado='proceso')
+        ItemPedido.objects.create(pedido=cls.pedido, producto=cls.producto, cantidad=4, precio_unitario=1000)
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def reservada(self):
+        self.stock.refresh_from_db()
+        return self.stock.cantidad_reservada
+
+    def test_doble_envio_reserva_una_vez(self):
+        url = reverse('ventas:completar_alistamiento', args=[self.pedido.pk])
+        self.assertEqual(self.client.post(url).status_code, 302)
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.assertEqual(self.reservada(), 4)
+
+        # Una instancia cargada antes del primer envío tampoco reserva de nuevo
+        resultado = self.pedido.completar_reservando(bodega=self.bodega, usuario=self.usuario)
+        self.assertTrue(resultado['conflicto'])
+        self.assertEqual(self.reservada(), 4)
+        self.assertEqual(MovimientoInventario.objects.filter(motivo='reserva').count(), 1)
+
+        self.client.post(reverse('ventas:cambiar_estado_pedido', args=[self.pedido.pk]), {'estado': 'completado'})
+        self.client.post(reverse('ventas:completar_pedido_inmediato', args=[self.pedido.pk]))
+        self.assertEqual(self.reservada(), 4)
+
+    def test_sin_stock_o_con_error_no_cambia_nada(self):
+        ItemPedido.objects.create(pedido=self.pedido, producto=self.producto, cantidad=20, precio_unitario=1000)
+        resultado = self.pedido.completar_reservando(bodega=self.bodega)
+        self.assertFalse(resultado['exito'])
+        self.assertEqual(Pedido.objects.get(pk=self.pedido.pk).estado, 'proceso')
+        self.assertEqual(self.reservada(), 0)
+
+        ItemPedido.objects.filter(cantidad=20).delete()
+        with mock.patch.object(Pedido, '_invalidar_metricas', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                Pedido.objects.get(pk=self.pedido.pk).completar_reservando(bodega=self.bodega)
+        self.assertEqual(Pedido.objects.get(pk=self.pedido.pk).estado, 'proceso')
+        self.assertEqual(self.reservada(), 0)
+
+    def test_vistas_simples_reservan(self):
+        respuesta = self.client.post(reverse('ventas:completar_pedido_inmediato', args=[self.pedido.pk]))
+        self.assertRedirects(respuesta, reverse('ventas:pedido_detail', args=[self.pedido.pk]), fetch_redirect_response=False)
+        self.assertEqual(Pedido.objects.get(pk=self.pedido.pk).estado, 'completado')
+        self.assertEqual(self.reservada(), 4)
+
+
+    def test_cantidad_fraccionaria_no_se_trunca(self):
+        ItemPedido.objects.filter(pedido=self.pedido).update(cantidad=Decimal('2.50'))
+        respuesta = self.client.post(reverse('ventas:completar_alistamiento', args=[self.pedido.pk]))
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertIn('enteras', respuesta.json()['error'])
+        self.assertEqual(Pedido.objects.get(pk=self.pedido.pk).estado, 'proceso')
+        self.assertEqual(self.reservada(), 0)
+
+    def test_suma_las_filas_de_variantes(self):
+        self.stock.cantidad = 1
+        self.stock.save()
+        variante = VarianteProducto.objects.create(
+            producto=self.producto, tipo_variante='color', valor='Rojo', codigo_variante='P001-R'
+        )
+        stock_variante = Stock.objects.create(producto=self.producto, variante=variante, bodega=self.bodega, cantidad=5)
+
+        resultado = self.pedido.completar_reservando(bodega=self.bodega, usuario=self.usuario)
+        self.assertTrue(resultado['exito'])
+        self.assertEqual(resultado['lineas'][0]['stock_disponible'], 6)
+        stock_variante.refresh_from_db()
+        self.assertEqual((self.reservada(), stock_variante.cantidad_reservada), (1, 3))
+        self.assertCountEqual(
+            MovimientoInventario.objects.filter(motivo='reserva').values_list('variante_id', flat=True),
+            [None, variante.pk],
+        )
+
+class ReporteItemsRechazadosTests(TestCase):
+    """La conciliación por entrega del reporte no agrega consultas por entrega"""
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre='General')
+        subcategoria = Subcategoria.objects.create(nombre='Varios', categoria=categoria)
+        cls.productos = [
+            Producto.objects.create(codigo=f'P{i}', nombre=f'Producto {i}', categoria=categoria, subcategoria=subcategoria)
+            for i in range(2)
+        ]
+        cls.cliente = Cliente.objects.create(numero_documento='1', nombre_completo='Cliente', telefono='300', direccion='Calle')
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def crear_entregas(self, cantidad):
+        for _ in range(cantidad):
+            numero = Pedido.objects.count() + 1
+            pedido = Pedido.objects.create(numero=f'PED{numero}', cliente=self.cliente)
+            items = [
+                ItemPedido.objects.create(pedido=pedido, producto=producto, cantidad=4, precio_unitario=1000)
+                for producto in self.productos
+            ]
+            entrega = Entrega.objects.create(
+                pedido=pedido, direccion_entrega='Calle', telefono_contacto='300', fecha_programada=timezone.now()
+            )
+            ItemRechazado.objects.create(entrega=entrega, item_pedido=items[0], cantidad_rechazada=1, motivo='defectuoso')
+
+    def consultar(self):
+        return self.client.get(reverse('ventas:reporte_items_rechazados'))
+
+    def test_consultas_constantes(self):
+        self.crear_entregas(1)
+        with CaptureQueriesContext(connection) as una_entrega:
+            respuesta = self.consultar()
+        self.assertEqual(len(respuesta.context['conciliacion_entregas']), 1)
+
+        self.crear_entregas(9)
+        with self.assertNumQueries(len(una_entrega)):
+            respuesta = self.consultar()
+        conciliacion = respuesta.context['conciliacion_entregas']
+        self.assertEqual(len(conciliacion), 10)
+        self.assertEqual(
+            {(fila['items_entregados'], fila['valor_entregado'], fila['valor_rechazado']) for fila in conciliacion},
+            {(2, Decimal('7000'), Decimal('1000'))},
+        )
+
+
+class TotalIncrementalTests(TestCase):
+    """Guardar el documento con un total viejo en memoria no deshace lo que sumaron las líneas"""
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre='General')
+        subcategoria = Subcategoria.objects.create(nombre='Varios', categoria=categoria)
+        cls.producto = Producto.objects.create(codigo='P001', nombre='Producto', categoria=categoria, subcategoria=subcategoria)
+        cls.cliente = Cliente.objects.create(numero_documento='1', nombre_completo='Cliente', telefono='300', direccion='Calle')
+
+    def test_guardar_pedido_despues_de_editar_una_linea(self):
+        pedido = Pedido.objects.create(numero='PED1', cliente=self.cliente)
+        item = ItemPedido.objects.create(pedido=pedido, producto=self.producto, cantidad=2, precio_unitario=1000)
+        pedido = Pedido.objects.get(pk=pedido.pk)
+
+        item.cantidad = 5
+        item.save()
+        pedido.estado = 'pendiente'
+        pedido.save()
+
+        self.assertEqual(pedido.total, Decimal('5000'))
+        self.assertEqual(Pedido.objects.values_list('estado', 'total').get(pk=pedido.pk), ('pendiente', Decimal('5000')))
+
+    def test_guardar_cotizacion_despues_de_editar_una_linea(self):
+        cotizacion = Cotizacion.objects.create(numero='COT1', cliente=self.cliente)
+        cotizacion = Cotizacion.objects.get(pk=cotizacion.pk)
+
+        ItemCotizacion.objects.create(cotizacion=cotizacion, producto=self.producto, cantidad=3, precio_unitario=1000)
+        cotizacion.estado = 'enviada'
+        cotizacion.save()
+
+        self.assertEqual(cotizacion.total, Decimal('3000'))
+        self.assertEqual(Cotizacion.objects.get(pk=cotizacion.pk).total, Decimal('3000'))
+
+
+class MetricasDashboardTests(TestCase):
+    """Las cifras del dashboard salen de consultas agrupadas y la caché se invalida al guardar"""
+
+    hoy = date(2025, 3, 15)
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre='General')
+        subcategoria = Subcategoria.objects.create(nombre='Varios', categoria=categoria)
+        productos = [
+            Producto.objects.create(codigo=f'P00{i}', nombre=f'Producto {i}', categoria=categoria, subcategoria=subcategoria)
+            for i in (1, 2)
+        ]
+        cliente = Cliente.objects.create(numero_documento='1', nombre_completo='Cliente', telefono='300', direccion='Calle')
+
+        def documento(modelo, numero, estado, dia, total=0, items=()):
+            documento = modelo.objects.create(numero=numero, cliente=cliente, estado=estado, total=total)
+            for producto, cantidad, precio in items:
+                ItemPedido.objects.create(pedido=documento, producto=productos[producto], cantidad=cantidad, precio_unitario=precio)
+            modelo.objects.filter(pk=documento.pk).update(fecha_creacion=timezone.make_aware(datetime(2025, *dia, 12)))
+            return documento
+
+        cls.pedido = documento(Pedido, 'PED1', 'completado', (3, 10), items=[(0, 2, 25), (1, 1, 50)])
+        documento(Pedido, 'PED2', 'completado', (3, 14), items=[(0, 1, 50)])
+        documento(Pedido, 'PED3', 'completado', (2, 20), total=30)
+        documento(Pedido, 'PED4', 'pendiente', (3, 15), total=40)
+        documento(Pedido, 'PED5', 'cancelado', (3, 12), total=70)
+        documento(Factura, 'FAC1', 'emitida', (3, 11), total=200)
+        documento(Factura, 'FAC2', 'pagada', (2, 10), total=100)
+        cls.factura = documento(Factura, 'FAC3', 'borrador', (3, 13), total=999)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cifras_agrupadas(self):
+        with self.assertNumQueries(7):
+            resultado = metricas.calcular_metricas_dashboard(7, self.hoy)
+
+        kpis = resultado['kpis']
+        self.assertEqual(kpis['pedidos_mes'], {'valor': 2, 'total': Decimal('150'), 'crecimiento': 400})
+        self.assertEqual(kpis['pedidos_periodo'], {'valor': 2, 'total': Decimal('150'), 'crecimiento': 100})
+        self.assertEqual(kpis['facturas_mes'], {'valor': 1, 'total': Decimal('200'), 'crecimiento': 100})
+        self.assertEqual((kpis['pedidos_pendientes'], kpis['facturas_pendientes']), (1, 1))
+        self.assertEqual(
+            {fila['estado']: (fila['cantidad'], fila['valor_total']) for fila in resultado['estadisticas_pedidos']},
+            {'completado': (3, Decimal('180')), 'pendiente': (1, Decimal('40')), 'cancelado': (1, Decimal('70'))},
+        )
+        self.assertEqual(
+            [(fila['producto__codigo'], fila['cantidad_vendida'], fila['valor_total']) for fila in resultado['top_productos']],
+            [('P001', 3, 100), ('P002', 1, 50)],
+        )
+        self.assertEqual(resultado['ventas_por_dia'], {
+            'labels': ['09/03', '10/03', '11/03', '12/03', '13/03', '14/03', '15/03'],
+            'data': [0, 100, 0, 0, 0, 50, 0],
+        })
+        self.assertEqual(
+            [actividad['titulo'] for actividad in resultado['actividad_reciente']],
+            ['Pedido PED4', 'Pedido PED2', 'Factura FAC3', 'Pedido PED5', 'Factura FAC1', 'Factura FAC2'],
+        )
+
+    def test_guardar_documentos_invalida_la_cache(self):
+        def pendientes():
+            return metricas.metricas_dashboard(None)['kpis']['pedidos_pendientes']
+
+        self.assertEqual(pendientes(), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(pendientes(), 1)
+
+        # Guardar sin cambiar estado ni total conserva la caché
+        pedido = Pedido.objects.get(pk=self.pedido.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            pedido.save()
+        with self.assertNumQueries(0):
+            pendientes()
+
+        pedido.estado = 'pendiente'
+        with self.captureOnCommitCallbacks(execute=True):
+            pedido.save()
+        self.assertEqual(pendientes(), 2)
+
+        factura = Factura.objects.get(pk=self.factura.pk)
+        factura.estado = 'emitida'
+        with mock.patch.object(pdf_facturas, 'programar_prerenderizado'):
+            with self.captureOnCommitCallbacks(execute=True):
+                factura.save()
+        self.assertEqual(metricas.metricas_dashboard(None)['kpis']['facturas_pendientes'], 2)
+
+
+class ExportacionTests(TestCase):
+    """Los escritores de CSV y XLSX producen archivos que se abren con los mismos valores"""
+
+    ENCABEZADOS = ['Número', 'Cliente', 'Total', 'Fecha', 'Activo']
+
+    @classmethod
+    def setUpTestData(cls):
+        Cliente.objects.create(numero_documento='1', nombre_completo='Ana\x01 Pérez\x0b', telefono='300', direccion='Calle')
+        Cliente.objects.create(numero_documento='2', nombre_completo='  "Comillas", coma\nlínea', telefono='301', direccion='Calle')
+
+    def definicion(self):
+        return exportacion.definicion_exportacion(
+            'clientes', ['Documento', 'Nombre'], Cliente.objects.order_by('numero_documento'),
+            ['numero_documento', 'nombre_completo'], pie=[('Total', 2)], anchos=[12, 30],
+        )
+
+    def test_excel_con_caracteres_de_control(self):
+        archivo = io.BytesIO()
+        exportacion.escribir_exportacion(self.definicion(), 'excel', archivo)
+        hoja = load_workbook(archivo).active
+        self.assertEqual(
+            [tuple(fila) for fila in hoja.iter_rows(values_only=True)],
+            [('Documento', 'Nombre'), ('1', 'Ana Pérez'), ('2', '  "Comillas", coma\nlínea'), ('Total', 2)],
+        )
+        self.assertTrue(hoja['A1'].font.b)
+
+    def test_excel_tipos_y_formato_de_moneda(self):
+        fecha = timezone.make_aware(datetime(2025, 3, 1, 14, 30))
+        filas = [
+            ('P1', 'Cliente <uno> & otro', Decimal('1234.50'), fecha, True),
+            ('P2', None, 0, date(2025, 3, 2), False),
+            ('P3', None, 0, None, False),
+        ]
+        respuesta = exportacion.respuesta_excel('pedidos.xlsx', self.ENCABEZADOS, filas, columnas_moneda=[2])
+        hoja = load_workbook(io.BytesIO(b''.join(respuesta.streaming_content))).active
+        self.assertEqual(
+            [tuple(fila) for fila in hoja.iter_rows(min_row=2, values_only=True)],
+            [
+                ('P1', 'Cliente <uno> & otro', 1234.5, datetime(2025, 3, 1, 14, 30), True),
+                ('P2', None, 0, datetime(2025, 3, 2), False),
+                ('P3', None, 0, None, False),
+            ],
+        )
+        self.assertEqual(hoja['C2'].number_format, exportacion.FORMATO_MONEDA)
+        self.assertEqual(hoja['D2'].number_format, exportacion.FORMATO_FECHA_HORA)
+        self.assertEqual(hoja['D3'].number_format, exportacion.FORMATO_FECHA)
+        self.assertTrue(hoja['D2'].is_date)
+
+    def test_csv(self):
+        archivo = io.BytesIO()
+        exportacion.escribir_exportacion(self.definicion(), 'csv', archivo)
+        filas = list(csv.reader(io.StringIO(archivo.getvalue().decode(), newline='')))
+        self.assertEqual(
+            filas,
+            [['Documento', 'Nombre'], ['1', 'Ana\x01 Pérez\x0b'], ['2', '  "Comillas", coma\nlínea'], ['Total', '2']],
+        )
+
+    def test_csv_en_streaming_por_partes(self):
+        filas = [(f'P{i}', 'x' * 100) for i in range(2000)]
+        with mock.patch.object(exportacion, 'TAMANO_ENVIO', 4096):
+            partes = list(exportacion.respuesta_csv('datos.csv', ['Código', 'Texto'], iter(filas)).streaming_content)
+        self.assertGreater(len(partes), 2)
+        leidas = list(csv.reader(io.StringIO(b''.join(partes).decode(), newline='')))
+        self.assertEqual(leidas[1:], [list(fila) for fila in filas])
+
+
+class TrabajosExportacionTests(TestCase):
+    """Los trabajos se reencolan por falta de latido y un intento reemplazado no pisa al nuevo"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+        cliente = Cliente.objects.create(numero_documento='1', nombre_completo='Cliente', telefono='300', direccion='Calle')
+        Pedido.objects.bulk_create([Pedido(numero=f'PED{i}', cliente=cliente, total=1000) for i in range(5)])
+
+    def setUp(self):
+        carpeta = tempfile.TemporaryDirectory()
+        self.addCleanup(carpeta.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=carpeta.name))
+        self.carpeta = carpeta.name
+
+    def encolar(self):
+        trabajo, _ = trabajos_exportacion.solicitar_exportacion(self.usuario, 'pedidos', 'csv', {})
+        return trabajo
+
+    def temporales(self):
+        return list((Path(self.carpeta) / trabajos_exportacion.CARPETA).glob('*.tmp'))
+
+    def test_reencola_por_latido_y_no_por_antiguedad(self):
+        trabajo = self.encolar()
+        trabajos_exportacion.tomar_siguiente()
+        hace_una_hora = timezone.now() - timedelta(hours=1)
+
+        # Empezó hace una hora pero sigue reportando avance
+        TrabajoExportacion.objects.filter(pk=trabajo.pk).update(fecha_inicio=hace_una_hora)
+        self.assertEqual(trabajos_exportacion.reencolar_abandonados(), 0)
+
+        TrabajoExportacion.objects.filter(pk=trabajo.pk).update(ultimo_latido=hace_una_hora)
+        self.assertEqual(trabajos_exportacion.reencolar_abandonados(), 1)
+        self.assertEqual(TrabajoExportacion.objects.get(pk=trabajo.pk).estado, 'pendiente')
+
+    def test_intento_reemplazado_no_toca_el_trabajo(self):
+        self.encolar()
+        primero = trabajos_exportacion.tomar_siguiente()
+        TrabajoExportacion.objects.filter(pk=primero.pk).update(ultimo_latido=timezone.now() - timedelta(hours=1))
+        trabajos_exportacion.reencolar_abandonados()
+        segundo = trabajos_exportacion.tomar_siguiente()
+        self.assertEqual((primero.intento, segundo.intento), (1, 2))
+
+        # El worker del primer intento despierta y termina después del reencolado
+        trabajos_exportacion.procesar_trabajo(primero)
+        trabajo = TrabajoExportacion.objects.get(pk=primero.pk)
+        self.assertEqual((trabajo.estado, trabajo.archivo.name), ('procesando', ''))
+        self.assertEqual(self.temporales(), [])
+
+        trabajos_exportacion.procesar_trabajo(segundo)
+        trabajo.refresh_from_db()
+        self.assertEqual((trabajo.estado, trabajo.filas_procesadas), ('completado', 5))
+        with trabajo.archivo.open('rb') as archivo:
+            self.assertEqual(len(archivo.read().decode().splitlines()), 6)
+        self.assertEqual(self.temporales(), [])
+
+
+class PaginacionKeysetTests(TestCase):
+    """Paginación por cursor: orden estable con fechas repetidas, cursores inválidos y conteo acotado"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cliente = Cliente.objects.create(numero_documento='1', nombre_completo='Cliente', telefono='300', direccion='Calle')
+        Pedido.objects.bulk_create([
+            Pedido(numero=f'PED{i:03}', cliente=cliente, estado='pendiente' if i % 2 else 'proceso')
+            for i in range(25)
+        ])
+        # Grupos de cinco pedidos con la misma fecha: el id desempata
+        base = timezone.now().replace(microsecond=0)
+        for i, pedido in enumerate(Pedido.objects.order_by('pk')):
+            Pedido.objects.filter(pk=pedido.pk).update(fecha_creacion=base - timedelta(minutes=i // 5))
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+
+    def recorrer(self, queryset, tamano):
+        vistos = []
+        cursor = None
+        while True:
+            pagina = pagina_keyset(queryset, 'fecha_creacion', cursor, tamano)
+            self.assertEqual(pagina['primera'], cursor is None)
+            vistos.extend(pedido.pk for pedido in pagina['objetos'])
+            if not pagina['has_next']:
+                self.assertIsNone(pagina['siguiente_cursor'])
+                return vistos
+            cursor = pagina['siguiente_cursor']
+
+    def test_recorre_todo_sin_repetir_con_fechas_iguales(self):
+        esperado = list(Pedido.objects.order_by('-fecha_creacion', '-pk').values_list('pk', flat=True))
+        for tamano in (1, 3, 5, 7, 25, 30):
+            self.assertEqual(self.recorrer(Pedido.objects.all(), tamano), esperado)
+
+        pendientes = Pedido.objects.filter(estado='pendiente')
+        self.assertEqual(
+            self.recorrer(pendientes, 4),
+            list(pendientes.order_by('-fecha_creacion', '-pk').values_list('pk', flat=True)),
+        )
+
+    def test_cursor_invalido_vuelve_a_la_primera_pagina(self):
+        fecha = timezone.now()
+        self.assertEqual(decodificar_cursor(codificar_cursor(fecha, 7)), (fecha, 7))
+
+        alterado = base64.urlsafe_b64encode(json.dumps([fecha.isoformat(), 'abc']).encode()).decode()
+        for cursor in (alterado, 'no-es-base64!', codificar_cursor(fecha, 7)[:-4]):
+            self.assertIsNone(decodificar_cursor(cursor))
+
+        self.client.force_login(self.usuario)
+        respuesta = self.client.get(reverse('ventas:api_pedidos_pendientes'), {'cursor': alterado, 'limit': 5})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(len(respuesta.json()), 5)
+        respuesta = self.client.get(reverse('ventas:pedido_list'), {'cursor': alterado})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertTrue(respuesta.context['page_obj']['primera'])
+
+    def test_conteo_aproximado(self):
+        pedidos = Pedido.objects.all()
+        self.assertEqual(conteo_aproximado(pedidos), {'valor': 25, 'exacto': True, 'texto': '25'})
+        self.assertEqual(conteo_aproximado(pedidos, limite=10), {'valor': 10, 'exacto': False, 'texto': '10+'})
+        self.assertEqual(conteo_aproximado(pedidos, limite=10, exacto=True)['valor'], 25)
+
+    def test_cargar_mas_conserva_los_filtros(self):
+        self.client.force_login(self.usuario)
+        url = reverse('ventas:pedido_list')
+
+        desde = (timezone.localdate() - timedelta(days=30)).isoformat()
+
+        respuesta = self.client.get(url, {'fecha_desde': desde, 'conteo': 'exacto', 'page': 3})
+        self.assertEqual(len(respuesta.context['pedidos']), 20)
+        self.assertEqual(respuesta.context['conteo']['texto'], '25')
+        siguiente = respuesta.context['url_siguiente']
+        parametros = QueryDict(siguiente.lstrip('?'))
+        self.assertEqual(sorted(parametros), ['cursor', 'fecha_desde'])
+        self.assertEqual(parametros['fecha_desde'], desde)
+        self.assertContains(respuesta, 'data-cargar-mas-boton')
+
+        respuesta = self.client.get(url + siguiente, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(len(respuesta.context['pedidos']), 5)
+        self.assertFalse(respuesta.context['page_obj']['primera'])
+        self.assertIsNone(respuesta.context['url_siguiente'])
+        self.assertNotIn('conteo', respuesta.context)
+
+
+class PdfFacturasTests(TestCase):
+    """Caché de PDF por huella de contenido e impresión por lotes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+        cls.cliente = Cliente.objects.create(numero_documento='1', nombre_completo='Cliente', telefono='300', direccion='Calle')
+        cls.facturas = []
+        for i in range(3):
+            factura = Factura.objects.create(cliente=cls.cliente, estado='emitida', total=1000 * (i + 1))
+            ItemFactura.objects.create(factura=factura, cantidad=i + 1, precio=1000)
+            cls.facturas.append(factura)
+
+    def setUp(self):
+        carpeta = tempfile.TemporaryDirectory()
+        self.addCleanup(carpeta.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=carpeta.name, PDF_CACHE_DIR=Path(carpeta.name) / 'pdf_cache'))
+        self.cache = Path(carpeta.name) / 'pdf_cache'
+        self.client.force_login(self.usuario)
+
+    def archivos(self, subcarpeta='facturas'):
+        return sorted(ruta.name for ruta in (self.cache / subcarpeta).glob('*.pdf'))
+
+    def test_huella_cambia_con_el_contenido(self):
+        factura_id = self.facturas[0].pk
+
+        def huella():
+            return pdf_facturas.huella_factura(pdf_facturas.obtener_pdf_factura(factura_id)[0])
+
+        huellas = [huella()]
+        self.assertEqual(huella(), huellas[0])
+
+        ItemFactura.objects.filter(factura_id=factura_id).update(precio=2000)
+        huellas.append(huella())
+        Factura.objects.filter(pk=factura_id).update(estado='pagada')
+        huellas.append(huella())
+        Cliente.objects.filter(pk=self.cliente.pk).update(direccion='Otra calle')
+        huellas.append(huella())
+        self.assertEqual(len(set(huellas)), 4)
+
+    def test_cache_y_borrado_de_la_version_anterior(self):
+        factura_id = self.facturas[0].pk
+        _, contenido = pdf_facturas.obtener_pdf_factura(factura_id)
+        self.assertTrue(contenido.startswith(b'%PDF'))
+        anteriores = self.archivos()
+        self.assertEqual(len(anteriores), 1)
+
+        with mock.patch.object(pdf_facturas, '_construir_pdf') as construir:
+            self.assertEqual(pdf_facturas.obtener_pdf_factura(factura_id)[1], contenido)
+        construir.assert_not_called()
+
+        ItemFactura.objects.filter(factura_id=factura_id).update(cantidad=5)
+        pdf_facturas.obtener_pdf_factura(factura_id)
+        actuales = self.archivos()
+        self.assertEqual(len(actuales), 1)
+        self.assertNotEqual(actuales, anteriores)
+
+        # Los borradores se renderizan siempre, sin caché
+        borrador = Factura.objects.create(cliente=self.cliente, estado='borrador')
+        pdf_facturas.obtener_pdf_factura(borrador.pk)
+        self.assertEqual(self.archivos(), actuales)
+
+    def test_prerenderiza_al_emitir(self):
+        with mock.patch.object(pdf_facturas, 'programar_prerenderizado') as programar:
+            with self.captureOnCommitCallbacks(execute=True):
+                factura = Factura.objects.create(cliente=self.cliente, estado='borrador')
+            programar.assert_not_called()
+
+            factura.estado = 'emitida'
+            with self.captureOnCommitCallbacks(execute=True):
+                factura.save()
+        programar.assert_called_once_with(factura.pk)
+
+    def test_lote_en_linea(self):
+        url = reverse('ventas:imprimir_facturas_lote')
+        ids = [factura.pk for factura in self.facturas]
+
+        respuesta = self.client.get(url, {'ids': ids})
+        self.assertEqual(respuesta['Content-Type'], 'application/pdf')
+        self.assertTrue(respuesta.content.startswith(b'%PDF'))
+        self.assertEqual(len(self.archivos('lotes')), 1)
+        with mock.patch.object(pdf_facturas, '_construir_pdf') as construir:
+            self.assertEqual(self.client.get(url, {'ids': ids}).content, respuesta.content)
+        construir.assert_not_called()
+
+        respuesta = self.client.get(url, {'ids': ids, 'formato': 'zip'})
+        with zipfile.ZipFile(io.BytesIO(respuesta.content)) as archivo:
+            self.assertEqual(
+                sorted(archivo.namelist()), sorted(f'factura_{factura.numero}.pdf' for factura in self.facturas)
+            )
+        self.assertEqual(len(self.archivos()), 3)
+
+        self.assertEqual(self.client.get(url, {'fecha': '31-12-2024'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'ids': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'ids': 999999}).status_code, 404)
+
+    def test_lote_grande_en_segundo_plano(self):
+        url = reverse('ventas:imprimir_facturas_lote')
+        with mock.patch.object(facturas_views, 'LOTE_EN_LINEA', 2), \
+                mock.patch.object(pdf_facturas, '_construir_pdf', wraps=pdf_facturas._construir_pdf) as construir:
+            respuesta = self.client.post(url, {'ids': [factura.pk for factura in self.facturas], 'formato': 'zip'})
+            self.assertEqual(respuesta.status_code, 202)
+            construir.assert_not_called()
+
+        trabajo = trabajos_exportacion.tomar_siguiente()
+        self.assertEqual((trabajo.pk, trabajo.tipo, trabajo.formato), (respuesta.json()['id'], 'facturas_pdf', 'zip'))
+        trabajos_exportacion.procesar_trabajo(trabajo)
+        trabajo.refresh_from_db()
+        self.assertEqual((trabajo.estado, trabajo.total_filas, trabajo.filas_procesadas), ('completado', 3, 3))
+        self.assertTrue(trabajo.nombre_archivo.endswith('.zip'))
+        with zipfile.ZipFile(trabajo.archivo.path) as archivo:
+            self.assertEqual(len(archivo.namelist()), 3)
+
+
+class PrerenderizadoFacturasTests(TransactionTestCase):
+    """Al emitir una factura su PDF queda en caché sin que nadie lo pida"""
+
+    def test_emitir_deja_el_pdf_en_cache(self):
+        carpeta = tempfile.TemporaryDirectory()
+        self.addCleanup(carpeta.cleanup)
+        cache = Path(carpeta.name) / 'facturas'
+        with override_settings(PDF_CACHE_DIR=Path(carpeta.name)):
+            cliente = Cliente.objects.create(numero_documento='1', nombre_completo='Cliente', telefono='300', direccion='Calle')
+            factura = Factura.objects.create(cliente=cliente, estado='borrador')
+            ItemFactura.objects.create(factura=factura, cantidad=2, precio=1000)
+            factura.estado = 'emitida'
+            factura.save()
+            # El hilo de pre-renderizado procesa en orden: esperar a que vacíe su cola
+            pdf_facturas._prerenderizador.submit(lambda: None).result(timeout=30)
+
+            rutas = list(cache.glob(f'{factura.pk}-*.pdf'))
+            self.assertEqual(len(rutas), 1)
+            with mock.patch.object(pdf_facturas, '_construir_pdf') as construir:
+                self.assertEqual(pdf_facturas.obtener_pdf_factura(factura.pk)[1], rutas[0].read_bytes())
+            construir.assert_not_called()
+
+
+class SecuenciaDocumentoTests(TestCase):
+    """Numeración por bloques, por periodo y continuando la de documentos anteriores"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cliente = Cliente.objects.create(numero_documento='1', nombre_completo='Cliente', telefono='300', direccion='Calle')
+
+    def reservar(self, cantidad, periodo=2025):
+        return reservar_numeros(Cotizacion, 'cotizacion', f'COT{periodo}', cantidad, 3, periodo)
+
+    def test_bloques_consecutivos(self):
+        self.assertEqual(self.reservar(3), ['COT2025001', 'COT2025002', 'COT2025003'])
+        self.assertEqual(self.reservar(1), ['COT2025004'])
+        self.assertEqual(self.reservar(2), ['COT2025005', 'COT2025006'])
+        self.assertEqual(SecuenciaDocumento.objects.get(tipo='cotizacion', periodo='2025').ultimo_valor, 6)
+
+    def test_cambio_de_periodo_reinicia(self):
+        self.reservar(5, periodo=2025)
+        self.assertEqual(self.reservar(2, periodo=2026), ['COT2026001', 'COT2026002'])
+        self.assertEqual(self.reservar(1, periodo=2025), ['COT2025006'])
+
+    def test_continua_documentos_anteriores(self):
+        # Comparación numérica: COT20251000 es mayor que COT2025999
+        for numero in ['COT2025999', 'COT20251000', 'COT2024500']:
+            Cotizacion.objects.create(numero=numero, cliente=self.cliente)
+        self.assertEqual(self.reservar(2), ['COT20251001', 'COT20251002'])
+
+    def test_rollback_devuelve_los_numeros(self):
+        self.reservar(2)
+        with transaction.atomic():
+            self.reservar(3)
+            transaction.set_rollback(True)
+        self.assertEqual(self.reservar(1), ['COT2025003'])
+
+
+class SecuenciaDocumentoConcurrenteTests(TransactionTestCase):
+    """Escritores simultáneos nunca reciben el mismo número ni dejan huecos"""
+
+    HILOS = 8
+    RESERVAS = 15
+
+    def test_reservas_concurrentes_sin_duplicados(self):
+        numeros = []
+        errores = []
+        candado = threading.Lock()
+        barrera = threading.Barrier(self.HILOS)
+
+        def escritor(bloque):
+            propios = []
+            try:
+                barrera.wait()
+                for _ in range(self.RESERVAS):
+                    propios.extend(SecuenciaDocumento.reservar('concurrencia', '2025', bloque))
+            except Exception as e:
+                errores.append(e)
+            finally:
+                connection.close()
+                with candado:
+                    numeros.extend(propios)
+
+        hilos = [threading.Thread(target=escritor, args=(1 + i % 3,)) for i in range(self.HILOS)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(errores, [])
+        esperado = sum(1 + i % 3 for i in range(self.HILOS)) * self.RESERVAS
+        self.assertEqual(sorted(numeros), list(range(1, esperado + 1)))
+        self.assertEqual(SecuenciaDocumento.objects.get(tipo='concurrencia').ultimo_valor, esperado)
+
+
+class OptimizadorRutasTests(TestCase):
+    """2-opt/Or-opt sobre el vecino más cercano: nunca peor, y cerca del óptimo en rutas cortas"""
+
+    origen = (4.65, -74.08)
+
+    def puntos(self, cantidad, semilla):
+        aleatorio = random.Random(semilla)
+        return [(4.65 + aleatorio.uniform(-0.1, 0.1), -74.08 + aleatorio.uniform(-0.1, 0.1)) for _ in range(cantidad)]
+
+    def optimo(self, puntos, regresar):
+        matriz = matriz_distancias(
+            [self.origen[0]] + [p[0] for p in puntos], [self.origen[1]] + [p[1] for p in puntos]
+        )
+        return min(
+            sum(matriz[a, b] for a, b in zip((0,) + orden, orden)) + (matriz[orden[-1], 0] if regresar else 0)
+            for orden in itertools.permutations(range(1, len(puntos) + 1))
+        )
+
+    def test_cerca_del_optimo_en_rutas_cortas(self):
+        for semilla in range(5):
+            puntos = self.puntos(7, semilla)
+            for regresar in (False, True):
+                resultado = optimizar_recorrido(self.origen, puntos, self.origen if regresar else None)
+                optimo = self.optimo(puntos, regresar)
+                self.assertEqual(sorted(resultado['orden']), list(range(7)))
+                self.assertGreaterEqual(resultado['distancia_total'], round(optimo, 2) - 0.01)
+                self.assertLessEqual(resultado['distancia_total'], optimo * 1.08)
+
+    def test_mejora_sobre_vecino_mas_cercano(self):
+        puntos = self.puntos(60, 11)
+        _, distancia_greedy = ordenar_paradas([{'lat': lat, 'lng': lng} for lat, lng in puntos], self.origen)
+        resultado = optimizar_recorrido(self.origen, puntos)
+        self.assertAlmostEqual(resultado['distancia_vecino_mas_cercano'], distancia_greedy, places=1)
+        self.assertLessEqual(resultado['distancia_total'], distancia_greedy)
+        self.assertAlmostEqual(resultado['ahorro_km'], distancia_greedy - resultado['distancia_total'], places=1)
+        self.assertAlmostEqual(sum(resultado['tramos']), resultado['distancia_total'], delta=0.5)
+
+        regreso = optimizar_recorrido(self.origen, puntos, self.origen)
+        self.assertGreater(regreso['distancia_regreso'], 0)
+        self.assertEqual(optimizar_recorrido(self.origen, puntos)['distancia_regreso'], 0)
+
+    def test_paradas_sin_gps_al_final(self):
+        paradas = [{'id': 1, 'lat': None, 'lng': None}] + [
+            {'id': i + 2, 'lat': lat, 'lng': lng} for i, (lat, lng) in enumerate(self.puntos(4, 3))
+        ]
+        ordenadas, resumen = optimizar_paradas(paradas, self.origen)
+        self.assertEqual([parada['orden'] for parada in ordenadas], [1, 2, 3, 4, 5])
+        self.assertEqual(ordenadas[-1]['id'], 1)
+        self.assertTrue(ordenadas[-1]['sin_gps'])
+        self.assertAlmostEqual(sum(p['distancia_desde_anterior'] for p in ordenadas), resumen['distancia_total'], delta=0.05)
+
+
+class EntregasEnLoteTests(TestCase):
+    """La creación masiva de entregas es todo o nada y numera con un solo bloque"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.repartidor = User.objects.create_user('repartidor', role='repartidor')
+        cls.pedidos = []
+        for i in range(3):
+            cliente = Cliente.objects.create(
+                numero_documento=str(i), nombre_completo=f'Cliente {i}', telefono=f'30{i}', direccion=f'Calle {i}'
+            )
+            cls.pedidos.append(Pedido.objects.create(numero=f'PED{i}', cliente=cliente, estado='completado'))
+
+    def crear(self, pedido_ids):
+        return Entrega.crear_en_lote(pedido_ids, self.repartidor, timezone.now())
+
+    def test_crea_en_orden_con_un_bloque_de_numeros(self):
+        año = datetime.now().year
+        pedido_ids = [self.pedidos[2].pk, self.pedidos[0].pk, self.pedidos[1].pk]
+
+        with CaptureQueriesContext(connection) as consultas:
+            entregas = self.crear(pedido_ids)
+        sentencias = [q['sql'] for q in consultas.captured_queries if 'SAVEPOINT' not in q['sql']]
+        self.assertLessEqual(len(sentencias), 5)
+        self.assertEqual(sum(sql.startswith('INSERT INTO "ventas_entrega"') for sql in sentencias), 1)
+
+        self.assertTrue(all(entrega.pk for entrega in entregas))
+        self.assertEqual([entrega.pedido_id for entrega in entregas], pedido_ids)
+        self.assertEqual([entrega.numero for entrega in entregas], [f'ENT{año}{n:03d}' for n in (1, 2, 3)])
+        self.assertEqual([entrega.direccion_entrega for entrega in entregas], ['Calle 2', 'Calle 0', 'Calle 1'])
+        self.assertEqual({entrega.estado for entrega in entregas}, {'asignada'})
+        self.assertEqual(SecuenciaDocumento.objects.get(tipo='entrega').ultimo_valor, 3)
+
+        # El siguiente número continúa el bloque
+        pedido = Pedido.objects.create(numero='PED9', cliente=self.pedidos[0].cliente, estado='completado')
+        self.assertEqual(self.crear([pedido.pk])[0].numero, f'ENT{año}004')
+
+    def test_ids_duplicados_crean_una_entrega(self):
+        entregas = self.crear([self.pedidos[0].pk, str(self.pedidos[0].pk), self.pedidos[1].pk])
+        self.assertEqual([entrega.pedido_id for entrega in entregas], [self.pedidos[0].pk, self.pedidos[1].pk])
+        self.assertEqual(Entrega.objects.count(), 2)
+
+    def test_un_pedido_no_disponible_cancela_el_lote(self):
+        self.crear([self.pedidos[0].pk])
+        Pedido.objects.filter(pk=self.pedidos[1].pk).update(estado='pendiente')
+
+        for pedido_ids in (
+            [self.pedidos[2].pk, self.pedidos[0].pk],   # ya tiene entrega
+            [self.pedidos[2].pk, self.pedidos[1].pk],   # no está completado
+            [self.pedidos[2].pk, 999999],               # no existe
+        ):
+            with self.subTest(pedido_ids=pedido_ids):
+                with self.assertRaises(ValueError):
+                    self.crear(pedido_ids)
+                self.assertEqual(Entrega.objects.count(), 1)
+                self.assertFalse(Entrega.objects.filter(pedido=self.pedidos[2]).exists())
+        self.assertEqual(SecuenciaDocumento.objects.get(tipo='entrega').ultimo_valor, 1)
+
+
+class RutasEntregaTests(TestCase):
+    """Coordenadas desde enlaces de mapas y orden de la ruta del repartidor"""
+
+    def test_coordenadas_desde_enlace(self):
+        for enlace, esperado in [
+            ('https://www.google.com/maps/@4.65,-74.08,15z', (4.65, -74.08)),
+            # El marcador tiene prioridad sobre el centro del mapa
+            ('https://www.google.com/maps/place/Tienda/@4.6,-74.0,15z/data=!4m5!3m4!3d4.6123!4d-74.0456',
+             (4.6123, -74.0456)),
+            ('https://maps.google.com/?q=4.7%2C-74.05', (4.7, -74.05)),
+            ('https://www.google.com/maps/dir/?api=1&destination=4.71,%20-74.06', (4.71, -74.06)),
+            ('https://waze.com/ul?ll=-33.45,-70.66&navigate=yes', (-33.45, -70.66)),
+            ('https://maps.app.goo.gl/AbCdEf123', None),
+            ('https://maps.google.com/?q=Calle+10+%2312-30', None),
+            ('https://maps.google.com/?q=95.1,-74.05', None),
+            ('', None),
+            (None, None),
+        ]:
+            with self.subTest(enlace=enlace):
+                self.assertEqual(coordenadas_desde_enlace(enlace), esperado)
+
+    def test_ruta_entregas(self):
+        Bodega.objects.create(
+            nombre='Principal', direccion='Calle 1', es_principal=True,
+            link_ubicacion='https://www.google.com/maps/@4.60,-74.08,15z',
+        )
+        ahora = timezone.now()
+        for i, latitud in enumerate(['4.61', '4.63', None, '4.62']):
+            cliente = Cliente.objects.create(
+                numero_documento=str(i), nombre_completo=f'Cliente {i}', telefono='300', direccion='Calle',
+                latitud=Decimal(latitud) if latitud else None, longitud=Decimal('-74.08') if latitud else None,
+            )
+            pedido = Pedido.objects.create(numero=f'PED{i}', cliente=cliente, estado='completado')
+            Entrega.objects.create(
+                numero=f'ENT{i}', pedido=pedido, direccion_entrega='Calle', telefono_contacto='300',
+                fecha_programada=ahora,
+            )
+        entregas = Entrega.objects.select_related('pedido__cliente').order_by('numero')
+
+        # Sin ubicación del repartidor sale de la bodega principal
+        with self.assertNumQueries(2):
+            paradas, distancia = ruta_entregas(entregas)
+        self.assertEqual([parada['numero'] for parada in paradas], ['ENT0', 'ENT3', 'ENT1', 'ENT2'])
+        self.assertEqual([parada['orden'] for parada in paradas], [1, 2, 3, 4])
+        self.assertTrue(paradas[-1]['sin_gps'])
+        self.assertAlmostEqual(distancia, distancia_km(4.60, -74.08, 4.63, -74.08), delta=0.05)
+        self.assertEqual(json.loads(json.dumps(paradas)), paradas)
+
+        repartidor = User.objects.create_user(
+            'repartidor', role='repartidor', latitud=Decimal('4.64'), longitud=Decimal('-74.08')
+        )
+        with self.assertNumQueries(1):
+            paradas, distancia = ruta_entregas(entregas.all(), repartidor)
+        self.assertEqual([parada['numero'] for parada in paradas], ['ENT1', 'ENT3', 'ENT0', 'ENT2'])
+        self.assertAlmostEqual(distancia, distancia_km(4.64, -74.08, 4.61, -74.08), delta=0.05)
+
+
+class DespachoTests(TestCase):
+    """El despacho reparte cada entrega una vez respetando cobertura, capacidad y jornada"""
+
+    bodega = (4.65, -74.08)
+
+    def paradas(self, cantidad, semilla=1):
+        aleatorio = random.Random(semilla)
+        return [
+            {'id': i, 'lat': 4.65 + aleatorio.uniform(-0.15, 0.15), 'lng': -74.08 + aleatorio.uniform(-0.15, 0.15)}
+            for i in range(cantidad)
+        ]
+
+    def test_restricciones(self):
+        aleatorio = random.Random(2)
+        repartidores = [
+            {'id': 100 + j, 'lat': 4.65 + aleatorio.uniform(-0.1, 0.1), 'lng': -74.08 + aleatorio.uniform(-0.1, 0.1), 'radio_km': 12}
+            for j in range(8)
+        ] + [{'id': 200, 'lat': None, 'lng': None, 'radio_km': 5}]
+        paradas = self.paradas(300) + [{'id': 'sin-gps', 'lat': None, 'lng': None}]
+        plan = planificar(paradas, repartidores, self.bodega, capacidad=40, jornada_horas=7)
+
+        asignadas = [parada for ruta in plan['rutas'] for parada in ruta['paradas']]
+        self.assertEqual(len(asignadas), len(set(asignadas)))
+        self.assertEqual(len(asignadas) + len(plan['sin_asignar']), len(paradas))
+        self.assertIn({'id': 'sin-gps', 'motivo': 'sin_gps'}, plan['sin_asignar'])
+
+        coordenadas = {parada['id']: (parada['lat'], parada['lng']) for parada in paradas}
+        por_id = {repartidor['id']: repartidor for repartidor in repartidores}
+        for ruta in plan['rutas']:
+            self.assertLessEqual(len(ruta['paradas']), 40)
+            self.assertLessEqual(ruta['duracion_horas'], 7)
+            repartidor = por_id[ruta['repartidor_id']]
+            if repartidor['lat'] is not None:
+                distancias = matriz_distancias(
+                    [repartidor['lat']] + [coordenadas[p][0] for p in ruta['paradas']],
+                    [repartidor['lng']] + [coordenadas[p][1] for p in ruta['paradas']],
+                )[0, 1:]
+                self.assertTrue((distancias <= 12).all())
+
+    def test_carga_pareja_y_jornada(self):
+        repartidores = [{'id': j, 'lat': None, 'lng': None, 'radio_km': 10} for j in range(5)]
+        plan = planificar(self.paradas(100), repartidores, self.bodega, capacidad=100, jornada_horas=24)
+        cargas = [len(ruta['paradas']) for ruta in plan['rutas']]
+        self.assertEqual(sum(cargas), 100)
+        self.assertLessEqual(max(cargas), 24)
+
+        # Jornada corta: lo que no cabe en nadie queda sin asignar por jornada
+        plan = planificar(self.paradas(100), repartidores, self.bodega, capacidad=100, jornada_horas=2)
+        self.assertTrue(all(ruta['duracion_horas'] <= 2 for ruta in plan['rutas']))
+        self.assertTrue(plan['sin_asignar'])
+        self.assertEqual({item['motivo'] for item in plan['sin_asignar']}, {'jornada'})
+        self.assertEqual(duracion_horas(30, 6), 2)
+
+    def test_guarda_asignaciones(self):
+        Bodega.objects.create(
+            nombre='Principal', direccion='Calle 1', es_principal=True,
+            link_ubicacion='https://www.google.com/maps/@4.65,-74.08,15z',
+        )
+        repartidores = [
+            User.objects.create_user(f'repartidor{j}', role='repartidor', radio_cobertura_km=Decimal('50'))
+            for j in range(3)
+        ]
+        ahora = timezone.now()
+        for parada in self.paradas(30):
+            cliente = Cliente.objects.create(
+                numero_documento=str(parada['id']), nombre_completo=f"Cliente {parada['id']}", telefono='300',
+                direccion='Calle', latitud=Decimal(str(round(parada['lat'], 7))), longitud=Decimal(str(round(parada['lng'], 7))),
+            )
+            pedido = Pedido.objects.create(numero=f"PED{parada['id']}", cliente=cliente, estado='completado')
+            Entrega.objects.create(
+                pedido=pedido, direccion_entrega='Calle', telefono_contacto='300',
+                fecha_programada=ahora, estado='pendiente' if parada['id'] < 20 else 'en_ruta',
+            )
+
+        with CaptureQueriesContext(connection) as consultas:
+            plan = despachar_dia(timezone.localdate(ahora), capacidad=10)
+        self.assertLessEqual(len(consultas), 10)
+        self.assertEqual(plan['resumen']['guardadas'], 20)
+
+        asignadas = Entrega.objects.filter(repartidor__isnull=False)
+        self.assertEqual(asignadas.count(), 20)
+        self.assertFalse(asignadas.exclude(estado='asignada').exists())
+        self.assertFalse(Entrega.objects.filter(estado='en_ruta', repartidor__isnull=False).exists())
+        for repartidor in repartidores:
+            ordenes = list(asignadas.filter(repartidor=repartidor).order_by('orden_ruta').values_list('orden_ruta', flat=True))
+            self.assertEqual(ordenes, list(range(1, len(ordenes) + 1)))
+
+        # Con un solo repartidor, las que ya no caben pierden la asignación del despacho anterior
+        User.objects.filter(pk__in=[repartidor.pk for repartidor in repartidores[1:]]).update(disponible_entregas=False)
+        plan = despachar_dia(timezone.localdate(ahora), capacidad=10)
+        self.assertEqual((plan['resumen']['guardadas'], plan['resumen']['desasignadas']), (10, 10))
+        self.assertTrue(all(item.get('desasignada') for item in plan['sin_asignar']))
+        self.assertEqual(set(asignadas.values_list('repartidor', flat=True)), {repartidores[0].pk})
+        self.assertEqual(
+            Entrega.objects.filter(estado='pendiente', repartidor__isnull=True, orden_ruta__isnull=True).count(), 10
+        )
+
+
+class SeguimientoGpsTests(TestCase):
+    """Los pings se acumulan en memoria, se guardan en bloque y permiten reproducir el recorrido"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.repartidor = User.objects.create_user('repartidor', role='repartidor')
+        cls.vendedor = User.objects.create_user('vendedor', role='vendedor')
+
+    def setUp(self):
+        # Buffer vacío y reloj de volcado en cero: nada se escribe hasta llamar volcar()
+        seguimiento_gps.volcar()
+        # El hilo de volcado usaría otra conexión, fuera de la transacción de la prueba
+        self.enterContext(mock.patch.object(seguimiento_gps, 'iniciar_volcador'))
+
+    def test_pings_en_lote(self):
+        ahora = timezone.now().replace(microsecond=0)
+        pings = [
+            {'latitud': 4.651, 'longitud': -74.081, 'registrada': (ahora - timedelta(seconds=20)).isoformat()},
+            {'latitud': 4.653, 'longitud': -74.083, 'registrada': ahora.isoformat()},
+            {'latitud': 4.652, 'longitud': -74.082, 'registrada': (ahora - timedelta(seconds=10)).isoformat()},
+            {'latitud': 123, 'longitud': -74.08},
+        ]
+        self.client.force_login(self.repartidor)
+        respuesta = self.client.post(
+            reverse('ventas:api_ubicacion_repartidor'), json.dumps({'pings': pings}), content_type='application/json'
+        )
+        self.assertEqual(respuesta.json(), {'success': True, 'recibidos': 3, 'descartados': 1})
+        self.assertFalse(PosicionRepartidor.objects.exists())
+        self.assertEqual(seguimiento_gps.pendientes(), 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(seguimiento_gps.volcar(), 3)
+        self.assertEqual(PosicionRepartidor.objects.filter(repartidor=self.repartidor).count(), 3)
+        # La última posición es la del ping más reciente, aunque llegó antes que otro
+        self.repartidor.refresh_from_db()
+        self.assertEqual((self.repartidor.latitud, self.repartidor.longitud), (Decimal('4.653'), Decimal('-74.083')))
+        self.assertEqual(self.repartidor.ubicacion_actualizada, ahora)
+
+        # Un ping atrasado entra al historial pero no retrocede la posición del usuario
+        seguimiento_gps.registrar_pings(self.repartidor.pk, [
+            {'latitud': 4.6, 'longitud': -74.0, 'registrada': (ahora - timedelta(minutes=5)).isoformat()}
+        ])
+        seguimiento_gps.volcar()
+        self.repartidor.refresh_from_db()
+        self.assertEqual(self.repartidor.latitud, Decimal('4.653'))
+        self.assertEqual(PosicionRepartidor.objects.count(), 4)
+
+    def test_recorrido_de_entrega(self):
+        inicio = timezone.now().replace(microsecond=0) - timedelta(hours=1)
+        cliente = Cliente.objects.create(numero_documento='1', nombre_completo='Cliente', telefono='300', direccion='Calle')
+        entrega = Entrega.objects.create(
+            pedido=Pedido.objects.create(numero='PED1', cliente=cliente, estado='completado'),
+            repartidor=self.repartidor, direccion_entrega='Calle', telefono_contacto='300',
+            fecha_programada=inicio, estado='entregada',
+            fecha_inicio=inicio, fecha_entrega=inicio + timedelta(minutes=30),
+        )
+        PosicionRepartidor.objects.bulk_create([
+            PosicionRepartidor(
+                repartidor=self.repartidor, latitud=Decimal('4.65') + Decimal('0.001') * minuto,
+                longitud=Decimal('-74.08'), registrada=inicio + timedelta(minutes=minuto),
+            )
+            for minuto in (-10, 20, 0, 10, 30, 40)
+        ])
+
+        self.client.force_login(self.vendedor)
+        datos = self.client.get(reverse('ventas:api_recorrido_entrega', args=[entrega.pk])).json()
+        self.assertEqual([punto[0] for punto in datos['puntos']], [4.65, 4.66, 4.67, 4.68])
+        self.assertAlmostEqual(datos['distancia_km'], 3.34, places=1)
+
+        otro = User.objects.create_user('otro', role='repartidor')
+        self.client.force_login(otro)
+        self.assertEqual(self.client.get(reverse('ventas:api_recorrido_entrega', args=[entrega.pk])).status_code, 403)
+
+
+class VolcadoPeriodicoGpsTests(TransactionTestCase):
+    """El hilo de volcado guarda los pings aunque no lleguen más lotes"""
+
+    def setUp(self):
+        self.repartidor = User.objects.create_user('repartidor', role='repartidor')
+        seguimiento_gps.volcar()
+        self.addCleanup(seguimiento_gps.detener_volcador)
+
+    def test_vuelca_sin_trafico(self):
+        seguimiento_gps.detener_volcador()
+        seguimiento_gps.iniciar_volcador(intervalo=0.05)
+        seguimiento_gps.registrar_pings(self.repartidor.pk, [{'latitud': 4.65, 'longitud': -74.08}])
+        # Ya hay un hilo: registrar más pings no arranca otro
+        hilo = seguimiento_gps.iniciar_volcador()
+
+        limite = time.monotonic() + 5
+        while PosicionRepartidor.objects.count() < 1 and time.monotonic() < limite:
+            time.sleep(0.02)
+        self.assertEqual(PosicionRepartidor.objects.count(), 1)
+        self.assertEqual(seguimiento_gps.pendientes(), 0)
+        self.assertIs(hilo, seguimiento_gps._volcador['hilo'])
+
+        seguimiento_gps.detener_volcador()
+        self.assertFalse(hilo.is_alive())
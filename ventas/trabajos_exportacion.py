@@ -0,0 +1,281 @@
+"""
+Exportaciones en segundo plano
+
+``TrabajoExportacion`` es una cola en la base de datos (sin broker externo).
+Al solicitar una exportación se guarda el trabajo y, al confirmar la
+transacción, un hilo del propio proceso web procesa los pendientes; el
+comando ``procesar_exportaciones`` hace lo mismo como worker dedicado. Los
+dos pueden convivir: cada trabajo se toma con un UPDATE condicional sobre
+``estado='pendiente'``.
+
+Mientras escribe, el worker renueva ``ultimo_latido`` con cada lote de
+filas; un trabajo 'procesando' sin latido durante ``ABANDONO_MINUTOS`` es
+de un worker que murió y vuelve a la cola. Cada intento escribe su propio
+archivo temporal y solo actualiza el trabajo si sigue siendo el intento
+vigente, así un worker lento que fue reemplazado no pisa al nuevo.
+
+Una solicitud idéntica (mismo usuario, tipo, formato y filtros) dentro de
+``EXPORTACION_TTL`` segundos reutiliza el trabajo existente en lugar de
+generar otro archivo.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, Q
+from django.http import HttpRequest, JsonResponse, QueryDict
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .exportacion import escribir_exportacion, nombre_archivo_exportacion, respuesta_exportacion
+from .models import TrabajoExportacion
+
+logger = logging.getLogger(__name__)
+
+# tipo -> función (parametros, usuario, formato) que retorna la definición de la exportación
+TIPOS = {
+    'pedidos': 'ventas.views.definicion_exportacion_pedidos',
+    'facturas': 'ventas.general_views.definicion_reporte_ventas',
+    'inventario': 'ventas.general_views.definicion_reporte_inventario',
+    'compras': 'ventas.general_views.definicion_reporte_compras',
+    'productos': 'inventario.productos_views.definicion_exportacion_productos',
+    'stock': 'inventario.general_views.definicion_exportacion_stock',
+    'movimientos': 'inventario.movimientos_views.definicion_exportacion_movimientos',
+    'facturas_pdf': 'ventas.facturas_views.definicion_lote_facturas',
+}
+
+# Parámetros de la URL que controlan la exportación y no son filtros
+PARAMETROS_CONTROL = ('formato', 'segundo_plano', 'page', 'csrfmiddlewaretoken')
+
+TTL_POR_DEFECTO = 30 * 60
+CARPETA = 'exportaciones'
+# Minutos sin latido tras los que un trabajo 'procesando' se considera abandonado
+ABANDONO_MINUTOS = 5
+
+_worker = ThreadPoolExecutor(max_workers=1)
+
+
+def _ttl():
+    return getattr(settings, 'EXPORTACION_TTL', TTL_POR_DEFECTO)
+
+
+def parametros_de_consulta(query_dict):
+    """Filtros de un QueryDict como dict serializable (listas de valores, sin parámetros de control)"""
+    return {
+        clave: valores
+        for clave, valores in sorted(query_dict.lists())
+        if clave not in PARAMETROS_CONTROL and any(valores)
+    }
+
+
+def _query_dict(parametros):
+    consulta = QueryDict(mutable=True)
+    for clave, valores in parametros.items():
+        consulta.setlist(clave, valores)
+    return consulta
+
+
+def solicitud_con_filtros(parametros, usuario):
+    """HttpRequest mínimo con los filtros en GET, para reutilizar el get_queryset de las vistas de lista"""
+    solicitud = HttpRequest()
+    solicitud.GET = _query_dict(parametros)
+    solicitud.user = usuario
+    return solicitud
+
+
+def definicion(tipo, parametros, usuario, formato):
+    """Definición de exportación (ver ``exportacion.definicion_exportacion``) de un tipo registrado"""
+    return import_string(TIPOS[tipo])(_query_dict(parametros), usuario, formato)
+
+
+def huella_exportacion(usuario, tipo, formato, parametros):
+    contenido = json.dumps([usuario.pk, tipo, formato, parametros], sort_keys=True)
+    return hashlib.sha256(contenido.encode()).hexdigest()
+
+
+# ============= SOLICITUD =============
+
+def solicitar_exportacion(usuario, tipo, formato, parametros):
+    """
+    Encola una exportación y retorna (trabajo, reutilizado). Si hay un trabajo
+    idéntico pendiente, en proceso o completado dentro del TTL con su archivo
+    disponible, se retorna ese.
+    """
+    if tipo not in TIPOS:
+        raise ValueError(f'Tipo de exportación desconocido: {tipo}')
+    if formato not in dict(TrabajoExportacion.FORMATO_CHOICES):
+        raise ValueError(f'Formato de exportación no soportado: {formato}')
+
+    huella = huella_exportacion(usuario, tipo, formato, parametros)
+    trabajo = TrabajoExportacion.objects.filter(
+        huella=huella, fecha_creacion__gte=timezone.now() - timedelta(seconds=_ttl())
+    ).exclude(estado='error').order_by('-fecha_creacion').first()
+    if trabajo and (trabajo.estado != 'completado' or os.path.exists(trabajo.archivo.path)):
+        return trabajo, True
+
+    trabajo = TrabajoExportacion.objects.create(
+        usuario=usuario, tipo=tipo, formato=formato, parametros=parametros, huella=huella
+    )
+    transaction.on_commit(programar_procesamiento)
+    return trabajo, False
+
+
+def estado_trabajo(trabajo):
+    """Datos del trabajo para consultar su avance"""
+    datos = {
+        'id': trabajo.pk,
+        'tipo': trabajo.tipo,
+        'formato': trabajo.formato,
+        'estado': trabajo.estado,
+        'progreso': trabajo.progreso,
+        'filas_procesadas': trabajo.filas_procesadas,
+        'total_filas': trabajo.total_filas,
+        'url_estado': reverse('ventas:estado_exportacion', args=[trabajo.pk]),
+    }
+    if trabajo.estado == 'completado':
+        datos['url_descarga'] = reverse('ventas:descargar_exportacion', args=[trabajo.pk])
+        datos['nombre_archivo'] = trabajo.nombre_archivo
+    elif trabajo.estado == 'error':
+        datos['error'] = trabajo.error
+    return datos
+
+
+def responder_exportacion(request, tipo, formato):
+    """
+    Respuesta de las vistas de exportación: en streaming, o con
+    ``?segundo_plano=1`` encola el trabajo y responde su estado en JSON (202).
+    """
+    parametros = parametros_de_consulta(request.GET)
+    if request.GET.get('segundo_plano'):
+        trabajo, reutilizado = solicitar_exportacion(request.user, tipo, formato, parametros)
+        return JsonResponse({**estado_trabajo(trabajo), 'reutilizado': reutilizado}, status=202)
+    return respuesta_exportacion(definicion(tipo, parametros, request.user, formato), formato)
+
+
+# ============= PROCESAMIENTO =============
+
+def tomar_siguiente():
+    """Marca como 'procesando' el pendiente más antiguo y lo retorna (None si no hay)"""
+    while True:
+        candidato = TrabajoExportacion.objects.filter(estado='pendiente').order_by('fecha_creacion').values_list(
+            'pk', flat=True
+        ).first()
+        if candidato is None:
+            return None
+        ahora = timezone.now()
+        tomado = TrabajoExportacion.objects.filter(pk=candidato, estado='pendiente').update(
+            estado='procesando', fecha_inicio=ahora, ultimo_latido=ahora, intento=F('intento') + 1
+        )
+        if tomado:
+            return TrabajoExportacion.objects.get(pk=candidato)
+
+
+class IntentoReemplazado(Exception):
+    """El trabajo se reencoló mientras este intento lo procesaba"""
+
+
+def procesar_trabajo(trabajo):
+    """Genera el archivo de un trabajo ya tomado y lo deja 'completado' o en 'error'"""
+    vigente = TrabajoExportacion.objects.filter(pk=trabajo.pk, estado='procesando', intento=trabajo.intento)
+
+    def actualizar(**campos):
+        if not vigente.update(ultimo_latido=timezone.now(), **campos):
+            raise IntentoReemplazado(f'Exportación {trabajo.pk}: el intento {trabajo.intento} fue reemplazado')
+
+    temporal = None
+    try:
+        datos = definicion(trabajo.tipo, trabajo.parametros, trabajo.usuario, trabajo.formato)
+        actualizar(total_filas=datos['queryset'].count())
+
+        nombre = nombre_archivo_exportacion(datos, trabajo.formato)
+        relativa = f'{CARPETA}/{trabajo.pk}-{nombre}'
+        ruta = Path(settings.MEDIA_ROOT) / relativa
+        ruta.parent.mkdir(parents=True, exist_ok=True)
+        temporal = ruta.with_name(f'{ruta.name}.{trabajo.intento}.tmp')
+        with open(temporal, 'wb') as archivo:
+            escribir_exportacion(
+                datos, trabajo.formato, archivo,
+                al_avanzar=lambda filas: actualizar(filas_procesadas=filas)
+            )
+        actualizar()
+        os.replace(temporal, ruta)
+
+        actualizar(estado='completado', archivo=relativa, nombre_archivo=nombre, fecha_fin=timezone.now())
+    except IntentoReemplazado as e:
+        logger.warning(str(e))
+        _borrar_temporal(temporal)
+    except Exception as e:
+        logger.exception(f"Error en exportación {trabajo.pk}")
+        _borrar_temporal(temporal)
+        vigente.update(estado='error', error=str(e), fecha_fin=timezone.now())
+
+
+def _borrar_temporal(temporal):
+    if temporal is not None:
+        try:
+            os.remove(temporal)
+        except FileNotFoundError:
+            pass
+
+
+def procesar_pendientes(limite=None):
+    """Procesa trabajos pendientes hasta vaciar la cola (o ``limite``); retorna cuántos procesó"""
+    procesados = 0
+    while limite is None or procesados < limite:
+        trabajo = tomar_siguiente()
+        if trabajo is None:
+            break
+        procesar_trabajo(trabajo)
+        procesados += 1
+    return procesados
+
+
+def _procesar_en_hilo():
+    try:
+        procesar_pendientes()
+    except Exception as e:
+        logger.error(f"Error procesando exportaciones: {str(e)}")
+    finally:
+        connections.close_all()
+
+
+def programar_procesamiento():
+    """Procesa la cola en el hilo de exportaciones del proceso actual"""
+    _worker.submit(_procesar_en_hilo)
+
+
+def reencolar_abandonados(minutos=ABANDONO_MINUTOS):
+    """Devuelve a 'pendiente' los trabajos 'procesando' sin latido en los últimos ``minutos``"""
+    limite = timezone.now() - timedelta(minutes=minutos)
+    sin_latido = Q(ultimo_latido__lt=limite) | Q(ultimo_latido__isnull=True, fecha_inicio__lt=limite)
+    return TrabajoExportacion.objects.filter(sin_latido, estado='procesando').update(
+        estado='pendiente', fecha_inicio=None, ultimo_latido=None, filas_procesadas=0
+    )
+
+
+def limpiar_vencidos(dias=1):
+    """Borra trabajos terminados de más de ``dias`` días y sus archivos; retorna cuántos borró"""
+    vencidos = TrabajoExportacion.objects.filter(
+        estado__in=['completado', 'error'], fecha_creacion__lt=timezone.now() - timedelta(days=dias)
+    )
+    borrados = 0
+    for trabajo in vencidos.iterator():
+        if trabajo.archivo:
+            trabajo.archivo.delete(save=False)
+        trabajo.delete()
+        borrados += 1
+
+    # Temporales de intentos cuyo worker murió antes de terminar
+    limite = (timezone.now() - timedelta(days=dias)).timestamp()
+    for temporal in (Path(settings.MEDIA_ROOT) / CARPETA).glob('*.tmp'):
+        if temporal.stat().st_mtime < limite:
+            _borrar_temporal(temporal)
+    return borrados
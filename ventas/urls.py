@@ -3,7 +3,7 @@ from . import views
 from .views import imprimir_tirilla_factura
 from .general_views import (
     dashboard_view, dashboard_charts_view, buscar_productos_api, obtener_precio_producto,
-    verificar_stock_disponible, test_autocompletado, test_ajax_simple, test_syntax,
+    test_autocompletado, test_ajax_simple, test_syntax,
     api_ventas_por_mes, api_productos_mas_vendidos, api_estados_pedidos,
     api_ventas_por_vendedor, api_estadisticas_dashboard, reportes_view,
     reporte_ventas, reporte_inventario, reporte_compras
@@ -26,14 +26,15 @@ from .pedidos_views import (
 )
 from .facturas_views import (
     FacturaListView, FacturaCreateView, FacturaDetailView, FacturaUpdateView,
-    marcar_factura_pagada, cancelar_factura, imprimir_factura,
-    reporte_ventas_periodo, estadisticas_ventas_api
+    marcar_factura_pagada, cancelar_factura, imprimir_factura, imprimir_facturas_lote,
+    reporte_ventas_periodo, estadisticas_ventas_api, exportar_facturas
 )
+from .exportaciones_views import mis_exportaciones, estado_exportacion, descargar_exportacion
 from .entregas_views import (
     EntregaListView, EntregaDetailView,
     EntregasRepartidorView, iniciar_entrega,
     completar_entrega, reportar_problema_entrega, completar_entrega_api,
-    obtener_entregas_repartidor, actualizar_ubicacion_repartidor,
+    obtener_entregas_repartidor, actualizar_ubicacion_repartidor, despachar_entregas_api, recorrido_entrega_api,
     reporte_entregas_periodo, estadisticas_entregas_api
     # EntregaCreateView, asignar_repartidor - Funciones comentadas
 )
@@ -43,7 +44,7 @@ app_name = 'ventas'
 urlpatterns = [
     # Tirilla de factura (impresión tipo recibo)
     path('facturas/<int:pk>/tirilla/', imprimir_tirilla_factura, name='tirilla_factura'),
-    # Optimización de rutas (placeholder, solo para evitar NoReverseMatch)
+    # Optimización de rutas (?optimizar=1 ordena las entregas en el servidor)
     path('optimizar-ruta/', views.optimizar_ruta, name='optimizar_ruta'),
     # Dashboard
     path('', dashboard_view, name='dashboard'),
@@ -97,12 +98,14 @@ urlpatterns = [
     path('facturas/nueva/', FacturaCreateView.as_view(), name='factura_create'),
     path('facturas/<int:pk>/', FacturaDetailView.as_view(), name='factura_detail'),
     path('facturas/<int:pk>/editar/', FacturaUpdateView.as_view(), name='factura_update'),
+    path('facturas/lote/imprimir/', imprimir_facturas_lote, name='imprimir_facturas_lote'),
     path('facturas/<int:pk>/imprimir/', imprimir_factura, name='imprimir_factura'),
     path('facturas/<int:pk>/generar-pdf/', views.generar_pdf_factura, name='generar_pdf_factura'),
     path('facturas/<int:pk>/marcar-pagada/', marcar_factura_pagada, name='marcar_factura_pagada'),
     path('facturas/<int:pk>/cancelar/', cancelar_factura, name='cancelar_factura'),
     path('facturas/<int:pk>/anular/', views.anular_factura, name='anular_factura'),
     path('facturas/reportes/', reporte_ventas_periodo, name='reporte_facturas'),
+    path('facturas/exportar/', exportar_facturas, name='exportar_facturas'),
     path('reportes/ventas/', views.reporte_ventas, name='reporte_ventas'),
     
     # Conversión de pedidos a facturas
@@ -114,17 +117,19 @@ urlpatterns = [
     # path('entregas/nueva/', EntregaCreateView.as_view(), name='entrega_create'),  # Vista comentada
     path('entregas/<int:pk>/', EntregaDetailView.as_view(), name='entrega_detail'),
     path('entregas/repartidor/', EntregasRepartidorView.as_view(), name='entregas_repartidor'),
+    path('entregas/repartidor/ruta/', views.ruta_optimizada_view, name='ruta_optimizada'),
     # path('entregas/<int:pk>/asignar/', asignar_repartidor, name='asignar_repartidor'),  # Función comentada
     path('entregas/<int:pk>/reprogramar/', views.reprogramar_entrega, name='reprogramar_entrega'),
     path('entregas/<int:pk>/iniciar/', iniciar_entrega, name='iniciar_entrega'),
     path('entregas/<int:pk>/completar/', completar_entrega, name='completar_entrega'),
     path('entregas/<int:pk>/problema/', reportar_problema_entrega, name='reportar_problema_entrega'),
     path('entregas/reportes/', reporte_entregas_periodo, name='reporte_entregas'),
+    path('entregas/reportes/rechazos/', views.ReporteItemsRechazadosView.as_view(), name='reporte_items_rechazados'),
     
     # APIs
     path('api/productos/', buscar_productos_api, name='api_productos'),
     path('api/productos/<int:producto_id>/precio/', obtener_precio_producto, name='api_precio_producto'),
-    path('api/verificar-stock/', verificar_stock_disponible, name='api_verificar_stock'),
+    path('api/verificar-stock/', views.verificar_stock_disponible, name='api_verificar_stock'),
     path('api/clientes/', buscar_clientes_api, name='api_clientes'),
     path('api/pedidos/pendientes/', obtener_pedidos_pendientes, name='api_pedidos_pendientes'),
     path('api/estadisticas/ventas/', estadisticas_ventas_api, name='api_estadisticas_ventas'),
@@ -144,10 +149,15 @@ urlpatterns = [
     path('api/entregas/<int:pk>/completar/', completar_entrega_api, name='api_completar_entrega'),
     path('api/entregas/repartidor/', obtener_entregas_repartidor, name='api_entregas_repartidor'),
     path('api/repartidor/ubicacion/', actualizar_ubicacion_repartidor, name='api_ubicacion_repartidor'),
+    path('api/entregas/<int:pk>/recorrido/', recorrido_entrega_api, name='api_recorrido_entrega'),
+    path('api/entregas/despachar/', despachar_entregas_api, name='api_despachar_entregas'),
     
     # Exportación de datos
     path('pedidos/exportar/excel/', views.exportar_pedidos_excel, name='exportar_pedidos_excel'),
     path('pedidos/exportar/csv/', views.exportar_pedidos_csv, name='exportar_pedidos_csv'),
+    path('exportaciones/', mis_exportaciones, name='mis_exportaciones'),
+    path('exportaciones/<int:pk>/', estado_exportacion, name='estado_exportacion'),
+    path('exportaciones/<int:pk>/descargar/', descargar_exportacion, name='descargar_exportacion'),
     
     # Sistema de Reportes Detallados
     path('reportes/', reportes_view, name='reportes'),
@@ -6,7 +6,7 @@ from django.db.models import Q, Sum, Count, Avg, F
 from django.db import models
 from django.contrib import messages
 from django.http import JsonResponse, Http404, HttpResponse
-from django.core.exceptions import PermissionDenied
+from django.core.exceptions import PermissionDenied, ValidationError
 from datetime import datetime, timedelta, date
 from decimal import Decimal, InvalidOperation
 from django.utils import timezone
@@ -17,6 +17,12 @@ from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from .models import Cliente, Cotizacion, Pedido, Factura, ItemCotizacion, ItemPedido, ItemFactura, Entrega
 from inventario.models import Producto, Stock, Bodega
+from inventario.busqueda import buscar_productos
+from inventario.reservas import verificar_disponibilidad
+from .metricas import RANGO_POR_DEFECTO, RANGOS_DIAS, metricas_dashboard
+from .pdf_facturas import obtener_pdf_factura
+from .exportacion import definicion_exportacion, nombre_persona
+from .trabajos_exportacion import responder_exportacion
 from .forms import ClienteForm, ClienteFilterForm, CotizacionForm, FacturaForm
 
 # Vista para imprimir tirilla de factura
@@ -66,7 +72,9 @@ def optimizar_ruta(request):
     bodega_principal = bodegas.filter(es_principal=True).first() or bodegas.first()
     punto_salida = bodega_principal.link_ubicacion if bodega_principal and bodega_principal.link_ubicacion else ""
     from .models import Entrega
-    entregas = Entrega.objects.select_related('pedido__cliente').filter(estado__in=['asignada', 'pendiente', 'proceso'])
+    entregas = Entrega.objects.select_related('pedido__cliente').prefetch_related('pedido__items__producto').filter(
+        estado__in=['asignada', 'pendiente', 'proceso']
+    )
     total_entregas = entregas.count()
     context = {
         'punto_salida': punto_salida,
@@ -74,6 +82,28 @@ def optimizar_ruta(request):
         'entregas': entregas,
         'total_entregas': total_entregas,
     }
+    
+    # ?optimizar=1 ordena las entregas en el servidor (2-opt/Or-opt) desde la bodega elegida
+    if request.GET.get('optimizar') == '1':
+        from .optimizador_rutas import optimizar_paradas
+        from .rutas import coordenadas_desde_enlace
+        
+        enlaces = {bodega.link_ubicacion for bodega in bodegas}
+        if request.GET.get('punto_salida') in enlaces:
+            context['punto_salida'] = punto_salida = request.GET['punto_salida']
+        origen = coordenadas_desde_enlace(punto_salida)
+        regresar = request.GET.get('regresar') == '1' and origen is not None
+        paradas = [
+            {
+                'entrega': entrega,
+                'lat': float(entrega.pedido.cliente.latitud) if entrega.pedido.cliente.latitud is not None else None,
+                'lng': float(entrega.pedido.cliente.longitud) if entrega.pedido.cliente.longitud is not None else None,
+            }
+            for entrega in entregas
+        ]
+        ordenadas, resumen = optimizar_paradas(paradas, origen, destino=origen if regresar else None)
+        context['entregas'] = [parada['entrega'] for parada in ordenadas]
+        context['ruta'] = {**resumen, 'regresar': regresar}
     return render(request, 'ventas/optimizar_ruta.html', context)
 
 class VentasRequiredMixin(UserPassesTestMixin):
@@ -92,160 +122,17 @@ class BodegaViewMixin(UserPassesTestMixin):
 
 @login_required
 def dashboard_view(request):
-    """Vista principal del dashboard con métricas y KPIs"""
-    
-    # Fechas para cálculos
-    hoy = date.today()
-    inicio_mes = hoy.replace(day=1)
-    mes_anterior = (inicio_mes - timedelta(days=1)).replace(day=1)
-    fin_mes_anterior = inicio_mes - timedelta(days=1)
-    
-    # Filtrar por vendedor si es necesario
-    queryset_pedidos = Pedido.objects.all()
-    queryset_facturas = Factura.objects.all()
-    
-    # Como no hay campo vendedor en los modelos simplificados, mostramos todos
-    # if hasattr(request.user, 'role') and request.user.role == 'vendedor':
-    #     queryset_pedidos = queryset_pedidos.filter(vendedor=request.user)
-    #     queryset_facturas = queryset_facturas.filter(vendedor=request.user)
-    
-    # ========== MÉTRICAS DEL MES ACTUAL ==========
-    
-    # Pedidos del mes
-    pedidos_mes = queryset_pedidos.filter(fecha_creacion__gte=inicio_mes)
-    pedidos_completados_mes = pedidos_mes.filter(estado='completado')
-    
-    # Facturas del mes
-    facturas_mes = queryset_facturas.filter(fecha_creacion__gte=inicio_mes)
-    facturas_emitidas_mes = facturas_mes.filter(estado__in=['emitida', 'pagada'])
-    
-    # Valores del mes actual
-    valor_pedidos_mes = pedidos_completados_mes.aggregate(
-        total=Sum('total'))['total'] or Decimal('0.00')
-    
-    valor_facturas_mes = facturas_emitidas_mes.aggregate(
-        total=Sum('total'))['total'] or Decimal('0.00')
-    
-    # ========== MÉTRICAS DEL MES ANTERIOR ==========
-    
-    # Pedidos del mes anterior
-    pedidos_mes_anterior = queryset_pedidos.filter(
-        fecha_creacion__gte=mes_anterior, 
-        fecha_creacion__lte=fin_mes_anterior,
-        estado='completado'
-    )
-    
-    # Facturas del mes anterior  
-    facturas_mes_anterior = queryset_facturas.filter(
-        fecha_creacion__gte=mes_anterior,
-        fecha_creacion__lte=fin_mes_anterior,
-        estado__in=['emitida', 'pagada']
-    )
-    
-    # Valores del mes anterior
-    valor_pedidos_mes_anterior = pedidos_mes_anterior.aggregate(
-        total=Sum('total'))['total'] or Decimal('0.00')
-    
-    valor_facturas_mes_anterior = facturas_mes_anterior.aggregate(
-        total=Sum('total'))['total'] or Decimal('0.00')
-    
-    # ========== CALCULAR CRECIMIENTOS ==========
-    
-    def calcular_crecimiento(actual, anterior):
-        if anterior == 0:
-            return 100 if actual > 0 else 0
-        return ((actual - anterior) / anterior) * 100
-    
-    crecimiento_pedidos = calcular_crecimiento(
-        float(valor_pedidos_mes), 
-        float(valor_pedidos_mes_anterior)
-    )
-    
-    crecimiento_facturas = calcular_crecimiento(
-        float(valor_facturas_mes),
-        float(valor_facturas_mes_anterior)
-    )
-    
-    # ========== ESTADÍSTICAS GENERALES ==========
-    
-    # Contadores generales
-    total_pedidos_pendientes = queryset_pedidos.filter(
-        estado__in=['borrador', 'pendiente', 'proceso']
-    ).count()
-    
-    total_facturas_pendientes = queryset_facturas.filter(
-        estado='emitida'
-    ).count()
-    
-    # Estadísticas por estado de pedidos
-    estadisticas_pedidos = queryset_pedidos.values('estado').annotate(
-        cantidad=Count('id'),
-        valor_total=Sum('total')
-    ).order_by('-cantidad')
-    
-    # ========== TOP PRODUCTOS (del mes) ==========
-    top_productos = ItemPedido.objects.filter(
-        pedido__fecha_creacion__gte=inicio_mes,
-        pedido__estado='completado'
-    ).values(
-        'pedido__numero'  # Usando campos disponibles en el modelo simplificado
-    ).annotate(
-        cantidad_vendida=Sum('cantidad'),
-        valor_total=Sum(F('cantidad') * F('precio_unitario'))
-    ).order_by('-cantidad_vendida')[:5]
-    
-    # ========== ACTIVIDAD RECIENTE ==========
-    actividad_reciente = []
-    
-    # Últimos pedidos
-    ultimos_pedidos = queryset_pedidos.select_related('cliente').order_by('-fecha_creacion')[:3]
-    for pedido in ultimos_pedidos:
-        actividad_reciente.append({
-            'tipo': 'pedido',
-            'titulo': f'Pedido {pedido.numero}',
-            'descripcion': f'Cliente: {pedido.cliente.nombre_completo}',
-            'valor': pedido.total,
-            'fecha': pedido.fecha_creacion,
-            'estado': pedido.estado,
-            'url': f'/ventas/pedidos/{pedido.id}/'
-        })
-    
-    # Últimas facturas
-    ultimas_facturas = queryset_facturas.select_related('cliente').order_by('-fecha_creacion')[:3]
-    for factura in ultimas_facturas:
-        actividad_reciente.append({
-            'tipo': 'factura',
-            'titulo': f'Factura {factura.numero}',
-            'descripcion': f'Cliente: {factura.cliente.nombre_completo}',
-            'valor': factura.total,
-            'fecha': factura.fecha_creacion,
-            'estado': factura.estado,
-            'url': f'/ventas/facturas/{factura.id}/'
-        })
-    
-    # Ordenar por fecha
-    actividad_reciente.sort(key=lambda x: x['fecha'], reverse=True)
-    actividad_reciente = actividad_reciente[:6]  # Top 6 más recientes
-    
-    # ========== DATOS PARA GRÁFICOS ==========
-    
-    # Gráfico 1: Ventas por día (últimos 30 días)
-    fecha_inicio_grafico = hoy - timedelta(days=30)
-    ventas_por_dia = []
-    labels_dias = []
-    
-    for i in range(30):
-        fecha = fecha_inicio_grafico + timedelta(days=i)
-        pedidos_dia = queryset_pedidos.filter(
-            fecha_creacion__date=fecha,
-            estado='completado'
-        ).aggregate(total=Sum('total'))['total'] or 0
-        
-        ventas_por_dia.append(float(pedidos_dia))
-        labels_dias.append(fecha.strftime('%d/%m'))
+    """
+    Vista principal del dashboard con métricas y KPIs.
+    ``?dias=7|30|90|365`` define el rango de la serie diaria y del KPI de periodo.
+    """
+    try:
+        dias = int(request.GET.get('dias', RANGO_POR_DEFECTO))
+    except ValueError:
+        dias = RANGO_POR_DEFECTO
+    metricas = metricas_dashboard(request.user, dias)
     
-    # Gráfico 2: Estados de pedidos (datos para pie chart)
-    estados_chart = []
+    # Gráfico de estados de pedidos (datos para pie chart)
     colores_estados = {
         'completado': '#10B981',  # Verde
         'proceso': '#3B82F6',     # Azul  
@@ -253,51 +140,34 @@ def dashboard_view(request):
         'borrador': '#6B7280',    # Gris
         'cancelado': '#EF4444'    # Rojo
     }
+    estados_chart = [
+        {
+            'label': stat['estado'].title(),
+            'value': stat['cantidad'],
+            'color': colores_estados.get(stat['estado'], '#6B7280')
+        }
+        for stat in metricas['estadisticas_pedidos'] if stat['cantidad'] > 0
+    ]
     
-    for stat in estadisticas_pedidos:
-        if stat['cantidad'] > 0:
-            estados_chart.append({
-                'label': stat['estado'].title(),
-                'value': stat['cantidad'],
-                'color': colores_estados.get(stat['estado'], '#6B7280')
-            })
-    
-    # Gráfico 3: Top productos (datos para gráfico de barras)
+    # Top productos (datos para gráfico de barras)
+    top_productos = metricas['top_productos']
     productos_chart = {
-        'labels': [p['producto__nombre'][:20] for p in top_productos[:5]], 
-        'data': [float(p['cantidad_vendida']) for p in top_productos[:5]],
-        'valores': [float(p['valor_total']) for p in top_productos[:5]]
+        'labels': [p['producto__nombre'][:20] for p in top_productos], 
+        'data': [float(p['cantidad_vendida']) for p in top_productos],
+        'valores': [float(p['valor_total']) for p in top_productos]
     }
     
-    # ========== CONTEXTO PARA EL TEMPLATE ==========
     context = {
         'title': 'Dashboard de Ventas',
-        # KPIs principales
-        'kpis': {
-            'pedidos_mes': {
-                'valor': pedidos_completados_mes.count(),
-                'total': valor_pedidos_mes,
-                'crecimiento': crecimiento_pedidos,
-            },
-            'facturas_mes': {
-                'valor': facturas_emitidas_mes.count(),
-                'total': valor_facturas_mes,
-                'crecimiento': crecimiento_facturas,
-            },
-            'pedidos_pendientes': total_pedidos_pendientes,
-            'facturas_pendientes': total_facturas_pendientes,
-        },
-        # Datos adicionales
-        'estadisticas_pedidos': estadisticas_pedidos,
+        'kpis': metricas['kpis'],
+        'estadisticas_pedidos': metricas['estadisticas_pedidos'],
         'top_productos': top_productos,
-        'actividad_reciente': actividad_reciente,
-        'mes_actual': hoy.strftime('%B %Y'),
-        # Datos para gráficos
+        'actividad_reciente': metricas['actividad_reciente'],
+        'mes_actual': date.today().strftime('%B %Y'),
+        'dias': metricas['dias'],
+        'rangos_dias': RANGOS_DIAS,
         'chart_data': {
-            'ventas_por_dia': {
-                'labels': labels_dias,
-                'data': ventas_por_dia
-            },
+            'ventas_por_dia': metricas['ventas_por_dia'],
             'estados_pedidos': estados_chart,
             'top_productos': productos_chart
         }
@@ -513,7 +383,7 @@ class CotizacionCreateView(VentasRequiredMixin, CreateView):
             items_existentes = cotizacion.items.count()
             if items_existentes > 0:
                 print(f"🗑️ Eliminando {items_existentes} items existentes")
-                cotizacion.items.all().delete()
+                ItemCotizacion.eliminar_lineas(cotizacion.items.all())
             
             # Crear los nuevos items
             items_creados = 0
@@ -556,9 +426,10 @@ class CotizacionCreateView(VentasRequiredMixin, CreateView):
             print(f"   ✅ Creados: {items_creados}")
             print(f"   ❌ Fallidos: {items_fallidos}")
             
-            # Calcular totales después de crear los items
+            # Cada item ya sumó su subtotal al total de la cotización
             if items_creados > 0:
-                total_calculado = cotizacion.calcular_totales()
+                cotizacion.refresh_from_db(fields=['total'])
+                total_calculado = cotizacion.total
                 print(f"💰 Total calculado: ${total_calculado:,.0f}")
                 
                 messages.success(self.request, f'✅ Cotización {cotizacion.numero} creada exitosamente con {items_creados} productos. Total: ${total_calculado:,.0f}')
@@ -723,134 +594,20 @@ def generar_pdf_cotizacion(request, pk):
 
 @login_required
 def generar_pdf_factura(request, pk):
-    """Vista para generar PDF de factura"""
+    """Vista para generar PDF de factura (desde la caché si la factura está finalizada)"""
     if not request.user.can_create_sales():
         messages.error(request, 'No tiene permisos para esta acción.')
         return redirect('ventas:factura_list')
     
     try:
-        from django.http import HttpResponse
-        from reportlab.lib.pagesizes import letter
-        from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-        from reportlab.lib.styles import getSampleStyleSheet
-        from reportlab.lib import colors
-        from io import BytesIO
-        from decimal import Decimal
-        
-        factura = Factura.objects.select_related('cliente').prefetch_related('itemfactura_set').get(pk=pk)
-        
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=letter)
-        elements = []
-        styles = getSampleStyleSheet()
-        
-        # Título
-        title = Paragraph(f"FACTURA {factura.numero}", styles['Title'])
-        elements.append(title)
-        elements.append(Spacer(1, 12))
-        
-        # Información del cliente
-        cliente_info = f"""
-        <b>Cliente:</b> {factura.cliente.nombre_completo}<br/>
-        <b>Documento:</b> {factura.cliente.numero_documento}<br/>
-        <b>Teléfono:</b> {factura.cliente.telefono}<br/>
-        <b>Dirección:</b> {factura.cliente.direccion}
-        """
-        cliente_para = Paragraph(cliente_info, styles['Normal'])
-        elements.append(cliente_para)
-        elements.append(Spacer(1, 12))
-        
-        # Información de la factura
-        factura_info = f"""
-        <b>Fecha de Emisión:</b> {factura.fecha_creacion.strftime('%d/%m/%Y')}<br/>
-        <b>Estado:</b> {factura.estado.title()}<br/>
-        <b>Método de Pago:</b> Efectivo/Transferencia
-        """
-        factura_para = Paragraph(factura_info, styles['Normal'])
-        elements.append(factura_para)
-        elements.append(Spacer(1, 12))
-        
-        # Tabla de items
-        data = [['Descripción', 'Cantidad', 'Precio Unit.', 'Subtotal']]
-        
-        total_general = Decimal('0.00')
-        if factura.itemfactura_set.exists():
-            for item in factura.itemfactura_set.all():
-                subtotal = item.cantidad * item.precio
-                total_general += subtotal
-                data.append([
-                    f'Item Factura #{item.id}',
-                    str(item.cantidad),
-                    f'${item.precio:,.2f}',
-                    f'${subtotal:,.2f}'
-                ])
-        else:
-            # Sin items detallados - usar total de factura
-            total_general = factura.total
-            data.append([
-                'Productos y servicios',
-                '1',
-                f'${factura.total:,.2f}',
-                f'${factura.total:,.2f}'
-            ])
-        
-        # Calcular impuestos (ejemplo: 19% IVA)
-        iva_porcentaje = Decimal('0.19')
-        subtotal_sin_iva = total_general / (1 + iva_porcentaje)
-        iva_valor = total_general - subtotal_sin_iva
-        
-        # Agregar fila de subtotal
-        data.append(['', '', 'Subtotal:', f'${subtotal_sin_iva:,.2f}'])
-        data.append(['', '', 'IVA (19%):', f'${iva_valor:,.2f}'])
-        
-        table = Table(data)
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 14),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-3, -3), colors.beige),
-            ('BACKGROUND', (-3, -2), (-1, -1), colors.lightgrey),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('FONTNAME', (-3, -2), (-1, -1), 'Helvetica-Bold'),
-        ]))
-        
-        elements.append(table)
-        elements.append(Spacer(1, 12))
-        
-        # Total final
-        total_info = f"""
-        <b>TOTAL A PAGAR:</b> ${total_general:,.2f}
-        """
-        total_para = Paragraph(total_info, styles['Heading2'])
-        elements.append(total_para)
-        
-        elements.append(Spacer(1, 24))
-        
-        # Términos y condiciones
-        terminos = """
-        <b>Términos y Condiciones:</b><br/>
-        • Esta factura debe ser cancelada en los términos acordados.<br/>
-        • Los precios incluyen IVA cuando aplique.<br/>
-        • Documento válido como soporte contable.
-        """
-        terminos_para = Paragraph(terminos, styles['Normal'])
-        elements.append(terminos_para)
-        
-        # Construir PDF
-        doc.build(elements)
-        buffer.seek(0)
-        
-        response = HttpResponse(buffer.getvalue(), content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="factura_{factura.numero}.pdf"'
-        
-        return response
-        
+        factura, contenido = obtener_pdf_factura(pk)
     except Factura.DoesNotExist:
         messages.error(request, 'Factura no encontrada.')
         return redirect('ventas:factura_list')
+    
+    response = HttpResponse(contenido, content_type='application/pdf')
+    response['Content-Disposition'] = f'attachment; filename="factura_{factura.numero}.pdf"'
+    return response
 
 def convertir_a_pedido(request, pk):
     """Vista para convertir cotización a pedido"""
@@ -892,8 +649,8 @@ def convertir_a_pedido(request, pk):
                 precio_unitario=item_cotizacion.precio_unitario,
             )
         
-        # Calcular totales del pedido
-        pedido.calcular_totales()
+        # Cada item ya sumó su subtotal al total del pedido
+        pedido.refresh_from_db(fields=['total'])
         
         messages.success(request, f'Cotización convertida exitosamente a pedido {pedido.numero}')
         return redirect('ventas:pedido_detail', pk=pedido.pk)
@@ -1090,60 +847,50 @@ def cambiar_estado_pedido(request, pk):
             # Cambiar estado
             estado_anterior = pedido.get_estado_display()
             
-            try:
-                pedido.estado = nuevo_estado
-                
-                # Si es un bodeguero iniciando un pedido (pendiente → proceso), asignarlo
-                if (pedido.estado == 'proceso' and 
-                    estado_anterior == 'Pendiente' and 
-                    request.user.can_view_inventory() and 
-                    hasattr(request.user, 'role') and 
-                    request.user.role == 'bodega'):
-                    pedido.asignado_a = request.user
-                    messages.success(request, f'Pedido #{pedido.numero} iniciado y asignado a {request.user.get_full_name()}.')
-                else:
-                    messages.success(request, f'Pedido #{pedido.numero} cambiado de {estado_anterior} a {pedido.get_estado_display()}.')
+            # Al completar el alistamiento se reservan todas las líneas de una vez,
+            # en la misma transacción que el cambio de estado
+            if nuevo_estado == 'completado':
+                try:
+                    resultado = pedido.completar_reservando(usuario=request.user)
+                except ValidationError as e:
+                    messages.error(request, ' '.join(e.messages))
+                    return redirect('ventas:pedido_detail', pk=pk)
                 
-                pedido.save()
+                if resultado['conflicto']:
+                    messages.warning(request, f'El pedido #{pedido.numero} ya cambió de estado.')
+                    return redirect('ventas:pedido_detail', pk=pk)
                 
-            except ValueError as e:
-                # Capturar errores de stock insuficiente
-                error_msg = str(e)
-                if "Stock insuficiente" in error_msg:
-                    # Extraer información del error para el template
-                    import re
-                    producto_match = re.search(r'Stock insuficiente para (.+)', error_msg)
-                    producto_nombre = producto_match.group(1) if producto_match else "producto desconocido"
-                    
-                    # Obtener información detallada del stock
-                    from inventario.models import Stock
-                    stock_info = []
-                    for item in pedido.items.all():
-                        if item.producto.nombre == producto_nombre:
-                            stock_total = Stock.objects.filter(producto=item.producto).aggregate(
-                                total=models.Sum('cantidad')
-                            )['total'] or 0
-                            
-                            stock_info.append({
-                                'producto': item.producto,
-                                'cantidad_pedida': item.cantidad,
-                                'stock_disponible': stock_total,
-                                'faltante': item.cantidad - stock_total
-                            })
-                    
-                    # Renderizar template de error de stock
+                if not resultado['exito']:
+                    # Reportar todos los faltantes del pedido en una sola pantalla
+                    faltantes = [linea for linea in resultado['lineas'] if linea['faltante'] > 0]
                     context = {
                         'pedido': pedido,
-                        'producto_nombre': producto_nombre,
-                        'stock_info': stock_info,
+                        'producto_nombre': ', '.join(linea['producto'].nombre for linea in faltantes),
+                        'stock_info': resultado['lineas'],
                         'estado_deseado': nuevo_estado,
-                        'estado_actual': estado_anterior
+                        'estado_actual': pedido.get_estado_display()
                     }
                     return render(request, 'ventas/error_stock_insuficiente.html', context)
-                else:
-                    # Otros errores de validación
-                    messages.error(request, f'Error al cambiar estado: {error_msg}')
-                    return redirect('ventas:pedido_detail', pk=pk)
+                
+                messages.success(request, f'Pedido #{pedido.numero} cambiado de {estado_anterior} a {pedido.get_estado_display()}.')
+                if 'alistamiento' in request.META.get('HTTP_REFERER', ''):
+                    return redirect('ventas:pedidos_alistamiento')
+                return redirect('ventas:pedido_detail', pk=pk)
+            
+            pedido.estado = nuevo_estado
+            
+            # Si es un bodeguero iniciando un pedido (pendiente → proceso), asignarlo
+            if (pedido.estado == 'proceso' and 
+                estado_anterior == 'Pendiente' and 
+                request.user.can_view_inventory() and 
+                hasattr(request.user, 'role') and 
+                request.user.role == 'bodega'):
+                pedido.asignado_a = request.user
+                messages.success(request, f'Pedido #{pedido.numero} iniciado y asignado a {request.user.get_full_name()}.')
+            else:
+                messages.success(request, f'Pedido #{pedido.numero} cambiado de {estado_anterior} a {pedido.get_estado_display()}.')
+            
+            pedido.save()
             
             # Redirigir de vuelta a alistamiento si vino desde ahí
             if 'alistamiento' in request.META.get('HTTP_REFERER', ''):
@@ -1373,8 +1120,8 @@ class PedidoCreateView(LoginRequiredMixin, VentasRequiredMixin, CreateView):
             pedido.delete()
             return self.form_invalid(form)
         
-        # Calcular totales
-        pedido.calcular_totales()
+        # Cada item ya sumó su subtotal al total del pedido
+        pedido.refresh_from_db(fields=['total'])
         
         messages.success(
             self.request, 
@@ -1813,61 +1560,85 @@ def reporte_facturas(request):
 # ============= API HELPERS =============
 
 def buscar_productos_api(request):
-    """API para buscar productos en tiempo real"""
+    """
+    API para buscar productos en tiempo real.
+
+    Con ``formato=compacto`` retorna solo id, codigo, nombre, precio y
+    disponible (flujo móvil de vendedores); si no, incluye el detalle de
+    stock por bodega, obtenido en una sola consulta para todos los resultados.
+    """
     if not request.user.is_authenticated or not request.user.can_create_sales():
         return JsonResponse({'error': 'No autorizado'}, status=401)
     
     query = request.GET.get('q', '')
     cliente_id = request.GET.get('cliente_id')  # Agregar cliente_id para determinar precio
+    compacto = request.GET.get('formato') == 'compacto'
     
     if len(query) < 2:
         return JsonResponse({'productos': []})
     
-    productos = Producto.objects.filter(
-        Q(codigo__icontains=query) | Q(nombre__icontains=query),
-        activo=True
-    ).select_related('categoria')[:10]
-    
-    # Obtener cliente para determinar precios
-    cliente = None
+    # Tipo de precio del cliente, resuelto una sola vez por petición
+    tipo_cliente = 'minorista'
     if cliente_id:
-        try:
-            cliente = Cliente.objects.get(id=cliente_id)
-        except Cliente.DoesNotExist:
-            pass
+        tipo_cliente = Cliente.objects.filter(id=cliente_id).values_list(
+            'tipo_cliente', flat=True
+        ).first() or tipo_cliente
+    
+    if compacto:
+        productos = buscar_productos(query, limite=10, queryset=Producto.objects.only(
+            'id', 'codigo', 'nombre', 'precio_minorista', 'precio_mayorista',
+            'existencia_total', 'existencia_reservada'
+        ))
+        return JsonResponse({'productos': [
+            {
+                'id': producto.id,
+                'codigo': producto.codigo,
+                'nombre': producto.nombre,
+                'precio': float(producto.get_precio_por_tipo(tipo_cliente)),
+                'disponible': producto.existencia_total - producto.existencia_reservada,
+            }
+            for producto in productos
+        ]})
+    
+    productos = buscar_productos(query, limite=10, queryset=Producto.objects.select_related('categoria'))
+    
+    # Stock por bodega de todos los resultados en una sola consulta
+    stocks_por_producto = {}
+    stocks = Stock.objects.filter(
+        producto_id__in=[producto.id for producto in productos]
+    ).values_list('producto_id', 'bodega__nombre', 'cantidad', 'cantidad_reservada')
+    for producto_id, bodega, cantidad, cantidad_reservada in stocks:
+        stocks_por_producto.setdefault(producto_id, []).append((bodega, cantidad, cantidad_reservada))
     
     data = []
     for producto in productos:
-        # Obtener precio según tipo de cliente
-        precio = producto.get_precio_para_cliente(cliente)
-        
-        # Verificar stock disponible en todas las bodegas
-        stocks_bodega = Stock.objects.filter(producto=producto).select_related('bodega')
-        stock_total = sum(stock.cantidad_disponible for stock in stocks_bodega)
+        stocks_bodega = stocks_por_producto.get(producto.id, [])
+        stock_total = sum(cantidad - cantidad_reservada for _, cantidad, cantidad_reservada in stocks_bodega)
         
         # Detalles por bodega
-        stock_bodegas = []
-        for stock in stocks_bodega:
-            if stock.cantidad > 0 or stock.cantidad_reservada > 0:
-                stock_bodegas.append({
-                    'bodega': stock.bodega.nombre,
-                    'cantidad_total': stock.cantidad,
-                    'cantidad_reservada': stock.cantidad_reservada,
-                    'cantidad_disponible': stock.cantidad_disponible
-                })
+        stock_bodegas = [
+            {
+                'bodega': bodega,
+                'cantidad_total': cantidad,
+                'cantidad_reservada': cantidad_reservada,
+                'cantidad_disponible': cantidad - cantidad_reservada
+            }
+            for bodega, cantidad, cantidad_reservada in stocks_bodega
+            if cantidad > 0 or cantidad_reservada > 0
+        ]
         
         data.append({
             'id': producto.id,
             'codigo': producto.codigo,
             'nombre': producto.nombre,
-            'precio': float(precio),
+            'precio': float(producto.get_precio_por_tipo(tipo_cliente)),
             'precio_minorista': float(producto.precio_minorista),
             'precio_mayorista': float(producto.precio_mayorista),
             'stock_total': stock_total,
             'stock_disponible': stock_total,
             'stock_bodegas': stock_bodegas,
             'categoria': producto.categoria.nombre,
-            'tipo_cliente_precio': cliente.tipo_cliente if cliente else 'minorista'
+            'tipo_cliente_precio': tipo_cliente
         })
     
     return JsonResponse({'productos': data})
@@ -1890,66 +1661,26 @@ def verificar_stock_disponible(request):
         if not productos_verificar:
             return JsonResponse({'error': 'No se especificaron productos'}, status=400)
         
-        resultados = []
-        stock_suficiente = True
-        
-        for item in productos_verificar:
-            producto_id = item.get('producto_id')
-            variante_id = item.get('variante_id')
-            cantidad_solicitada = int(item.get('cantidad', 0))
-            
-            if not producto_id or cantidad_solicitada <= 0:
-                continue
-            
-            try:
-                producto = Producto.objects.get(id=producto_id)
-                
-                # Obtener stock específico o general
-                if bodega_id:
-                    # Stock en bodega específica
-                    try:
-                        stock = Stock.objects.get(
-                            producto=producto,
-                            variante_id=variante_id,
-                            bodega_id=bodega_id
-                        )
-                        stock_disponible = stock.cantidad_disponible
-                    except Stock.DoesNotExist:
-                        stock_disponible = 0
-                else:
-                    # Stock total en todas las bodegas
-                    stocks = Stock.objects.filter(
-                        producto=producto,
-                        variante_id=variante_id
-                    )
-                    stock_disponible = sum(s.cantidad_disponible for s in stocks)
-                
-                suficiente = stock_disponible >= cantidad_solicitada
-                if not suficiente:
-                    stock_suficiente = False
-                
-                resultados.append({
-                    'producto_id': producto_id,
-                    'producto_nombre': producto.nombre,
-                    'variante_id': variante_id,
-                    'cantidad_solicitada': cantidad_solicitada,
-                    'stock_disponible': stock_disponible,
-                    'suficiente': suficiente,
-                    'faltante': max(0, cantidad_solicitada - stock_disponible)
-                })
-                
-            except Producto.DoesNotExist:
-                resultados.append({
-                    'producto_id': producto_id,
-                    'error': 'Producto no encontrado',
-                    'suficiente': False
-                })
-                stock_suficiente = False
-        
-        return JsonResponse({
-            'stock_suficiente': stock_suficiente,
-            'productos': resultados
-        })
+        try:
+            bodega_id = int(bodega_id) if bodega_id else None
+            lineas = [
+                {
+                    'producto_id': int(item['producto_id']),
+                    'variante_id': int(item['variante_id']) if item.get('variante_id') else None,
+                    'cantidad': int(item.get('cantidad', 0)),
+                }
+                for item in productos_verificar
+                if item.get('producto_id')
+            ]
+        except (TypeError, ValueError):
+            return JsonResponse({'error': 'Producto, variante, bodega o cantidad inválidos'}, status=400)
+        
+        # Todas las líneas se resuelven con una sola consulta de stock
+        return JsonResponse(verificar_disponibilidad(
+            [linea for linea in lineas if linea['cantidad'] > 0],
+            bodega_id=bodega_id,
+            sugerir_bodega=bool(data.get('sugerir_bodega')),
+        ))
         
     except json.JSONDecodeError:
         return JsonResponse({'error': 'JSON inválido'}, status=400)
@@ -2708,10 +2439,10 @@ def ruta_optimizada_view(request):
     # Verificar que el usuario sea repartidor
     if not request.user.can_deliver_orders():
         messages.error(request, "No tienes permisos para ver rutas de entrega.")
-        return redirect('dashboard')
+        return redirect('accounts:dashboard')
     
     # Obtener entregas asignadas al repartidor para hoy
-    hoy = timezone.now().date()
+    hoy = timezone.localdate()
     entregas = Entrega.objects.filter(
         repartidor=request.user,
         fecha_programada__date=hoy,
@@ -2725,38 +2456,17 @@ def ruta_optimizada_view(request):
         }
         return render(request, 'ventas/ruta_optimizada.html', context)
     
-    # Verificar si se solicita recalcular
-    recalcular = request.GET.get('recalcular') == '1'
+    # ?regresar=1 incluye el regreso a la bodega al final de la ruta
+    regresar = request.GET.get('regresar') == '1'
     
     try:
-        # Obtener o crear ruta optimizada
-        ruta_data = request.user.optimizar_ruta_entregas(list(entregas), recalcular=recalcular)
+        ruta_data = request.user.optimizar_ruta_entregas(entregas, regresar=regresar)
         
-        if ruta_data:
-            # Preparar datos para el template
-            ruta_detallada = []
-            orden = 1
-            
-            for entrega in ruta_data['entregas_ordenadas']:
-                cliente = entrega.pedido.cliente
-                
-                ruta_detallada.append({
-                    'orden': orden,
-                    'entrega': entrega,
-                    'cliente': cliente,
-                })
-                orden += 1
-            
-            # Actualizar datos con información detallada
-            ruta_data['ruta_detallada'] = ruta_detallada
-            
-            context = {
-                'ruta_data': ruta_data
-            }
-        else:
-            context = {
-                'ruta_data': None
-            }
+        context = {
+            'ruta_data': ruta_data,
+            'regresar': regresar
+        }
+        if not ruta_data:
             messages.warning(request, "No se pudo calcular una ruta optimizada.")
     
     except Exception as e:
@@ -3064,45 +2774,65 @@ class ReporteItemsRechazadosView(LoginRequiredMixin, TemplateView):
         
         # Filtrar items rechazados
         from .models import ItemRechazado
-        queryset = ItemRechazado.objects.select_related(
-            'entrega__pedido__cliente',
-            'item_pedido__producto',
-            'entrega__repartidor'
-        ).order_by('-fecha_rechazo')
+        queryset = ItemRechazado.objects.all()
         
         if fecha_desde:
-            queryset = queryset.filter(fecha_rechazo__gte=fecha_desde)
+            queryset = queryset.filter(fecha_rechazo__date__gte=fecha_desde)
         if fecha_hasta:
-            queryset = queryset.filter(fecha_rechazo__lte=fecha_hasta)
+            queryset = queryset.filter(fecha_rechazo__date__lte=fecha_hasta)
         if motivo:
             queryset = queryset.filter(motivo=motivo)
         
-        # Calcular estadísticas
-        total_items_rechazados = queryset.count()
-        valor_total_rechazado = sum(item.valor_rechazado for item in queryset)
-        entregas_con_rechazos = queryset.values('entrega').distinct().count()
+        # Estadísticas y agrupaciones agregadas en la base de datos
+        resumen = ItemRechazado.resumen(queryset)
         
         # Calcular porcentaje de rechazo (sobre total de entregas del período)
         entregas_totales = Entrega.objects.all()
         if fecha_desde:
-            entregas_totales = entregas_totales.filter(fecha_programada__gte=fecha_desde)
+            entregas_totales = entregas_totales.filter(fecha_programada__date__gte=fecha_desde)
         if fecha_hasta:
-            entregas_totales = entregas_totales.filter(fecha_programada__lte=fecha_hasta)
+            entregas_totales = entregas_totales.filter(fecha_programada__date__lte=fecha_hasta)
         
         total_entregas = entregas_totales.count()
+        entregas_con_rechazos = resumen['entregas']
         porcentaje_rechazo = (entregas_con_rechazos / total_entregas * 100) if total_entregas > 0 else 0
         
         # Paginación
         from django.core.paginator import Paginator
-        paginator = Paginator(queryset, self.paginate_by)
+        listado = queryset.select_related(
+            'entrega__pedido__cliente',
+            'item_pedido__producto',
+            'entrega__repartidor'
+        ).order_by('-fecha_rechazo', '-pk')
+        paginator = Paginator(listado, self.paginate_by)
         page_number = self.request.GET.get('page')
         page_obj = paginator.get_page(page_number)
         
+        # Conciliación de las entregas de la página: items y rechazos cargados en bloque
+        entregas = Entrega.con_conciliacion(
+            Entrega.objects.filter(pk__in={item.entrega_id for item in page_obj}).order_by('-fecha_programada', '-pk')
+        )
+        conciliacion = []
+        for entrega in entregas:
+            entregados = entrega.get_items_entregados_efectivamente()
+            conciliacion.append({
+                'entrega': entrega,
+                'items_entregados': len(entregados),
+                'valor_entregado': sum(
+                    (fila['cantidad_entregada'] * fila['item'].precio_unitario for fila in entregados), Decimal('0.00')
+                ),
+                'valor_rechazado': entrega.get_total_rechazado(),
+            })
+        
         context.update({
+            'conciliacion_entregas': conciliacion,
             'items_rechazados': page_obj,
-            'total_items_rechazados': total_items_rechazados,
-            'valor_total_rechazado': valor_total_rechazado,
+            'total_items_rechazados': resumen['total_items'],
+            'valor_total_rechazado': resumen['valor_total'],
             'entregas_con_rechazos': entregas_con_rechazos,
+            'rechazos_por_motivo': resumen['por_motivo'],
+            'rechazos_por_producto': resumen['por_producto'][:10],
+            'rechazos_por_repartidor': resumen['por_repartidor'],
             'porcentaje_rechazo': porcentaje_rechazo,
             'is_paginated': page_obj.has_other_pages(),
             'page_obj': page_obj,
@@ -3145,6 +2875,25 @@ def asignar_pedido_bodega(request, pk):
 
 # ============= VISTAS SIMPLES PARA URLs FALTANTES =============
 
+def _completar_con_reserva(request, pedido, estados_origen):
+    """Completa el pedido reservando su stock y deja el mensaje del resultado; retorna si se completó"""
+    try:
+        resultado = pedido.completar_reservando(usuario=request.user, estados_origen=estados_origen)
+    except ValidationError as e:
+        messages.error(request, ' '.join(e.messages))
+        return False
+    if resultado['conflicto']:
+        messages.warning(request, f'El pedido #{pedido.numero} ya está completado o cancelado.')
+    elif not resultado['exito']:
+        faltantes = ', '.join(
+            f"{linea['producto'].nombre} (disponible: {linea['stock_disponible']}, requerido: {linea['cantidad_pedida']})"
+            for linea in resultado['lineas'] if linea['faltante'] > 0
+        )
+        messages.error(request, f'Stock insuficiente para completar el pedido: {faltantes}.')
+    else:
+        messages.success(request, f'Pedido #{pedido.numero} completado exitosamente.')
+    return resultado['exito']
+
 @login_required
 def cambiar_estado_pedido_simple(request, pk):
     """Vista simple para cambiar estado de pedido"""
@@ -3152,7 +2901,9 @@ def cambiar_estado_pedido_simple(request, pk):
     
     if request.method == 'POST':
         nuevo_estado = request.POST.get('estado')
-        if nuevo_estado in ['pendiente', 'proceso', 'completado', 'cancelado']:
+        if nuevo_estado == 'completado':
+            _completar_con_reserva(request, pedido, Pedido.ESTADOS_ABIERTOS)
+        elif nuevo_estado in ['pendiente', 'proceso', 'cancelado']:
             pedido.estado = nuevo_estado
             pedido.save()
             messages.success(request, f'Estado del pedido actualizado a {nuevo_estado}.')
@@ -3166,11 +2917,9 @@ def completar_pedido_inmediato(request, pk):
     """Vista simple para completar pedido inmediatamente"""
     pedido = get_object_or_404(Pedido, pk=pk)
     
-    if request.method == 'POST':
-        pedido.estado = 'completado'
-        pedido.fecha_completado = timezone.now()
-        pedido.save()
-        messages.success(request, 'Pedido completado exitosamente.')
+    if request.method == 'POST' and _completar_con_reserva(request, pedido, Pedido.ESTADOS_ABIERTOS):
+        if request.POST.get('generar_factura') == '1':
+            return redirect('ventas:convertir_a_factura', pk=pk)
     
     return redirect('ventas:pedido_detail', pk=pk)
 
@@ -3288,27 +3037,23 @@ def reporte_ventas(request):
 
 # ============= EXPORTACIÓN A EXCEL/CSV =============
 
-@login_required
-def exportar_pedidos_excel(request):
-    """Exportar pedidos filtrados a Excel"""
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-    from openpyxl.utils import get_column_letter
-    from django.http import HttpResponse
-    import io
-    
-    # Obtener filtros desde GET parameters
-    fecha_inicio = request.GET.get('fecha_inicio')
-    fecha_fin = request.GET.get('fecha_fin')
-    estado = request.GET.get('estado')
-    vendedor = request.GET.get('vendedor')
-    cliente = request.GET.get('cliente')
+ENCABEZADOS_EXPORTACION_PEDIDOS = [
+    'Número', 'Cliente', 'Documento', 'Vendedor', 'Estado', 'Total',
+    'Fecha Creación', 'Asignado a'
+]
+
+
+def _pedidos_para_exportar(parametros):
+    """Pedidos filtrados con los parámetros GET de la lista (fechas, estado, vendedor, cliente)"""
+    fecha_inicio = parametros.get('fecha_inicio')
+    fecha_fin = parametros.get('fecha_fin')
+    estado = parametros.get('estado')
+    vendedor = parametros.get('vendedor')
+    cliente = parametros.get('cliente')
     
-    # Construir queryset con filtros
-    pedidos = Pedido.objects.all().select_related('cliente', 'asignado_a').order_by('-fecha_creacion')
+    pedidos = Pedido.objects.order_by('-fecha_creacion')
     
     if fecha_inicio:
-        from datetime import datetime
         try:
             fecha_inicio = datetime.strptime(fecha_inicio, '%Y-%m-%d').date()
             pedidos = pedidos.filter(fecha_creacion__date__gte=fecha_inicio)
@@ -3316,7 +3061,6 @@ def exportar_pedidos_excel(request):
             pass
     
     if fecha_fin:
-        from datetime import datetime
         try:
             fecha_fin = datetime.strptime(fecha_fin, '%Y-%m-%d').date()
             pedidos = pedidos.filter(fecha_creacion__date__lte=fecha_fin)
@@ -3334,166 +3078,47 @@ def exportar_pedidos_excel(request):
             Q(cliente__nombre_completo__icontains=cliente) |
             Q(cliente__numero_documento__icontains=cliente)
         )
-    
-    # Crear workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Pedidos"
-    
-    # Estilos
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-    header_alignment = Alignment(horizontal="center", vertical="center")
-    border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
+    return pedidos
+
+
+def definicion_exportacion_pedidos(parametros, usuario, formato):
+    """Exportación de pedidos filtrados (en CSV el total va como texto)"""
+    estados = dict(Pedido.ESTADO_CHOICES)
+    campos = (
+        'id', 'numero', 'cliente__nombre_completo', 'cliente__numero_documento',
+        'cliente__vendedor_asignado__first_name', 'cliente__vendedor_asignado__last_name',
+        'estado', 'total', 'fecha_creacion', 'asignado_a__first_name', 'asignado_a__last_name',
     )
     
-    # Headers
-    headers = [
-        'Número', 'Cliente', 'Documento', 'Vendedor', 'Estado', 'Total',
-        'Fecha Creación', 'Asignado a'
-    ]
-    
-    # Escribir headers
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = header_alignment
-        cell.border = border
-    
-    # Escribir datos
-    for row, pedido in enumerate(pedidos, 2):
-        data = [
-            pedido.numero or f"PED-{pedido.id}",
-            pedido.cliente.nombre_completo,
-            pedido.cliente.numero_documento,
-            pedido.cliente.vendedor_asignado.get_full_name() if pedido.cliente.vendedor_asignado else 'Sin asignar',
-            pedido.get_estado_display(),
-            float(pedido.total),
-            pedido.fecha_creacion.strftime('%Y-%m-%d %H:%M'),
-            pedido.asignado_a.get_full_name() if pedido.asignado_a else 'Sin asignar'
+    def convertir(fila):
+        (pk, numero, cliente, documento, vendedor_nombre, vendedor_apellido,
+         estado, total, fecha, asignado_nombre, asignado_apellido) = fila
+        return [
+            numero or f"PED-{pk}",
+            cliente,
+            documento,
+            nombre_persona(vendedor_nombre, vendedor_apellido),
+            estados.get(estado, estado),
+            str(total) if formato == 'csv' else float(total),
+            timezone.localtime(fecha).strftime('%Y-%m-%d %H:%M'),
+            nombre_persona(asignado_nombre, asignado_apellido),
         ]
-        
-        for col, value in enumerate(data, 1):
-            cell = ws.cell(row=row, column=col, value=value)
-            cell.border = border
-            
-            # Formato especial para números
-            if col == 6:  # Total
-                cell.number_format = '_-$* #,##0.00_-;-$* #,##0.00_-;_-$* "-"??_-;_-@_-'
-    
-    # Ajustar anchos de columna
-    column_widths = {
-        'A': 15,  # Número
-        'B': 30,  # Cliente
-        'C': 20,  # Documento
-        'D': 25,  # Vendedor
-        'E': 15,  # Estado
-        'F': 15,  # Total
-        'G': 20,  # Fecha Creación
-        'H': 25   # Asignado a
-    }
     
-    for col, width in column_widths.items():
-        ws.column_dimensions[col].width = width
-    
-    # Preparar respuesta HTTP
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-    
-    # Nombre del archivo con timestamp
-    from datetime import datetime
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f'pedidos_export_{timestamp}.xlsx'
-    
-    response = HttpResponse(
-        output.getvalue(),
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    return definicion_exportacion(
+        'pedidos_export', ENCABEZADOS_EXPORTACION_PEDIDOS, _pedidos_para_exportar(parametros), campos, convertir,
+        hoja='Pedidos', anchos=[15, 30, 20, 25, 15, 15, 20, 25], columnas_moneda=[5],
     )
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    
-    return response
+
+
+@login_required
+def exportar_pedidos_excel(request):
+    """Exportar pedidos filtrados a Excel (en streaming, o en segundo plano con ?segundo_plano=1)"""
+    return responder_exportacion(request, 'pedidos', 'excel')
 
 @login_required
 def exportar_pedidos_csv(request):
-    """Exportar pedidos filtrados a CSV"""
-    import csv
-    from django.http import HttpResponse
-    
-    # Obtener filtros desde GET parameters (mismo que Excel)
-    fecha_inicio = request.GET.get('fecha_inicio')
-    fecha_fin = request.GET.get('fecha_fin')
-    estado = request.GET.get('estado')
-    vendedor = request.GET.get('vendedor')
-    cliente = request.GET.get('cliente')
-    
-    # Construir queryset con filtros
-    pedidos = Pedido.objects.all().select_related('cliente', 'asignado_a').order_by('-fecha_creacion')
-    
-    if fecha_inicio:
-        from datetime import datetime
-        try:
-            fecha_inicio = datetime.strptime(fecha_inicio, '%Y-%m-%d').date()
-            pedidos = pedidos.filter(fecha_creacion__date__gte=fecha_inicio)
-        except ValueError:
-            pass
-    
-    if fecha_fin:
-        from datetime import datetime
-        try:
-            fecha_fin = datetime.strptime(fecha_fin, '%Y-%m-%d').date()
-            pedidos = pedidos.filter(fecha_creacion__date__lte=fecha_fin)
-        except ValueError:
-            pass
-    
-    if estado and estado != 'todos':
-        pedidos = pedidos.filter(estado=estado)
-    
-    if vendedor and vendedor != 'todos':
-        pedidos = pedidos.filter(cliente__vendedor_asignado_id=vendedor)
-    
-    if cliente:
-        pedidos = pedidos.filter(
-            Q(cliente__nombre_completo__icontains=cliente) |
-            Q(cliente__numero_documento__icontains=cliente)
-        )
-    
-    # Crear respuesta CSV
-    from datetime import datetime
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f'pedidos_export_{timestamp}.csv'
-    
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    
-    # Configurar CSV writer con encoding UTF-8
-    writer = csv.writer(response)
-    
-    # Escribir headers
-    writer.writerow([
-        'Número', 'Cliente', 'Documento', 'Vendedor', 'Estado', 'Total',
-        'Fecha Creación', 'Asignado a'
-    ])
-    
-    # Escribir datos
-    for pedido in pedidos:
-        writer.writerow([
-            pedido.numero or f"PED-{pedido.id}",
-            pedido.cliente.nombre_completo,
-            pedido.cliente.numero_documento,
-            pedido.cliente.vendedor_asignado.get_full_name() if pedido.cliente.vendedor_asignado else 'Sin asignar',
-            pedido.get_estado_display(),
-            str(pedido.total),
-            pedido.fecha_creacion.strftime('%Y-%m-%d %H:%M'),
-            pedido.asignado_a.get_full_name() if pedido.asignado_a else 'Sin asignar'
-        ])
-    
-    return response
+    """Exportar pedidos filtrados a CSV (en streaming, o en segundo plano con ?segundo_plano=1)"""
+    return responder_exportacion(request, 'pedidos', 'csv')
 
 # Función de imprimir_pedido PDF definida anteriormente en la línea 886
 